@@ -16,6 +16,7 @@
 import os
 import re
 import socket
+import threading
 import traceback
 import time
 import datetime
@@ -125,14 +126,28 @@ def getAzureDiagnosticKeyRange():
     endKey = getMDSPartitionKey(identity, getMDSTimestamp(endTime))
     return startKey, endKey
 
+_tableServices = {}
+
+def getTableService(accountName, accountKey, hostBase):
+    """
+    One TableService per account for the lifetime of the daemon, instead of 
+    a new client for every query
+    """
+    serviceKey = (accountName, accountKey, hostBase)
+    tableService = _tableServices.get(serviceKey)
+    if tableService is None:
+        tableService = TableService(account_name = accountName, 
+                                    account_key = accountKey,
+                                    host_base = hostBase)
+        _tableServices[serviceKey] = tableService
+    return tableService
+
 def getAzureDiagnosticCPUData(accountName, accountKey, hostBase,
                               startKey, endKey, deploymentId):
     try:
         waagent.Log("Retrieve diagnostic data(CPU).")
         table = "LinuxCpuVer2v0"
-        tableService = TableService(account_name = accountName, 
-                                    account_key = accountKey,
-                                    host_base = hostBase)
+        tableService = getTableService(accountName, accountKey, hostBase)
         ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}' "
                    "and DeploymentId eq '{2}'").format(startKey, endKey, deploymentId)
         oselect = ("PercentProcessorTime,DeploymentId")
@@ -154,9 +169,7 @@ def getAzureDiagnosticMemoryData(accountName, accountKey, hostBase,
     try:
         waagent.Log("Retrieve diagnostic data: Memory")
         table = "LinuxMemoryVer2v0"
-        tableService = TableService(account_name = accountName, 
-                                    account_key = accountKey,
-                                    host_base = hostBase)
+        tableService = getTableService(accountName, accountKey, hostBase)
         ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}' "
                    "and DeploymentId eq '{2}'").format(startKey, endKey, deploymentId)
         oselect = ("PercentAvailableMemory,DeploymentId")
@@ -374,73 +387,156 @@ def sameList(l1, l2):
             return False
     return True
 
+#Interval between two snapshots of the per-NIC counters, rates are derived
+#from the last two snapshots
+NetworkSampleInterval = 15
+
+class NetworkCounterSampler(object):
+    def __init__(self, interval=NetworkSampleInterval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.thread = None
+        self.lastSample = None
+        self.rates = None
+        self.sample()
+
+    def sample(self):
+        nics = psutil.net_io_counters(pernic=True)
+        sampleTime = time.time()
+        with self.lock:
+            if self.lastSample is not None:
+                lastTime, lastNics = self.lastSample
+                interval = max(sampleTime - lastTime, 0.001)
+                rates = {}
+                for nicName, stat in nics.iteritems():
+                    lastStat = lastNics.get(nicName)
+                    if lastStat is None:
+                        rates[nicName] = (0, 0)
+                        continue
+                    #Counters go backwards when the NIC is reset
+                    bytesRecv = max(stat.bytes_recv - lastStat.bytes_recv, 0)
+                    bytesSent = max(stat.bytes_sent - lastStat.bytes_sent, 0)
+                    rates[nicName] = (bytesRecv / interval, 
+                                      bytesSent / interval)
+                self.rates = rates
+            self.lastSample = (sampleTime, nics)
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            self.stopEvent.wait(self.interval)
+            if self.stopEvent.is_set():
+                break
+            try:
+                self.sample()
+            except Exception as e:
+                waagent.Warn(("Failed to sample network counters: {0}"
+                              "").format(e))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def getNicNames(self):
+        with self.lock:
+            return [nicName for nicName in self.lastSample[1].keys() 
+                    if nicName != 'lo']
+
+    def getRates(self):
+        #Until the background thread took its second snapshot, measure from
+        #the first one to now instead of reporting nothing
+        with self.lock:
+            rates = self.rates
+        if rates is None:
+            self.sample()
+            with self.lock:
+                rates = self.rates
+        return rates
+
+_networkCounterSampler = None
+_networkCounterSamplerLock = threading.Lock()
+
+def getNetworkCounterSampler():
+    global _networkCounterSampler
+    with _networkCounterSamplerLock:
+        if _networkCounterSampler is None:
+            _networkCounterSampler = NetworkCounterSampler()
+            _networkCounterSampler.start()
+        return _networkCounterSampler
+
 class NetworkInfo(object):
-    def __init__(self):
-        self.nics = psutil.net_io_counters(pernic=True)
-        self.nicNames = []
-        for nicName, stat in self.nics.iteritems():
-            if nicName != 'lo':
-                self.nicNames.append(nicName)
+    def __init__(self, sampler=None):
+        if sampler is None:
+            sampler = getNetworkCounterSampler()
+        self.sampler = sampler
+        self.nicNames = sampler.getNicNames()
+        self.rates = None
 
     def getAdapterIds(self):
         return self.nicNames
 
+    def getNetworkRates(self, adapterId):
+        #All adapters and both directions come from the same window
+        if self.rates is None:
+            self.rates = self.sampler.getRates()
+        return self.rates.get(adapterId, (0, 0))
+
     def getNetworkReadBytes(self, adapterId):
-        net = psutil.net_io_counters(pernic=True)
-        if net[adapterId] != None:
-            bytes_recv1 = net[adapterId][1]
-            time1 = time.time()
-            
-            time.sleep(0.2)
-            
-            net = psutil.net_io_counters(pernic=True)
-            bytes_recv2 = net[adapterId][1]
-            time2 = time.time()
-            
-            interval = (time2 - time1)
-            
-            return (bytes_recv2 - bytes_recv1) / interval
-        else:
-            return 0
+        return self.getNetworkRates(adapterId)[0]
 
     def getNetworkWriteBytes(self, adapterId):
-        net = psutil.net_io_counters(pernic=True)
-        if net[adapterId] != None:
-            bytes_sent1 = net[adapterId][0]
-            time1 = time.time()
-            
-            time.sleep(0.2)
-            
-            net = psutil.net_io_counters(pernic=True)
-            bytes_sent2 = net[adapterId][0]
-            time2 = time.time()
-            
-            interval = (time2 - time1)
-            
-            return (bytes_sent2 - bytes_sent1) / interval
-        else:
-            return 0
+        return self.getNetworkRates(adapterId)[1]
 
-    def getNetstat(self):
-        retCode, output = waagent.RunGetOutput("netstat -s", chk_err=False)
-        return output
+    def getSnmp(self):
+        return waagent.GetFileContents("/proc/net/snmp")
 
     def getNetworkPacketRetransmitted(self):
-        netstat = self.getNetstat()
-        match = re.search("(\d+)\s*segments retransmited", netstat)
-        if match != None:
-            return int(match.group(1))
+        #Same counter as "segments retransmited" of netstat -s, without 
+        #forking netstat
+        snmp = self.getSnmp()
+        retransSegs = getTcpRetransSegs(snmp)
+        if retransSegs is not None:
+            return retransSegs
         else:
-            waagent.Error("Failed to parse netstat output: {0}".format(netstat))
+            waagent.Error("Failed to parse /proc/net/snmp: {0}".format(snmp))
             updateLatestErrorRecord(FAILED_TO_RETRIEVE_LOCAL_DATA)
             AddExtensionEvent(message=FAILED_TO_RETRIEVE_LOCAL_DATA)
             return None
-
+def getTcpRetransSegs(snmp):
+    """
+    /proc/net/snmp has a header and a value line per protocol:
+    Tcp: RtoAlgorithm RtoMin ... RetransSegs InErrs ...
+    Tcp: 1 200 ... 2763 0 ...
+    """
+    if snmp is None:
+        return None
+    tcpLines = filter(lambda l : l.startswith("Tcp:"), snmp.split("\n"))
+    if len(tcpLines) < 2:
+        return None
+    names = tcpLines[0].split()
+    values = tcpLines[1].split()
+    if "RetransSegs" not in names or len(names) != len(values):
+        return None
+    return int(values[names.index("RetransSegs")])
 
 HwInfoFile = os.path.join(LibDir, "HwInfo")
 class HardwareChangeInfo(object):
-    def __init__(self, networkInfo):
+    def __init__(self, networkInfo, staticFacts=None):
         self.networkInfo = networkInfo
+        self.staticFacts = staticFacts
+
+    def getMacAddress(self, adapterId):
+        if self.staticFacts is not None:
+            return self.staticFacts.getMacAddress(adapterId)
+        return getMacAddress(adapterId)
 
     def getHwInfo(self):
         if not os.path.isfile(HwInfoFile):
@@ -455,7 +551,7 @@ class HardwareChangeInfo(object):
 
     def getLastHardwareChange(self):
         oldTime, oldMacs = self.getHwInfo()
-        newMacs = map(lambda x : getMacAddress(x), 
+        newMacs = map(lambda x : self.getMacAddress(x), 
                       self.networkInfo.getAdapterIds())
         newTime = int(time.time())
         newMacs.sort()
@@ -470,24 +566,89 @@ class HardwareChangeInfo(object):
         else:
             return oldTime
 
+def getCpuFrequency(cpuinfo):
+    """
+    The current frequency of the first processor in /proc/cpuinfo:
+    cpu MHz         : 2394.459
+    """
+    if cpuinfo is None:
+        return None
+    freqMatch = re.search("cpu MHz\s*:\s*([0-9.]+)", cpuinfo)
+    if freqMatch is None:
+        return None
+    return float(freqMatch.group(1))
+
+class StaticFacts(object):
+    """
+    Facts that only change with the hardware: CPU topology and processor 
+    type (/proc/cpuinfo and lscpu), NIC MAC addresses and the LUN to data 
+    disk mapping. They are computed again only when the set of NICs or 
+    block devices changes, which costs a listdir instead of a fork. The 
+    CPU frequency changes over time, it is not one of them.
+    """
+    def __init__(self):
+        self.signature = None
+        self.cpuInfo = None
+        self.macs = {}
+        self.lunToDevMap = {}
+
+    def getSignature(self, adapterIds):
+        return (tuple(sorted(adapterIds)), 
+                tuple(sorted(os.listdir('/sys/block'))))
+
+    def refresh(self, adapterIds):
+        signature = self.getSignature(adapterIds)
+        if signature == self.signature:
+            return
+        if self.signature is not None:
+            waagent.Log("Hardware change detected, reloading static facts.")
+        self.cpuInfo = CPUInfo.getCPUInfo()
+        self.macs = dict(map(lambda x : (x, getMacAddress(x)), adapterIds))
+        self.lunToDevMap = getLunToDevMap()
+        self.signature = signature
+
+    def getCPUInfo(self):
+        return self.cpuInfo
+
+    def getMacAddress(self, adapterId):
+        mac = self.macs.get(adapterId)
+        if mac is None:
+            mac = getMacAddress(adapterId)
+        return mac
+
+    def getLunToDevMap(self):
+        return self.lunToDevMap
+
+_staticFacts = StaticFacts()
+
+def getStaticFacts():
+    _staticFacts.refresh(getNetworkCounterSampler().getNicNames())
+    return _staticFacts
+
 class LinuxMetric(object):
     def __init__(self, config):
         self.config = config
+        #Network
+        self.networkInfo = NetworkInfo()
+        self.staticFacts = getStaticFacts()
         #CPU
-        self.cpuInfo = CPUInfo.getCPUInfo()
+        self.cpuInfo = self.staticFacts.getCPUInfo()
         #Memory
         self.memInfo = MemoryInfo()
-        #Network
-        self.networkInfo = NetworkInfo()
         #Detect hardware change
-        self.hwChangeInfo = HardwareChangeInfo(self.networkInfo)
+        self.hwChangeInfo = HardwareChangeInfo(self.networkInfo, 
+                                               self.staticFacts)
         self.timestamp = int(time.time())
 
     def getTimestamp(self):
         return self.timestamp
 
     def getCurrHwFrequency(self):
-        return self.cpuInfo.getFrequency()
+        #Read every cycle, the frequency of the cached lscpu output is stale
+        frequency = getCpuFrequency(waagent.GetFileContents("/proc/cpuinfo"))
+        if frequency is None:
+            frequency = self.cpuInfo.getFrequency()
+        return frequency
 
     def getMaxHwFrequency(self):
         return self.getCurrHwFrequency()
@@ -544,7 +705,7 @@ class LinuxMetric(object):
         return self.networkInfo.getAdapterIds()
 
     def getNetworkAdapterMapping(self, adapterId):
-        return getMacAddress(adapterId)
+        return self.staticFacts.getMacAddress(adapterId)
 
     def getMaxNetworkBandwidth(self, adapterId):
         return 1000 #Mbit/s 
@@ -812,9 +973,7 @@ def getStorageTableKeyRange():
 def getStorageMetrics(account, key, hostBase, table, startKey, endKey):
     try:
         waagent.Log("Retrieve storage metrics data.")
-        tableService = TableService(account_name = account, 
-                                    account_key = key,
-                                    host_base = hostBase)
+        tableService = getTableService(account, key, hostBase)
         ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}'"
                    "").format(startKey, endKey)
         oselect = ("TotalRequests,TotalIngress,TotalEgress,AverageE2ELatency,"
@@ -839,9 +998,20 @@ def getFirstLun(dev):
     for lun in os.listdir(path):
         return int(lun[-1])
 
+def getLunToDevMap():
+    lunToDevMap = {}
+    dataDisks = getDataDisks()
+    if dataDisks is None:
+        return lunToDevMap
+    for dev in dataDisks:
+        lun = getFirstLun(dev)
+        lunToDevMap[lun] = dev
+    return lunToDevMap
+
 class DiskInfo(object):
-    def __init__(self, config):
+    def __init__(self, config, staticFacts=None):
         self.config = config
+        self.staticFacts = staticFacts
 
     def getDiskMapping(self):
         osdiskVhd = "{0} {1}".format(self.config.getOSDiskAccount(),
@@ -858,14 +1028,12 @@ class DiskInfo(object):
                 "/dev/sda": osdisk,
         }
 
-        dataDisks = getDataDisks()
-        if dataDisks is None or len(dataDisks) == 0:
+        if self.staticFacts is not None:
+            lunToDevMap = self.staticFacts.getLunToDevMap()
+        else:
+            lunToDevMap = getLunToDevMap()
+        if len(lunToDevMap) == 0:
             return diskMapping
-        
-        lunToDevMap = {}
-        for dev in dataDisks:
-            lun = getFirstLun(dev)
-            lunToDevMap[lun] = dev
 
         diskCount = self.config.getDataDiskCount()
         for i in range(0, diskCount):
@@ -979,7 +1147,7 @@ class StorageDataSource(object):
         counters.append(self.createCounterDiskMapping("/dev/sdb", 
                                                       "not mapped to vhd"))
         #Add disk mapping for osdisk and data disk
-        diskMapping = DiskInfo(self.config).getDiskMapping()
+        diskMapping = DiskInfo(self.config, getStaticFacts()).getDiskMapping()
         for dev, disk in diskMapping.iteritems():
             counters.append(self.createCounterDiskMapping(dev, disk.get("vhd")))
             counters.append(self.createCounterDiskType(dev, disk.get("type")))
@@ -1309,6 +1477,9 @@ class PerfCounter(object):
 
 class EnhancedMonitor(object):
     def __init__(self, config):
+        #Take the first network snapshot now, so that the first collection
+        #already has a window to measure the network rates over
+        getNetworkCounterSampler()
         self.dataSources = []
         self.dataSources.append(VMDataSource(config))
         self.dataSources.append(StorageDataSource(config))
@@ -19,6 +19,7 @@
 import datetime
 import os
 import json
+import time
 import unittest
 
 import env
@@ -184,10 +185,31 @@ class TestAEM(unittest.TestCase):
         self.assertNotEquals(0, len(adapterIds))
         adapterId = adapterIds[0]
         self.assertNotEquals(None, aem.getMacAddress(adapterId))
-        self.assertNotEquals(None, netinfo.getNetworkReadBytes())
-        self.assertNotEquals(None, netinfo.getNetworkWriteBytes())
+        self.assertNotEquals(None, netinfo.getNetworkReadBytes(adapterId))
+        self.assertNotEquals(None, netinfo.getNetworkWriteBytes(adapterId))
         self.assertNotEquals(None, netinfo.getNetworkPacketRetransmitted())
 
+    def test_network_counter_sampler(self):
+        sampler = aem.NetworkCounterSampler(interval=0.1)
+        nicNames = sampler.getNicNames()
+        self.assertNotEquals(0, len(nicNames))
+        self.assertFalse('lo' in nicNames)
+        #The first read measures from the initial snapshot
+        rates = sampler.getRates()
+        self.assertNotEquals(None, rates)
+        sampler.start()
+        time.sleep(0.3)
+        sampler.stop()
+        rates = sampler.getRates()
+        for nicName in nicNames:
+            readBytes, writeBytes = rates[nicName]
+            self.assertTrue(readBytes >= 0)
+            self.assertTrue(writeBytes >= 0)
+        netinfo = aem.NetworkInfo(sampler)
+        self.assertEquals(rates[nicNames[0]][0], 
+                          netinfo.getNetworkReadBytes(nicNames[0]))
+        self.assertEquals(0, netinfo.getNetworkWriteBytes("nosuchnic"))
+
     def test_hwchangeinfo(self):
         netinfo = aem.NetworkInfo()
         testHwInfoFile = "/tmp/HwInfo"
@@ -284,6 +306,16 @@ class TestAEM(unittest.TestCase):
             self.assertNotEquals(None, counter)
             self.assertNotEquals(None, counter.value)
 
+    def test_get_cpu_frequency(self):
+        cpuinfo = ("processor\t: 0\n"
+                   "model name\t: Intel(R) Xeon(R) CPU E5-2673 v3 @ 2.40GHz\n"
+                   "cpu MHz\t\t: 2394.459\n"
+                   "processor\t: 1\n"
+                   "cpu MHz\t\t: 2394.100\n")
+        self.assertEquals(2394.459, aem.getCpuFrequency(cpuinfo))
+        self.assertEquals(None, aem.getCpuFrequency("processor\t: 0\n"))
+        self.assertEquals(None, aem.getCpuFrequency(None))
+
     def test_storagemetric(self):
         metrics = mock_getStorageMetrics()
         self.assertNotEquals(None, metrics)
@@ -304,6 +336,23 @@ class TestAEM(unittest.TestCase):
         mapping = aem.DiskInfo(config).getDiskMapping()
         self.assertNotEquals(None, mapping)
 
+    def test_get_tcp_retrans_segs(self):
+        snmp = ("Tcp: RtoAlgorithm RtoMin RtoMax RetransSegs InErrs\n"
+                "Tcp: 1 200 120000 2763 0\n"
+                "Udp: InDatagrams NoPorts\n"
+                "Udp: 10 0\n")
+        self.assertEquals(2763, aem.getTcpRetransSegs(snmp))
+        self.assertEquals(None, aem.getTcpRetransSegs("Udp: InDatagrams\n"))
+        self.assertEquals(None, aem.getTcpRetransSegs(None))
+
+    def test_static_facts(self):
+        facts = aem.getStaticFacts()
+        self.assertNotEquals(None, facts.getCPUInfo())
+        self.assertNotEquals(None, facts.getLunToDevMap())
+        signature = facts.signature
+        self.assertTrue(facts is aem.getStaticFacts())
+        self.assertEquals(signature, facts.signature)
+
     def test_get_storage_key_range(self):
         startKey, endKey = aem.getStorageTableKeyRange()
         self.assertNotEquals(None, startKey)
@@ -30,8 +30,13 @@ else:
     _strtype = str
 
 from datetime import datetime
+from io import BytesIO
 from xml.dom import minidom
 from xml.sax.saxutils import escape as xml_escape
+try:
+    from xml.etree import cElementTree as ETree
+except ImportError:
+    from xml.etree import ElementTree as ETree
 
 #--------------------------------------------------------------------------
 # constants
@@ -94,6 +99,10 @@ _ERROR_CANNOT_SERIALIZE_VALUE_TO_ENTITY = \
 _ERROR_PAGE_BLOB_SIZE_ALIGNMENT = \
     'Invalid page blob size: {0}. ' + \
     'The size must be aligned to a 512-byte boundary.'
+_ERROR_BLOB_RANGE_MD5_MISMATCH = \
+    'MD5 mismatch for range {0}: expected {1}, computed {2}.'
+_ERROR_BLOB_RANGE_SHORT_READ = \
+    'Unexpected length for range {0}: got {1} bytes.'
 
 _USER_AGENT_STRING = 'pyazure/' + __version__
 
@@ -216,6 +225,31 @@ def _get_entry_properties_from_node(entry, include_id, id_prefix_to_skip=None, u
     return properties
 
 
+def _get_entry_properties_from_etree(entry, include_id, id_prefix_to_skip=None, use_title_as_id=False):
+    ''' get properties from an entry ElementTree element '''
+    properties = {}
+
+    etag = entry.get('{' + METADATA_NS + '}etag')
+    if etag:
+        properties['etag'] = _etree_text(etag)
+    for updated in _get_child_nodes_etree(entry, 'updated'):
+        properties['updated'] = _get_first_child_value_etree(updated)
+    for name in _get_children_from_path_etree(entry, 'author', 'name'):
+        if _has_child_nodes_etree(name):
+            properties['author'] = _get_first_child_value_etree(name)
+
+    if include_id:
+        if use_title_as_id:
+            for title in _get_child_nodes_etree(entry, 'title'):
+                properties['name'] = _get_first_child_value_etree(title)
+        else:
+            for id in _get_child_nodes_etree(entry, 'id'):
+                properties['name'] = _get_readable_id(
+                    _get_first_child_value_etree(id), id_prefix_to_skip)
+
+    return properties
+
+
 def _get_entry_properties(xmlstr, include_id, id_prefix_to_skip=None):
     ''' get properties from entry xml '''
     xmldoc = minidom.parseString(xmlstr)
@@ -265,6 +299,88 @@ def _get_child_nodesNS(node, ns, tagName):
             if childNode.parentNode == node]
 
 
+def _etree_local_name(tag):
+    ''' strips the {namespace} from an ElementTree tag '''
+    if tag[:1] == '{':
+        return tag[tag.index('}') + 1:]
+    return tag
+
+
+def _get_child_nodes_etree(element, tagName):
+    return [child for child in element if _etree_local_name(child.tag) == tagName]
+
+
+def _get_child_nodesNS_etree(element, ns, tagName):
+    tag = '{' + ns + '}' + tagName
+    return [child for child in element if child.tag == tag]
+
+
+def _get_children_from_path_etree(element, *path):
+    '''same as _get_children_from_path for an ElementTree element, the path
+    starts with the children of element.'''
+    cur = element
+    for index, child in enumerate(path):
+        if isinstance(child, _strtype):
+            next = _get_child_nodes_etree(cur, child)
+        else:
+            next = _get_child_nodesNS_etree(cur, *child)
+        if index == len(path) - 1:
+            return next
+        elif not next:
+            break
+
+        cur = next[0]
+    return []
+
+
+def _has_child_nodes_etree(element):
+    ''' the equivalent of element.childNodes in minidom '''
+    return bool(element.text) or len(element) > 0
+
+
+def _get_first_child_value_etree(element):
+    ''' the equivalent of element.firstChild.nodeValue in minidom: the text of
+    the element, None if it is empty or starts with a child element '''
+    if element.text:
+        return _etree_text(element.text)
+    return None
+
+
+class _ElementStream(object):
+
+    '''Parses an xml document incrementally with iterparse and yields the
+    elements named one of tag_names (local names) whose ancestors are
+    parent_path, as soon as each one is complete. Each element is removed
+    from the tree once the caller is done with it, so that a large listing
+    never holds more than one of them at a time. The root element (with
+    everything but the yielded elements) is available from root.'''
+
+    def __init__(self, body, parent_path, tag_names):
+        if isinstance(body, _unicode_type):
+            body = body.encode('utf-8')
+        self.body = body
+        self.parent_path = list(parent_path)
+        self.tag_names = tag_names
+        self.root = None
+
+    def __iter__(self):
+        depth = len(self.parent_path)
+        stack = []
+        for event, element in ETree.iterparse(BytesIO(self.body), events=('start', 'end')):
+            if event == 'start':
+                if self.root is None:
+                    self.root = element
+                stack.append(element)
+                continue
+
+            stack.pop()
+            if len(stack) == depth and \
+               _etree_local_name(element.tag) in self.tag_names and \
+               [_etree_local_name(parent.tag) for parent in stack] == self.parent_path:
+                yield element
+                stack[-1].remove(element)
+
+
 def _create_entry(entry_body):
     ''' Adds common part of entry to a given entry body and return the whole
     xml. '''
@@ -327,10 +443,20 @@ if sys.version_info < (3,):
             return value.encode('utf-8')
 
         return str(value)
+
+    def _etree_text(value):
+        # ElementTree returns str for ascii text, minidom always returns
+        # unicode
+        if isinstance(value, str):
+            return value.decode('utf-8')
+        return value
 else:
     _str = str
     _unicode_type = str
 
+    def _etree_text(value):
+        return value
+
 
 def _str_or_none(value):
     if value is None:
@@ -419,7 +545,14 @@ def _clone_node_with_namespaces(node_to_clone, original_doc):
     return clone
 
 
-def _convert_response_to_feeds(response, convert_callback):
+def _convert_response_to_feeds(response, convert_callback, convert_element_callback=None):
+    '''Converts the entries of an atom feed. convert_callback is either a
+    WindowsAzureData class, filled from the content of each entry, or a
+    function converting the xml of each entry. When convert_element_callback
+    is given, it is used instead of convert_callback and is passed the
+    ElementTree element of each entry, so that the entries don't have to be
+    serialized and parsed again.
+    The feed is parsed incrementally, one entry at a time.'''
     if response is None:
         return None
 
@@ -432,27 +565,38 @@ def _convert_response_to_feeds(response, convert_callback):
     if x_ms_continuation:
         setattr(feeds, 'x_ms_continuation', x_ms_continuation)
 
-    xmldoc = minidom.parseString(response.body)
-    xml_entries = _get_children_from_path(xmldoc, 'feed', 'entry')
-    if not xml_entries:
-        # in some cases, response contains only entry but no feed
-        xml_entries = _get_children_from_path(xmldoc, 'entry')
-    if inspect.isclass(convert_callback) and issubclass(convert_callback, WindowsAzureData):
-        for xml_entry in xml_entries:
-            return_obj = convert_callback()
-            for node in _get_children_from_path(xml_entry,
-                                                'content',
-                                                convert_callback.__name__):
-                _fill_data_to_return_object(node, return_obj)
-            for name, value in _get_entry_properties_from_node(xml_entry,
-                                                               include_id=True,
-                                                               use_title_as_id=True).items():
-                setattr(return_obj, name, value)
-            feeds.append(return_obj)
-    else:
+    is_class_callback = inspect.isclass(convert_callback) and issubclass(convert_callback, WindowsAzureData)
+    if not is_class_callback and convert_element_callback is None:
+        xmldoc = minidom.parseString(response.body)
+        xml_entries = _get_children_from_path(xmldoc, 'feed', 'entry')
+        if not xml_entries:
+            # in some cases, response contains only entry but no feed
+            xml_entries = _get_children_from_path(xmldoc, 'entry')
         for xml_entry in xml_entries:
             new_node = _clone_node_with_namespaces(xml_entry, xmldoc)
             feeds.append(convert_callback(new_node.toxml('utf-8')))
+        return feeds
+
+    def convert_entry(xml_entry):
+        if not is_class_callback:
+            return convert_element_callback(xml_entry)
+        return_obj = convert_callback()
+        for node in _get_children_from_path_etree(xml_entry,
+                                                  'content',
+                                                  convert_callback.__name__):
+            _fill_data_to_return_object_etree(node, return_obj)
+        for name, value in _get_entry_properties_from_etree(xml_entry,
+                                                            include_id=True,
+                                                            use_title_as_id=True).items():
+            setattr(return_obj, name, value)
+        return return_obj
+
+    stream = _ElementStream(response.body, ['feed'], ['entry'])
+    for xml_entry in stream:
+        feeds.append(convert_entry(xml_entry))
+    if not feeds and _etree_local_name(stream.root.tag) == 'entry':
+        # in some cases, response contains only entry but no feed
+        feeds.append(convert_entry(stream.root))
 
     return feeds
 
@@ -572,8 +716,11 @@ def _fill_data_minidom(xmldoc, element_name, data_member):
     if not xmlelements or not xmlelements[0].childNodes:
         return None
 
-    value = xmlelements[0].firstChild.nodeValue
+    return _convert_data_member_value(xmlelements[0].firstChild.nodeValue, data_member)
+
 
+def _convert_data_member_value(value, data_member):
+    '''Converts the text of an xml element to the type of data_member'''
     if data_member is None:
         return value
     elif isinstance(data_member, datetime):
@@ -585,7 +732,10 @@ def _fill_data_minidom(xmldoc, element_name, data_member):
 
 
 def _get_node_value(xmlelement, data_type):
-    value = xmlelement.firstChild.nodeValue
+    return _convert_node_value(xmlelement.firstChild.nodeValue, data_type)
+
+
+def _convert_node_value(value, data_type):
     if data_type is datetime:
         return _to_datetime(value)
     elif data_type is bool:
@@ -657,25 +807,27 @@ containers member populated with the results.
     #       </Queue>
     #   </Queues>
     # </EnumerationResults>
-    respbody = response.body
     return_obj = return_type()
-    doc = minidom.parseString(respbody)
 
+    # the items are converted as they are parsed, without building the DOM
+    # of the whole listing
     items = []
-    for enum_results in _get_child_nodes(doc, 'EnumerationResults'):
-        # path is something like Queues, Queue
-        for child in _get_children_from_path(enum_results,
-                                             resp_type,
-                                             resp_type[:-1]):
-            items.append(_fill_instance_element(child, item_type))
-
+    stream = _ElementStream(response.body,
+                            ['EnumerationResults', resp_type],
+                            [resp_type[:-1]])
+    for child in stream:
+        items.append(_parse_response_body_from_etree_element(child, item_type))
+
+    enum_results = stream.root
+    if enum_results is not None and \
+       _etree_local_name(enum_results.tag) == 'EnumerationResults':
         for name, value in vars(return_obj).items():
             # queues, Queues, this is the list its self which we populated
             # above
             if name == resp_type.lower():
                 # the list its self.
                 continue
-            value = _fill_data_minidom(enum_results, name, value)
+            value = _fill_data_etree(enum_results, name, value)
             if value is not None:
                 setattr(return_obj, name, value)
 
@@ -773,6 +925,134 @@ def _parse_response_body_from_xml_node(node, return_type):
     return return_obj
 
 
+def _fill_list_of_etree(element, element_type, xml_element_name):
+    return [_parse_response_body_from_etree_element(child, element_type)
+            for child in _get_child_nodes_etree(element, xml_element_name)]
+
+
+def _fill_scalar_list_of_etree(element, element_type, parent_xml_element_name,
+                               xml_element_name):
+    '''same as _fill_scalar_list_of for an ElementTree element'''
+    xmlelements = _get_child_nodes_etree(element, parent_xml_element_name)
+    if xmlelements:
+        xmlelements = _get_child_nodes_etree(xmlelements[0], xml_element_name)
+        return [_convert_node_value(_get_first_child_value_etree(xmlelement), element_type)
+                for xmlelement in xmlelements]
+
+
+def _fill_dict_etree(element, element_name):
+    xmlelements = _get_child_nodes_etree(element, element_name)
+    if xmlelements:
+        return_obj = {}
+        for child in xmlelements[0]:
+            if _has_child_nodes_etree(child):
+                return_obj[_etree_text(_etree_local_name(child.tag))] = \
+                    _get_first_child_value_etree(child)
+        return return_obj
+
+
+def _fill_dict_of_etree(element, parent_xml_element_name, pair_xml_element_name,
+                        key_xml_element_name, value_xml_element_name):
+    '''same as _fill_dict_of for an ElementTree element'''
+    return_obj = {}
+
+    xmlelements = _get_child_nodes_etree(element, parent_xml_element_name)
+    if xmlelements:
+        xmlelements = _get_child_nodes_etree(xmlelements[0], pair_xml_element_name)
+        for pair in xmlelements:
+            keys = _get_child_nodes_etree(pair, key_xml_element_name)
+            values = _get_child_nodes_etree(pair, value_xml_element_name)
+            if keys and values:
+                key = _get_first_child_value_etree(keys[0])
+                value = _get_first_child_value_etree(values[0])
+                return_obj[key] = value
+
+    return return_obj
+
+
+def _fill_instance_child_etree(element, element_name, return_type):
+    xmlelements = _get_child_nodes_etree(
+        element, _get_serialization_name(element_name))
+
+    if not xmlelements:
+        return None
+
+    return_obj = return_type()
+    _fill_data_to_return_object_etree(xmlelements[0], return_obj)
+
+    return return_obj
+
+
+def _fill_data_etree(element, element_name, data_member):
+    xmlelements = _get_child_nodes_etree(
+        element, _get_serialization_name(element_name))
+
+    if not xmlelements or not _has_child_nodes_etree(xmlelements[0]):
+        return None
+
+    return _convert_data_member_value(_get_first_child_value_etree(xmlelements[0]), data_member)
+
+
+def _fill_data_to_return_object_etree(element, return_obj):
+    '''same as _fill_data_to_return_object for an ElementTree element'''
+    members = dict(vars(return_obj))
+    for name, value in members.items():
+        if isinstance(value, _list_of):
+            setattr(return_obj,
+                    name,
+                    _fill_list_of_etree(element,
+                                        value.list_type,
+                                        value.xml_element_name))
+        elif isinstance(value, _scalar_list_of):
+            setattr(return_obj,
+                    name,
+                    _fill_scalar_list_of_etree(element,
+                                               value.list_type,
+                                               _get_serialization_name(name),
+                                               value.xml_element_name))
+        elif isinstance(value, _dict_of):
+            setattr(return_obj,
+                    name,
+                    _fill_dict_of_etree(element,
+                                        _get_serialization_name(name),
+                                        value.pair_xml_element_name,
+                                        value.key_xml_element_name,
+                                        value.value_xml_element_name))
+        elif isinstance(value, _xml_attribute):
+            real_value = element.get(value.xml_element_name)
+            if real_value is not None:
+                setattr(return_obj, name, _etree_text(real_value))
+        elif isinstance(value, WindowsAzureData):
+            setattr(return_obj,
+                    name,
+                    _fill_instance_child_etree(element, name, value.__class__))
+        elif isinstance(value, dict):
+            setattr(return_obj,
+                    name,
+                    _fill_dict_etree(element, _get_serialization_name(name)))
+        elif isinstance(value, _Base64String):
+            value = _fill_data_etree(element, name, '')
+            if value is not None:
+                value = _decode_base64_to_text(value)
+            # always set the attribute, so we don't end up returning an object
+            # with type _Base64String
+            setattr(return_obj, name, value)
+        else:
+            value = _fill_data_etree(element, name, value)
+            if value is not None:
+                setattr(return_obj, name, value)
+
+
+def _parse_response_body_from_etree_element(element, return_type):
+    '''
+    fill all the data of an ElementTree element into a class of return_type
+    '''
+    return_obj = return_type()
+    _fill_data_to_return_object_etree(element, return_obj)
+
+    return return_obj
+
+
 def _parse_response_body_from_xml_text(respbody, return_type):
     '''
     parse the xml and fill all the data into a class of return_type
@@ -19,9 +19,9 @@
 import os
 import os.path
 import re
-import shutil
 import subprocess
 import sys
+import threading
 import time
 import traceback
 
@@ -40,10 +40,18 @@ elif sys.version_info[0] == 2:
     import urllib2 as urllib
     from urlparse import urlparse
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 ExtensionShortName = 'CustomScriptForLinux'
 
 # Global Variables
 DownloadDirectory = 'download'
+# Files downloaded at the same time and size of the reads from the network
+MaxConcurrentDownloads = 4
+DownloadBufferSize = 1024 * 1024
 
 # CustomScript-specific Operation
 DownloadOp = "Download"
@@ -306,13 +314,13 @@ def daemon(hutil):
 
 def download_blobs(storage_account_name, storage_account_key,
                    blob_uris, command, hutil):
-    for blob_uri in blob_uris:
-        if blob_uri:
-            download_blob(storage_account_name,
-                          storage_account_key,
-                          blob_uri,
-                          command,
-                          hutil)
+    def download(blob_uri):
+        return download_blob(storage_account_name,
+                             storage_account_key,
+                             blob_uri,
+                             command,
+                             hutil)
+    download_in_parallel(blob_uris, download, hutil)
 
 
 def download_blob(storage_account_name, storage_account_key,
@@ -320,15 +328,28 @@ def download_blob(storage_account_name, storage_account_key,
     try:
         seqNo = hutil.get_seq_no()
         download_dir = prepare_download_dir(seqNo)
-        result = download_and_save_blob(storage_account_name,
-                                        storage_account_key,
-                                        blob_uri,
-                                        download_dir,
-                                        hutil)
+        normalize = True
+        try:
+            result = download_and_save_blob(storage_account_name,
+                                            storage_account_key,
+                                            blob_uri,
+                                            download_dir,
+                                            hutil,
+                                            normalize)
+        except UnicodeError as e:
+            hutil.log(("Failed to convert {0} to UTF-8: {1}, download it "
+                       "again as is").format(blob_uri, e))
+            normalize = False
+            result = download_and_save_blob(storage_account_name,
+                                            storage_account_key,
+                                            blob_uri,
+                                            download_dir,
+                                            hutil,
+                                            normalize)
         blob_name, _, _, download_path = result
-        preprocess_files(download_path, hutil)
         if command and blob_name in command:
             os.chmod(download_path, 0o100)
+        return download_path
     except Exception as e:
         error_msg = "Failed to download blob with uri: {0} with error {1}".format(blob_uri, e)
         raise Exception(error_msg)
@@ -338,7 +359,8 @@ def download_and_save_blob(storage_account_name,
                            storage_account_key,
                            blob_uri,
                            download_dir,
-                           hutil):
+                           hutil,
+                           normalize=False):
     container_name = get_container_name_from_uri(blob_uri, hutil)
     blob_name = get_blob_name_from_uri(blob_uri, hutil)
     host_base = get_host_base_from_uri(blob_uri)
@@ -354,14 +376,19 @@ def download_and_save_blob(storage_account_name,
     blob_service = BlobService(storage_account_name,
                                storage_account_key,
                                host_base=host_base)
-    blob_service.get_blob_to_path(container_name, blob_name, download_path)
+    with open(download_path, 'wb') as dest:
+        writer = DownloadWriter(dest, download_path, normalize)
+        blob_service.get_blob_to_file(container_name, blob_name, writer,
+                                      max_connections=MaxConcurrentDownloads)
+        writer.close()
+    log_preprocessed(writer, hutil)
     return blob_name, container_name, host_base, download_path
 
 
 def download_external_files(uris, command, hutil):
-    for uri in uris:
-        if uri:
-            download_external_file(uri, command, hutil)
+    def download(uri):
+        return download_external_file(uri, command, hutil)
+    download_in_parallel(uris, download, hutil)
 
 
 def download_external_file(uri, command, hutil):
@@ -371,83 +398,193 @@ def download_external_file(uri, command, hutil):
     file_name = path.split('/')[-1]
     file_path = os.path.join(download_dir, file_name)
     try:
-        download_and_save_file(uri, file_path)
-        preprocess_files(file_path, hutil)
+        try:
+            writer = download_and_save_file(uri, file_path, normalize=True)
+        except UnicodeError as e:
+            hutil.log(("Failed to convert {0} to UTF-8: {1}, download it "
+                       "again as is").format(uri, e))
+            writer = download_and_save_file(uri, file_path)
+        log_preprocessed(writer, hutil)
         if command and file_name in command:
             os.chmod(file_path, 0o100)
+        return file_path
     except Exception as e:
         error_msg = ("Failed to download external file with uri: {0} "
                      "with error {1}").format(uri, e)
         raise Exception(error_msg)
 
 
-def download_and_save_file(uri, file_path, timeout=30, buf_size=1024):
+def download_and_save_file(uri, file_path, timeout=30,
+                           buf_size=DownloadBufferSize, normalize=False):
     src = urllib.urlopen(uri, timeout=timeout)
-    with open(file_path, 'wb') as dest:
-        buf = src.read(buf_size)
-        while(buf):
-            dest.write(buf)
+    try:
+        with open(file_path, 'wb') as dest:
+            writer = DownloadWriter(dest, file_path, normalize)
             buf = src.read(buf_size)
+            while(buf):
+                writer.write(buf)
+                buf = src.read(buf_size)
+            writer.close()
+    finally:
+        src.close()
+    return writer
 
 
-def preprocess_files(file_path, hutil):
+def download_in_parallel(uris, download, hutil):
     """
-        The file is preprocessed if it satisfies any of the following
-        condistions:
-            the file's extension is '.sh' or '.py'
-            the content of the file starts with '#!'
+        Runs download(uri) for every uri with at most MaxConcurrentDownloads
+        downloads in flight. After the first failure no new download is
+        started, the error is raised once the running ones are done.
+        The uris of the same file name are saved to the same path, they are
+        downloaded one after another in their order, so the last one wins.
+        The time taken by each file is logged and reported in the status.
     """
-    ret = to_process(file_path)
-    if ret:
-        dos2unix(file_path)
-        hutil.log("Converting {0} from DOS to Unix formats: Done".format(file_path))
-        remove_bom(file_path)
-        hutil.log("Removing BOM of {0}: Done".format(file_path))
+    uris = [uri for uri in uris if uri]
+    pending = queue.Queue()
+    uris_by_file_name = {}
+    for uri in uris:
+        file_name = get_path_from_uri(uri).rstrip('/').split('/')[-1]
+        if file_name in uris_by_file_name:
+            hutil.log("{0} is downloaded to the same file as {1}".format(
+                uri, uris_by_file_name[file_name][0]))
+            uris_by_file_name[file_name].append(uri)
+        else:
+            uris_by_file_name[file_name] = [uri]
+            pending.put(uris_by_file_name[file_name])
+    lock = threading.Lock()
+    timings = []
+    errors = []
+
+    def worker():
+        while True:
+            try:
+                same_file_uris = pending.get_nowait()
+            except queue.Empty:
+                return
+            for uri in same_file_uris:
+                with lock:
+                    if errors:
+                        return
+                start_time = time.time()
+                try:
+                    file_path = download(uri)
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                    return
+                elapsed = time.time() - start_time
+                size = os.path.getsize(file_path)
+                hutil.log("Downloaded {0}: {1} bytes in {2:.2f}s".format(
+                    file_path, size, elapsed))
+                with lock:
+                    timings.append((os.path.basename(file_path), size, elapsed))
+
+    start_time = time.time()
+    workers = []
+    for i in range(min(MaxConcurrentDownloads, len(uris_by_file_name))):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        workers.append(t)
+    for t in workers:
+        t.join()
+    if errors:
+        raise errors[0]
+
+    msg = "Downloaded {0} file(s) in {1:.2f}s: {2}".format(
+        len(timings),
+        time.time() - start_time,
+        ", ".join(["{0} ({1} bytes, {2:.2f}s)".format(name, size, elapsed)
+                   for name, size, elapsed in timings]))
+    hutil.log(msg)
+    hutil.do_status_report('Downloading', 'transitioning', '0', msg)
 
 
-def to_process(file_path, extensions=['.sh', ".py"]):
+class DownloadWriter(object):
+    """
+        File like object the downloaded data is written through. When
+        normalize is set and the file is a script (see is_script), the BOM
+        is removed, UTF-16 is converted to UTF-8 and DOS line breaks are
+        converted to Unix ones on the fly, so the file is written only once.
+    """
+    def __init__(self, dest, file_path, normalize=False):
+        self.dest = dest
+        self.file_path = file_path
+        self.normalize = normalize
+        # None until the first bytes of the file are known
+        self.is_script = None
+        self.head = b''
+        self.decoder = None
+        self.pending_cr = False
+        self.bom_removed = False
+
+    def write(self, data):
+        if not data:
+            return
+        if self.is_script is None:
+            self.head += data
+            if len(self.head) < 64:
+                return
+            data = self._start()
+        self._write(data)
+
+    def close(self):
+        if self.is_script is None:
+            self._write(self._start())
+        if self.decoder is not None:
+            self._write_newlines(self.decoder.decode(b'', True).encode('utf-8'))
+        if self.pending_cr:
+            self.dest.write(b'\n')
+            self.pending_cr = False
+
+    def _start(self):
+        data = self.head
+        self.head = b''
+        self.is_script = self.normalize and is_script(self.file_path, data)
+        if self.is_script:
+            if data.startswith(BOM_UTF8):
+                data = data[len(BOM_UTF8):]
+                self.bom_removed = True
+            elif data.startswith(BOM_UTF16_LE) or data.startswith(BOM_UTF16_BE):
+                self.decoder = getincrementaldecoder('utf-16')()
+                self.bom_removed = True
+        return data
+
+    def _write(self, data):
+        if not self.is_script:
+            self.dest.write(data)
+            return
+        if self.decoder is not None:
+            data = self.decoder.decode(data).encode('utf-8')
+        self._write_newlines(data)
+
+    def _write_newlines(self, data):
+        if self.pending_cr:
+            data = b'\r' + data
+            self.pending_cr = False
+        # A '\r' at the end of the chunk may be the first half of a '\r\n'
+        if data.endswith(b'\r'):
+            data = data[:-1]
+            self.pending_cr = True
+        self.dest.write(data.replace(b'\r\n', b'\n').replace(b'\r', b'\n'))
+
+
+def log_preprocessed(writer, hutil):
+    if writer.is_script:
+        hutil.log("Converting {0} from DOS to Unix formats: Done".format(writer.file_path))
+        if writer.bom_removed:
+            hutil.log("Removing BOM of {0}: Done".format(writer.file_path))
+
+
+def is_script(file_path, head, extensions=['.sh', ".py"]):
     for extension in extensions:
         if file_path.endswith(extension):
             return True
-    with open(file_path, 'rb') as f:
-        contents = f.read(64)
-    if b'#!' in contents:
+    if b'#!' in head[:64]:
         return True
     return False
 
 
-def dos2unix(file_path):
-    with open(file_path, 'rU') as f:
-        contents = f.read()
-    temp_file_path = file_path + ".tmp"
-    with open(temp_file_path, 'wb') as f_temp:
-        f_temp.write(contents.encode())
-    shutil.move(temp_file_path, file_path)
-
-
-def remove_bom(file_path):
-    with open(file_path, 'rb') as f:
-        contents = f.read()
-    bom_list = [BOM, BOM_BE, BOM_LE, BOM_UTF16, BOM_UTF16_BE, BOM_UTF16_LE, BOM_UTF8]
-    for bom in bom_list:
-        if contents.startswith(bom):
-            break
-    else:
-        return
-    new_contents = None
-    for encoding in ["utf-8-sig", "utf-16"]:
-        try:
-            new_contents = contents.decode(encoding).encode('utf-8')
-            break
-        except UnicodeDecodeError:
-            continue
-    if new_contents is not None:
-        temp_file_path = file_path + ".tmp"
-        with open(temp_file_path, 'wb') as f_temp:
-            f_temp.write(new_contents)
-        shutil.move(temp_file_path, file_path)
-
-
 def get_blob_name_from_uri(uri, hutil):
     return get_properties_from_uri(uri, hutil)['blob_name']
 
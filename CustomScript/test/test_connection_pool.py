@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+#
+# CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import threading
+import time
+import unittest
+import env
+from azure.http import HTTPError, HTTPRequest
+from azure.http.httpclient import _HTTPClient
+
+if sys.version_info < (3,):
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+else:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.path == '/slow':
+            time.sleep(0.1)
+        body = self.path.encode('utf-8')
+        self.send_response(404 if self.path == '/missing' else 200)
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        # Drops the connection without telling the client, as a server does when the idle timeout expires
+        if self.path == '/drop':
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class KeepAliveServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), KeepAliveHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = KeepAliveServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def create_client(self, **kwargs):
+        client = _HTTPClient(None, protocol='http', **kwargs)
+        self.addCleanup(client.connection_pool.clear)
+        return client
+
+    def get(self, client, path='/'):
+        request = HTTPRequest()
+        request.host = '127.0.0.1:{0}'.format(self.server.server_address[1])
+        request.method = 'GET'
+        request.path = path
+        request.body = None
+        return client.perform_request(request)
+
+    def test_requests_share_one_connection(self):
+        client = self.create_client()
+        for i in range(20):
+            self.assertEqual(self.get(client, '/{0}'.format(i)).body, '/{0}'.format(i).encode('utf-8'))
+        self.assertRaises(HTTPError, self.get, client, '/missing')
+        self.assertEqual(self.get(client).status, 200)
+
+        self.assertEqual(self.server.connections, 1)
+        stats = client.connection_pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reused'], 21)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_concurrent_requests(self):
+        client = self.create_client(pool_size=3)
+        errors = []
+
+        def worker():
+            try:
+                for i in range(10):
+                    self.get(client, '/slow')
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=worker) for i in range(5)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.requests, 50)
+        stats = client.connection_pool.stats()
+        # A connection is never used by two requests at once, and at most pool_size idle ones are kept
+        self.assertTrue(5 <= self.server.connections < 50, self.server.connections)
+        self.assertEqual(stats['created'] + stats['reused'], 50)
+        self.assertEqual(stats['idle'], 3)
+        self.assertEqual(stats['discarded'], stats['created'] - 3)
+
+    def test_idle_connections_are_evicted(self):
+        client = self.create_client(idle_timeout=0.1)
+        self.get(client)
+        self.get(client)
+        time.sleep(0.3)
+        self.get(client)
+
+        self.assertEqual(self.server.connections, 2)
+        stats = client.connection_pool.stats()
+        self.assertEqual(stats['evicted'], 1)
+        self.assertEqual(stats['reused'], 1)
+
+    def test_stale_connection_is_retried_once(self):
+        client = self.create_client()
+        self.get(client, '/drop')
+        time.sleep(0.1)
+        self.assertEqual(self.get(client).body, b'/')
+
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(client.connection_pool.stats()['retried'], 1)
+
+    def test_connection_closed_by_the_server_is_not_kept(self):
+        client = self.create_client()
+        self.get(client, '/close')
+        self.get(client)
+
+        self.assertEqual(self.server.connections, 2)
+        stats = client.connection_pool.stats()
+        self.assertEqual(stats['reused'], 0)
+        self.assertEqual(stats['retried'], 0)
+
+    def test_proxy_change_drops_the_connections(self):
+        client = self.create_client()
+        self.get(client)
+        client.set_proxy(None, None, None, None)
+        self.assertEqual(client.connection_pool.stats()['idle'], 0)
+        self.get(client)
+        self.assertEqual(self.server.connections, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
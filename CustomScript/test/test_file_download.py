@@ -19,7 +19,10 @@
 import unittest
 import os
 import tempfile
+import threading
+import time
 import customscript as cs
+from MockUtil import MockUtil
 
 class TestFileDownload(unittest.TestCase):
     def test_download_blob(self):
@@ -42,5 +45,38 @@ class TestFileDownload(unittest.TestCase):
         uri = "http://www.bing.com/"
         self.download_to_tmp(uri)
 
+    def test_same_file_name_downloaded_in_order(self):
+        uris = ["https://a.example.com/scripts/install.sh",
+                "https://a.example.com/scripts/setup.py",
+                "https://b.example.com/v2/install.sh",
+                "https://c.example.com/install.sh?sv=2015"]
+        download_dir = tempfile.mkdtemp()
+        lock = threading.Lock()
+        downloading = set()
+        downloaded = []
+
+        def download(uri):
+            file_name = cs.get_path_from_uri(uri).split('/')[-1]
+            with lock:
+                self.assertFalse(file_name in downloading)
+                downloading.add(file_name)
+            time.sleep(0.1)
+            file_path = os.path.join(download_dir, file_name)
+            with open(file_path, 'w') as f:
+                f.write(uri)
+            with lock:
+                downloading.remove(file_name)
+                downloaded.append(uri)
+            return file_path
+
+        cs.download_in_parallel(uris, download, MockUtil(self))
+        self.assertEqual([uri for uri in downloaded if 'install.sh' in uri],
+                         [uris[0], uris[2], uris[3]])
+        with open(os.path.join(download_dir, 'install.sh')) as f:
+            self.assertEqual(f.read(), uris[3])
+        for file_name in os.listdir(download_dir):
+            os.remove(os.path.join(download_dir, file_name))
+        os.rmdir(download_dir)
+
 if __name__ == '__main__':
     unittest.main()
@@ -20,9 +20,9 @@ import unittest
 import os
 import zipfile
 import codecs
+import io
 import shutil
 
-from MockUtil import MockUtil
 import customscript as cs
 
 class TestPreprocessFile(unittest.TestCase):
@@ -55,15 +55,23 @@ class TestPreprocessFile(unittest.TestCase):
                 print(file)
                 raise
 
+    def normalize(self, file_path):
+        """Writes the file through the DownloadWriter, in 4 KB chunks as a download."""
+        dest = io.BytesIO()
+        writer = cs.DownloadWriter(dest, file_path, normalize=True)
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(4096), b''):
+                writer.write(chunk)
+        writer.close()
+        self.assertTrue(writer.is_script)
+        return dest.getvalue()
+
     def test_bom(self):
         print("\nTest: Remove BOM")
-        hutil = MockUtil(self)
         files = [file for file in os.listdir('encoding') if 'bom' in file]
         for file in files:
             file_path = os.path.join('encoding', file)
-            cs.preprocess_files(file_path, hutil)
-            with open(file_path, 'r') as f:
-                contents = f.read()
+            contents = self.normalize(file_path)
             if "utf8" in file:
                 self.assertFalse(contents.startswith(codecs.BOM_UTF8))
             if "utf16_le" in file:
@@ -73,14 +81,36 @@ class TestPreprocessFile(unittest.TestCase):
 
     def test_windows_line_break(self):
         print("\nTest: Convert text files from DOS to Unix formats")
-        hutil = MockUtil(self)
         files = [file for file in os.listdir('encoding') if 'dos' in file]
         for file in files:
             file_path = os.path.join('encoding', file)
-            cs.preprocess_files(file_path, hutil)
-            with open(file_path, 'r') as f:
-                contents = f.read()
-            self.assertFalse("\r\n" in contents)
+            contents = self.normalize(file_path)
+            self.assertFalse(b"\r\n" in contents)
+
+
+class TestDownloadWriter(unittest.TestCase):
+    def test_download_writer(self):
+        print("\nTest: Normalize a script while it is downloaded")
+        dest = io.BytesIO()
+        writer = cs.DownloadWriter(dest, "test.sh", normalize=True)
+        contents = codecs.BOM_UTF8 + b"echo 1\r\n" * 20 + b"echo 2\r"
+        # Split a '\r\n' across two writes
+        writer.write(contents[:82])
+        writer.write(contents[82:])
+        writer.close()
+        self.assertEqual(b"echo 1\n" * 20 + b"echo 2\n", dest.getvalue())
+
+        dest = io.BytesIO()
+        writer = cs.DownloadWriter(dest, "test.sh", normalize=True)
+        writer.write(codecs.BOM_UTF16_LE + u"echo \u00e9\r\n".encode("utf-16-le"))
+        writer.close()
+        self.assertEqual(u"echo \u00e9\n".encode("utf-8"), dest.getvalue())
+
+        dest = io.BytesIO()
+        writer = cs.DownloadWriter(dest, "test.bin", normalize=True)
+        writer.write(b"\r\n" * 100)
+        writer.close()
+        self.assertEqual(b"\r\n" * 100, dest.getvalue())
 
 if __name__ == '__main__':
     unittest.main()
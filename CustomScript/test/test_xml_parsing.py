@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+#
+# CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks the streaming (iterparse) parsing of the listings of the vendored azure sdk against the DOM (minidom) parsing
+it replaced, on responses shaped like the recorded List Blobs, List Containers and Query Entities responses.
+
+Run it with "benchmark [entry count]" as arguments to compare the CPU time and the peak memory of both.
+"""
+
+import gc
+import sys
+import time
+import unittest
+import env
+from datetime import datetime
+from xml.dom import minidom
+from azure import (WindowsAzureData,
+                   METADATA_NS,
+                   _convert_response_to_feeds,
+                   _fill_data_minidom,
+                   _fill_data_to_return_object,
+                   _fill_instance_element,
+                   _get_child_nodes,
+                   _get_child_nodesNS,
+                   _get_children_from_path,
+                   _get_entry_properties_from_node,
+                   _parse_enum_results_list)
+from azure.http import HTTPResponse
+from azure.storage import (BlobEnumResults, Blob, BlobPrefix, Container, ContainerEnumResults, Entity,
+                           EntityProperty, _ENTITY_TO_PYTHON_CONVERSIONS, _convert_etree_element_to_entity,
+                           _convert_xml_to_entity, _parse_blob_enum_results_list, _remove_prefix,
+                           _set_entity_attr)
+
+TABLE_NS = 'http://schemas.microsoft.com/ado/2007/08/dataservices'
+
+
+def blob_list_body(count, prefixes=0):
+    blobs = ''.join(
+        '<Blob><Name>folder/blob-{0:05d}.vhd</Name><Url>https://account.blob.core.windows.net/vhds/folder/blob-{0:05d}.vhd'
+        '</Url><Properties><Last-Modified>Wed, 19 Mar 2014 21:40:52 GMT</Last-Modified><Etag>0x8D111D9A1C5D{0:04X}'
+        '</Etag><Content-Length>{1}</Content-Length><Content-Type>application/octet-stream</Content-Type>'
+        '<Content-Encoding /><Content-Language /><Content-MD5>1B2M2Y8AsgTpgAmY7PhCfg==</Content-MD5><Cache-Control />'
+        '<x-ms-blob-sequence-number>0</x-ms-blob-sequence-number><BlobType>PageBlob</BlobType>'
+        '<LeaseStatus>unlocked</LeaseStatus><LeaseState>available</LeaseState></Properties><Metadata>'
+        '<Owner>team-{2}</Owner><Purpose>caf&#233; &amp; tests</Purpose></Metadata></Blob>'.format(i, i * 512, i % 7)
+        for i in range(count))
+    blob_prefixes = ''.join('<BlobPrefix><Name>folder/sub-{0}/</Name></BlobPrefix>'.format(i) for i in range(prefixes))
+    return ('<?xml version="1.0" encoding="utf-8"?><EnumerationResults ContainerName="https://account.blob.core.'
+            'windows.net/vhds"><Prefix>folder/</Prefix><MaxResults>5000</MaxResults><Delimiter>/</Delimiter><Blobs>'
+            + blobs + blob_prefixes + '</Blobs><NextMarker>2!92!MDAwMDE</NextMarker></EnumerationResults>').encode('utf-8')
+
+
+def container_list_body(count):
+    containers = ''.join(
+        '<Container><Name>container-{0}</Name><Url>https://account.blob.core.windows.net/container-{0}</Url>'
+        '<Properties><Last-Modified>Wed, 19 Mar 2014 21:40:52 GMT</Last-Modified><Etag>"0x8D111D9A1C5D{0:04X}"'
+        '</Etag></Properties><Metadata><Key>value {0}</Key></Metadata></Container>'.format(i)
+        for i in range(count))
+    return ('<?xml version="1.0" encoding="utf-8"?><EnumerationResults AccountName="https://account.blob.core.'
+            'windows.net/"><MaxResults>5000</MaxResults><Containers>' + containers +
+            '</Containers><NextMarker /></EnumerationResults>').encode('utf-8')
+
+
+def entity_feed_body(count):
+    entries = ''.join(
+        '<entry m:etag="W/&quot;datetime\'2014-03-19T21%3A40%3A52.{0:07d}Z\'&quot;"><id>https://account.table.core.'
+        'windows.net/customers(PartitionKey=\'p\',RowKey=\'{0}\')</id><title type="text" /><updated>'
+        '2014-03-19T21:40:52Z</updated><author><name /></author><link rel="edit" title="customers" href="customers('
+        'PartitionKey=\'p\',RowKey=\'{0}\')" /><category term="account.customers" scheme="http://schemas.microsoft.'
+        'com/ado/2007/08/dataservices/scheme" /><content type="application/xml"><m:properties><d:PartitionKey>p'
+        '</d:PartitionKey><d:RowKey>{0}</d:RowKey><d:Timestamp m:type="Edm.DateTime">2014-03-19T21:40:52.1234567Z'
+        '</d:Timestamp><d:Address>Mountain View, caf&#233;</d:Address><d:Age m:type="Edm.Int32">{1}</d:Age>'
+        '<d:AmountDue m:type="Edm.Double">200.23</d:AmountDue><d:BinaryData m:type="Edm.Binary" m:null="true" />'
+        '<d:CustomerCode m:type="Edm.Guid">c9da6455-213d-42c9-9a79-3e9149a57833</d:CustomerCode><d:CustomerSince '
+        'm:type="Edm.DateTime">2008-07-10T00:00:00</d:CustomerSince><d:IsActive m:type="Edm.Boolean">true'
+        '</d:IsActive><d:NumOfOrders m:type="Edm.Int64">255</d:NumOfOrders><d:Notes></d:Notes></m:properties>'
+        '</content></entry>'.format(i, i % 90)
+        for i in range(count))
+    return ('<?xml version="1.0" encoding="utf-8" standalone="yes"?><feed xml:base="https://account.table.core.'
+            'windows.net/" xmlns:d="' + TABLE_NS + '" xmlns:m="' + METADATA_NS + '" xmlns="http://www.w3.org/2005/'
+            'Atom"><title type="text">customers</title><id>https://account.table.core.windows.net/customers</id>'
+            '<updated>2014-03-19T21:40:52Z</updated><link rel="self" title="customers" href="customers" />' +
+            entries + '</feed>').encode('utf-8')
+
+
+class QueueDescription(WindowsAzureData):
+
+    def __init__(self):
+        self.lock_duration = u''
+        self.max_size_in_megabytes = 0
+        self.requires_session = False
+        self.message_count = 0
+
+
+def queue_feed_body(count):
+    entries = ''.join(
+        '<entry><id>https://namespace.servicebus.windows.net/queue-{0}</id><title type="text">queue-{0}</title>'
+        '<published>2014-03-19T21:40:52Z</published><updated>2014-03-19T21:40:52Z</updated><author><name>namespace'
+        '</name></author><link rel="self" href="queue-{0}" /><content type="application/xml"><QueueDescription '
+        'xmlns="http://schemas.microsoft.com/netservices/2010/10/servicebus/connect" xmlns:i="http://www.w3.org/'
+        '2001/XMLSchema-instance"><LockDuration>PT1M</LockDuration><MaxSizeInMegabytes>1024</MaxSizeInMegabytes>'
+        '<RequiresSession>false</RequiresSession><MessageCount>{0}</MessageCount></QueueDescription></content>'
+        '</entry>'.format(i)
+        for i in range(count))
+    return ('<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom"><title type="text">'
+            'Queues</title><id>https://namespace.servicebus.windows.net/$Resources/Queues</id><updated>'
+            '2014-03-19T21:40:52Z</updated>' + entries + '</feed>').encode('utf-8')
+
+
+def response(body, headers=None):
+    return HTTPResponse(200, 'OK', headers or [], body)
+
+
+# The DOM based parsing the streaming parsing replaced, as references
+
+def minidom_parse_blob_enum_results_list(response):
+    return_obj = BlobEnumResults()
+    doc = minidom.parseString(response.body)
+
+    for enum_results in _get_child_nodes(doc, 'EnumerationResults'):
+        for child in _get_children_from_path(enum_results, 'Blobs', 'Blob'):
+            return_obj.blobs.append(_fill_instance_element(child, Blob))
+
+        for child in _get_children_from_path(enum_results, 'Blobs', 'BlobPrefix'):
+            return_obj.prefixes.append(_fill_instance_element(child, BlobPrefix))
+
+        for name, value in vars(return_obj).items():
+            if name == 'blobs' or name == 'prefixes':
+                continue
+            value = _fill_data_minidom(enum_results, name, value)
+            if value is not None:
+                setattr(return_obj, name, value)
+
+    return return_obj
+
+
+def minidom_parse_enum_results_list(response, return_type, resp_type, item_type):
+    return_obj = return_type()
+    doc = minidom.parseString(response.body)
+
+    items = []
+    for enum_results in _get_child_nodes(doc, 'EnumerationResults'):
+        for child in _get_children_from_path(enum_results, resp_type, resp_type[:-1]):
+            items.append(_fill_instance_element(child, item_type))
+
+        for name, value in vars(return_obj).items():
+            if name == resp_type.lower():
+                continue
+            value = _fill_data_minidom(enum_results, name, value)
+            if value is not None:
+                setattr(return_obj, name, value)
+
+    setattr(return_obj, resp_type.lower(), items)
+    return return_obj
+
+
+def minidom_convert_xml_to_entity(xmlstr):
+    xmldoc = minidom.parseString(xmlstr)
+
+    xml_properties = None
+    for entry in _get_child_nodes(xmldoc, 'entry'):
+        for content in _get_child_nodes(entry, 'content'):
+            xml_properties = _get_child_nodesNS(content, METADATA_NS, 'properties')
+
+    if not xml_properties:
+        return None
+
+    entity = Entity()
+    for xml_property in xml_properties[0].childNodes:
+        name = _remove_prefix(xml_property.nodeName)
+        if name in ['Timestamp']:
+            continue
+
+        if xml_property.firstChild:
+            value = xml_property.firstChild.nodeValue
+        else:
+            value = ''
+
+        isnull = xml_property.getAttributeNS(METADATA_NS, 'null')
+        mtype = xml_property.getAttributeNS(METADATA_NS, 'type')
+
+        if not isnull and not mtype:
+            _set_entity_attr(entity, name, value)
+        elif isnull != 'true':
+            conv = _ENTITY_TO_PYTHON_CONVERSIONS.get(mtype)
+            if conv is not None:
+                property = conv(value)
+            else:
+                property = EntityProperty(mtype, value)
+            _set_entity_attr(entity, name, property)
+
+    for entry in _get_child_nodes(xmldoc, 'entry'):
+        etag = entry.getAttributeNS(METADATA_NS, 'etag')
+        if etag:
+            _set_entity_attr(entity, 'etag', etag)
+
+    return entity
+
+
+def minidom_convert_response_to_feeds(response, convert_callback):
+    feeds = []
+    xmldoc = minidom.parseString(response.body)
+    for xml_entry in _get_children_from_path(xmldoc, 'feed', 'entry'):
+        if isinstance(convert_callback, type):
+            return_obj = convert_callback()
+            for node in _get_children_from_path(xml_entry, 'content', convert_callback.__name__):
+                _fill_data_to_return_object(node, return_obj)
+            for name, value in _get_entry_properties_from_node(xml_entry, include_id=True,
+                                                               use_title_as_id=True).items():
+                setattr(return_obj, name, value)
+            feeds.append(return_obj)
+        else:
+            feeds.append(convert_callback(xml_entry.toxml('utf-8').replace(
+                b'<entry', b'<entry xmlns="http://www.w3.org/2005/Atom" xmlns:d="' + TABLE_NS.encode('utf-8') +
+                b'" xmlns:m="' + METADATA_NS.encode('utf-8') + b'"', 1)))
+    return feeds
+
+
+def to_plain(value):
+    """Converts model objects to dictionaries, with the types of the values, so that they can be compared."""
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, to_plain(item)) for key, item in value.items())
+    if hasattr(value, '__dict__'):
+        return (type(value).__name__, to_plain(vars(value)))
+    return (type(value).__name__, value)
+
+
+class TestXmlParsing(unittest.TestCase):
+    def test_blob_list(self):
+        blob_list = response(blob_list_body(50, prefixes=3))
+        results = _parse_blob_enum_results_list(blob_list)
+        self.assertEqual(to_plain(results), to_plain(minidom_parse_blob_enum_results_list(blob_list)))
+
+        self.assertEqual(len(results), 50)
+        self.assertEqual(results.next_marker, u'2!92!MDAwMDE')
+        self.assertEqual(results.max_results, 5000)
+        self.assertEqual(results.delimiter, u'/')
+        self.assertEqual([prefix.name for prefix in results.prefixes], ['folder/sub-0/', 'folder/sub-1/',
+                                                                        'folder/sub-2/'])
+        blob = results[7]
+        self.assertEqual(blob.name, u'folder/blob-00007.vhd')
+        self.assertEqual(blob.properties.content_length, 3584)
+        self.assertEqual(blob.properties.content_encoding, u'')
+        self.assertEqual(blob.properties.blob_type, u'PageBlob')
+        self.assertEqual(blob.metadata, {'Owner': u'team-0', 'Purpose': u'caf\xe9 & tests'})
+
+    def test_empty_blob_list(self):
+        blob_list = response(b'<?xml version="1.0" encoding="utf-8"?><EnumerationResults ContainerName="https://'
+                             b'account.blob.core.windows.net/vhds"><Blobs /><NextMarker /></EnumerationResults>')
+        results = _parse_blob_enum_results_list(blob_list)
+        self.assertEqual(to_plain(results), to_plain(minidom_parse_blob_enum_results_list(blob_list)))
+        self.assertEqual(len(results), 0)
+
+    def test_container_list(self):
+        container_list = response(container_list_body(20))
+        results = _parse_enum_results_list(container_list, ContainerEnumResults, 'Containers', Container)
+        self.assertEqual(to_plain(results), to_plain(
+            minidom_parse_enum_results_list(container_list, ContainerEnumResults, 'Containers', Container)))
+        self.assertEqual(results[3].name, u'container-3')
+        self.assertEqual(results[3].properties.etag, u'"0x8D111D9A1C5D0003"')
+        self.assertEqual(results[3].metadata, {'Key': u'value 3'})
+
+    def test_entity_feed(self):
+        entity_feed = response(entity_feed_body(20), [('x-ms-continuation-nextpartitionkey', '1!8!cA--'),
+                                                      ('x-ms-continuation-nextrowkey', '1!4!MjA-')])
+        entities = _convert_response_to_feeds(entity_feed, _convert_xml_to_entity, _convert_etree_element_to_entity)
+        self.assertEqual(to_plain(entities),
+                         to_plain(minidom_convert_response_to_feeds(entity_feed, minidom_convert_xml_to_entity)))
+        # The callback converting the xml of each entry gives the same entities
+        self.assertEqual(to_plain(entities), to_plain(_convert_response_to_feeds(entity_feed, _convert_xml_to_entity)))
+
+        self.assertEqual(entities.x_ms_continuation['NextPartitionKey'], '1!8!cA--')
+        entity = entities[5]
+        self.assertEqual(entity.RowKey, u'5')
+        self.assertEqual(entity.Age, 5)
+        self.assertEqual(entity.AmountDue, 200.23)
+        self.assertEqual(entity.IsActive, True)
+        self.assertEqual(entity.CustomerSince, datetime(2008, 7, 10))
+        self.assertEqual(entity.Address, u'Mountain View, caf\xe9')
+        self.assertEqual(entity.Notes, u'')
+        self.assertEqual(entity.CustomerCode.type, 'Edm.Guid')
+        self.assertFalse(hasattr(entity, 'BinaryData'))
+        self.assertFalse(hasattr(entity, 'Timestamp'))
+        self.assertEqual(entity.etag, u'W/"datetime\'2014-03-19T21%3A40%3A52.0000005Z\'"')
+
+    def test_single_entity(self):
+        body = entity_feed_body(1)
+        entry = body[body.index(b'<entry'):body.index(b'</feed>')].replace(
+            b'<entry', b'<entry xmlns="http://www.w3.org/2005/Atom" xmlns:d="' + TABLE_NS.encode('utf-8') +
+            b'" xmlns:m="' + METADATA_NS.encode('utf-8') + b'"', 1)
+        self.assertEqual(to_plain(_convert_xml_to_entity(entry)), to_plain(minidom_convert_xml_to_entity(entry)))
+        entities = _convert_response_to_feeds(response(entry), _convert_xml_to_entity, _convert_etree_element_to_entity)
+        self.assertEqual(len(entities), 1)
+        self.assertEqual(entities[0].RowKey, u'0')
+
+    def test_class_feed(self):
+        queue_feed = response(queue_feed_body(10))
+        queues = _convert_response_to_feeds(queue_feed, QueueDescription)
+        self.assertEqual(to_plain(queues), to_plain(minidom_convert_response_to_feeds(queue_feed, QueueDescription)))
+        self.assertEqual(queues[4].name, u'queue-4')
+        self.assertEqual(queues[4].message_count, 4)
+        self.assertEqual(queues[4].max_size_in_megabytes, 1024)
+        self.assertEqual(queues[4].requires_session, False)
+        self.assertEqual(queues[4].author, u'namespace')
+
+
+def measure(function, *args):
+    """Returns the CPU time in seconds and, when tracemalloc is available (python 3.4+), the peak memory in MB."""
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    gc.collect()
+    start = time.process_time() if hasattr(time, 'process_time') else time.clock()
+    function(*args)
+    cpu_time = (time.process_time() if hasattr(time, 'process_time') else time.clock()) - start
+
+    peak = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+        tracemalloc.stop()
+    return cpu_time, peak
+
+
+def benchmark(count):
+    blob_list = response(blob_list_body(count))
+    container_list = response(container_list_body(count))
+    entity_feed = response(entity_feed_body(min(count, 1000)))
+    cases = [
+        ('List Blobs ({0} blobs, {1:.1f} MB)'.format(count, len(blob_list.body) / 1024.0 / 1024.0),
+         (minidom_parse_blob_enum_results_list, blob_list),
+         (_parse_blob_enum_results_list, blob_list)),
+        ('List Containers ({0} containers, {1:.1f} MB)'.format(count, len(container_list.body) / 1024.0 / 1024.0),
+         (minidom_parse_enum_results_list, container_list, ContainerEnumResults, 'Containers', Container),
+         (_parse_enum_results_list, container_list, ContainerEnumResults, 'Containers', Container)),
+        ('Query Entities ({0} entities, {1:.1f} MB)'.format(min(count, 1000), len(entity_feed.body) / 1024.0 / 1024.0),
+         (_convert_response_to_feeds, entity_feed, _convert_xml_to_entity),
+         (_convert_response_to_feeds, entity_feed, _convert_xml_to_entity, _convert_etree_element_to_entity)),
+    ]
+    for name, dom_parsing, streaming_parsing in cases:
+        print(name)
+        for label, parsing in [('  minidom  ', dom_parsing), ('  iterparse', streaming_parsing)]:
+            cpu_time, peak = measure(*parsing)
+            print('{0}: {1:7.3f} s CPU, {2} peak'.format(
+                label, cpu_time, 'n/a' if peak is None else '{0:6.1f} MB'.format(peak)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 5000)
+    else:
+        unittest.main()
@@ -14,12 +14,16 @@
 #--------------------------------------------------------------------------
 import base64
 import os
+import socket
 import sys
+import threading
+import time
 
 if sys.version_info < (3,):
     from httplib import (
         HTTPSConnection,
         HTTPConnection,
+        HTTPException,
         HTTP_PORT,
         HTTPS_PORT,
         )
@@ -28,6 +32,7 @@ else:
     from http.client import (
         HTTPSConnection,
         HTTPConnection,
+        HTTPException,
         HTTP_PORT,
         HTTPS_PORT,
         )
@@ -36,6 +41,103 @@ else:
 from azure.http import HTTPError, HTTPResponse
 from azure import _USER_AGENT_STRING, _update_request_uri_query
 
+# idle connections kept per host, and how long they are kept. The storage
+# front ends drop idle connections after about a minute.
+_DEFAULT_POOL_SIZE = 10
+_DEFAULT_IDLE_TIMEOUT = 30
+
+
+class _ConnectionPool(object):
+
+    '''
+    Keeps the connections the server left open, so that the next requests to
+    the same host (and through the same proxy) are sent on them instead of
+    opening a new connection and doing a new TLS handshake each time.
+
+    A connection is used by one request at a time: get takes it out of the
+    pool, and put returns it once the whole response has been read. At most
+    max_size idle connections are kept per key, the extra ones are closed,
+    as are the connections idle for more than idle_timeout seconds.
+    '''
+
+    def __init__(self, max_size=_DEFAULT_POOL_SIZE,
+                 idle_timeout=_DEFAULT_IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = {}    # key -> list of (connection, time it was put)
+        self.created = 0
+        self.reused = 0
+        self.retried = 0
+        self.evicted = 0
+        self.discarded = 0
+
+    def get(self, key):
+        ''' Returns an idle connection for key, or None. '''
+        expired = []
+        connection = None
+        with self._lock:
+            idle = self._idle.get(key)
+            now = time.time()
+            # the most recently used connection is the least likely to have
+            # been closed by the server
+            while idle:
+                candidate, put_time = idle.pop()
+                if now - put_time > self.idle_timeout:
+                    expired.append(candidate)
+                    expired.extend(c for c, _ in idle)
+                    del idle[:]
+                else:
+                    connection = candidate
+                    break
+            if connection is not None:
+                self.reused += 1
+            self.evicted += len(expired)
+        for candidate in expired:
+            candidate.close()
+        return connection
+
+    def put(self, key, connection):
+        ''' Returns the connection to the pool, or closes it if it's full. '''
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append((connection, time.time()))
+                return
+            self.discarded += 1
+        connection.close()
+
+    def count_created(self, retry=False):
+        with self._lock:
+            self.created += 1
+            if retry:
+                self.retried += 1
+
+    def clear(self):
+        ''' Closes all the idle connections. '''
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
+
+    def stats(self):
+        '''
+        Returns the number of connections created, of requests sent on a
+        reused connection, of stale connections a request was sent again
+        after, and of idle connections closed because they expired or the
+        pool was full.
+        '''
+        with self._lock:
+            idle = sum(len(connections) for connections in self._idle.values())
+            return {'created': self.created,
+                    'reused': self.reused,
+                    'retried': self.retried,
+                    'evicted': self.evicted,
+                    'discarded': self.discarded,
+                    'idle': idle}
+
 
 class _HTTPClient(object):
 
@@ -44,7 +146,9 @@ class _HTTPClient(object):
     '''
 
     def __init__(self, service_instance, cert_file=None, account_name=None,
-                 account_key=None, protocol='https'):
+                 account_key=None, protocol='https',
+                 pool_size=_DEFAULT_POOL_SIZE,
+                 idle_timeout=_DEFAULT_IDLE_TIMEOUT):
         '''
         service_instance: service client instance.
         cert_file:
@@ -53,6 +157,9 @@ class _HTTPClient(object):
         account_name: the storage account.
         account_key:
             the storage account access key.
+        pool_size: the number of idle connections kept open per host.
+        idle_timeout:
+            the number of seconds an idle connection is kept open.
         '''
         self.service_instance = service_instance
         self.status = None
@@ -67,6 +174,7 @@ class _HTTPClient(object):
         self.proxy_user = None
         self.proxy_password = None
         self.use_httplib = self.should_use_httplib()
+        self.connection_pool = _ConnectionPool(pool_size, idle_timeout)
 
     def should_use_httplib(self):
         if sys.platform.lower().startswith('win') and self.cert_file:
@@ -104,6 +212,7 @@ class _HTTPClient(object):
         self.proxy_port = port
         self.proxy_user = user
         self.proxy_password = password
+        self.connection_pool.clear()
 
     def get_uri(self, request):
         ''' Return the target uri for the request.'''
@@ -178,47 +287,88 @@ class _HTTPClient(object):
               not isinstance(connection, HTTPConnection)):
             connection.send(None)
 
+    def get_connection_key(self, request):
+        protocol = request.protocol_override \
+            if request.protocol_override else self.protocol
+        return (protocol, request.host, self.proxy_host, self.proxy_port)
+
+    def send_request(self, connection, request):
+        '''
+        Sends the request on the connection and reads the whole response.
+        Returns the response and whether the server closes the connection.
+        '''
+        connection.putrequest(request.method, request.path)
+
+        if not self.use_httplib:
+            if self.proxy_host and self.proxy_user:
+                connection.set_proxy_credentials(
+                    self.proxy_user, self.proxy_password)
+
+        self.send_request_headers(connection, request.headers)
+        self.send_request_body(connection, request.body)
+
+        resp = connection.getresponse()
+        headers = resp.getheaders()
+
+        # for consistency across platforms, make header names lowercase
+        for i, value in enumerate(headers):
+            headers[i] = (value[0].lower(), value[1])
+
+        respbody = None
+        if resp.length is None:
+            respbody = resp.read()
+        elif resp.length > 0:
+            respbody = resp.read(resp.length)
+
+        will_close = getattr(resp, 'will_close', True)
+        return HTTPResponse(
+            int(resp.status), resp.reason, headers, respbody), will_close
+
     def perform_request(self, request):
         ''' Sends request to cloud service server and return the response. '''
-        connection = self.get_connection(request)
+        key = None
+        connection = None
+        # winhttp manages its connections itself
+        if self.use_httplib:
+            key = self.get_connection_key(request)
+            connection = self.connection_pool.get(key)
+        reused = connection is not None
+        if connection is None:
+            connection = self.get_connection(request)
+            self.connection_pool.count_created()
         try:
-            connection.putrequest(request.method, request.path)
-
-            if not self.use_httplib:
-                if self.proxy_host and self.proxy_user:
-                    connection.set_proxy_credentials(
-                        self.proxy_user, self.proxy_password)
-
-            self.send_request_headers(connection, request.headers)
-            self.send_request_body(connection, request.body)
-
-            resp = connection.getresponse()
-            self.status = int(resp.status)
-            self.message = resp.reason
-            self.respheader = headers = resp.getheaders()
-
-            # for consistency across platforms, make header names lowercase
-            for i, value in enumerate(headers):
-                headers[i] = (value[0].lower(), value[1])
-
-            respbody = None
-            if resp.length is None:
-                respbody = resp.read()
-            elif resp.length > 0:
-                respbody = resp.read(resp.length)
-
-            response = HTTPResponse(
-                int(resp.status), resp.reason, headers, respbody)
-            if self.status == 307:
-                new_url = urlparse(dict(headers)['location'])
-                request.host = new_url.hostname
-                request.path = new_url.path
-                request.path, request.query = _update_request_uri_query(request)
-                return self.perform_request(request)
-            if self.status >= 300:
-                raise HTTPError(self.status, self.message,
-                                self.respheader, respbody)
-
-            return response
-        finally:
+            try:
+                response, will_close = self.send_request(connection, request)
+            except (HTTPException, socket.error):
+                if not reused:
+                    raise
+                # the server closed the idle connection, send it again on a
+                # new one
+                connection.close()
+                connection = self.get_connection(request)
+                self.connection_pool.count_created(retry=True)
+                response, will_close = self.send_request(connection, request)
+        except:
+            connection.close()
+            raise
+
+        if key is not None and not will_close:
+            self.connection_pool.put(key, connection)
+        else:
             connection.close()
+
+        # the attributes are shared by all threads, only use the locals below
+        self.status = response.status
+        self.message = response.message
+        self.respheader = response.headers
+        if response.status == 307:
+            new_url = urlparse(dict(response.headers)['location'])
+            request.host = new_url.hostname
+            request.path = new_url.path
+            request.path, request.query = _update_request_uri_query(request)
+            return self.perform_request(request)
+        if response.status >= 300:
+            raise HTTPError(response.status, response.message,
+                            response.headers, response.body)
+
+        return response
@@ -0,0 +1,276 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#--------------------------------------------------------------------------
+import hashlib
+import os
+import sys
+import threading
+
+from azure import (
+    WindowsAzureError,
+    _encode_base64,
+    _ERROR_BLOB_RANGE_MD5_MISMATCH,
+    _ERROR_BLOB_RANGE_SHORT_READ,
+    )
+
+if sys.version_info < (3,):
+    import Queue as queue
+else:
+    import queue
+
+
+def _pwrite(fd, data, offset, lock):
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        # python 2 has no pwrite, share the file offset under a lock
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while data:
+                written = os.write(fd, data)
+                data = data[written:]
+
+
+class _ParallelTransfer(object):
+
+    '''
+    Runs transfer(chunk) on max_connections threads for every chunk returned
+    by next_chunk. The threads share the kept alive connections of the
+    service's _HTTPClient. After the first failure no new chunk is started
+    and the error is raised once the running ones are done.
+    '''
+
+    def __init__(self, blob_service, max_connections, progress_callback,
+                 total):
+        self.blob_service = blob_service
+        self.max_connections = max_connections
+        self.progress_callback = progress_callback
+        self.total = total
+        self.progress = 0
+        self.lock = threading.Lock()
+        self.error = None
+
+    def run(self, count=None):
+        '''
+        With a count the chunks are the indexes in range(count), otherwise
+        next_chunk has to be overridden.
+        '''
+        self.chunks = queue.Queue()
+        threads = self.max_connections
+        if count is not None:
+            for index in range(count):
+                self.chunks.put(index)
+            threads = min(threads, count)
+
+        if self.progress_callback:
+            self.progress_callback(0, self.total)
+
+        workers = []
+        for _ in range(threads):
+            worker = threading.Thread(target=self._worker)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def _worker(self):
+        while self.error is None:
+            try:
+                chunk = self.next_chunk()
+                if chunk is None:
+                    return
+                length = self.transfer(chunk)
+            except Exception as e:
+                with self.lock:
+                    if self.error is None:
+                        self.error = e
+                self.cancel()
+                return
+            with self.lock:
+                self.progress += length
+                if self.progress_callback:
+                    self.progress_callback(self.progress, self.total)
+
+    def next_chunk(self):
+        try:
+            return self.chunks.get_nowait()
+        except queue.Empty:
+            return None
+
+    def transfer(self, chunk):
+        '''
+        Transfers the chunk returned by next_chunk and returns its length in
+        bytes. The downloader and the uploader do the transfer.
+        '''
+        return 0
+
+    def cancel(self):
+        '''
+        Called after the first failure, wakes up the threads waiting for the
+        chunks of the failed ones.
+        '''
+        pass
+
+
+class _BlobChunkDownloader(_ParallelTransfer):
+
+    '''
+    Downloads the ranges of a blob in parallel. Files are preallocated and
+    each range is written at its offset with pwrite, other streams get the
+    ranges in order, with at most two ranges per connection kept in memory.
+    The MD5 of every range is checked as it arrives.
+    '''
+
+    def __init__(self, blob_service, container_name, blob_name, blob_size,
+                 chunk_size, stream, max_connections, snapshot=None,
+                 x_ms_lease_id=None, progress_callback=None):
+        super(_BlobChunkDownloader, self).__init__(
+            blob_service, max_connections, progress_callback, blob_size)
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.blob_size = blob_size
+        self.chunk_size = chunk_size
+        self.stream = stream
+        self.snapshot = snapshot
+        self.x_ms_lease_id = x_ms_lease_id
+        self.fd = None
+        self.write_lock = threading.Lock()
+        self.ready = threading.Condition(self.write_lock)
+        self.next_index = 0
+        self.pending = {}
+
+    def download(self):
+        try:
+            fd = self.stream.fileno()
+            self.offset = self.stream.tell()
+            self.stream.flush()
+            os.ftruncate(fd, self.offset + self.blob_size)
+            self.fd = fd
+        except (AttributeError, IOError, OSError):
+            self.fd = None
+
+        count = (self.blob_size + self.chunk_size - 1) // self.chunk_size
+        self.run(count)
+
+        if self.fd is not None:
+            self.stream.seek(self.offset + self.blob_size)
+
+    def transfer(self, index):
+        if self.fd is None:
+            # do not run too far ahead of the writer
+            with self.ready:
+                while self.error is None and \
+                        index >= self.next_index + 2 * self.max_connections:
+                    self.ready.wait()
+                if self.error is not None:
+                    return 0
+
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, self.blob_size) - 1
+        chunk_range = 'bytes={0}-{1}'.format(start, end)
+        data = self.blob_service.get_blob(
+            self.container_name, self.blob_name, self.snapshot,
+            x_ms_range=chunk_range, x_ms_lease_id=self.x_ms_lease_id,
+            x_ms_range_get_content_md5='true')
+
+        if len(data) != end - start + 1:
+            raise WindowsAzureError(_ERROR_BLOB_RANGE_SHORT_READ.format(
+                chunk_range, len(data)))
+        expected_md5 = data.properties.get('content-md5')
+        if expected_md5:
+            actual_md5 = _encode_base64(hashlib.md5(data).digest())
+            if actual_md5 != expected_md5:
+                raise WindowsAzureError(_ERROR_BLOB_RANGE_MD5_MISMATCH.format(
+                    chunk_range, expected_md5, actual_md5))
+
+        if self.fd is not None:
+            _pwrite(self.fd, data, self.offset + start,
+                    self.write_lock)
+        else:
+            with self.ready:
+                self.pending[index] = data
+                while self.next_index in self.pending:
+                    self.stream.write(self.pending.pop(self.next_index))
+                    self.next_index += 1
+                self.ready.notify_all()
+        return len(data)
+
+    def cancel(self):
+        with self.ready:
+            self.ready.notify_all()
+
+
+class _BlobChunkUploader(_ParallelTransfer):
+
+    '''
+    Uploads a stream as the blocks of a block blob in parallel. The stream
+    is read in order, one block per connection at a time, and every block
+    is sent with its MD5 so the service validates it.
+    '''
+
+    def __init__(self, blob_service, container_name, blob_name, count,
+                 chunk_size, stream, max_connections, x_ms_lease_id=None,
+                 progress_callback=None):
+        super(_BlobChunkUploader, self).__init__(
+            blob_service, max_connections, progress_callback, count)
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.count = count
+        self.chunk_size = chunk_size
+        self.stream = stream
+        self.x_ms_lease_id = x_ms_lease_id
+        self.read_lock = threading.Lock()
+        self.remain_bytes = count
+        self.block_count = 0
+
+    def upload(self):
+        '''
+        Uploads all the blocks and returns their ids, in order. Without a
+        count the stream is read until its end.
+        '''
+        self.run()
+        return ['{0:08d}'.format(index)
+                for index in range(self.block_count)]
+
+    def next_chunk(self):
+        # the block index is given by the read order
+        with self.read_lock:
+            request_count = self.chunk_size if self.remain_bytes is None \
+                else min(self.remain_bytes, self.chunk_size)
+            if request_count <= 0:
+                return None
+            data = self.stream.read(request_count)
+            if not data:
+                return None
+            if self.remain_bytes is not None:
+                self.remain_bytes -= len(data)
+            index = self.block_count
+            self.block_count += 1
+            return index, data
+
+    def transfer(self, chunk):
+        index, data = chunk
+        self.blob_service.put_block(
+            self.container_name, self.blob_name, data,
+            '{0:08d}'.format(index),
+            content_md5=_encode_base64(hashlib.md5(data).digest()),
+            x_ms_lease_id=self.x_ms_lease_id)
+        return len(data)
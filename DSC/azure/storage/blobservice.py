@@ -52,6 +52,7 @@ from azure.storage import (
     _update_storage_blob_header,
     )
 from azure.storage.storageclient import _StorageClient
+from azure.storage._chunking import _BlobChunkDownloader, _BlobChunkUploader
 from os import path
 import sys
 if sys.version_info >= (3,):
@@ -770,7 +771,8 @@ class BlobService(_StorageClient):
                                  x_ms_blob_content_md5=None,
                                  x_ms_blob_cache_control=None,
                                  x_ms_meta_name_values=None,
-                                 x_ms_lease_id=None, progress_callback=None):
+                                 x_ms_lease_id=None, progress_callback=None,
+                                 max_connections=1):
         '''
         Creates a new block blob from a file/stream, or updates the content of
         an existing block blob, with automatic chunking and progress
@@ -809,6 +811,9 @@ class BlobService(_StorageClient):
             Callback for progress with signature function(current, total) where
             current is the number of bytes transfered so far, and total is the
             size of the blob, or None if the total size is unknown.
+        max_connections:
+            Optional. Number of blocks uploaded in parallel, on kept alive
+            connections, when the blob is uploaded in blocks.
         '''
         _validate_not_none('container_name', container_name)
         _validate_not_none('blob_name', blob_name)
@@ -857,6 +862,24 @@ class BlobService(_StorageClient):
                           x_ms_meta_name_values,
                           x_ms_lease_id)
 
+            if max_connections > 1:
+                uploader = _BlobChunkUploader(self, container_name, blob_name,
+                                              count,
+                                              self._BLOB_MAX_CHUNK_DATA_SIZE,
+                                              stream, max_connections,
+                                              x_ms_lease_id,
+                                              progress_callback)
+                block_ids = uploader.upload()
+                self.put_block_list(container_name, blob_name, block_ids,
+                                    content_md5, x_ms_blob_cache_control,
+                                    x_ms_blob_content_type,
+                                    x_ms_blob_content_encoding,
+                                    x_ms_blob_content_language,
+                                    x_ms_blob_content_md5,
+                                    x_ms_meta_name_values,
+                                    x_ms_lease_id)
+                return
+
             remain_bytes = count
             block_ids = []
             block_index = 0
@@ -1392,7 +1415,7 @@ class BlobService(_StorageClient):
 
     def get_blob_to_path(self, container_name, blob_name, file_path,
                          open_mode='wb', snapshot=None, x_ms_lease_id=None,
-                         progress_callback=None):
+                         progress_callback=None, max_connections=1):
         '''
         Downloads a blob to a file path, with automatic chunking and progress
         notifications.
@@ -1409,6 +1432,9 @@ class BlobService(_StorageClient):
             Callback for progress with signature function(current, total) where
             current is the number of bytes transfered so far, and total is the
             size of the blob.
+        max_connections:
+            Optional. Number of ranges downloaded in parallel, see
+            get_blob_to_file.
         '''
         _validate_not_none('container_name', container_name)
         _validate_not_none('blob_name', blob_name)
@@ -1421,11 +1447,12 @@ class BlobService(_StorageClient):
                                   stream,
                                   snapshot,
                                   x_ms_lease_id,
-                                  progress_callback)
+                                  progress_callback,
+                                  max_connections)
 
     def get_blob_to_file(self, container_name, blob_name, stream,
                          snapshot=None, x_ms_lease_id=None,
-                         progress_callback=None):
+                         progress_callback=None, max_connections=1):
         '''
         Downloads a blob to a file/stream, with automatic chunking and progress
         notifications.
@@ -1441,6 +1468,11 @@ class BlobService(_StorageClient):
             Callback for progress with signature function(current, total) where
             current is the number of bytes transfered so far, and total is the
             size of the blob.
+        max_connections:
+            Optional. Number of ranges downloaded in parallel, each one on its
+            own kept alive connection. A file stream is preallocated and the
+            ranges are written at their offsets, other streams are written in
+            order. The MD5 of every range is validated.
         '''
         _validate_not_none('container_name', container_name)
         _validate_not_none('blob_name', blob_name)
@@ -1449,7 +1481,16 @@ class BlobService(_StorageClient):
         props = self.get_blob_properties(container_name, blob_name)
         blob_size = int(props['content-length'])
 
-        if blob_size < self._BLOB_MAX_DATA_SIZE:
+        if max_connections > 1 and \
+                blob_size > self._BLOB_MAX_CHUNK_DATA_SIZE:
+            downloader = _BlobChunkDownloader(self, container_name, blob_name,
+                                              blob_size,
+                                              self._BLOB_MAX_CHUNK_DATA_SIZE,
+                                              stream, max_connections,
+                                              snapshot, x_ms_lease_id,
+                                              progress_callback)
+            downloader.download()
+        elif blob_size < self._BLOB_MAX_DATA_SIZE:
             if progress_callback:
                 progress_callback(0, blob_size)
 
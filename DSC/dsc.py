@@ -33,6 +33,8 @@ import serializerfactory
 import httpclient
 import urllib2httpclient
 import httpclientfactory
+import lcmconfiguration
+import packagemanager
 
 from azure.storage import BlobService
 from Utils.WAAgentUtil import waagent
@@ -58,6 +60,14 @@ package_pattern = '(\d+).(\d+).(\d+).(\d+)'
 nodeid_path = '/etc/opt/omi/conf/dsc/agentid'
 date_time_format = "%Y-%m-%dT%H:%M:%SZ"
 extension_handler_version = "2.71.1.0"
+agent_service_cert_path = "/etc/opt/omi/ssl/oaas.crt"
+agent_service_key_path = "/etc/opt/omi/ssl/oaas.key"
+
+# Client of the DSC agent service, keeps its connection open across the requests of this process
+agent_service_http_client = None
+
+# The LCM configuration, read once and kept until the meta MOF changes
+lcm_configuration_reader = lcmconfiguration.LcmConfigurationReader()
 
 # Error codes
 UnsupportedDistro = 51 #excludes from SLA
@@ -309,25 +319,22 @@ def send_heart_beat_msg_to_agent_service(status_event_type):
         while retry_count <= 5 and canRetry:
             waagent.AddExtensionEvent(name=ExtensionShortName, op='HeartBeatInProgress', isSuccess=True,
                                       message="In send_heart_beat_msg_to_agent_service method")
-            code, output, stderr = run_cmd("python /opt/microsoft/dsc/Scripts/GetDscLocalConfigurationManager.py")
-            if code == 0 and "RefreshMode=Pull" in output:
+            code, lcm_configuration, stderr = lcm_configuration_reader.read()
+            if code == 0 and lcm_configuration.is_pull_mode:
                 waagent.AddExtensionEvent(name=ExtensionShortName, op='HeartBeatInProgress', isSuccess=True,
                                           message="sends heartbeat message in pullmode")
-                m = re.search("ServerURL=([^\n]+)", output)
-                if not m:
+                registration_url = lcm_configuration.server_url
+                if registration_url is None:
                     return
-                registration_url = m.group(1)
                 agent_id = get_nodeid(nodeid_path)
                 node_extended_properties_url = registration_url + "/Nodes(AgentId='" + agent_id + "')/ExtendedProperties"
                 waagent.AddExtensionEvent(name=ExtensionShortName, op='HeartBeatInProgress', isSuccess=True,
                                           message="Url is " + node_extended_properties_url)
                 headers = {'Content-Type': "application/json; charset=utf-8", 'Accept': "application/json",
                            "ProtocolVersion": "2.0"}
-                data = construct_node_extension_properties(output, status_event_type)
+                data = construct_node_extension_properties(lcm_configuration, status_event_type)
 
-                http_client_factory = httpclientfactory.HttpClientFactory("/etc/opt/omi/ssl/oaas.crt",
-                                                                          "/etc/opt/omi/ssl/oaas.key")
-                http_client = http_client_factory.create_http_client(sys.version_info)
+                http_client = get_agent_service_http_client()
 
                 response = http_client.post(node_extended_properties_url, headers=headers, data=data)
                 waagent.AddExtensionEvent(name=ExtensionShortName, op='HeartBeatInProgress', isSuccess=True,
@@ -347,16 +354,19 @@ def send_heart_beat_msg_to_agent_service(status_event_type):
     return response
 
 
-def get_lcm_config_setting(setting_name, lcmconfig):
-    valuegroup = re.search(setting_name + "=([^\n]+)", lcmconfig)
-    if not valuegroup:
-        return ""
-    value = valuegroup.group(1)
-
-    return value
+def get_agent_service_http_client():
+    """
+    Returns the http client authenticated with the oaas certificate, created once so that its certificate is loaded
+    once and its connection to the agent service is reused by the retries and the later requests.
+    """
+    global agent_service_http_client
+    if agent_service_http_client is None:
+        http_client_factory = httpclientfactory.HttpClientFactory(agent_service_cert_path, agent_service_key_path)
+        agent_service_http_client = http_client_factory.create_http_client(sys.version_info)
+    return agent_service_http_client
 
 
-def construct_node_extension_properties(lcmconfig, status_event_type):
+def construct_node_extension_properties(lcm_configuration, status_event_type):
     waagent.AddExtensionEvent(name=ExtensionShortName, op='HeartBeatInProgress', isSuccess=True,
                               message="Getting properties")
     OMSCLOUD_ID = get_omscloudid()
@@ -369,13 +379,13 @@ def construct_node_extension_properties(lcmconfig, status_event_type):
         minor_version = distro_info[1].split('.')[1]
 
     VMUUID = get_vmuuid()
-    node_config_names = get_lcm_config_setting('ConfigurationNames', lcmconfig)
-    configuration_mode = get_lcm_config_setting("ConfigurationMode", lcmconfig)
-    configuration_mode_frequency = get_lcm_config_setting("ConfigurationModeFrequencyMins", lcmconfig)
-    refresh_frequency_mins = get_lcm_config_setting("RefreshFrequencyMins", lcmconfig)
-    reboot_node = get_lcm_config_setting("RebootNodeIfNeeded", lcmconfig)
-    action_after_reboot = get_lcm_config_setting("ActionAfterReboot", lcmconfig)
-    allow_module_overwrite = get_lcm_config_setting("AllowModuleOverwrite", lcmconfig)
+    node_config_names = lcm_configuration.get("ConfigurationNames")
+    configuration_mode = lcm_configuration.get("ConfigurationMode")
+    configuration_mode_frequency = lcm_configuration.get("ConfigurationModeFrequencyMins")
+    refresh_frequency_mins = lcm_configuration.get("RefreshFrequencyMins")
+    reboot_node = lcm_configuration.get("RebootNodeIfNeeded")
+    action_after_reboot = lcm_configuration.get("ActionAfterReboot")
+    allow_module_overwrite = lcm_configuration.get("AllowModuleOverwrite")
 
     waagent.AddExtensionEvent(name=ExtensionShortName, op='HeartBeatInProgress', isSuccess=True,
                               message="Constructing properties data")
@@ -451,23 +461,24 @@ def run_cmd(cmd):
 
 def run_dpkg_cmd_with_retry(cmd):
     """
-    Attempts to run the cmd - if it fails, checks to see if dpkg is locked by another
-    process, if so, it will sleep for 5 seconds and then try running the command again.
-    If dpkg is still locked, then it will return the DPKGLockedErrorCode which won't
-    count against our SLA numbers.
+    Attempts to run the cmd - if it fails because dpkg is locked by another process,
+    waits for the dpkg lock to be released and runs the command again, until the lock
+    timeout. If dpkg is still locked, then it will return the DPKGLockedErrorCode which
+    won't count against our SLA numbers.
     """
-    exit_code, output, stderr = run_cmd(cmd)
-    if not exit_code == 0:
-        dpkg_locked = is_dpkg_locked(exit_code, stderr)
-        if dpkg_locked:
-            # Try one more time:
-            time.sleep(5)
-            exit_code, output, stderr = run_cmd(cmd)
-            dpkg_locked = is_dpkg_locked(exit_code, stderr)
-            if dpkg_locked:
-                exit_code = DPKGLockedErrorCode
-
-    return exit_code, output, stderr
+    return get_dpkg_package_manager().run_cmd_with_lock_retry(cmd)
+
+
+def get_dpkg_package_manager():
+    return packagemanager.DpkgPackageManager(run_cmd, locked_exit_code=DPKGLockedErrorCode)
+
+
+def get_package_manager():
+    if distro_category == DistroCategory.debian:
+        return get_dpkg_package_manager()
+    elif distro_category == DistroCategory.redhat or distro_category == DistroCategory.suse:
+        return packagemanager.RpmPackageManager(run_cmd, locked_exit_code=DPKGLockedErrorCode)
+    return None
 
 def get_config(key):
     if key in public_settings:
@@ -521,11 +532,7 @@ def deb_remove_old_oms_package(package_name, version):
 
 
 def deb_get_pkg_version(package_name):
-    code, output, stderr = run_dpkg_cmd_with_retry('dpkg -s ' + package_name + ' | grep Version:')
-    if code == 0:
-        code, output, stderr = run_dpkg_cmd_with_retry("dpkg -s " + package_name + " | grep Version: | awk '{print $2}'")
-        if code == 0:
-            return output
+    return get_dpkg_package_manager().get_installed_versions([package_name])[package_name]
 
 
 def rpm_remove_incomptible_dsc_package():
@@ -552,16 +559,45 @@ def install_dsc_packages():
     dsc_package_path = dsc_package_prefix + openssl_version
     waagent.AddExtensionEvent(name=ExtensionShortName, op='InstallInProgress', isSuccess=True,
                               message="Installing omipackage version: " + omi_package_path + "; dsc package version: " + dsc_package_path)
+    package_manager = get_package_manager()
+    if package_manager is None:
+        return
     if distro_category == DistroCategory.debian:
-        deb_install_pkg(omi_package_path + '.x64.deb', 'omi', omi_major_version, omi_minor_version, omi_build,
-                        omi_release, ' --force-confold --force-confdef --refuse-downgrade ')
-        deb_install_pkg(dsc_package_path + '.x64.deb', 'dsc', dsc_major_version, dsc_minor_version, dsc_build,
-                        dsc_release, '')
-    elif distro_category == DistroCategory.redhat or distro_category == DistroCategory.suse:
-        rpm_install_pkg(omi_package_path + '.x64.rpm', 'omi', omi_major_version, omi_minor_version, omi_build,
-                        omi_release)
-        rpm_install_pkg(dsc_package_path + '.x64.rpm', 'dsc', dsc_major_version, dsc_minor_version, dsc_build,
-                        dsc_release)
+        package_extension = '.x64.deb'
+        install_options = '--force-confold --force-confdef --refuse-downgrade'
+    else:
+        package_extension = '.x64.rpm'
+        install_options = ''
+    packages = [('omi', omi_package_path + package_extension, omi_major_version, omi_minor_version, omi_build,
+                 omi_release),
+                ('dsc', dsc_package_path + package_extension, dsc_major_version, dsc_minor_version, dsc_build,
+                 dsc_release)]
+
+    # Query the installed versions of all the packages at once, and install the missing or older ones together
+    installed_versions = package_manager.get_installed_versions([package[0] for package in packages])
+    package_paths = []
+    for package_name, package_path, major_version, minor_version, build, release in packages:
+        version = installed_versions[package_name]
+        waagent.AddExtensionEvent(name=ExtensionShortName, op='InstallInProgress', isSuccess=True,
+                                  message="package name: " + package_name + ";  existing package version:" + str(version))
+        if version is not None and compare_pkg_version(version, major_version, minor_version, build, release) == 1:
+            # package is already installed
+            hutil.log(package_name + ' version ' + version + ' is already installed')
+        else:
+            package_paths.append(package_path)
+    if not package_paths:
+        return
+
+    code, output, stderr = package_manager.install(package_paths, install_options)
+    if code == 0:
+        hutil.log(', '.join(package_paths) + ' installed successfully')
+    elif code == DPKGLockedErrorCode:
+        hutil.do_exit(DPKGLockedErrorCode, 'Install', 'error', str(DPKGLockedErrorCode), 'Install failed because the package manager on the VM is currently locked. Please try installing again.')
+    else:
+        waagent.AddExtensionEvent(name=ExtensionShortName, op='InstallInProgress', isSuccess=False,
+                                  message="Failed to install packages :" + ', '.join(package_paths))
+        raise Exception('Failed to install packages {0}: stdout: {1}, stderr: {2}'.format(', '.join(package_paths),
+                                                                                         output, stderr))
 
 
 def compare_pkg_version(system_package_version, major_version, minor_version, build, release):
@@ -577,51 +613,6 @@ def compare_pkg_version(system_package_version, major_version, minor_version, bu
     return 0
 
 
-def rpm_check_pkg_exists(package_name, major_version, minor_version, build, release):
-    code, output, stderr = run_cmd('rpm -q --queryformat "%{VERSION}.%{RELEASE}" ' + package_name)
-    waagent.AddExtensionEvent(name=ExtensionShortName, op='InstallInProgress', isSuccess=True,
-                              message="package name: " + package_name + ";  existing package version:" + output)
-    hutil.log("package name: " + package_name + ";  existing package version:" + output)
-    if code == 0:
-        return compare_pkg_version(output, major_version, minor_version, build, release)
-
-
-def rpm_install_pkg(package_path, package_name, major_version, minor_version, build, release):
-    if rpm_check_pkg_exists(package_name, major_version, minor_version, build, release) == 1:
-        # package is already installed
-        return
-    else:
-        code, output, stderr = run_cmd('rpm -Uvh ' + package_path)
-        if code == 0:
-            hutil.log(package_name + ' is installed successfully')
-        else:
-            waagent.AddExtensionEvent(name=ExtensionShortName, op='InstallInProgress', isSuccess=True,
-                                      message="Failed to install RPM package :" + package_path)
-             raise Exception('Failed to install package {0}: stdout: {1}, stderr: {2}'.format(package_name, output, stderr))
-
-
-def deb_install_pkg(package_path, package_name, major_version, minor_version, build, release, install_options):
-    version = deb_get_pkg_version(package_name)
-    if version is not None and compare_pkg_version(version, major_version, minor_version, build, release) == 1:
-        # package is already installed
-        hutil.log(package_name + ' version ' + version + ' is already installed')
-        waagent.AddExtensionEvent(name=ExtensionShortName, op='InstallInProgress', isSuccess=True,
-                                  message="dsc package with version: " + version + "is already installed.")
-        return
-    else:
-        cmd = 'dpkg -i ' + install_options + ' ' + package_path
-        code, output, stderr = run_dpkg_cmd_with_retry(cmd)
-        if code == 0:
-            hutil.log(package_name + ' version ' + str(major_version) + '.' + str(minor_version) + '.' + str(
-                build) + '.' + str(release) + ' is installed successfully')
-        elif code == DPKGLockedErrorCode:
-            hutil.do_exit(DPKGLockedErrorCode, 'Install', 'error', str(DPKGLockedErrorCode), 'Install failed because the package manager on the VM is currently locked. Please try installing again.')
-        else:
-            waagent.AddExtensionEvent(name=ExtensionShortName, op='InstallInProgress', isSuccess=False,
-                                      message="Failed to install debian package :" + package_path)
-            raise Exception('Failed to install package {0}: stdout: {1}, stderr: {2}'.format(package_name, output, stderr))
-
-
 def install_package(package):
     if distro_category == DistroCategory.debian:
         apt_package_install(package)
@@ -639,7 +630,7 @@ def zypper_package_install(package):
     else:
         waagent.AddExtensionEvent(name=ExtensionShortName, op='InstallInProgress', isSuccess=True,
                                   message="Failed to install zypper package :" + package)
-         raise Exception('Failed to install package {0}: stdout: {1}, stderr: {2}'.format(package, output, stderr))
+        raise Exception('Failed to install package {0}: stdout: {1}, stderr: {2}'.format(package, output, stderr))
 
 
 def yum_package_install(package):
@@ -852,9 +843,10 @@ def apply_dsc_meta_configuration(config_file_path):
     waagent.AddExtensionEvent(name=ExtensionShortName, op='EnableInProgress', isSuccess=True,
                               message='running the cmd: ' + cmd)
     code, output, stderr = run_cmd(cmd)
+    lcm_configuration_reader.invalidate()
     if code == 0:
-        code, output, stderr = run_cmd('/opt/microsoft/dsc/Scripts/GetDscLocalConfigurationManager.py')
-        return output
+        code, lcm_configuration, stderr = lcm_configuration_reader.read()
+        return lcm_configuration.output
     else:
         error_msg = 'Failed to apply Meta MOF configuration: stdout: {0}, stderr: {1}'.format(output, stderr)
         hutil.error(error_msg)
@@ -1060,19 +1052,6 @@ def rpm_uninstall_package(package_name):
                                   message="failed to remove the package" + package_name)
         raise Exception('Failed to remove package ' + package_name)
         
-def is_dpkg_locked(exit_code, output):
-    """
-    If dpkg is locked, the output will contain a message similar to 'dpkg
-    status database is locked by another process'
-    """
-    if exit_code is not 0:
-        dpkg_locked_search = r'^.*dpkg.+lock.*$'
-        dpkg_locked_re = re.compile(dpkg_locked_search, re.M)
-        if dpkg_locked_re.search(output):
-            return True
-    return False
-
-
 def register_automation(registration_key, registation_url, node_configuration_name, refresh_freq,
                         configuration_mode_freq, configuration_mode):
     if (registration_key == '' or registation_url == ''):
@@ -1102,6 +1081,7 @@ def register_automation(registration_key, registation_url, node_configuration_na
                               isSuccess=True,
                               message="Registration URL " + registation_url + "Optional parameters to Registration" + optional_parameters)
     code, output, stderr = run_cmd(cmd + optional_parameters)
+    lcm_configuration_reader.invalidate()
     if not code == 0:
         error_msg = '(03109)Failed to register with Azure Automation DSC: stdout: {0}, stderr: {1}'.format(output, stderr)
         hutil.error(error_msg)
@@ -5,6 +5,7 @@
 import os
 
 from curlhttpclient import CurlHttpClient
+from persistenthttpclient import PersistentHttpClient
 from urllib2httpclient import Urllib2HttpClient
 
 PY_MAJOR_VERSION = 0
@@ -17,7 +18,7 @@ class HttpClientFactory:
 
     Targets :
         [2.4.0 - 2.7.9[ : CurlHttpclient
-        [2.7.9 - 2.7.9+ : Urllib2Httpclient
+        [2.7.9 - 2.7.9+ : PersistentHttpClient
 
         This is due to the lack of built-in strict certificate verification prior to 2.7.9.
         The ssl module was also unavailable for [2.4.0 - 2.6.0[.
@@ -39,7 +40,7 @@ class HttpClientFactory:
 
         Returns:
             An instance of CurlHttpClient if the installed Python version is below 2.7.9
-            An instance of Urllib2 if the installed Python version is or is above 2.7.9
+            An instance of PersistentHttpClient if the installed Python version is or is above 2.7.9
         """
         if version_info[PY_MAJOR_VERSION] == 2 and version_info[PY_MINOR_VERSION] < 7:
             return CurlHttpClient(self.cert, self.key, self.insecure, self.proxy_configuration)
@@ -47,4 +48,4 @@ class HttpClientFactory:
             PY_MICRO_VERSION] < 9:
             return CurlHttpClient(self.cert, self.key, self.insecure, self.proxy_configuration)
         else:
-            return Urllib2HttpClient(self.cert, self.key, self.insecure, self.proxy_configuration)
\ No newline at end of file
+            return PersistentHttpClient(self.cert, self.key, self.insecure, self.proxy_configuration)
\ No newline at end of file
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# DSC extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cached reader of the DSC Local Configuration Manager (LCM) configuration."""
+
+import os
+import re
+import subprocess
+
+get_lcm_configuration_cmd = '/opt/microsoft/dsc/Scripts/GetDscLocalConfigurationManager.py'
+meta_mof_path = '/etc/opt/omi/conf/dsc/configuration/MetaConfig.mof'
+
+setting_pattern = re.compile(r'^\s*(\w+)=(.*?)\s*$')
+
+
+def run_cmd(cmd):
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True)
+    stdout, stderr = proc.communicate()
+    return proc.returncode, stdout, stderr
+
+
+class LcmConfiguration:
+    """The LCM configuration, as printed by GetDscLocalConfigurationManager.py.
+
+    The settings are the Name=Value lines of the output. A setting present more than once (e.g. ServerURL in both the
+    configuration download manager and the report manager) has the value of its first occurrence.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.settings = {}
+        for line in output.splitlines():
+            match = setting_pattern.match(line)
+            if match and match.group(1) not in self.settings:
+                self.settings[match.group(1)] = match.group(2)
+
+    def get(self, setting_name, default=""):
+        """Returns the value of the setting as a string, or default if the setting isn't there."""
+        return self.settings.get(setting_name, default)
+
+    def get_int(self, setting_name, default=None):
+        try:
+            return int(self.settings[setting_name])
+        except (KeyError, ValueError):
+            return default
+
+    def get_bool(self, setting_name, default=None):
+        value = self.settings.get(setting_name, "").lower()
+        if value in ("true", "false"):
+            return value == "true"
+        return default
+
+    @property
+    def succeeded(self):
+        return self.get_int("ReturnValue") == 0
+
+    @property
+    def refresh_mode(self):
+        return self.get("RefreshMode")
+
+    @property
+    def is_pull_mode(self):
+        return self.refresh_mode == "Pull"
+
+    @property
+    def server_url(self):
+        return self.get("ServerURL") or None
+
+    @property
+    def configuration_mode(self):
+        return self.get("ConfigurationMode")
+
+    @property
+    def configuration_mode_frequency_mins(self):
+        return self.get_int("ConfigurationModeFrequencyMins")
+
+    @property
+    def refresh_frequency_mins(self):
+        return self.get_int("RefreshFrequencyMins")
+
+    @property
+    def reboot_node_if_needed(self):
+        return self.get_bool("RebootNodeIfNeeded")
+
+
+class LcmConfigurationReader:
+    """Reads the LCM configuration once and keeps it until the meta MOF changes, so that the heartbeat retries, the
+    node properties and the status don't start a new interpreter for GetDscLocalConfigurationManager.py each time.
+
+    The cached configuration is dropped when the meta MOF is replaced or modified (device, inode, size or modification
+    time changed), and by invalidate(), which is to be called after applying a meta configuration or registering.
+    """
+
+    def __init__(self, cmd=get_lcm_configuration_cmd, meta_mof_path=meta_mof_path, run_cmd=run_cmd):
+        self.cmd = cmd
+        self.meta_mof_path = meta_mof_path
+        self.run_cmd = run_cmd
+        self.configuration = None
+        self.meta_mof_signature = None
+        self.read_count = 0
+
+    def get_meta_mof_signature(self):
+        try:
+            stat = os.stat(self.meta_mof_path)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino, stat.st_size, getattr(stat, 'st_mtime_ns', stat.st_mtime)
+
+    def invalidate(self):
+        self.configuration = None
+        self.meta_mof_signature = None
+
+    def read(self):
+        """Returns the LCM configuration.
+
+        Returns:
+            A tuple (code, configuration, stderr), configuration is an LcmConfiguration, which is only cached when
+            the command succeeded.
+        """
+        signature = self.get_meta_mof_signature()
+        if self.configuration is not None and signature == self.meta_mof_signature:
+            return 0, self.configuration, ''
+
+        code, output, stderr = self.run_cmd(self.cmd)
+        self.read_count += 1
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', 'replace')
+        if isinstance(stderr, bytes):
+            stderr = stderr.decode('utf-8', 'replace')
+
+        configuration = LcmConfiguration(output)
+        if code == 0:
+            self.configuration = configuration
+            self.meta_mof_signature = signature
+        else:
+            self.invalidate()
+        return code, configuration, stderr
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#
+# DSC extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Queries and installs packages with dpkg or rpm, waiting for the package manager lock when it's held."""
+
+import errno
+import fcntl
+import os
+import re
+import subprocess
+import time
+
+# How long to wait for another process to release the package manager lock
+lock_timeout = 60
+lock_poll_interval = 0.5
+LockedErrorCode = 51
+
+
+def run_cmd(cmd):
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True)
+    stdout, stderr = proc.communicate()
+    return proc.returncode, stdout, stderr
+
+
+def to_text(output):
+    if isinstance(output, bytes):
+        return output.decode('utf-8', 'replace')
+    return output
+
+
+def is_lock_held(lock_path):
+    """
+    Tells whether another process holds the lock on lock_path. dpkg and rpm both lock with fcntl, which lockf uses
+    too, so the probe takes the lock without blocking and releases it right away. A lock file which doesn't exist or
+    can't be opened isn't waited for, the package manager reports the error itself then.
+    """
+    try:
+        fd = os.open(lock_path, os.O_RDWR)
+    except (IOError, OSError):
+        return False
+    try:
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            return e.errno in (errno.EACCES, errno.EAGAIN)
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+        return False
+    finally:
+        os.close(fd)
+
+
+def wait_for_locks(lock_paths, deadline, poll_interval=lock_poll_interval):
+    """
+    Waits until none of the locks is held or the deadline (a time.time() value) is reached.
+
+    Returns:
+        True if the locks are free, False if they are still held at the deadline.
+    """
+    while True:
+        if not any(is_lock_held(lock_path) for lock_path in lock_paths):
+            return True
+        now = time.time()
+        if now >= deadline:
+            return False
+        time.sleep(min(poll_interval, deadline - now))
+
+
+class PackageManager:
+    """
+    Base class of the package managers.
+
+    get_installed_versions queries the versions of several packages with a single command, and install installs
+    several packages in a single transaction, so that they're consistent with each other and dependencies between
+    them are resolved by the package manager.
+    """
+    lock_paths = []
+
+    def __init__(self, run_cmd=run_cmd, lock_timeout=lock_timeout, lock_paths=None, locked_exit_code=LockedErrorCode,
+                 poll_interval=lock_poll_interval):
+        self.run_cmd = run_cmd
+        self.lock_timeout = lock_timeout
+        if lock_paths is not None:
+            self.lock_paths = lock_paths
+        self.locked_exit_code = locked_exit_code
+        self.poll_interval = poll_interval
+
+    def get_query_cmd(self, package_names):
+        """Returns the command which lists the installed versions of the packages.
+
+        Args:
+            package_names : list, the names of the packages.
+
+        Returns:
+            A string, the command.
+        """
+        pass
+
+    def parse_installed_versions(self, output):
+        """Parses the output of the query command.
+
+        Args:
+            output : string, the output of the command returned by get_query_cmd.
+
+        Returns:
+            A dictionary of the version of each of the installed packages listed.
+        """
+        pass
+
+    def get_install_cmd(self, package_paths, options):
+        """Returns the command which installs the packages in a single transaction.
+
+        Args:
+            package_paths : list  , the paths of the package files.
+            options       : string, the options of the package manager, may be empty.
+
+        Returns:
+            A string, the command.
+        """
+        pass
+
+    def is_locked(self, exit_code, stderr):
+        """Tells whether the command failed because another process holds the package manager lock.
+
+        Args:
+            exit_code : int   , the exit code of the command.
+            stderr    : string, the error output of the command.
+
+        Returns:
+            True if the package manager was locked.
+        """
+        pass
+
+    def get_installed_versions(self, package_names):
+        """
+        Returns a dictionary of the installed version of each of the packages, None for the packages which aren't
+        installed.
+        """
+        code, output, stderr = self.run_cmd(self.get_query_cmd(package_names))
+        # Both dpkg-query and rpm fail when one of the packages isn't installed but still list the others
+        installed_versions = self.parse_installed_versions(to_text(output))
+        return dict((package_name, installed_versions.get(package_name)) for package_name in package_names)
+
+    def install(self, package_paths, options=''):
+        """
+        Installs the packages in a single transaction.
+
+        Returns:
+            A tuple (exit code, stdout, stderr), the exit code is locked_exit_code if another process held the
+            package manager lock until the lock timeout.
+        """
+        return self.run_cmd_with_lock_retry(self.get_install_cmd(package_paths, options))
+
+    def run_cmd_with_lock_retry(self, cmd):
+        """
+        Runs the cmd once the package manager lock is free. If it still fails because of the lock (another process
+        took it meanwhile), waits for the lock again and retries, until the lock timeout.
+        """
+        deadline = time.time() + self.lock_timeout
+        while True:
+            wait_for_locks(self.lock_paths, deadline, self.poll_interval)
+            exit_code, output, stderr = self.run_cmd(cmd)
+            output, stderr = to_text(output), to_text(stderr)
+            if exit_code == 0 or not self.is_locked(exit_code, stderr):
+                return exit_code, output, stderr
+            now = time.time()
+            if now >= deadline:
+                return self.locked_exit_code, output, stderr
+            # The lock may be one which can't be probed, don't retry in a busy loop
+            time.sleep(min(self.poll_interval, deadline - now))
+
+
+class DpkgPackageManager(PackageManager):
+    lock_paths = ['/var/lib/dpkg/lock-frontend', '/var/lib/dpkg/lock']
+    locked_re = re.compile(r'^.*dpkg.+lock.*$', re.M)
+
+    def get_query_cmd(self, package_names):
+        return "dpkg-query -W -f='${Package}\\t${Status}\\t${Version}\\n' " + ' '.join(package_names)
+
+    def parse_installed_versions(self, output):
+        versions = {}
+        for line in output.splitlines():
+            fields = line.split('\t')
+            # Removed packages keep a status (e.g. "deinstall ok config-files"), only "... installed" ones count
+            if len(fields) == 3 and fields[1].endswith(' installed') and fields[0] not in versions:
+                versions[fields[0]] = fields[2]
+        return versions
+
+    def get_install_cmd(self, package_paths, options):
+        return ' '.join(['dpkg -i'] + ([options] if options else []) + package_paths)
+
+    def is_locked(self, exit_code, stderr):
+        """
+        If dpkg is locked, the output will contain a message similar to 'dpkg
+        status database is locked by another process'
+        """
+        return exit_code != 0 and self.locked_re.search(stderr) is not None
+
+
+class RpmPackageManager(PackageManager):
+    lock_paths = ['/var/lib/rpm/.rpm.lock']
+    locked_re = re.compile(r'transaction lock')
+
+    def get_query_cmd(self, package_names):
+        return "rpm -q --queryformat '%{NAME}\\t%{VERSION}.%{RELEASE}\\n' " + ' '.join(package_names)
+
+    def parse_installed_versions(self, output):
+        versions = {}
+        for line in output.splitlines():
+            # Packages which aren't installed are reported as "package <name> is not installed"
+            fields = line.split('\t')
+            if len(fields) == 2 and fields[0] not in versions:
+                versions[fields[0]] = fields[1]
+        return versions
+
+    def get_install_cmd(self, package_paths, options):
+        return ' '.join(['rpm -Uvh'] + ([options] if options else []) + package_paths)
+
+    def is_locked(self, exit_code, stderr):
+        return exit_code != 0 and self.locked_re.search(stderr) is not None
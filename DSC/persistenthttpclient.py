@@ -0,0 +1,267 @@
+#!/usr/bin/env python2
+#
+# Copyright (C) Microsoft Corporation, All rights reserved.
+
+"""Persistent HttpClient."""
+
+import http.client
+import socket
+import threading
+import urllib.parse
+
+from httpclient import *
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+DEFAULT_TIMEOUT = 30
+
+
+class ResumableHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPSConnection which resumes the TLS session of the previous connection to the same server, so that
+    reconnecting skips the full handshake (and the client certificate exchange). Session resumption needs python 3.6+,
+    older versions do a full handshake on every connection.
+    """
+
+    def __init__(self, host, port=None, timeout=DEFAULT_TIMEOUT, context=None, session_holder=None):
+        http.client.HTTPSConnection.__init__(self, host, port, timeout=timeout, context=context)
+        self.session_holder = session_holder
+
+    def connect(self):
+        session = self.session_holder.session if self.session_holder is not None else None
+        if session is None or not hasattr(ssl.SSLSocket, "session"):
+            http.client.HTTPSConnection.connect(self)
+            return
+
+        # Same as HTTPSConnection.connect, with the session to resume
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host if self._tunnel_host else self.host
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname, session=session)
+
+    def save_session(self):
+        """Keeps the TLS session of this connection for the next connection. With TLS 1.3 the session ticket is only
+        sent after the handshake, so this is called once a response was read.
+        """
+        if self.session_holder is not None and self.sock is not None and getattr(self.sock, "session", None):
+            self.session_holder.session = self.sock.session
+
+
+class TlsSessionHolder:
+    """The TLS session of the last connection to a server."""
+
+    def __init__(self):
+        self.session = None
+
+
+class PersistentHttpClient(HttpClient):
+    """Http client which keeps one connection per server alive across requests. Inherits from HttpClient.
+
+    Targets:
+        [2.7.9 - 2.7.9+] only due to the lack of strict certificate verification prior to this version.
+
+    The SSL context (with the client certificate and key loaded) is created once for the lifetime of the client, and
+    the connection to each server is kept open (keep-alive) until the server closes it. A request sent on a
+    connection the server closed meanwhile is sent again once on a new connection, which resumes the TLS session of
+    the previous one.
+
+    Implements the following method common to all classes inheriting HttpClient.
+        get     (url, headers)
+        post    (url, headers, data)
+        put     (url, headers, data)
+        delete  (url, headers, data)
+    """
+
+    def __init__(self, cert_path, key_path, insecure=False, proxy_configuration=None, timeout=DEFAULT_TIMEOUT):
+        HttpClient.__init__(self, cert_path, key_path, insecure, proxy_configuration)
+        self.timeout = timeout
+        self.ssl_context = self.create_ssl_context()
+        self.connections = {}
+        self.tls_sessions = {}
+        self.lock = threading.Lock()
+
+        # counters, for diagnostics and benchmarks
+        self.connection_count = 0
+        self.resumed_session_count = 0
+        self.request_count = 0
+
+    def create_ssl_context(self):
+        """Creates the SSL context shared by all connections of this client.
+
+        Returns:
+            An ssl.SSLContext
+        """
+        ssl_context = ssl.create_default_context()
+        if self.insecure:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        if self.cert_path is not None and self.key_path is not None:
+            ssl_context.load_cert_chain(self.cert_path, self.key_path)
+        return ssl_context
+
+    def get_connection(self, scheme, host, port):
+        """Returns the open connection to the server, or a new one.
+
+        Args:
+            scheme  : string, http or https.
+            host    : string, the host.
+            port    : int   , the port (None for the default one).
+
+        Returns:
+            A tuple (connection, reused), reused is True when the connection was already used for a previous request.
+        """
+        key = (scheme, host, port)
+        connection = self.connections.get(key)
+        if connection is not None:
+            return connection, True
+
+        proxy_host, proxy_port = None, None
+        if self.proxy_configuration is not None:
+            proxy = urllib.parse.urlsplit(self.proxy_configuration)
+            proxy_host, proxy_port = proxy.hostname, proxy.port
+
+        if scheme == "https":
+            session_holder = self.tls_sessions.setdefault(key, TlsSessionHolder())
+            if proxy_host is not None:
+                connection = ResumableHTTPSConnection(proxy_host, proxy_port, timeout=self.timeout,
+                                                      context=self.ssl_context, session_holder=session_holder)
+                connection.set_tunnel(host, port)
+            else:
+                connection = ResumableHTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context,
+                                                      session_holder=session_holder)
+        else:
+            if proxy_host is not None:
+                connection = http.client.HTTPConnection(proxy_host, proxy_port, timeout=self.timeout)
+                connection.set_tunnel(host, port)
+            else:
+                connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+        self.connections[key] = connection
+        return connection, False
+
+    def close(self):
+        """Closes all connections of this client."""
+        with self.lock:
+            for connection in self.connections.values():
+                connection.close()
+            self.connections.clear()
+
+    def send(self, connection, method, path, headers, body):
+        """Sends the request and reads the whole response, so that the connection can be used for the next one.
+
+        Returns:
+            A RequestResponse
+        """
+        new_connection = connection.sock is None
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        raw_data = response.read()
+
+        if new_connection:
+            self.connection_count += 1
+            if getattr(connection.sock, "session_reused", False):
+                self.resumed_session_count += 1
+        if isinstance(connection, ResumableHTTPSConnection):
+            connection.save_session()
+        if response.will_close:
+            connection.close()
+        return RequestResponse(response.status, raw_data)
+
+    def issue_request(self, url, headers, method, data=None):
+        """Issues a request to the provided url using the provided headers, on the open connection to the server.
+
+        Args:
+            url     : string    , the url.
+            headers : dictionary, contains the headers key value pair.
+            method  : string    , the http method.
+            data    : string    , contains the serialized request body.
+
+        Returns:
+            A RequestResponse
+        """
+        parsed_url = urllib.parse.urlsplit(url)
+        path = parsed_url.path or "/"
+        if parsed_url.query:
+            path += "?" + parsed_url.query
+
+        with self.lock:
+            self.request_count += 1
+            connection, reused = self.get_connection(parsed_url.scheme, parsed_url.hostname, parsed_url.port)
+            try:
+                return self.send(connection, method, path, headers, data)
+            except (http.client.BadStatusLine, http.client.CannotSendRequest, http.client.ResponseNotReady,
+                    socket.error):
+                connection.close()
+                if not reused:
+                    del self.connections[(parsed_url.scheme, parsed_url.hostname, parsed_url.port)]
+                    raise
+                # The server closed the kept alive connection meanwhile (idle timeout), send the request again on a
+                # new connection.
+                return self.send(connection, method, path, headers, data)
+            except Exception:
+                connection.close()
+                raise
+
+    def get(self, url, headers=None):
+        """Issues a GET request to the provided url and using the provided headers.
+
+        Args:
+            url     : string    , the url.
+            headers : dictionary, contains the headers key value pair.
+
+        Returns:
+            A RequestResponse
+        """
+        headers = self.merge_headers(self.default_headers, headers)
+        return self.issue_request(url, headers, self.GET)
+
+    def post(self, url, headers=None, data=None):
+        """Issues a POST request to the provided url and using the provided headers.
+
+        Args:
+            url     : string    , the url.
+            headers : dictionary, contains the headers key value pair.
+            data    : dictionary, contains the non-serialized request body.
+
+        Returns:
+            A RequestResponse
+        """
+        return self.issue_request_with_body(url, headers, self.POST, data)
+
+    def put(self, url, headers=None, data=None):
+        """Issues a PUT request to the provided url and using the provided headers.
+
+        Args:
+            url     : string    , the url.
+            headers : dictionary, contains the headers key value pair.
+            data    : dictionary, contains the non-serialized request body.
+
+        Returns:
+            A RequestResponse
+        """
+        return self.issue_request_with_body(url, headers, self.PUT, data)
+
+    def delete(self, url, headers=None, data=None):
+        """Issues a DELETE request to the provided url and using the provided headers.
+
+        Args:
+            url     : string    , the url.
+            headers : dictionary, contains the headers key value pair.
+            data    : dictionary, contains the non-serialized request body.
+
+        Returns:
+            A RequestResponse
+        """
+        return self.issue_request_with_body(url, headers, self.DELETE, data)
+
+    def issue_request_with_body(self, url, headers, method, data):
+        headers = self.merge_headers(self.default_headers, headers)
+
+        if data is None:
+            serial_data = ""
+        else:
+            serial_data = self.json.dumps(data)
+            headers.update({self.CONTENT_TYPE_HEADER_KEY: self.APP_JSON_HEADER_VALUE})
+
+        return self.issue_request(url, headers, method, serial_data.encode("utf-8"))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+#
+# DSC Extension For Linux
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local HTTPS stand-in for the DSC pull server / agent service, requiring a client certificate like the real one.
+It counts the TLS connections it accepts and how many resumed a previous TLS session, so that the http clients can be
+tested and benchmarked without a real pull server.
+
+Run it directly to benchmark the http clients:
+    python pullserver_standin.py [request count]
+"""
+
+import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+def create_certificates(directory):
+    """Creates a self-signed server certificate for localhost and a self-signed client certificate (the oaas.crt and
+    oaas.key stand-ins) with the openssl command.
+
+    Returns:
+        A dictionary with the paths of the server_cert, server_key, client_cert and client_key files.
+    """
+    paths = {}
+    for name, subject, extension in [("server", "/CN=localhost", "subjectAltName=DNS:localhost,IP:127.0.0.1"),
+                                     ("client", "/CN=oaas", "extendedKeyUsage=clientAuth")]:
+        paths[name + "_cert"] = os.path.join(directory, name + ".crt")
+        paths[name + "_key"] = os.path.join(directory, name + ".key")
+        subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                               "-subj", subject, "-addext", extension,
+                               "-keyout", paths[name + "_key"], "-out", paths[name + "_cert"]],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return paths
+
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+    """Answers every request with a small JSON document, keeping the connection alive (HTTP/1.1)."""
+    protocol_version = "HTTP/1.1"
+    # The status line, the headers and the body are written separately, don't let them wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Closes the connections idle for longer than the server's idle timeout, like the real servers do.
+        self.timeout = self.server.idle_timeout
+        BaseHTTPRequestHandler.setup(self)
+
+    def handle_request(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        self.server.record_request(self.command, self.path, body)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        response = json.dumps({"status": "ok"}).encode("utf-8")
+        self.send_response(self.server.status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = handle_request
+    do_POST = handle_request
+    do_PUT = handle_request
+    do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PullServerStandin(ThreadingMixIn, HTTPServer):
+    """HTTPS server on a free port of localhost, which requires the client certificate."""
+    daemon_threads = True
+
+    def __init__(self, certificates, idle_timeout=5, latency=0, status_code=200):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StandinRequestHandler)
+        self.idle_timeout = idle_timeout
+        self.latency = latency
+        self.status_code = status_code
+        self.lock = threading.Lock()
+        self.connection_count = 0
+        self.resumed_session_count = 0
+        self.requests = []
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certificates["server_cert"], certificates["server_key"])
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.load_verify_locations(certificates["client_cert"])
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.thread = None
+
+    @property
+    def url(self):
+        return "https://localhost:{0}".format(self.server_address[1])
+
+    def get_request(self):
+        connection, address = HTTPServer.get_request(self)
+        with self.lock:
+            self.connection_count += 1
+            if connection.session_reused:
+                self.resumed_session_count += 1
+        return connection, address
+
+    def record_request(self, method, path, body):
+        with self.lock:
+            self.requests.append((method, path, body))
+
+    def handle_error(self, request, client_address):
+        # Clients going away are expected (e.g. handshakes without a client certificate)
+        pass
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def benchmark(request_count):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from persistenthttpclient import PersistentHttpClient
+    from urllib2httpclient import Urllib2HttpClient
+
+    directory = tempfile.mkdtemp()
+    try:
+        certificates = create_certificates(directory)
+        # The clients trust the stand-in's self-signed certificate through the default verify paths
+        os.environ["SSL_CERT_FILE"] = certificates["server_cert"]
+        for client_class in [Urllib2HttpClient, PersistentHttpClient]:
+            server = PullServerStandin(certificates).start()
+            client = client_class(certificates["client_cert"], certificates["client_key"])
+            start = time.time()
+            for i in range(request_count):
+                # GET, Urllib2HttpClient can't send a str body on python 3
+                response = client.get(server.url + "/Nodes(AgentId='0')/ExtendedProperties",
+                                      headers={"Accept": "application/json", "ProtocolVersion": "2.0"})
+                assert response.status_code == 200
+            elapsed = time.time() - start
+            print("{0}: {1} requests, {2} connections ({3} resumed TLS sessions), {4:.2f} ms per request".format(
+                client_class.__name__, request_count, server.connection_count, server.resumed_session_count,
+                elapsed * 1000 / request_count))
+            server.stop()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
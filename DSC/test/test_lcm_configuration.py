@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# DSC Extension For Linux
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+import env
+from lcmconfiguration import LcmConfiguration, LcmConfigurationReader
+
+lcm_output = """instance of GetMetaConfiguration
+{
+    ReturnValue=0
+    MetaConfiguration=
+    instance of MSFT_DSCMetaConfiguration
+    {
+        ConfigurationModeFrequencyMins=15
+        RebootNodeIfNeeded=false
+        ConfigurationMode=ApplyAndMonitor
+        ActionAfterReboot=ContinueConfiguration
+        RefreshMode=Pull
+        AllowModuleOverwrite=false
+        RefreshFrequencyMins=30
+        ConfigurationDownloadManagers=
+        {
+            [0]=instance of MSFT_WebDownloadManager
+            {
+                ServerURL=https://oaas.example.com/accounts/0
+            }
+        }
+        ReportManagers=
+        {
+            [0]=instance of MSFT_WebReportManager
+            {
+                ServerURL=https://reports.example.com/accounts/0
+            }
+        }
+    }
+}
+"""
+
+
+class TestLcmConfiguration(unittest.TestCase):
+    def test_settings(self):
+        lcm_configuration = LcmConfiguration(lcm_output)
+        self.assertTrue(lcm_configuration.succeeded)
+        self.assertTrue(lcm_configuration.is_pull_mode)
+        # The first ServerURL is the configuration download manager's
+        self.assertEqual(lcm_configuration.server_url, "https://oaas.example.com/accounts/0")
+        self.assertEqual(lcm_configuration.configuration_mode, "ApplyAndMonitor")
+        self.assertEqual(lcm_configuration.configuration_mode_frequency_mins, 15)
+        self.assertEqual(lcm_configuration.refresh_frequency_mins, 30)
+        self.assertEqual(lcm_configuration.reboot_node_if_needed, False)
+        self.assertEqual(lcm_configuration.get("AllowModuleOverwrite"), "false")
+        self.assertEqual(lcm_configuration.get("ConfigurationNames"), "")
+
+    def test_push_mode_without_server(self):
+        lcm_configuration = LcmConfiguration(lcm_output.replace("RefreshMode=Pull", "RefreshMode=Push")
+                                             .replace("ServerURL", "Server"))
+        self.assertFalse(lcm_configuration.is_pull_mode)
+        self.assertIsNone(lcm_configuration.server_url)
+
+
+class TestLcmConfigurationReader(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.meta_mof_path = os.path.join(self.directory, "MetaConfig.mof")
+        self.write_meta_mof("instance of MSFT_DSCMetaConfiguration {};")
+        self.commands = []
+        self.code = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_meta_mof(self, content):
+        with open(self.meta_mof_path, "w") as meta_mof:
+            meta_mof.write(content)
+
+    def run_cmd(self, cmd):
+        self.commands.append(cmd)
+        return self.code, lcm_output.encode("utf-8"), b""
+
+    def create_reader(self):
+        return LcmConfigurationReader("GetDscLocalConfigurationManager.py", self.meta_mof_path, self.run_cmd)
+
+    def test_read_once(self):
+        reader = self.create_reader()
+        for i in range(6):
+            code, lcm_configuration, stderr = reader.read()
+            self.assertEqual(code, 0)
+            self.assertEqual(lcm_configuration.server_url, "https://oaas.example.com/accounts/0")
+        self.assertEqual(self.commands, ["GetDscLocalConfigurationManager.py"])
+
+    def test_meta_mof_change_invalidates(self):
+        reader = self.create_reader()
+        reader.read()
+        self.write_meta_mof("instance of MSFT_DSCMetaConfiguration { RefreshMode = \"Pull\"; };")
+        reader.read()
+        reader.read()
+        os.remove(self.meta_mof_path)
+        reader.read()
+        self.assertEqual(len(self.commands), 3)
+
+    def test_invalidate(self):
+        reader = self.create_reader()
+        reader.read()
+        reader.invalidate()
+        reader.read()
+        self.assertEqual(len(self.commands), 2)
+
+    def test_failures_are_not_cached(self):
+        reader = self.create_reader()
+        self.code = 1
+        code, lcm_configuration, stderr = reader.read()
+        self.assertEqual(code, 1)
+        self.code = 0
+        reader.read()
+        reader.read()
+        self.assertEqual(len(self.commands), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,7 +35,8 @@ class TestNodeExtensionProperties(unittest.TestCase):
         config = dsc.apply_dsc_meta_configuration('mof/dscnode.nxFile.meta.mof')
         self.assertTrue('ReturnValue=0' in config)
         
-        content = dsc.construct_node_extension_properties(config, "upgrade")
+        code, lcm_configuration, stderr = dsc.lcm_configuration_reader.read()
+        content = dsc.construct_node_extension_properties(lcm_configuration, "upgrade")
         data = json.dumps(content)
         self.assertTrue('OMSCloudId' in data, "OMSCLoudID doesn't exist")
         
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+#
+# DSC Extension For Linux
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import env
+import packagemanager
+from packagemanager import DpkgPackageManager, RpmPackageManager
+
+# Stand-ins for dpkg-query, dpkg and rpm. They log their command lines to calls.log (one fork each), keep the
+# installed packages in installed.json and fail like the real ones when the lock file is held by another process.
+stub_common = """#!{python}
+import errno, fcntl, json, os, re, sys
+stub_dir = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(stub_dir, 'calls.log'), 'a') as log:
+    log.write(' '.join([os.path.basename(sys.argv[0])] + sys.argv[1:]) + '\\n')
+installed_path = os.path.join(stub_dir, 'installed.json')
+installed = json.load(open(installed_path))
+
+def is_locked():
+    locked_runs_path = os.path.join(stub_dir, 'locked_runs')
+    if os.path.exists(locked_runs_path):
+        locked_runs = int(open(locked_runs_path).read())
+        if locked_runs > 0:
+            open(locked_runs_path, 'w').write(str(locked_runs - 1))
+            return True
+    fd = os.open(os.path.join(stub_dir, 'lock'), os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return True
+    return False
+
+def install(package_paths):
+    for package_path in package_paths:
+        m = re.match(r'(\\w+)-(\\d+)\\.(\\d+)\\.(\\d+)-(\\d+)', os.path.basename(package_path))
+        installed[m.group(1)] = ['install ok installed', '.'.join(m.groups()[1:])]
+    json.dump(installed, open(installed_path, 'w'))
+"""
+
+stubs = {
+    'dpkg-query': """
+code = 0
+for name in sys.argv[3:]:
+    if name in installed:
+        sys.stdout.write('{0}\\t{1}\\t{2}\\n'.format(name, installed[name][0], installed[name][1]))
+    else:
+        sys.stderr.write('dpkg-query: no packages found matching {0}\\n'.format(name))
+        code = 1
+sys.exit(code)
+""",
+    'dpkg': """
+if is_locked():
+    sys.stderr.write('dpkg: error: dpkg frontend lock is locked by another process\\n')
+    sys.exit(2)
+install([arg for arg in sys.argv[2:] if not arg.startswith('-')])
+""",
+    'rpm': """
+if sys.argv[1] == '-q':
+    code = 0
+    for name in sys.argv[4:]:
+        if name in installed:
+            sys.stdout.write('{0}\\t{1}\\n'.format(name, installed[name][1]))
+        else:
+            sys.stdout.write('package {0} is not installed\\n'.format(name))
+            code += 1
+    sys.exit(code)
+if is_locked():
+    sys.stderr.write("error: can't create transaction lock on /var/lib/rpm/.rpm.lock (Resource temporarily unavailable)\\n")
+    sys.exit(1)
+install([arg for arg in sys.argv[2:] if not arg.startswith('-')])
+"""}
+
+omi_deb = 'packages/omi-1.4.2-5.ssl_110.x64.deb'
+dsc_deb = 'packages/dsc-1.1.1-926.ssl_110.x64.deb'
+
+
+class TestPackageManager(unittest.TestCase):
+    def setUp(self):
+        self.stub_dir = tempfile.mkdtemp()
+        for name, body in stubs.items():
+            path = os.path.join(self.stub_dir, name)
+            with open(path, 'w') as stub:
+                stub.write(stub_common.format(python=sys.executable) + body)
+            os.chmod(path, 0o755)
+        self.set_installed({})
+        self.lock_path = os.path.join(self.stub_dir, 'lock')
+        open(self.lock_path, 'w').close()
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.stub_dir + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.stub_dir)
+
+    def set_installed(self, installed):
+        with open(os.path.join(self.stub_dir, 'installed.json'), 'w') as installed_file:
+            json.dump(installed, installed_file)
+
+    def get_calls(self):
+        calls_path = os.path.join(self.stub_dir, 'calls.log')
+        if not os.path.exists(calls_path):
+            return []
+        with open(calls_path) as calls:
+            return calls.read().splitlines()
+
+    def hold_lock(self, seconds):
+        holder = subprocess.Popen([sys.executable, '-c', 'import fcntl, sys, time\n'
+                                   'lock = open(sys.argv[1], "w")\n'
+                                   'fcntl.lockf(lock, fcntl.LOCK_EX)\n'
+                                   'sys.stdout.write("locked\\n")\n'
+                                   'sys.stdout.flush()\n'
+                                   'time.sleep(float(sys.argv[2]))\n', self.lock_path, str(seconds)],
+                                  stdout=subprocess.PIPE)
+        holder.stdout.readline()
+        self.addCleanup(holder.stdout.close)
+        self.addCleanup(holder.wait)
+        self.addCleanup(holder.kill)
+        return holder
+
+    def create_dpkg(self, **kwargs):
+        return DpkgPackageManager(lock_paths=[self.lock_path], **kwargs)
+
+    def test_dpkg_versions_in_one_query(self):
+        self.set_installed({'omi': ['install ok installed', '1.4.2.5'],
+                            'dsc': ['deinstall ok config-files', '1.1.1.294']})
+        self.assertEqual(self.create_dpkg().get_installed_versions(['omi', 'dsc', 'omiserver']),
+                         {'omi': '1.4.2.5', 'dsc': None, 'omiserver': None})
+        self.assertEqual(len(self.get_calls()), 1)
+
+    def test_rpm_versions_in_one_query(self):
+        self.set_installed({'omi': ['install ok installed', '1.4.2.5']})
+        package_manager = RpmPackageManager(lock_paths=[self.lock_path])
+        self.assertEqual(package_manager.get_installed_versions(['omi', 'dsc']), {'omi': '1.4.2.5', 'dsc': None})
+        self.assertEqual(len(self.get_calls()), 1)
+
+    def test_install_in_one_transaction(self):
+        package_manager = self.create_dpkg()
+        start = time.time()
+        versions = package_manager.get_installed_versions(['omi', 'dsc'])
+        code, output, stderr = package_manager.install(
+            [omi_deb, dsc_deb], '--force-confold --force-confdef --refuse-downgrade')
+        latency = time.time() - start
+
+        self.assertEqual(versions, {'omi': None, 'dsc': None})
+        self.assertEqual(code, 0)
+        self.assertEqual(package_manager.get_installed_versions(['omi', 'dsc']), {'omi': '1.4.2.5', 'dsc': '1.1.1.926'})
+        # One query and one install, instead of two dpkg -s per package and one dpkg -i per package
+        calls = self.get_calls()
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(calls[1], 'dpkg -i --force-confold --force-confdef --refuse-downgrade ' + omi_deb + ' ' + dsc_deb)
+        self.assertTrue(latency < 5, latency)
+
+    def test_rpm_install_in_one_transaction(self):
+        package_manager = RpmPackageManager(lock_paths=[self.lock_path])
+        code, output, stderr = package_manager.install([omi_deb.replace('.deb', '.rpm'), dsc_deb.replace('.deb', '.rpm')])
+        self.assertEqual(code, 0)
+        self.assertEqual(self.get_calls(), ['rpm -Uvh ' + omi_deb.replace('.deb', '.rpm') + ' ' + dsc_deb.replace('.deb', '.rpm')])
+
+    def test_install_waits_for_the_lock(self):
+        self.hold_lock(0.5)
+        start = time.time()
+        code, output, stderr = self.create_dpkg(poll_interval=0.05).install([omi_deb])
+        latency = time.time() - start
+
+        self.assertEqual(code, 0)
+        # The lock is probed without running dpkg, and dpkg runs as soon as the lock is released
+        self.assertEqual(len(self.get_calls()), 1)
+        self.assertTrue(0.3 < latency < 5, latency)
+
+    def test_install_gives_up_at_the_deadline(self):
+        self.hold_lock(30)
+        start = time.time()
+        code, output, stderr = self.create_dpkg(lock_timeout=0.5, poll_interval=0.05, locked_exit_code=51).install(
+            [omi_deb])
+        self.assertEqual(code, 51)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(len(self.get_calls()), 1)
+
+    def test_install_retries_when_the_lock_is_taken_meanwhile(self):
+        with open(os.path.join(self.stub_dir, 'locked_runs'), 'w') as locked_runs:
+            locked_runs.write('2')
+        code, output, stderr = self.create_dpkg(poll_interval=0.05).install([omi_deb])
+        self.assertEqual(code, 0)
+        self.assertEqual(len(self.get_calls()), 3)
+
+    def test_other_errors_are_not_retried(self):
+        code, output, stderr = self.create_dpkg().install(['packages/missing.deb'])
+        self.assertNotEqual(code, 0)
+        self.assertEqual(len(self.get_calls()), 1)
+
+    def test_lock_probe(self):
+        self.assertFalse(packagemanager.is_lock_held(self.lock_path))
+        self.assertFalse(packagemanager.is_lock_held(os.path.join(self.stub_dir, 'missing')))
+        self.hold_lock(30)
+        self.assertTrue(packagemanager.is_lock_held(self.lock_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
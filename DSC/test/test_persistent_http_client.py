@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# DSC Extension For Linux
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import shutil
+import tempfile
+import time
+import unittest
+import env
+from persistenthttpclient import PersistentHttpClient
+from pullserver_standin import PullServerStandin, create_certificates
+
+headers = {'Content-Type': "application/json; charset=utf-8", 'Accept': "application/json", "ProtocolVersion": "2.0"}
+
+
+class TestPersistentHttpClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.certificates = create_certificates(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def start_server(self, **kwargs):
+        server = PullServerStandin(self.certificates, **kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def create_client(self):
+        client = PersistentHttpClient(self.certificates["client_cert"], self.certificates["client_key"])
+        client.ssl_context.load_verify_locations(self.certificates["server_cert"])
+        self.addCleanup(client.close)
+        return client
+
+    def test_requests_share_one_connection(self):
+        server = self.start_server()
+        client = self.create_client()
+        url = server.url + "/Nodes(AgentId='0')/ExtendedProperties"
+        for i in range(10):
+            response = client.post(url, headers=headers.copy(), data={"ExtensionStatusEvent": "ExtensionHeartbeat"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.deserialized_data, {"status": "ok"})
+        self.assertEqual(client.get(url, headers=headers.copy()).status_code, 200)
+
+        self.assertEqual(server.connection_count, 1)
+        self.assertEqual(client.connection_count, 1)
+        self.assertEqual(client.request_count, 11)
+        self.assertEqual(len(server.requests), 11)
+        method, path, body = server.requests[0]
+        self.assertEqual((method, path), ("POST", "/Nodes(AgentId='0')/ExtendedProperties"))
+        self.assertEqual(json.loads(body.decode("utf-8")), {"ExtensionStatusEvent": "ExtensionHeartbeat"})
+
+    def test_error_status_is_returned(self):
+        server = self.start_server(status_code=503)
+        client = self.create_client()
+        response = client.post(server.url + "/Nodes(AgentId='0')/ExtendedProperties", headers=headers.copy(),
+                               data={})
+        self.assertEqual(response.status_code, 503)
+
+    def test_reconnects_after_idle_close_and_resumes_tls_session(self):
+        server = self.start_server(idle_timeout=0.2)
+        client = self.create_client()
+        url = server.url + "/Nodes(AgentId='0')/ExtendedProperties"
+        self.assertEqual(client.post(url, headers=headers.copy(), data={}).status_code, 200)
+        # The server closes the connection, the client finds out when sending the next request
+        time.sleep(0.5)
+        self.assertEqual(client.post(url, headers=headers.copy(), data={}).status_code, 200)
+
+        self.assertEqual(server.connection_count, 2)
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(server.resumed_session_count, 1)
+        self.assertEqual(client.resumed_session_count, 1)
+
+    def test_client_certificate_is_loaded_once(self):
+        server = self.start_server()
+        client = self.create_client()
+        ssl_context = client.ssl_context
+        for i in range(3):
+            client.close()
+            self.assertEqual(client.get(server.url + "/", headers=headers.copy()).status_code, 200)
+        self.assertTrue(client.ssl_context is ssl_context)
+        self.assertEqual(server.connection_count, 3)
+        self.assertEqual(server.resumed_session_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+#
+# Azure Linux extension
+#
+# Linux Azure Diagnostic Extension (Current version is specified in manifest.xml)
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+# MIT License
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the ""Software""), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import collections
+import os
+import traceback
+
+
+def read_process_rss_kb(pid, proc_root='/proc'):
+    """
+    Read the resident memory of a process from /proc/<pid>/status's VmRSS value.
+    Note: "VmSize" for some reason starts out very high (>2000000) for mdsd, so can't use that.
+    :param pid: ID of the process
+    :param proc_root: Mount point of procfs (for tests)
+    :return int: Memory usage in KB, None if the process doesn't exist
+    """
+    try:
+        with open(os.path.join(proc_root, str(pid), 'status')) as proc_file:
+            for line in proc_file:
+                if line.startswith("VmRSS:"):  # Example line: "VmRSS:   33904 kB"
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def read_total_memory_kb(proc_root='/proc'):
+    """
+    Read the total memory of the VM from /proc/meminfo.
+    :param proc_root: Mount point of procfs (for tests)
+    :return int: Total memory in KB, None if it can't be read
+    """
+    try:
+        with open(os.path.join(proc_root, 'meminfo')) as meminfo_file:
+            for line in meminfo_file:
+                if line.startswith("MemTotal:"):  # Example line: "MemTotal:  8141604 kB"
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def read_cgroup_memory_limit_kb(pid='self', proc_root='/proc', cgroup_root='/sys/fs/cgroup'):
+    """
+    Read the memory limit of the cgroup of a process (e.g., the one the agent sets up for the extension). The limits
+    of the parent cgroups apply too, so the lowest limit up to the root is returned. Both cgroup v1 (memory controller)
+    and v2 (unified hierarchy) are supported.
+    :param pid: ID of the process, 'self' by default
+    :param proc_root: Mount point of procfs (for tests)
+    :param cgroup_root: Mount point of the cgroup file systems (for tests)
+    :return int: Memory limit in KB, None if there's no limit or it can't be read
+    """
+    cgroup_dir = None
+    limit_file_name = None
+    try:
+        with open(os.path.join(proc_root, str(pid), 'cgroup')) as cgroup_file:
+            for line in cgroup_file:  # Example lines: "4:memory:/system.slice/waagent.service" or "0::/azure.slice"
+                fields = line.strip().split(':', 2)
+                if len(fields) != 3:
+                    continue
+                hierarchy_id, controllers, path = fields
+                if 'memory' in controllers.split(','):
+                    cgroup_dir = os.path.join(cgroup_root, 'memory', path.lstrip('/'))
+                    limit_file_name = 'memory.limit_in_bytes'
+                    break
+                if hierarchy_id == '0' and controllers == '':
+                    cgroup_dir = os.path.join(cgroup_root, path.lstrip('/'))
+                    limit_file_name = 'memory.max'
+    except (IOError, OSError):
+        return None
+    if cgroup_dir is None:
+        return None
+
+    limit_kb = None
+    cgroup_dir = os.path.normpath(cgroup_dir)
+    cgroup_root = os.path.normpath(cgroup_root)
+    while True:
+        try:
+            with open(os.path.join(cgroup_dir, limit_file_name)) as limit_file:
+                value = limit_file.read().strip()
+            if value != 'max':  # cgroup v1 has no 'max', its "no limit" is a huge number and gets capped by the caller
+                limit_kb = min(limit_kb, int(value) // 1024) if limit_kb is not None else int(value) // 1024
+        except (IOError, OSError, ValueError):
+            pass
+        if cgroup_dir == cgroup_root or os.path.dirname(cgroup_dir) == cgroup_dir \
+                or not cgroup_dir.startswith(cgroup_root):
+            break
+        cgroup_dir = os.path.dirname(cgroup_dir)
+    return limit_kb
+
+
+class MemoryGrowthDecision(object):
+    """
+    A decision to recycle a process, with the samples it's based on so that the thresholds can be tuned from logs.
+    """
+
+    def __init__(self, reason, rss_kb, slope_kb_per_hour, threshold_kb, samples):
+        """
+        Constructor
+        :param reason: Why the process should be recycled (str)
+        :param rss_kb: Latest memory usage in KB
+        :param slope_kb_per_hour: Memory growth fitted over the sliding window, None if not computed
+        :param threshold_kb: Memory usage the process isn't allowed to reach, in KB
+        :param samples: List of (timestamp, rss_kb) samples in the sliding window
+        """
+        self.reason = reason
+        self.rss_kb = rss_kb
+        self.slope_kb_per_hour = slope_kb_per_hour
+        self.threshold_kb = threshold_kb
+        self.samples = samples
+
+    def format_samples(self, max_samples=40):
+        """
+        Format the samples as "+<seconds since first sample>s:<rss>KB" items, thinned out to max_samples items
+        (the first and the last are always kept) so that the message stays short enough for a telemetry event.
+        """
+        if not self.samples:
+            return ''
+        step = max(1, (len(self.samples) + max_samples - 1) // max_samples)
+        samples = self.samples[::step]
+        if samples[-1] is not self.samples[-1]:
+            samples.append(self.samples[-1])
+        first_time = self.samples[0][0]
+        return ' '.join('+{0}s:{1}KB'.format(int(t - first_time), rss_kb) for t, rss_kb in samples)
+
+    def __str__(self):
+        slope = 'n/a' if self.slope_kb_per_hour is None else '{0}KB/h'.format(int(self.slope_kb_per_hour))
+        return "{0} (RSS: {1}KB, growth: {2}, threshold: {3}KB, samples: {4})".format(
+            self.reason, self.rss_kb, slope, self.threshold_kb, self.format_samples())
+
+
+class MemoryGrowthDetector(object):
+    """
+    Detects a memory leak of a long running process (mdsd) from a time series of its RSS, instead of a fixed
+    threshold that is too low for large VMs and too high for small ones. The thresholds are relative to the memory
+    the process can actually use: the total memory of the VM, or the memory limit of its cgroup if lower.
+    The process is recycled when:
+    1. its RSS goes over hard_limit_ratio of that memory, whatever the trend, or
+    2. the growth fitted (least squares) over the sliding window is steady (r^2 >= min_fit_quality), still going on
+       in the latest half of the window (so that a warm up followed by a plateau doesn't count), and projects the RSS
+       over the hard limit within projection_seconds.
+    Create one detector per process start, the samples of a previous process don't mean anything for the new one.
+    """
+
+    def __init__(self, total_memory_kb, cgroup_limit_kb=None, hard_limit_ratio=0.5, window_seconds=2*3600,
+                 min_window_seconds=3600, projection_seconds=6*3600, min_fit_quality=0.8, min_rss_ratio=0.05):
+        """
+        Constructor
+        :param total_memory_kb: Total memory of the VM in KB
+        :param cgroup_limit_kb: Memory limit of the cgroup of the process in KB, None if there's none
+        :param hard_limit_ratio: Fraction of the usable memory the process is never allowed to use
+        :param window_seconds: Length of the sliding window the growth is fitted over
+        :param min_window_seconds: The growth isn't judged before the samples cover this long
+        :param projection_seconds: How far ahead the fitted growth is projected against the hard limit
+        :param min_fit_quality: Minimum coefficient of determination of the fit for the growth to be steady
+        :param min_rss_ratio: A process using less than this fraction of the usable memory is never recycled
+        """
+        usable_memory_kb = total_memory_kb
+        if cgroup_limit_kb is not None and cgroup_limit_kb > 0:
+            usable_memory_kb = min(usable_memory_kb, cgroup_limit_kb)
+        self.usable_memory_kb = usable_memory_kb
+        self.hard_limit_kb = int(usable_memory_kb * hard_limit_ratio)
+        self.min_rss_kb = int(usable_memory_kb * min_rss_ratio)
+        self.window_seconds = window_seconds
+        self.min_window_seconds = min_window_seconds
+        self.projection_seconds = projection_seconds
+        self.min_fit_quality = min_fit_quality
+        self._samples = collections.deque()
+
+    def __str__(self):
+        return "usable memory: {0}KB, hard limit: {1}KB, growth window: {2}s, projection: {3}s".format(
+            self.usable_memory_kb, self.hard_limit_kb, self.window_seconds, self.projection_seconds)
+
+    @staticmethod
+    def fit_growth(samples):
+        """
+        Least squares fit of the samples to a line.
+        :param samples: Sequence of (timestamp, rss_kb)
+        :return (float, float): The slope in KB per second and the coefficient of determination (r^2),
+                                (None, None) if the samples can't be fitted
+        """
+        n = len(samples)
+        if n < 3:
+            return None, None
+        mean_t = sum(t for t, rss_kb in samples) / float(n)
+        mean_rss = sum(rss_kb for t, rss_kb in samples) / float(n)
+        s_tt = sum((t - mean_t) ** 2 for t, rss_kb in samples)
+        s_tr = sum((t - mean_t) * (rss_kb - mean_rss) for t, rss_kb in samples)
+        s_rr = sum((rss_kb - mean_rss) ** 2 for t, rss_kb in samples)
+        if s_tt == 0:
+            return None, None
+        slope = s_tr / s_tt
+        fit_quality = 1.0 if s_rr == 0 else (s_tr * s_tr) / (s_tt * s_rr)
+        return slope, fit_quality
+
+    def add_sample(self, timestamp, rss_kb):
+        """
+        Record an RSS sample and decide whether the process should be recycled.
+        :param timestamp: Time of the sample in seconds (e.g., time.time())
+        :param rss_kb: Memory usage of the process in KB
+        :return MemoryGrowthDecision: The decision to recycle the process, None to keep it running
+        """
+        self._samples.append((timestamp, rss_kb))
+        while timestamp - self._samples[0][0] > self.window_seconds:
+            self._samples.popleft()
+        samples = list(self._samples)
+
+        if rss_kb > self.hard_limit_kb:
+            return MemoryGrowthDecision("Memory usage over the hard limit", rss_kb, None, self.hard_limit_kb, samples)
+
+        if rss_kb < self.min_rss_kb or timestamp - samples[0][0] < self.min_window_seconds:
+            return None
+        slope, fit_quality = self.fit_growth(samples)
+        if slope is None or slope <= 0 or fit_quality < self.min_fit_quality:
+            return None
+        half_window_start = timestamp - (timestamp - samples[0][0]) / 2.0
+        recent_slope, recent_fit_quality = self.fit_growth([s for s in samples if s[0] >= half_window_start])
+        if recent_slope is None or recent_slope <= 0 or recent_fit_quality < self.min_fit_quality:
+            return None
+        projected_rss_kb = rss_kb + min(slope, recent_slope) * self.projection_seconds
+        if projected_rss_kb <= self.hard_limit_kb:
+            return None
+        return MemoryGrowthDecision("Steady memory growth projected over the hard limit in {0}s (fit r^2: {1:.2f})"
+                                    .format(self.projection_seconds, fit_quality),
+                                    rss_kb, slope * 3600, self.hard_limit_kb, samples)
+
+
+def check_suspected_memory_leak(pid, detector, logger_err, timestamp):
+    """
+    Sample the memory usage of a process and check it for a suspected memory leak.
+    :param pid: ID of the process we are checking.
+    :param detector: MemoryGrowthDetector of the process
+    :param logger_err: Error logging function (e.g., hutil.error)
+    :param timestamp: Time of the sample in seconds (e.g., time.time())
+    :return MemoryGrowthDecision: The decision to recycle the process, None if no leak is suspected.
+    """
+    try:
+        rss_kb = read_process_rss_kb(pid)
+        if rss_kb is None:
+            return None
+        return detector.add_sample(timestamp, rss_kb)
+    except Exception as e:
+        # Not to throw in case any statement above fails. Just log.
+        logger_err("Failed to check memory usage of pid={0}.\nError: {1}\nTrace:\n{2}".format(pid, e, traceback.format_exc()))
+        return None
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Azure Linux extension
+#
+# Linux Azure Diagnostic Extension (Current version is specified in manifest.xml)
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+# MIT License
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the ""Software""), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import threading
+
+
+def read_process_cmdline(pid, proc_root='/proc'):
+    """
+    Read the command line of a process from /proc, without running any command.
+    :param pid: ID of the process (int or str)
+    :param proc_root: Mount point of procfs (for tests)
+    :return str: The command line with its arguments separated by spaces, None if the process doesn't exist
+    """
+    try:
+        with open(os.path.join(proc_root, str(pid).strip(), 'cmdline'), 'rb') as f:
+            return f.read().replace(b'\0', b' ').decode('utf-8', 'replace').strip()
+    except (IOError, OSError):
+        return None
+
+
+def read_pid_file(pid_file_path):
+    """
+    Read a process ID from a pid file (e.g., /var/opt/omi/run/omiserver.pid)
+    :param pid_file_path: Path of the pid file
+    :return int: The process ID, None if the file doesn't exist or doesn't hold a pid
+    """
+    try:
+        with open(pid_file_path, 'r') as f:
+            return int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def is_process_running(pid, cmdline_substring, proc_root='/proc'):
+    """
+    Check from /proc whether the process is alive and is still the expected program (pids get reused).
+    :param pid: ID of the process, may be None
+    :param cmdline_substring: A string the command line of the process should contain (e.g., 'omiserver')
+    :param proc_root: Mount point of procfs (for tests)
+    :return bool: True if the process is running
+    """
+    if pid is None:
+        return False
+    cmdline = read_process_cmdline(pid, proc_root)
+    return cmdline is not None and cmdline_substring in cmdline
+
+
+class ChildExitWatcher(object):
+    """
+    Waits on a child process (subprocess.Popen object) in a thread of its own, so that the supervisor wakes up
+    as soon as the child exits instead of polling it every monitoring cycle. The thread reaps the child, so
+    check the child's exit through this object, not through child.poll().
+    """
+
+    def __init__(self, child):
+        """
+        Constructor
+        :param child: subprocess.Popen object of a process started by this process
+        """
+        self._child = child
+        self._exited = threading.Event()
+        thread = threading.Thread(target=self._wait_for_child)
+        thread.daemon = True
+        thread.start()
+
+    def _wait_for_child(self):
+        try:
+            self._child.wait()
+        finally:
+            self._exited.set()
+
+    def wait(self, timeout):
+        """
+        Wait for the child to exit.
+        :param timeout: Maximum seconds to wait
+        :return bool: True if the child exited (within the timeout or before)
+        """
+        self._exited.wait(timeout)
+        return self._exited.is_set()
+
+    def returncode(self):
+        return self._child.returncode
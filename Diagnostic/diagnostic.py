@@ -48,6 +48,9 @@ try:
     import watcherutil
     from Utils.lad_ext_settings import LadExtSettings
     from Utils.misc_helpers import *
+    from Utils.process_helpers import ChildExitWatcher, read_process_cmdline, read_pid_file, is_process_running
+    from Utils.memory_helpers import MemoryGrowthDetector, check_suspected_memory_leak, read_total_memory_kb, \
+        read_cgroup_memory_limit_kb
     import lad_config_all as lad_cfg
     from Utils.imds_util import ImdsLogger
     import Utils.omsagent_util as oms
@@ -76,6 +79,7 @@ g_lad_pids_filepath = ''  # LAD process IDs (diagnostic.py, mdsd) file path. g_e
 g_ext_op_type = None  # Extension operation type (e.g., Install, Enable, HeartBeat, ...)
 g_mdsd_bin_path = '/usr/local/lad/bin/mdsd'  # mdsd binary path. Fixed w/ lad-mdsd-*.{deb,rpm} pkgs
 g_diagnostic_py_filepath = ''  # Full path of this script. g_ext_dir + '/diagnostic.py'
+g_omi_server_pid_filepath = '/var/opt/omi/run/omiserver.pid'  # Written by omiserver, used to check if OMI is alive
 # Only 2 globals not following 'g_...' naming convention, for legacy readability...
 RunGetOutput = None  # External command executor callable
 hutil = None  # Handler util object
@@ -577,10 +581,16 @@ def start_mdsd(configurator):
 
         num_quick_consecutive_crashes = 0
         mdsd_crash_msg = ''
+        # mdsd runs in our cgroup, so its memory limit (if any) applies to mdsd too
+        total_memory_kb = read_total_memory_kb()
+        cgroup_memory_limit_kb = read_cgroup_memory_limit_kb()
 
         while num_quick_consecutive_crashes < 3:  # We consider only quick & consecutive crashes for retries
 
-            RunGetOutput('rm -f ' + g_mdsd_file_resources_prefix + '.pidport')  # Must delete any existing port num file
+            try:
+                os.remove(g_mdsd_file_resources_prefix + '.pidport')  # Must delete any existing port num file
+            except OSError:
+                pass
             mdsd_stdout_stream = open(mdsd_stdout_redirect_path, "w")
             hutil.log("Start mdsd " + str(command))
             mdsd = subprocess.Popen(command,
@@ -590,8 +600,14 @@ def start_mdsd(configurator):
                                     env=copy_env)
 
             write_lad_pids_to_file(g_lad_pids_filepath, os.getpid(), mdsd.pid)
+            # Wakes the monitoring loop up as soon as mdsd exits, so that it's restarted right away
+            mdsd_exit_watcher = ChildExitWatcher(mdsd)
 
             last_mdsd_start_time = datetime.datetime.now()
+            mdsd_memory_growth_detector = None
+            if total_memory_kb:
+                mdsd_memory_growth_detector = MemoryGrowthDetector(total_memory_kb, cgroup_memory_limit_kb)
+                hutil.log("mdsd memory leak detection: " + str(mdsd_memory_growth_detector))
             last_error_time = last_mdsd_start_time
             omi_installed = True  # Remembers if OMI is installed at each iteration
             telegraf_restart_retries = 0
@@ -599,21 +615,24 @@ def start_mdsd(configurator):
             max_restart_retries = 10
             # Continuously monitors mdsd process
             while True:
-                time.sleep(30)
-                if " ".join(get_lad_pids()).find(str(mdsd.pid)) < 0 and len(get_lad_pids()) >= 2:
+                if mdsd_exit_watcher.wait(30):  # if mdsd has terminated
+                    hutil.log("mdsd exited with code {0}".format(mdsd_exit_watcher.returncode()))
+                    mdsd_stdout_stream.flush()
+                    break
+                lad_pids = get_lad_pids()
+                if " ".join(lad_pids).find(str(mdsd.pid)) < 0 and len(lad_pids) >= 2:
                     mdsd.kill()
                     hutil.log("Another process is started, now exit")
                     return
-                if mdsd.poll() is not None:  # if mdsd has terminated
-                    time.sleep(60)
-                    mdsd_stdout_stream.flush()
-                    break
 
                 # mdsd is now up for at least 30 seconds. Do some monitoring activities.
                 # 1. Mitigate if memory leak is suspected.
-                mdsd_memory_leak_suspected, mdsd_memory_usage_in_KB = check_suspected_memory_leak(mdsd.pid, hutil.error)
-                if mdsd_memory_leak_suspected:
-                    g_lad_log_helper.log_suspected_memory_leak_and_kill_mdsd(mdsd_memory_usage_in_KB, mdsd,
+                mdsd_memory_leak_decision = None
+                if mdsd_memory_growth_detector:
+                    mdsd_memory_leak_decision = check_suspected_memory_leak(mdsd.pid, mdsd_memory_growth_detector,
+                                                                            hutil.error, time.time())
+                if mdsd_memory_leak_decision:
+                    g_lad_log_helper.log_suspected_memory_leak_and_kill_mdsd(mdsd_memory_leak_decision, mdsd,
                                                                              waagent_ext_event_type)
                     break
                 # 2. Restart OMI if it crashed (Issue #128)
@@ -712,6 +731,9 @@ def start_mdsd(configurator):
 
             mdsd_crash_msg = "MDSD crash(uptime=" + str(mdsd_up_time) + "):" + tail(mdsd_stdout_redirect_path) + tail(err_file_path)
             hutil.error("MDSD crashed:" + mdsd_crash_msg)
+            # The first crash is restarted right away, but back off if mdsd keeps crashing
+            if 1 < num_quick_consecutive_crashes < 3:
+                time.sleep(60)
 
         # mdsd all 3 allowed quick/consecutive crashes exhausted
         hutil.do_status_report(waagent_ext_event_type, "error", '1', "mdsd stopped: " + mdsd_crash_msg)
@@ -813,7 +835,7 @@ def get_lad_pids():
 
     with open(g_lad_pids_filepath, "r") as f:
         for pid in f.readlines():
-            is_still_alive = RunGetOutput("cat /proc/" + pid.strip() + "/cmdline", should_log=False)[1]
+            is_still_alive = read_process_cmdline(pid) or ''
             if is_still_alive.find('/waagent/') > 0:
                 lad_pids.append(pid.strip())
             else:
@@ -843,7 +865,8 @@ def restart_omi_if_crashed(omi_installed, mdsd):
         hutil.log("OMI is reinstalled. Will resume checking if OMI is up and running.")
 
     should_restart_omi = False
-    if omi_installed:
+    # A running omiserver process is enough, the noop query is only needed when it's gone
+    if omi_installed and not is_process_running(read_pid_file(g_omi_server_pid_filepath), 'omiserver'):
         cmd_exit_status, cmd_output = RunGetOutput(cmd=omicli_noop_query_cmd, should_log=False)
         should_restart_omi = cmd_exit_status is not 0
         if should_restart_omi:
@@ -0,0 +1,154 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from Utils.memory_helpers import MemoryGrowthDetector, read_process_rss_kb, read_total_memory_kb, \
+    read_cgroup_memory_limit_kb
+
+GB_IN_KB = 1024 * 1024
+MB_IN_KB = 1024
+SAMPLE_INTERVAL = 30  # The LAD daemon loop samples mdsd every 30 seconds
+
+
+def make_trace(hours, rss_kb_at, noise_kb=0, seed=0):
+    """
+    Synthetic RSS trace of a process, sampled like the LAD daemon loop does.
+    :param hours: Length of the trace
+    :param rss_kb_at: Function of the elapsed seconds returning the RSS in KB
+    :param noise_kb: Amplitude of the uniform noise added to each sample
+    :return list: (timestamp, rss_kb) samples
+    """
+    rng = random.Random(seed)
+    start = 1500000000
+    return [(start + t, max(0, int(rss_kb_at(t) + rng.uniform(-noise_kb, noise_kb))))
+            for t in range(0, int(hours * 3600), SAMPLE_INTERVAL)]
+
+
+def replay(detector, trace):
+    """
+    Replay a trace through a detector, the way the LAD daemon loop would: the process is recycled at the first
+    decision.
+    :return (float, MemoryGrowthDecision): Hours since the start of the trace when the process got recycled and the
+                                           decision, (None, None) if it kept running
+    """
+    for timestamp, rss_kb in trace:
+        decision = detector.add_sample(timestamp, rss_kb)
+        if decision:
+            return (timestamp - trace[0][0]) / 3600.0, decision
+    return None, None
+
+
+class MemoryGrowthSimulationTest(unittest.TestCase):
+
+    def test_flat_large_workload_on_large_vm(self):
+        # 6GB of legit steady usage on a 64GB VM used to be killed by the fixed 2GB threshold
+        trace = make_trace(24, lambda t: 6 * GB_IN_KB, noise_kb=200 * MB_IN_KB)
+        self.assertEqual(replay(MemoryGrowthDetector(64 * GB_IN_KB), trace), (None, None))
+
+    def test_warm_up_then_plateau(self):
+        # Caches fill up to 2.5GB in the first 40 minutes on an 8GB VM, then stay there
+        trace = make_trace(12, lambda t: min(2.5 * GB_IN_KB, 300 * MB_IN_KB + t * 1000), noise_kb=50 * MB_IN_KB)
+        self.assertEqual(replay(MemoryGrowthDetector(8 * GB_IN_KB), trace), (None, None))
+
+    def test_garbage_collection_sawtooth(self):
+        # Grows by 400MB and drops back every 20 minutes
+        trace = make_trace(12, lambda t: 500 * MB_IN_KB + (t % 1200) * 400 * MB_IN_KB / 1200)
+        self.assertEqual(replay(MemoryGrowthDetector(4 * GB_IN_KB), trace), (None, None))
+
+    def test_slow_leak_on_small_vm(self):
+        # 50MB/hour on a 1GB VM, the fixed 2GB threshold would never have fired before the OOM killer
+        trace = make_trace(24, lambda t: 100 * MB_IN_KB + t * 50 * MB_IN_KB / 3600, noise_kb=5 * MB_IN_KB)
+        hours, decision = replay(MemoryGrowthDetector(GB_IN_KB), trace)
+        self.assertTrue(hours is not None and hours < 4)
+        self.assertTrue(decision.reason.startswith("Steady memory growth"))
+        self.assertTrue(decision.slope_kb_per_hour > 40 * MB_IN_KB)
+        self.assertTrue(decision.rss_kb < decision.threshold_kb)
+        self.assertEqual(decision.threshold_kb, 512 * MB_IN_KB)
+
+    def test_leak_on_large_vm_is_caught_before_the_hard_limit(self):
+        trace = make_trace(48, lambda t: GB_IN_KB + t * GB_IN_KB / 3600, noise_kb=100 * MB_IN_KB)
+        hours, decision = replay(MemoryGrowthDetector(64 * GB_IN_KB), trace)
+        self.assertTrue(hours is not None and hours < 30)
+        self.assertTrue(decision.reason.startswith("Steady memory growth"))
+
+    def test_cgroup_limit_lowers_the_thresholds(self):
+        trace = make_trace(24, lambda t: 100 * MB_IN_KB + t * 50 * MB_IN_KB / 3600, noise_kb=5 * MB_IN_KB)
+        self.assertEqual(replay(MemoryGrowthDetector(64 * GB_IN_KB), trace), (None, None))
+        hours, decision = replay(MemoryGrowthDetector(64 * GB_IN_KB, cgroup_limit_kb=GB_IN_KB), trace)
+        self.assertTrue(hours is not None and hours < 4)
+
+    def test_sudden_jump_over_hard_limit(self):
+        trace = make_trace(2, lambda t: 200 * MB_IN_KB if t < 1800 else 3 * GB_IN_KB)
+        hours, decision = replay(MemoryGrowthDetector(4 * GB_IN_KB), trace)
+        self.assertEqual(hours, 0.5)
+        self.assertTrue(decision.reason.startswith("Memory usage over the hard limit"))
+
+    def test_decision_carries_its_samples(self):
+        trace = make_trace(24, lambda t: 100 * MB_IN_KB + t * 50 * MB_IN_KB / 3600)
+        hours, decision = replay(MemoryGrowthDetector(GB_IN_KB), trace)
+        # The samples are the sliding window ending at the decision
+        self.assertEqual(decision.samples[-1][1], decision.rss_kb)
+        self.assertTrue(decision.samples[-1][0] - decision.samples[0][0] <= 2 * 3600)
+        formatted_samples = decision.format_samples().split()
+        self.assertTrue(len(formatted_samples) <= 41)
+        self.assertEqual(formatted_samples[0], '+0s:{0}KB'.format(decision.samples[0][1]))
+        self.assertEqual(formatted_samples[-1], '+{0}s:{1}KB'.format(decision.samples[-1][0] - decision.samples[0][0],
+                                                                     decision.rss_kb))
+        self.assertTrue(formatted_samples[-1] in str(decision))
+
+
+class MemoryReadersTest(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _write(self, path, content):
+        path = os.path.join(self._root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_read_process_rss_kb(self):
+        self._write('proc/1234/status', 'Name:\tmdsd\nVmSize:\t 2513204 kB\nVmRSS:\t   33904 kB\n')
+        proc_root = os.path.join(self._root, 'proc')
+        self.assertEqual(read_process_rss_kb(1234, proc_root), 33904)
+        self.assertEqual(read_process_rss_kb(2345, proc_root), None)
+
+    def test_read_total_memory_kb(self):
+        self._write('proc/meminfo', 'MemTotal:        8141604 kB\nMemFree:          197732 kB\n')
+        self.assertEqual(read_total_memory_kb(os.path.join(self._root, 'proc')), 8141604)
+        self.assertEqual(read_total_memory_kb(self._root), None)
+
+    def test_read_cgroup_v1_memory_limit(self):
+        self._write('proc/self/cgroup', '5:cpu,cpuacct:/azure.slice/lad.service\n4:memory:/azure.slice/lad.service\n')
+        self._write('cgroup/memory/memory.limit_in_bytes', '9223372036854771712\n')
+        self._write('cgroup/memory/azure.slice/memory.limit_in_bytes', str(4 * 1024 * 1024 * 1024) + '\n')
+        self._write('cgroup/memory/azure.slice/lad.service/memory.limit_in_bytes', '9223372036854771712\n')
+        self.assertEqual(read_cgroup_memory_limit_kb(proc_root=os.path.join(self._root, 'proc'),
+                                                     cgroup_root=os.path.join(self._root, 'cgroup')),
+                         4 * GB_IN_KB)
+
+    def test_read_cgroup_v2_memory_limit(self):
+        self._write('proc/self/cgroup', '0::/azure.slice/lad.service\n')
+        self._write('cgroup/azure.slice/memory.max', 'max\n')
+        self._write('cgroup/azure.slice/lad.service/memory.max', str(512 * 1024 * 1024) + '\n')
+        self.assertEqual(read_cgroup_memory_limit_kb(proc_root=os.path.join(self._root, 'proc'),
+                                                     cgroup_root=os.path.join(self._root, 'cgroup')),
+                         512 * MB_IN_KB)
+
+    def test_no_cgroup_memory_limit(self):
+        self._write('proc/self/cgroup', '0::/\n')
+        self._write('cgroup/cgroup.controllers', 'cpu memory\n')
+        self.assertEqual(read_cgroup_memory_limit_kb(proc_root=os.path.join(self._root, 'proc'),
+                                                     cgroup_root=os.path.join(self._root, 'cgroup')),
+                         None)
+
+
+if __name__ == '__main__':
+    unittest.main()
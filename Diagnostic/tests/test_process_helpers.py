@@ -0,0 +1,74 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from Utils.process_helpers import ChildExitWatcher, read_process_cmdline, read_pid_file, is_process_running
+
+
+class ProcessHelpersTest(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Create a fake /proc with a LAD daemon and an omiserver process in it
+        """
+        self._proc_root = tempfile.mkdtemp()
+        for pid, cmdline in [(1234, ['python2', '/var/lib/waagent/Microsoft.Azure.Diagnostics.LinuxDiagnostic-3.0.121/diagnostic.py', '-daemon']),
+                             (2345, ['/opt/omi/bin/omiserver', '-d'])]:
+            os.mkdir(os.path.join(self._proc_root, str(pid)))
+            with open(os.path.join(self._proc_root, str(pid), 'cmdline'), 'wb') as f:
+                f.write(b'\0'.join(arg.encode('utf-8') for arg in cmdline) + b'\0')
+
+    def tearDown(self):
+        shutil.rmtree(self._proc_root)
+
+    def test_read_process_cmdline(self):
+        self.assertEqual(read_process_cmdline('1234\n', self._proc_root),
+                         'python2 /var/lib/waagent/Microsoft.Azure.Diagnostics.LinuxDiagnostic-3.0.121/diagnostic.py -daemon')
+        self.assertEqual(read_process_cmdline(9999, self._proc_root), None)
+        self.assertTrue('python' in read_process_cmdline(os.getpid()))
+
+    def test_is_process_running(self):
+        self.assertTrue(is_process_running(2345, 'omiserver', self._proc_root))
+        # The pid was reused by another program
+        self.assertFalse(is_process_running(1234, 'omiserver', self._proc_root))
+        self.assertFalse(is_process_running(9999, 'omiserver', self._proc_root))
+        self.assertFalse(is_process_running(None, 'omiserver', self._proc_root))
+
+    def test_read_pid_file(self):
+        pid_file_path = os.path.join(self._proc_root, 'omiserver.pid')
+        self.assertEqual(read_pid_file(pid_file_path), None)
+        with open(pid_file_path, 'w') as f:
+            f.write('2345\n')
+        self.assertEqual(read_pid_file(pid_file_path), 2345)
+        with open(pid_file_path, 'w') as f:
+            f.write('')
+        self.assertEqual(read_pid_file(pid_file_path), None)
+
+    def test_child_exit_is_seen_right_away(self):
+        child = subprocess.Popen([sys.executable, '-c', 'import time, sys; time.sleep(0.2); sys.exit(3)'])
+        watcher = ChildExitWatcher(child)
+        start = time.time()
+        self.assertTrue(watcher.wait(30))
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(watcher.returncode(), 3)
+        # Already exited, doesn't wait anymore
+        self.assertTrue(watcher.wait(30))
+
+    def test_running_child_times_out(self):
+        child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        try:
+            watcher = ChildExitWatcher(child)
+            self.assertFalse(watcher.wait(0.2))
+            child.kill()
+            self.assertTrue(watcher.wait(5))
+        finally:
+            if child.returncode is None:
+                child.kill()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,6 +35,7 @@ import subprocess
 import time
 import signal
 import metrics_ext_utils.metrics_common_utils as metrics_utils
+import metrics_ext_utils.process_registry as process_registry
 
 
 def is_running(is_lad):
@@ -47,12 +48,12 @@ def is_running(is_lad):
     else:
         metrics_bin = metrics_constants.ama_metrics_extension_bin
 
-    proc = subprocess.Popen(["ps  aux | grep MetricsExtension | grep -v grep"], stdout=subprocess.PIPE, shell=True)
-    output = proc.communicate()[0]
-    if metrics_bin in output.decode('utf-8', 'ignore'):
-        return True
-    else:
-        return False
+    _, configFolder = get_handler_vars()
+    metrics_pid_path = configFolder + "/metrics_configs/metrics_pid.txt"
+    name = "lad_metrics_extension" if is_lad else "ama_metrics_extension"
+    process_registry.registry.register(name, metrics_bin, pid_file=metrics_pid_path,
+                                       systemd_unit="metrics-extension.service")
+    return process_registry.registry.is_running(name)
 
 
 def stop_metrics_service(is_lad):
@@ -92,9 +93,7 @@ def stop_metrics_service(is_lad):
                 pid = f.read()
             if pid != "":
                 # Check if the process running is indeed MetricsExtension, ignore if the process output doesn't contain MetricsExtension
-                proc = subprocess.Popen(["ps -o cmd= {0}".format(pid)], stdout=subprocess.PIPE, shell=True)
-                output = proc.communicate()[0]
-                if metrics_ext_bin in output.decode('utf-8', 'ignore'):
+                if process_registry.is_process_running(pid.strip(), metrics_ext_bin):
                     os.kill(int(pid), signal.SIGKILL)
                 else:
                     return False, "Found a different process running with PID {0}. Failed to stop MetricsExtension.".format(pid)
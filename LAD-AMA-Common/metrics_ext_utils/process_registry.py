@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+# Azure Linux extension
+#
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+# MIT License
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the ""Software""), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+# THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# This File keeps track of the binaries (telegraf, MetricsExtension) LAD and Azure Monitor Extension start, so that their
+# watchers can check whether they are still running from /proc, without spawning ps through a shell every cycle.
+
+import os
+import threading
+
+
+def read_process_state(pid, proc_root="/proc"):
+    """
+    Read the state of a process from /proc/<pid>/stat (R, S, D, Z...)
+    :param pid: ID of the process
+    :param proc_root: Mount point of procfs (for tests)
+    :return: The state letter, None if the process does not exist
+    """
+    try:
+        with open(os.path.join(proc_root, str(pid), "stat"), "r") as f:
+            stat = f.read()
+    except (IOError, OSError):
+        return None
+    # The process name is in parentheses and may contain spaces and parentheses itself
+    fields = stat[stat.rfind(")") + 1:].split()
+    if not fields:
+        return None
+    return fields[0]
+
+
+def read_process_exe(pid, proc_root="/proc"):
+    """
+    Read the path of the binary a process runs, from /proc/<pid>/exe, or from its command line when the exe link
+    can't be read (processes of other users without root)
+    :param pid: ID of the process
+    :param proc_root: Mount point of procfs (for tests)
+    :return: The path of the binary, None if the process does not exist
+    """
+    try:
+        exe = os.readlink(os.path.join(proc_root, str(pid), "exe"))
+        # The binary was replaced (e.g. upgraded) while the process was running
+        if exe.endswith(" (deleted)"):
+            exe = exe[:-len(" (deleted)")]
+        return exe
+    except (IOError, OSError):
+        pass
+    try:
+        with open(os.path.join(proc_root, str(pid), "cmdline"), "rb") as f:
+            cmdline = f.read()
+    except (IOError, OSError):
+        return None
+    return cmdline.split(b"\0")[0].decode("utf-8", "ignore") or None
+
+
+def is_process_running(pid, bin_path, proc_root="/proc"):
+    """
+    Check whether a process is alive (not a zombie) and runs bin_path, pids get reused by other processes
+    :param pid: ID of the process, may be None
+    :param bin_path: Path of the binary the process should run
+    :param proc_root: Mount point of procfs (for tests)
+    """
+    if pid is None:
+        return False
+    state = read_process_state(pid, proc_root)
+    if state is None or state in ("Z", "X", "x"):
+        return False
+    # exe is the resolved path of the binary, bin_path may be a symlink to it
+    return read_process_exe(pid, proc_root) in (bin_path, os.path.realpath(bin_path))
+
+
+class ProcessRegistry(object):
+    """
+    The binaries managed by the extension, and the pid each one was last seen running with. A binary is looked up from
+    its pid file (started as a process when there is no systemd), then from the cgroup of its systemd unit (the
+    processes of the unit, MainPID included), and last from all of /proc (started by hand). Once found, the pid is
+    kept and the check is only a couple of reads in /proc/<pid>, the lookup happens again after the process exits.
+    """
+
+    # The hierarchies systemd puts the units' cgroups in: cgroup v1, hybrid, and unified (v2)
+    systemd_cgroup_dirs = ["systemd", "unified", ""]
+
+    def __init__(self, proc_root="/proc", cgroup_root="/sys/fs/cgroup"):
+        """
+        Constructor
+        :param proc_root: Mount point of procfs (for tests)
+        :param cgroup_root: Mount point of the cgroup file systems (for tests)
+        """
+        self.proc_root = proc_root
+        self.cgroup_root = cgroup_root
+        self._processes = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, bin_path, pid_file=None, systemd_unit=None):
+        """
+        Register a binary to watch, registering it again with the same arguments keeps its last seen pid
+        :param name: Name of the binary in the registry (e.g. "lad_telegraf")
+        :param bin_path: Path of the binary
+        :param pid_file: Path of the file the pid is written to when the binary is started as a process
+        :param systemd_unit: Name of the systemd unit the binary runs as (e.g. "metrics-sourcer.service")
+        """
+        with self._lock:
+            process = self._processes.get(name)
+            if process is not None and (process["bin_path"], process["pid_file"], process["systemd_unit"]) == \
+                    (bin_path, pid_file, systemd_unit):
+                return
+            self._processes[name] = {"bin_path": bin_path, "pid_file": pid_file, "systemd_unit": systemd_unit,
+                                     "pid": None}
+
+    def get_pid(self, name):
+        """
+        Get the pid of a registered binary
+        :param name: Name of the binary in the registry
+        :return: The pid of the running binary, None if it is not running
+        """
+        with self._lock:
+            process = self._processes[name]
+            if is_process_running(process["pid"], process["bin_path"], self.proc_root):
+                return process["pid"]
+            process["pid"] = self._find_pid(process)
+            return process["pid"]
+
+    def is_running(self, name):
+        """
+        Check whether a registered binary is running
+        :param name: Name of the binary in the registry
+        """
+        return self.get_pid(name) is not None
+
+    def _find_pid(self, process):
+        candidates = []
+        if process["pid_file"]:
+            candidates.extend(self._read_pids(process["pid_file"]))
+        if process["systemd_unit"]:
+            for cgroup_dir in self.systemd_cgroup_dirs:
+                candidates.extend(self._read_pids(os.path.join(self.cgroup_root, cgroup_dir, "system.slice",
+                                                               process["systemd_unit"], "cgroup.procs")))
+        for pid in candidates:
+            if is_process_running(pid, process["bin_path"], self.proc_root):
+                return pid
+        try:
+            pids = sorted(int(entry) for entry in os.listdir(self.proc_root) if entry.isdigit())
+        except OSError:
+            return None
+        for pid in pids:
+            if is_process_running(pid, process["bin_path"], self.proc_root):
+                return pid
+        return None
+
+    def _read_pids(self, path):
+        try:
+            with open(path, "r") as f:
+                return [int(line) for line in f.read().split() if line.isdigit()]
+        except (IOError, OSError):
+            return []
+
+
+# The registry shared by the telegraf and MetricsExtension handlers
+registry = ProcessRegistry()
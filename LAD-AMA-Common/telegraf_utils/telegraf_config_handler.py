@@ -34,6 +34,7 @@ from shutil import copyfile, rmtree
 import time
 import metrics_ext_utils.metrics_constants as metrics_constants
 import metrics_ext_utils.metrics_common_utils as metrics_utils
+import metrics_ext_utils.process_registry as process_registry
 
 
 
@@ -457,12 +458,12 @@ def is_running(is_lad):
     else:
         telegraf_bin = metrics_constants.ama_telegraf_bin
 
-    proc = subprocess.Popen(["ps  aux | grep telegraf | grep -v grep"], stdout=subprocess.PIPE, shell=True)
-    output = proc.communicate()[0]
-    if telegraf_bin in output.decode('utf-8', 'ignore'):
-        return True
-    else:
-        return False
+    _, configFolder = get_handler_vars()
+    telegraf_pid_path = configFolder + "/telegraf_configs/telegraf_pid.txt"
+    name = "lad_telegraf" if is_lad else "ama_telegraf"
+    process_registry.registry.register(name, telegraf_bin, pid_file=telegraf_pid_path,
+                                       systemd_unit="metrics-sourcer.service")
+    return process_registry.registry.is_running(name)
 
 def stop_telegraf_service(is_lad):
     """
@@ -500,9 +501,7 @@ def stop_telegraf_service(is_lad):
                 pid = f.read()
             if pid != "":
                 # Check if the process running is indeed telegraf, ignore if the process output doesn't contain telegraf
-                proc = subprocess.Popen(["ps -o cmd= {0}".format(pid)], stdout=subprocess.PIPE, shell=True)
-                output = proc.communicate()[0]
-                if telegraf_bin in output.decode('utf-8', 'ignore'):
+                if process_registry.is_process_running(pid.strip(), telegraf_bin):
                     os.kill(int(pid), signal.SIGKILL)
                 else:
                     return False, "Found a different process running with PID {0}. Failed to stop telegraf.".format(pid)
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from metrics_ext_utils.process_registry import ProcessRegistry, is_process_running, read_process_state, \
+    read_process_exe
+
+TELEGRAF_BIN = "/usr/sbin/telegraf"
+ME_BIN = "/usr/sbin/MetricsExtension"
+
+
+class ProcessRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._proc_root = os.path.join(self._root, "proc")
+        self._cgroup_root = os.path.join(self._root, "cgroup")
+        os.makedirs(self._proc_root)
+        self.add_process(1, "/lib/systemd/systemd", "systemd")
+        self.add_process(4321, "/usr/bin/python3", "python3")
+        self.registry = ProcessRegistry(self._proc_root, self._cgroup_root)
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def add_process(self, pid, exe, comm, state="S"):
+        """
+        Add a process to the fake /proc, its exe link points to a binary that doesn't have to exist
+        """
+        pid_dir = os.path.join(self._proc_root, str(pid))
+        if os.path.isdir(pid_dir):
+            shutil.rmtree(pid_dir)
+        os.makedirs(pid_dir)
+        with open(os.path.join(pid_dir, "stat"), "w") as f:
+            f.write("{0} ({1}) {2} 1 {0} {0} 0 -1 4194560 1043 0 0 0 12 3 0 0 20 0 11 0 1845 0\n".format(pid, comm, state))
+        with open(os.path.join(pid_dir, "cmdline"), "wb") as f:
+            f.write(exe.replace(" (deleted)", "").encode("utf-8") + b"\0--config\0/etc/telegraf.conf\0")
+        os.symlink(exe, os.path.join(pid_dir, "exe"))
+
+    def remove_process(self, pid):
+        shutil.rmtree(os.path.join(self._proc_root, str(pid)))
+
+    def write_file(self, path, content):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_read_process_state(self):
+        self.add_process(100, TELEGRAF_BIN, "tele (graf) x", state="Z")
+        self.assertEqual(read_process_state(100, self._proc_root), "Z")
+        self.assertEqual(read_process_state(4321, self._proc_root), "S")
+        self.assertEqual(read_process_state(999, self._proc_root), None)
+
+    def test_read_process_exe(self):
+        self.add_process(100, TELEGRAF_BIN + " (deleted)", "telegraf")
+        self.assertEqual(read_process_exe(100, self._proc_root), TELEGRAF_BIN)
+        # No access to the exe link, the command line tells
+        os.remove(os.path.join(self._proc_root, "100", "exe"))
+        self.assertEqual(read_process_exe(100, self._proc_root), TELEGRAF_BIN)
+        self.assertEqual(read_process_exe(999, self._proc_root), None)
+
+    def test_is_process_running(self):
+        self.add_process(100, TELEGRAF_BIN, "telegraf")
+        self.add_process(101, TELEGRAF_BIN, "telegraf", state="Z")
+        self.assertTrue(is_process_running(100, TELEGRAF_BIN, self._proc_root))
+        self.assertTrue(is_process_running("100", TELEGRAF_BIN, self._proc_root))
+        self.assertFalse(is_process_running(100, ME_BIN, self._proc_root))
+        self.assertFalse(is_process_running(101, TELEGRAF_BIN, self._proc_root))
+        self.assertFalse(is_process_running(999, TELEGRAF_BIN, self._proc_root))
+        self.assertFalse(is_process_running(None, TELEGRAF_BIN, self._proc_root))
+
+    def test_pid_file(self):
+        pid_file = os.path.join(self._root, "telegraf_pid.txt")
+        self.registry.register("telegraf", TELEGRAF_BIN, pid_file=pid_file)
+        self.assertFalse(self.registry.is_running("telegraf"))
+
+        self.add_process(200, TELEGRAF_BIN, "telegraf")
+        self.write_file(pid_file, "200")
+        self.assertEqual(self.registry.get_pid("telegraf"), 200)
+
+        # The pid got reused by another program after telegraf exited
+        self.add_process(200, "/usr/bin/bash", "bash")
+        self.assertFalse(self.registry.is_running("telegraf"))
+
+    def test_systemd_unit(self):
+        self.registry.register("me", ME_BIN, systemd_unit="metrics-extension.service")
+        for cgroup_dir in ["systemd/system.slice/metrics-extension.service",
+                           "system.slice/metrics-extension.service"]:
+            shutil.rmtree(self._cgroup_root, ignore_errors=True)
+            # The unit runs a wrapper shell which runs MetricsExtension
+            self.add_process(299, "/usr/bin/bash", "bash")
+            self.add_process(300, ME_BIN, "MetricsExtension")
+            self.write_file(os.path.join(self._cgroup_root, cgroup_dir, "cgroup.procs"), "299\n300\n")
+            self.assertEqual(self.registry.get_pid("me"), 300)
+            self.remove_process(300)
+            self.write_file(os.path.join(self._cgroup_root, cgroup_dir, "cgroup.procs"), "299\n")
+            self.assertFalse(self.registry.is_running("me"))
+
+    def test_started_by_hand(self):
+        self.registry.register("telegraf", TELEGRAF_BIN, pid_file=os.path.join(self._root, "telegraf_pid.txt"),
+                               systemd_unit="metrics-sourcer.service")
+        self.add_process(400, TELEGRAF_BIN, "telegraf")
+        self.assertEqual(self.registry.get_pid("telegraf"), 400)
+
+    def test_restarted_process_is_found_again(self):
+        self.registry.register("telegraf", TELEGRAF_BIN, systemd_unit="metrics-sourcer.service")
+        procs_path = os.path.join(self._cgroup_root, "system.slice/metrics-sourcer.service/cgroup.procs")
+        self.add_process(500, TELEGRAF_BIN, "telegraf")
+        self.write_file(procs_path, "500\n")
+        self.assertEqual(self.registry.get_pid("telegraf"), 500)
+        self.remove_process(500)
+        self.add_process(501, TELEGRAF_BIN, "telegraf")
+        self.write_file(procs_path, "501\n")
+        self.assertEqual(self.registry.get_pid("telegraf"), 501)
+
+    def test_register_again(self):
+        self.add_process(600, TELEGRAF_BIN, "telegraf")
+        self.registry.register("telegraf", TELEGRAF_BIN)
+        self.assertTrue(self.registry.is_running("telegraf"))
+        # Same arguments, the registration and its pid are kept
+        self.registry.register("telegraf", TELEGRAF_BIN)
+        self.assertEqual(self.registry._processes["telegraf"]["pid"], 600)
+        self.registry.register("telegraf", ME_BIN)
+        self.assertEqual(self.registry._processes["telegraf"]["pid"], None)
+        self.assertFalse(self.registry.is_running("telegraf"))
+
+    def test_running_check_does_not_scan_proc(self):
+        self.add_process(700, TELEGRAF_BIN, "telegraf")
+        for pid in range(1000, 1200):
+            self.add_process(pid, "/usr/bin/sleep", "sleep")
+        self.registry.register("telegraf", TELEGRAF_BIN)
+        self.assertTrue(self.registry.is_running("telegraf"))
+        # The known pid is checked first, /proc isn't listed anymore
+        listdir = os.listdir
+        os.listdir = lambda path: self.fail("/proc was scanned") if path == self._proc_root else listdir(path)
+        try:
+            start = time.time()
+            for i in range(1000):
+                self.assertTrue(self.registry.is_running("telegraf"))
+            self.assertTrue(time.time() - start < 1)
+        finally:
+            os.listdir = listdir
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,17 +20,23 @@ from xml.dom import minidom
 from azure import (WindowsAzureData,
                    WindowsAzureError,
                    METADATA_NS,
+                   ETree,
                    xml_escape,
+                   _ElementStream,
                    _create_entry,
                    _decode_base64_to_text,
                    _decode_base64_to_bytes,
                    _encode_base64,
-                   _fill_data_minidom,
-                   _fill_instance_element,
+                   _etree_local_name,
+                   _etree_text,
+                   _fill_data_etree,
                    _get_child_nodes,
-                   _get_child_nodesNS,
+                   _get_child_nodes_etree,
+                   _get_child_nodesNS_etree,
                    _get_children_from_path,
-                   _get_entry_properties,
+                   _get_entry_properties_from_etree,
+                   _get_first_child_value_etree,
+                   _parse_response_body_from_etree_element,
                    _general_error_handler,
                    _list_of,
                    _parse_response_for_dict,
@@ -378,24 +384,28 @@ class Table(WindowsAzureData):
 
 
 def _parse_blob_enum_results_list(response):
-    respbody = response.body
     return_obj = BlobEnumResults()
-    doc = minidom.parseString(respbody)
 
-    for enum_results in _get_child_nodes(doc, 'EnumerationResults'):
-        for child in _get_children_from_path(enum_results, 'Blobs', 'Blob'):
-            return_obj.blobs.append(_fill_instance_element(child, Blob))
-
-        for child in _get_children_from_path(enum_results,
-                                             'Blobs',
-                                             'BlobPrefix'):
+    # the blobs are converted as they are parsed, without building the DOM of
+    # the whole listing
+    stream = _ElementStream(response.body,
+                            ['EnumerationResults', 'Blobs'],
+                            ['Blob', 'BlobPrefix'])
+    for child in stream:
+        if _etree_local_name(child.tag) == 'Blob':
+            return_obj.blobs.append(
+                _parse_response_body_from_etree_element(child, Blob))
+        else:
             return_obj.prefixes.append(
-                _fill_instance_element(child, BlobPrefix))
+                _parse_response_body_from_etree_element(child, BlobPrefix))
 
+    enum_results = stream.root
+    if enum_results is not None and \
+       _etree_local_name(enum_results.tag) == 'EnumerationResults':
         for name, value in vars(return_obj).items():
             if name == 'blobs' or name == 'prefixes':
                 continue
-            value = _fill_data_minidom(enum_results, name, value)
+            value = _fill_data_etree(enum_results, name, value)
             if value is not None:
                 setattr(return_obj, name, value)
 
@@ -807,13 +817,16 @@ def _convert_xml_to_entity(xmlstr):
       </content>
     </entry>
     '''
-    xmldoc = minidom.parseString(xmlstr)
+    return _convert_etree_element_to_entity(ETree.fromstring(xmlstr))
 
+
+def _convert_etree_element_to_entity(entry):
+    ''' Converts the ElementTree element of an entry to entity. '''
     xml_properties = None
-    for entry in _get_child_nodes(xmldoc, 'entry'):
-        for content in _get_child_nodes(entry, 'content'):
+    if _etree_local_name(entry.tag) == 'entry':
+        for content in _get_child_nodes_etree(entry, 'content'):
             # TODO: Namespace
-            xml_properties = _get_child_nodesNS(
+            xml_properties = _get_child_nodesNS_etree(
                 content, METADATA_NS, 'properties')
 
     if not xml_properties:
@@ -821,20 +834,19 @@ def _convert_xml_to_entity(xmlstr):
 
     entity = Entity()
     # extract each property node and get the type from attribute and node value
-    for xml_property in xml_properties[0].childNodes:
-        name = _remove_prefix(xml_property.nodeName)
+    for xml_property in xml_properties[0]:
+        name = _etree_text(_etree_local_name(xml_property.tag))
         # exclude the Timestamp since it is auto added by azure when
         # inserting entity. We don't want this to mix with real properties
         if name in ['Timestamp']:
             continue
 
-        if xml_property.firstChild:
-            value = xml_property.firstChild.nodeValue
-        else:
+        value = _get_first_child_value_etree(xml_property)
+        if value is None:
             value = ''
 
-        isnull = xml_property.getAttributeNS(METADATA_NS, 'null')
-        mtype = xml_property.getAttributeNS(METADATA_NS, 'type')
+        isnull = _etree_text(xml_property.get('{' + METADATA_NS + '}null', u''))
+        mtype = _etree_text(xml_property.get('{' + METADATA_NS + '}type', u''))
 
         # if not isnull and no type info, then it is a string and we just
         # need the str type to hold the property.
@@ -853,9 +865,8 @@ def _convert_xml_to_entity(xmlstr):
                 property = EntityProperty(mtype, value)
             _set_entity_attr(entity, name, property)
 
-        # extract id, updated and name value from feed entry and set them of
-        # rule.
-    for name, value in _get_entry_properties(xmlstr, True).items():
+    # extract the etag from the entry
+    for name, value in _get_entry_properties_from_etree(entry, True).items():
         if name in ['etag']:
             _set_entity_attr(entity, name, value)
 
@@ -876,10 +887,15 @@ def _convert_xml_to_table(xmlstr):
     Simply call convert_xml_to_entity and extract the table name, and add
     updated and author info
     '''
+    return _convert_etree_element_to_table(ETree.fromstring(xmlstr))
+
+
+def _convert_etree_element_to_table(entry):
+    ''' Converts the ElementTree element of an entry to table class. '''
     table = Table()
-    entity = _convert_xml_to_entity(xmlstr)
+    entity = _convert_etree_element_to_entity(entry)
     setattr(table, 'name', entity.TableName)
-    for name, value in _get_entry_properties(xmlstr, False).items():
+    for name, value in _get_entry_properties_from_etree(entry, False).items():
         setattr(table, name, value)
     return table
 
@@ -35,6 +35,8 @@ from azure.http.batchclient import _BatchClient
 from azure.storage import (
     StorageServiceProperties,
     _convert_entity_to_xml,
+    _convert_etree_element_to_entity,
+    _convert_etree_element_to_table,
     _convert_response_to_entity,
     _convert_table_to_xml,
     _convert_xml_to_entity,
@@ -148,7 +150,8 @@ class TableService(_StorageClient):
         request.headers = _update_storage_table_header(request)
         response = self._perform_request(request)
 
-        return _convert_response_to_feeds(response, _convert_xml_to_table)
+        return _convert_response_to_feeds(response, _convert_xml_to_table,
+                                          _convert_etree_element_to_table)
 
     def create_table(self, table, fail_on_exist=False):
         '''
@@ -267,7 +270,8 @@ class TableService(_StorageClient):
         request.headers = _update_storage_table_header(request)
         response = self._perform_request(request)
 
-        return _convert_response_to_feeds(response, _convert_xml_to_entity)
+        return _convert_response_to_feeds(response, _convert_xml_to_entity,
+                                          _convert_etree_element_to_entity)
 
     def insert_entity(self, table_name, entity,
                       content_type='application/atom+xml'):
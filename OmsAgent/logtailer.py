@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+# OmsAgentForLinux Extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import hashlib
+
+
+class LogTailer(object):
+    """
+    Reads the lines appended to a log file since the previous read.
+    The position is kept as (device, inode, offset), optionally in a state file so that it survives restarts, along
+    with a hash of the first bytes of the file since a new log may get the inode of a deleted one.
+    A rotated log (new inode) is read from the start, after the rest of the previous file if it can still be found
+    under one of rotated_paths, and a truncated log (copytruncate) is read from the start too.
+    Only the new bytes are read, in blocks of block_size, and at most max_read_size bytes per call (the most recent
+    ones), so that a call takes the same time however large the file is and however much was logged in between.
+    A file seen for the first time is read from its last initial_read_size bytes.
+    """
+
+    head_size = 128
+
+    def __init__(self, path, state_path=None, rotated_paths=None, block_size=64 * 1024,
+                 max_read_size=4 * 1024 * 1024, initial_read_size=1024 * 1024):
+        self._path = path
+        self._state_path = state_path
+        self._rotated_paths = [path + '.1'] if rotated_paths is None else rotated_paths
+        self._block_size = block_size
+        self._max_read_size = max_read_size
+        self._initial_read_size = initial_read_size
+        self._device = None
+        self._inode = None
+        self._offset = None
+        self._head = None
+        self._load_state()
+
+    def get_position(self):
+        """
+            Returns the (device, inode, offset) the next read starts from, offset is None before the first read.
+        """
+        return self._device, self._inode, self._offset
+
+    def reset(self):
+        self._device = None
+        self._inode = None
+        self._offset = None
+        self._head = None
+        self._save_state()
+
+    def read_new_lines(self):
+        """
+            Returns the complete lines (without their line break) appended to the log since the previous call.
+            A line still being written is returned by the next call, once it's complete.
+        """
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            # The log is being rotated or isn't there yet, the position stays on the previous file.
+            return []
+
+        lines = []
+        with open(self._path, 'rb') as log_file:
+            # Use the stat of the opened file, the path may have been rotated again meanwhile.
+            stat = os.fstat(log_file.fileno())
+            start_mid_line = False
+            if self._offset is None:
+                offset = max(0, stat.st_size - self._initial_read_size)
+                start_mid_line = offset > 0
+            elif (stat.st_dev, stat.st_ino) != (self._device, self._inode):
+                lines.extend(self._read_rest_of_rotated_file())
+                offset = 0
+            elif stat.st_size < self._offset or not self._is_same_head(log_file):
+                # Truncated (e.g. logrotate's copytruncate) or replaced by a new log with the same inode, what was
+                # appended before is gone.
+                offset = 0
+            else:
+                offset = self._offset
+            new_lines, offset = self._read_lines(log_file, offset, stat.st_size, start_mid_line)
+            lines.extend(new_lines)
+            head = self._read_head(log_file, min(stat.st_size, self.head_size))
+
+        self._device, self._inode, self._offset, self._head = stat.st_dev, stat.st_ino, offset, head
+        self._save_state()
+        return lines
+
+    def _read_head(self, log_file, size):
+        """
+            Returns [size, hash] of the first size bytes of the log.
+        """
+        log_file.seek(0)
+        return [size, hashlib.sha256(log_file.read(size)).hexdigest()]
+
+    def _is_same_head(self, log_file):
+        """
+            Tells whether the log still starts with the bytes it started with at the previous read.
+        """
+        if self._head is None:
+            return True
+        return self._read_head(log_file, self._head[0]) == list(self._head)
+
+    def _read_rest_of_rotated_file(self):
+        for rotated_path in self._rotated_paths:
+            try:
+                with open(rotated_path, 'rb') as log_file:
+                    stat = os.fstat(log_file.fileno())
+                    if (stat.st_dev, stat.st_ino) == (self._device, self._inode) and stat.st_size >= self._offset:
+                        lines, offset = self._read_lines(log_file, self._offset, stat.st_size)
+                        return lines
+            except (IOError, OSError):
+                continue
+        return []
+
+    def _read_lines(self, log_file, offset, size, start_mid_line=False):
+        """
+            Reads the complete lines between offset and size, returns them and the offset after the last one.
+            start_mid_line tells that offset may be in the middle of a line, which is skipped then.
+        """
+        if size - offset > self._max_read_size:
+            # Too much to catch up on, skip to the most recent part.
+            offset = size - self._max_read_size
+            start_mid_line = True
+
+        skip_first_line = False
+        if start_mid_line and offset > 0:
+            log_file.seek(offset - 1)
+            skip_first_line = log_file.read(1) != b'\n'
+
+        log_file.seek(offset)
+        lines = []
+        remainder = b''
+        position = offset
+        while position < size:
+            block = log_file.read(min(self._block_size, size - position))
+            if not block:
+                break
+            position += len(block)
+            block_lines = (remainder + block).split(b'\n')
+            remainder = block_lines.pop()
+            lines.extend(block_lines)
+
+        if skip_first_line:
+            if not lines:
+                # Still within the line offset started in, keep skipping it.
+                return [], position
+            lines.pop(0)
+        return [line.rstrip(b'\r').decode('utf-8', 'replace') for line in lines], position - len(remainder)
+
+    def _load_state(self):
+        if self._state_path is None or not os.path.isfile(self._state_path):
+            return
+        try:
+            with open(self._state_path, 'r') as state_file:
+                state = json.load(state_file)
+            self._device, self._inode, self._offset = state['device'], state['inode'], state['offset']
+            self._head = state.get('head')
+        except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError):
+            # A corrupted state file is as good as none.
+            self._device, self._inode, self._offset, self._head = None, None, None, None
+
+    def _save_state(self):
+        if self._state_path is None:
+            return
+        temp_path = self._state_path + '.tmp'
+        with open(temp_path, 'w') as state_file:
+            json.dump({'device': self._device, 'inode': self._inode, 'offset': self._offset, 'head': self._head},
+                      state_file)
+        os.rename(temp_path, self._state_path)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# OmsAgent extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import env
+import os
+import shutil
+import tempfile
+from logtailer import LogTailer
+
+
+class TestLogTailer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.dir, 'omsagent.log')
+        self.state_path = os.path.join(self.dir, 'omsagent_log_marker.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def append(self, text, path=None):
+        with open(path or self.log_path, 'ab') as log_file:
+            log_file.write(text.encode('utf-8'))
+
+    def test_reads_only_new_lines(self):
+        self.append('line 1\nline 2\n')
+        tailer = LogTailer(self.log_path, block_size=4)
+        self.assertEqual(tailer.read_new_lines(), ['line 1', 'line 2'])
+        self.assertEqual(tailer.read_new_lines(), [])
+        self.append('line 3\nline ')
+        self.assertEqual(tailer.read_new_lines(), ['line 3'])
+        # The partial line is returned once it's complete
+        self.append('4\r\n')
+        self.assertEqual(tailer.read_new_lines(), ['line 4'])
+
+    def test_first_read_starts_near_the_end(self):
+        self.append(''.join('old line {0}\n'.format(i) for i in range(1000)))
+        # Starts in the middle of 'old line 997', which is skipped
+        self.assertEqual(LogTailer(self.log_path, initial_read_size=30).read_new_lines(), ['old line 998', 'old line 999'])
+        # Starts right at the beginning of 'old line 998'
+        self.assertEqual(LogTailer(self.log_path, initial_read_size=26).read_new_lines(), ['old line 998', 'old line 999'])
+
+    def test_position_is_kept_across_runs(self):
+        self.append('line 1\n')
+        LogTailer(self.log_path, self.state_path).read_new_lines()
+        self.append('line 2\n')
+        tailer = LogTailer(self.log_path, self.state_path)
+        self.assertEqual(tailer.read_new_lines(), ['line 2'])
+        self.assertEqual(tailer.get_position()[2], os.path.getsize(self.log_path))
+
+    def test_corrupted_state_is_ignored(self):
+        self.append('line 1\n')
+        with open(self.state_path, 'w') as state_file:
+            state_file.write('{"device": 1')
+        self.assertEqual(LogTailer(self.log_path, self.state_path).read_new_lines(), ['line 1'])
+
+    def test_rotation(self):
+        self.append('line 1\n')
+        tailer = LogTailer(self.log_path, self.state_path)
+        tailer.read_new_lines()
+        self.append('line 2\n')
+        os.rename(self.log_path, self.log_path + '.1')
+        self.append('line 3\n')
+        self.assertEqual(tailer.read_new_lines(), ['line 2', 'line 3'])
+        self.assertEqual(tailer.read_new_lines(), [])
+
+    def test_rotation_with_the_old_file_gone(self):
+        self.append('line 1\n')
+        tailer = LogTailer(self.log_path)
+        tailer.read_new_lines()
+        os.remove(self.log_path)
+        self.assertEqual(tailer.read_new_lines(), [])
+        self.append('line 2\n')
+        self.assertEqual(tailer.read_new_lines(), ['line 2'])
+
+    def test_truncation(self):
+        self.append('a long line 1\n')
+        tailer = LogTailer(self.log_path)
+        tailer.read_new_lines()
+        with open(self.log_path, 'wb') as log_file:
+            log_file.write(b'line 2\n')
+        self.assertEqual(tailer.read_new_lines(), ['line 2'])
+
+    def test_catching_up_is_bounded(self):
+        self.append('line 0\n')
+        tailer = LogTailer(self.log_path, max_read_size=100, block_size=16)
+        tailer.read_new_lines()
+        self.append(''.join('line {0}\n'.format(i) for i in range(1, 10000)))
+        lines = tailer.read_new_lines()
+        # Only the most recent complete lines within max_read_size are read
+        self.assertTrue(0 < len(lines) <= 100 // len('line 9999\n') + 1)
+        self.assertEqual(lines[-1], 'line 9999')
+        self.assertEqual(lines, ['line {0}'.format(i) for i in range(10000 - len(lines), 10000)])
+
+
+if __name__ == '__main__':
+    unittest.main()
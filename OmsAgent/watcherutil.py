@@ -32,7 +32,7 @@ import json
 import uuid
 from threading import Thread
 import re
-import hashlib
+from logtailer import LogTailer
 from omsagent import run_command_and_log
 from omsagent import RestartOMSAgentServiceCommand
 
@@ -46,6 +46,7 @@ from omsagent import RestartOMSAgentServiceCommand
 MemoryThresholdToWatchFor = 20
 OmsAgentPidFile = "/var/opt/microsoft/omsagent/run/omsagent.pid"
 OmsAgentLogFile = "/var/opt/microsoft/omsagent/log/omsagent.log"
+OmsAgentLogMarkerFile = "omsagent_log_marker.json"
 reg_ex = re.compile('([0-9]{4}-[0-9]{2}-[0-9]{2}.*)\[(\w+)\]:(.*)')
 maxMessageSize = 100
 OMSExtensionVersion = '1.13.19'
@@ -53,6 +54,7 @@ OMSExtensionVersion = '1.13.19'
 We can add to the list below with more error messages to identify non recoverable errors.
 """
 ErrorStatements = ["Errono::ENOSPC error=", "Fatal error, can not clear buffer file", "No space left on the device"]
+error_statements_reg_ex = re.compile('|'.join(re.escape(error_statement) for error_statement in ErrorStatements))
 
 class SelfMonitorInfo(object):
     """
@@ -105,18 +107,6 @@ class SelfMonitorInfo(object):
         else:
             return "Red"
 
-class LogFileMarker(object):
-    """
-        Class to hold omsagent log file marker information.
-    """
-    def __init__(self):
-        self._last_pos = 0
-        self._last_crc = ""
-
-    def reset_marker(self):
-        self._last_pos = 0
-        self._last_crc = ""
-
 class Watcher(object):
     """
     A class that handles periodic monitoring activities.
@@ -252,7 +242,7 @@ class Watcher(object):
 
         pass
 
-    def monitor_heartbeat(self, self_mon_info, log_file_marker):
+    def monitor_heartbeat(self, self_mon_info, log_tailer):
         """
             Monitor heartbeat health. OMS output plugin will update the timestamp
             of new heartbeat file every 5 minutes. We will check if it is updated
@@ -271,7 +261,7 @@ class Watcher(object):
                 # If we do not see heartbeat for last 3 iterations, take corrective action.
                 take_action = True
 
-            elif (self.check_for_fatal_oms_logs(log_file_marker)):
+            elif (self.check_for_fatal_oms_logs(log_tailer)):
 
                 # If we see hearbeat missing and error message, no need to wait for more than one
                 # iteration. It is not a false positive. Take corrective action immediately.
@@ -365,7 +355,8 @@ class Watcher(object):
         """
 
         self_mon_info = SelfMonitorInfo()
-        log_file_marker = LogFileMarker()
+        # The position in the log is kept next to the pid file of this process, across restarts of the extension.
+        log_tailer = LogTailer(OmsAgentLogFile, os.path.join(os.getcwd(), OmsAgentLogMarkerFile))
 
         # check every 6 minutes. we want to be bit pessimistic while looking for health, especially heartbeats which is emitted every 5 minutes.
         sleepTime =  6 * 60
@@ -376,7 +367,7 @@ class Watcher(object):
         while True:
             try:
                 # Monitor heartbeat and logs.
-                self.monitor_heartbeat(self_mon_info, log_file_marker)
+                self.monitor_heartbeat(self_mon_info, log_tailer)
 
                 # Monitor memory usage
                 self.monitor_resource(self_mon_info)
@@ -423,9 +414,9 @@ class Watcher(object):
 
         return 0
 
-    def check_for_fatal_oms_logs(self, log_file_marker):
+    def check_for_fatal_oms_logs(self, log_tailer):
         """
-            This function will go through oms log file and check for the
+            This function will go through the oms log lines written since the previous check and look for the
             logs indicating non recoverable state. That set is hardcoded right now
             and we can add it to it as we learn more.
             If we find there is atleast one occurance of such log line from last occurance,
@@ -435,65 +426,33 @@ class Watcher(object):
         read_start_time = int(time.time())
 
         if os.path.isfile(OmsAgentLogFile):
-            last_crc = log_file_marker._last_crc
-            last_pos = log_file_marker._last_pos
 
             # We do not want to propogate any exception to the caller.
 
             try:
-                f = open(OmsAgentLogFile, "r")
-
-                text = f.readline()
-
-                #  Handle log rotate. Check for CRC of first line of the log file.
-                #  Some of the agents like Splunk uses this technique.
-                #  If it matches with previous CRC, then file has not changed.
-                #  If it is not matching then file has changed and do not seek from
-                #  the last_pos rather continue from the begining.
+                #  The tailer keeps the inode and the offset of the previous check, handles log rotation and
+                #  truncation, and only reads what was appended since then.
+                lines = log_tailer.read_new_lines()
+                self._hutil_log("Read {0} new lines, position = {1}".format(len(lines), log_tailer.get_position()))
 
-                if (text != ''):
-                    crc = hashlib.sha256(text).hexdigest()
-                    self._hutil_log("Last crc = {0}, current crc= {1} position = {2}".format(last_crc, crc, last_pos))
-                    if (last_crc == crc):
-
-                        if (last_pos > 0):
-                            f.seek(last_pos)
-                    else:
-                        self._hutil_log("File has changed do not seek from the offset. current crc = {0}".format(crc))
-
-                    log_file_marker._last_crc = crc
-                    total_lines_read = 1
-
-                while True:
-                    text = f.readline()
-
-                    if (text == ''):
-                        log_file_marker._last_pos = f.tell()
-                        break
-
-                    total_lines_read += 1
+                for text in lines:
                     res = reg_ex.match(text)
 
                     if res:
-                        log_entry_time = self.get_total_seconds_from_epoch_for_fluent_logs(res.group(1))
-                        if (log_entry_time + (10 * 60) < read_start_time):
-                            # ignore log line if we are reading logs older than 10 minutes.
-                            pass
-                        elif (res.group(2) == "warn" or res.group(2) == "error"):
-                            for error_statement in ErrorStatements:
-                                if (res.group(3) in error_statement):
-                                    self._hutil_error("Found non recoverable error log in agent log file")
-
-                                    # File should be closed in the finally block.
-                                    return True
+                        if (res.group(2) == "warn" or res.group(2) == "error") and error_statements_reg_ex.search(res.group(3)):
+                            log_entry_time = self.get_total_seconds_from_epoch_for_fluent_logs(res.group(1))
+                            if (log_entry_time + (10 * 60) < read_start_time):
+                                # ignore log line if we are reading logs older than 10 minutes.
+                                pass
+                            else:
+                                self._hutil_error("Found non recoverable error log in agent log file")
+                                return True
 
                 self._hutil_log("Did not find any non recoverable logs in omsagent log file")
 
             except Exception as e:
                 self._hutil_error ("Caught an exception {0}".format(traceback.format_exc()))
 
-            finally:
-                f.close()
         else:
             self._hutil_error ("Omsagent log file not found : {0}".format(OmsAgentLogFile))
 
@@ -18,6 +18,7 @@
 
 import time
 import datetime
+import threading
 import traceback
 try:
     import httplib as httplibs
@@ -31,6 +32,55 @@ from subprocess import *
 from Utils.WAAgentUtil import waagent
 import sys
 
+class HttpConnectionCache(object):
+    """
+    Keeps one keep-alive connection per (thread, host) so that repeated calls
+    to the same storage host skip the TCP and TLS handshake.
+    httplib connections are not thread safe, so every thread gets its own.
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.all_connections = []
+        self.created_count = 0
+        self.reused_count = 0
+
+    def get(self, key, factory):
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = {}
+            self.local.connections = connections
+        connection = connections.get(key)
+        if connection is not None:
+            with self.lock:
+                self.reused_count = self.reused_count + 1
+            return connection, True
+        connection = factory()
+        connections[key] = connection
+        with self.lock:
+            self.created_count = self.created_count + 1
+            self.all_connections.append(connection)
+        return connection, False
+
+    def discard(self, key):
+        connections = getattr(self.local, 'connections', None)
+        if connections is not None and key in connections:
+            connection = connections.pop(key)
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def close_all(self):
+        with self.lock:
+            connections = self.all_connections
+            self.all_connections = []
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
 class HttpUtil(object):
     """description of class"""
     __instance = None
@@ -151,3 +201,50 @@ class HttpUtil(object):
             return result, resp, errorMsg, responeBody
         else:
             return result, resp, errorMsg
+
+    def HttpCallGetResponseKeepAlive(self, method, sasuri_obj, data, headers, connection_cache):
+        """
+        Same contract as HttpCallGetResponse with responseBodyRequired = True, but the
+        connection is taken from connection_cache and left open for the next call.
+        It does not log, so it is safe to call from worker threads while frozen.
+        A reused connection which fails (stale socket closed by the server) is
+        replaced and the request is retried once.
+        """
+        result = CommonVariables.error_http_failure
+        resp = None
+        errorMsg = None
+        responseBody = ""
+        use_proxy = not (self.proxyHost == None or self.proxyPort != None)
+        key = (sasuri_obj.hostname, use_proxy)
+        if(use_proxy):
+            url = "https://{0}:{1}{2}".format(sasuri_obj.hostname, 443, (sasuri_obj.path + '?' + sasuri_obj.query))
+        else:
+            url = sasuri_obj.path + '?' + sasuri_obj.query
+
+        def create_connection():
+            if(use_proxy):
+                connection = httplibs.HTTPSConnection(self.proxyHost, self.proxyPort, timeout = 10)
+                connection.set_tunnel(sasuri_obj.hostname, 443)
+            else:
+                connection = httplibs.HTTPSConnection(sasuri_obj.hostname, timeout = 10)
+            return connection
+
+        for attempt in range(2):
+            connection, reused = connection_cache.get(key, create_connection)
+            try:
+                connection.request(method=method, url=url, body=data, headers = headers)
+                resp = connection.getresponse()
+                # the body has to be drained before the connection can be reused.
+                responseBody = resp.read().decode('utf-8-sig')
+                if(resp.getheader('connection', '').lower() == 'close'):
+                    connection_cache.discard(key)
+                result = CommonVariables.success
+                errorMsg = None
+                break
+            except Exception as e:
+                connection_cache.discard(key)
+                resp = None
+                errorMsg = str(datetime.datetime.now()) +  " Failed to call http with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
+                if(not reused):
+                    break
+        return result, resp, errorMsg, responseBody
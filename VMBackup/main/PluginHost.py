@@ -200,19 +200,21 @@ class PluginHost(object):
 
         result = PluginHostResult()
         curr = 0
+        threads = []
         for plugin in self.plugins:
             t1 = threading.Thread(target=plugin.pre_script, args=(curr, self.preScriptCompleted, self.preScriptResult))
             t1.start()
+            threads.append(t1)
             curr = curr + 1
 
+        # the plugin threads end as soon as their script completes, so join them against one deadline
+        # instead of checking the completion flags every pollTime seconds
+        deadline = time.time() + (int(self.timeoutInSeconds/self.pollTime) + 2) * self.pollTime #waiting 10 more seconds to escape race condition between Host and script timing out
+        for t1 in threads:
+            t1.join(max(0, deadline - time.time()))
         flag = True
-        for i in range(0, int(self.timeoutInSeconds/self.pollTime) + 2): #waiting 10 more seconds to escape race condition between Host and script timing out
-            time.sleep(self.pollTime)
-            flag = True
-            for j in range(0,self.noOfPlugins):
-                flag = flag & self.preScriptCompleted[j]
-            if flag:
-                break
+        for j in range(0,self.noOfPlugins):
+            flag = flag & self.preScriptCompleted[j]
 
 
         continueBackup = True
@@ -247,19 +249,21 @@ class PluginHost(object):
 
         self.logger.log('Starting postscript for all modules.',True,'Info')
         curr = 0
+        threads = []
         for plugin in self.plugins:
             t1 = threading.Thread(target=plugin.post_script, args=(curr, self.postScriptCompleted, self.postScriptResult))
             t1.start()
+            threads.append(t1)
             curr = curr + 1
 
+        # the plugin threads end as soon as their script completes, so join them against one deadline
+        # instead of checking the completion flags every pollTime seconds
+        deadline = time.time() + (int(self.timeoutInSeconds/self.pollTime) + 2) * self.pollTime #waiting 10 more seconds to escape race condition between Host and script timing out
+        for t1 in threads:
+            t1.join(max(0, deadline - time.time()))
         flag = True
-        for i in range(0, int(self.timeoutInSeconds/self.pollTime) + 2): #waiting 10 more seconds to escape race condition between Host and script timing out
-            time.sleep(self.pollTime)
-            flag = True
-            for j in range(0,self.noOfPlugins):
-                flag = flag & self.postScriptCompleted[j]
-            if flag:
-                break
+        for j in range(0,self.noOfPlugins):
+            flag = flag & self.postScriptCompleted[j]
 
         continueBackup = True
 
@@ -1,5 +1,7 @@
 import json
 import subprocess
+import sys
+import threading
 import time
 import os
 from pwd import getpwuid
@@ -36,6 +38,24 @@ from Utils import HandlerUtil
     # errorcode = process return code, means bash script encountered some other error, like 127 for script not found
 
 
+def wait_for_process(process, timeout):
+    """
+    Waits for the process to exit for at most timeout seconds.
+    Returns True if the process exited.
+    """
+    if sys.version_info > (3,):
+        try:
+            process.wait(timeout = timeout)
+        except subprocess.TimeoutExpired:
+            pass
+    else:
+        waiter = threading.Thread(target = process.wait)
+        waiter.daemon = True
+        waiter.start()
+        waiter.join(timeout)
+    return process.poll() is not None
+
+
 class ScriptRunnerResult(object):
     def __init__(self):
         self.errorCode = None
@@ -209,16 +229,12 @@ class ScriptRunner(object):
         process = subprocess.Popen(paramsStr, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
         flag_timeout = False
-        curr = 0
         cnt = 0
         while True:
-            while process.poll() is None:
-                if curr >= self.pollTotalCount:
-                    self.logger.log('Prescript for '+self.pluginName+' timed out.',True,'Error')
-                    flag_timeout = True
-                    break
-                curr = curr + 1
-                time.sleep(self.pollSleepTime)
+            # returns as soon as the script exits, instead of checking every pollSleepTime
+            if not wait_for_process(process, self.timeoutInSeconds):
+                self.logger.log('Prescript for '+self.pluginName+' timed out.',True,'Error')
+                flag_timeout = True
             if process.returncode is CommonVariables.PrePost_ScriptStatus_Success:
                 break
             if flag_timeout:
@@ -264,16 +280,12 @@ class ScriptRunner(object):
         process = subprocess.Popen(paramsStr, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
         flag_timeout = False
-        curr = 0
         cnt = 0
         while True:
-            while process.poll() is None:
-                if curr >= self.pollTotalCount:
-                    self.logger.log('Postscript for '+self.pluginName+' timed out.',True,'Error')
-                    flag_timeout = True
-                    break
-                curr = curr + 1
-                time.sleep(self.pollSleepTime)
+            # returns as soon as the script exits, instead of checking every pollSleepTime
+            if not wait_for_process(process, self.timeoutInSeconds):
+                self.logger.log('Postscript for '+self.pluginName+' timed out.',True,'Error')
+                flag_timeout = True
             if process.returncode is CommonVariables.PrePost_ScriptStatus_Success:
                 break
             if flag_timeout:
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import os.path
+import re
+import threading
+import traceback
+from common import DeviceItem
+
+class MountInfo(object):
+    def __init__(self, major_minor, mount_point, fstype, source):
+        self.major_minor = major_minor
+        self.mount_point = mount_point
+        self.fstype = fstype
+        self.source = source
+        self.device = None
+    def __str__(self):
+        return "source:" + str(self.source) + " mountpoint:" + str(self.mount_point) + " fstype:" + str(self.fstype) + " majmin:" + str(self.major_minor) + " device:" + str(self.device)
+
+class BlockDevice(object):
+    def __init__(self, name, major_minor):
+        self.name = name
+        self.major_minor = major_minor
+        self.type = None
+        self.size = None
+        self.model = None
+        self.label = None
+        self.uuid = None
+    def __str__(self):
+        return "name:" + str(self.name) + " type:" + str(self.type) + " majmin:" + str(self.major_minor) + " size:" + str(self.size) + " model:" + str(self.model)
+
+class BlockDeviceInventory(object):
+    """
+    Mounts and block devices of the VM, read once per run straight from
+    /proc/self/mountinfo, /sys/class/block and /dev/disk/by-*, without running
+    mount, lsblk or df. Mounts, FsFreezer, SizeCalculation and ResourceDiskUtil
+    share the same instance through get_instance().
+    """
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, logger, proc_root = '/proc', sys_root = '/sys', dev_root = '/dev'):
+        self.logger = logger
+        self.proc_root = proc_root
+        self.sys_root = sys_root
+        self.dev_root = dev_root
+        self.mounts = []
+        self.mounts_by_mount_point = {}
+        self.devices_by_name = {}
+        self.devices_by_major_minor = {}
+        self.load_block_devices()
+        self.load_mounts()
+
+    @staticmethod
+    def get_instance(logger):
+        with BlockDeviceInventory.__instance_lock:
+            if BlockDeviceInventory.__instance is None:
+                BlockDeviceInventory.__instance = BlockDeviceInventory(logger)
+            return BlockDeviceInventory.__instance
+
+    @staticmethod
+    def invalidate():
+        with BlockDeviceInventory.__instance_lock:
+            BlockDeviceInventory.__instance = None
+
+    def read_sys_value(self, path):
+        try:
+            with open(path, 'r') as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def read_symlink_names(self, by_dir):
+        # /dev/disk/by-uuid/<uuid> -> ../../sda1, gives {'sda1': '<uuid>'}
+        names = {}
+        by_path = os.path.join(self.dev_root, 'disk', by_dir)
+        if os.path.isdir(by_path):
+            for link in os.listdir(by_path):
+                target = os.path.basename(os.path.realpath(os.path.join(by_path, link)))
+                names[target] = self.unescape_udev(link)
+        return names
+
+    @staticmethod
+    def unescape_udev(value):
+        return re.sub(r'\\x([0-9a-fA-F]{2})', lambda m: chr(int(m.group(1), 16)), value)
+
+    @staticmethod
+    def unescape_mountinfo(value):
+        return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), value)
+
+    def load_block_devices(self):
+        class_block = os.path.join(self.sys_root, 'class', 'block')
+        if not os.path.isdir(class_block):
+            return
+        labels = self.read_symlink_names('by-label')
+        uuids = self.read_symlink_names('by-uuid')
+        for kernel_name in os.listdir(class_block):
+            device_path = os.path.join(class_block, kernel_name)
+            major_minor = self.read_sys_value(os.path.join(device_path, 'dev'))
+            # device mapper devices are known by their dm name, as lsblk and mount report them
+            dm_name = self.read_sys_value(os.path.join(device_path, 'dm', 'name'))
+            device = BlockDevice(dm_name if dm_name else kernel_name, major_minor)
+            size = self.read_sys_value(os.path.join(device_path, 'size'))
+            if size is not None and size.isdigit():
+                device.size = int(size) * 512
+            if dm_name:
+                dm_uuid = self.read_sys_value(os.path.join(device_path, 'dm', 'uuid')) or ''
+                if dm_uuid.startswith('LVM-'):
+                    device.type = 'lvm'
+                elif dm_uuid.startswith('CRYPT-'):
+                    device.type = 'crypt'
+                else:
+                    device.type = 'dm'
+            elif os.path.exists(os.path.join(device_path, 'partition')):
+                device.type = 'part'
+            elif kernel_name.startswith('loop'):
+                device.type = 'loop'
+            elif kernel_name.startswith('md'):
+                device.type = self.read_sys_value(os.path.join(device_path, 'md', 'level')) or 'md'
+            elif kernel_name.startswith('sr'):
+                device.type = 'rom'
+            else:
+                device.type = 'disk'
+            device.model = self.read_sys_value(os.path.join(device_path, 'device', 'model'))
+            device.label = labels.get(kernel_name)
+            device.uuid = uuids.get(kernel_name)
+            self.devices_by_name[device.name] = device
+            if major_minor is not None:
+                self.devices_by_major_minor[major_minor] = device
+
+    def load_mounts(self):
+        """
+        /proc/self/mountinfo line:
+        36 35 98:0 /mnt1 /mnt2 rw,noatime master:1 - ext3 /dev/root rw,errors=continue
+        """
+        with open(os.path.join(self.proc_root, 'self', 'mountinfo'), 'r') as f:
+            lines = f.read().splitlines()
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 7 or '-' not in fields:
+                continue
+            separator = fields.index('-', 6)
+            if len(fields) < separator + 3:
+                continue
+            mount = MountInfo(fields[2], self.unescape_mountinfo(fields[4]), fields[separator + 1], self.unescape_mountinfo(fields[separator + 2]))
+            mount.device = self.devices_by_major_minor.get(mount.major_minor)
+            if mount.device is None and mount.source.startswith('/dev/'):
+                # btrfs and friends report an anonymous major:minor, resolve the source instead
+                source_name = os.path.basename(os.path.realpath(mount.source))
+                mount.device = self.devices_by_name.get(source_name)
+                if mount.device is None:
+                    mount.device = self.devices_by_name.get(os.path.basename(mount.source))
+            self.mounts.append(mount)
+            # the last mount on a mount point is the visible one
+            self.mounts_by_mount_point[mount.mount_point] = mount
+
+    def visible_mounts(self):
+        """ mounts in mount order, keeping only the last (visible) mount of each mount point """
+        return [mount for mount in self.mounts if self.mounts_by_mount_point[mount.mount_point] is mount]
+
+    def get_mount_points(self):
+        """ same result as DiskUtil.get_mount_points """
+        mount_points = []
+        mount_points_info = []
+        for mount in self.visible_mounts():
+            mount_points.append(mount.mount_point)
+            mount_points_info.append((mount.mount_point, mount.source, mount.fstype))
+        return mount_points, mount_points_info
+
+    def get_mount_file_systems(self):
+        """ same result as DiskUtil.get_mount_file_systems """
+        return [(mount.source, mount.fstype, mount.mount_point) for mount in self.visible_mounts()]
+
+    def get_device_items(self):
+        """ same result as DiskUtil.get_device_items(None): one item per mounted block device mount """
+        device_items = []
+        for mount in self.mounts:
+            device = mount.device
+            if device is None:
+                continue
+            device_item = DeviceItem()
+            device_item.name = device.name
+            device_item.type = device.type
+            device_item.file_system = mount.fstype
+            device_item.mount_point = mount.mount_point
+            device_item.label = device.label
+            device_item.uuid = device.uuid
+            device_item.model = device.model
+            device_item.size = device.size
+            device_items.append(device_item)
+        return device_items
+
+    def get_mount_point_of_device(self, device_name):
+        """ mount point of the first mount whose source device starts with device_name, e.g. 'sdb' """
+        for mount in self.mounts:
+            if mount.source.startswith('/dev/' + device_name) or (mount.device is not None and mount.device.name.startswith(device_name)):
+                return mount.mount_point
+        return None
+
+    def get_file_system_usage(self):
+        """
+        rows like 'df -k' prints them: (source, size, used, available, mount point), sizes in KB.
+        File systems without blocks (proc, sysfs, cgroup, ...) are left out and a device mounted
+        on several mount points is reported once, on its shortest mount point.
+        """
+        usage_by_source = {}
+        rows = []
+        for mount in self.visible_mounts():
+            try:
+                stat = os.statvfs(mount.mount_point)
+            except OSError as e:
+                self.logger.log("statvfs failed for " + str(mount.mount_point) + " with error " + str(e), True)
+                continue
+            if stat.f_blocks == 0:
+                continue
+            block_size = stat.f_frsize if stat.f_frsize else stat.f_bsize
+            size = stat.f_blocks * block_size // 1024
+            used = (stat.f_blocks - stat.f_bfree) * block_size // 1024
+            available = stat.f_bavail * block_size // 1024
+            row = [mount.source, size, used, available, mount.mount_point]
+            if mount.source.startswith('/'):
+                previous_row = usage_by_source.get(mount.source)
+                if previous_row is not None:
+                    if len(mount.mount_point) < len(previous_row[4]):
+                        previous_row[:] = row
+                    continue
+                usage_by_source[mount.source] = row
+            rows.append(row)
+        return [tuple(row) for row in rows]
@@ -77,6 +77,7 @@ import platform
 import subprocess
 import datetime
 import Utils.Status
+from Utils.VMBackupConfig import VMBackupConfig
 from MachineIdentity import MachineIdentity
 import ExtensionErrorCodeHelper
 import traceback
@@ -319,20 +320,18 @@ class HandlerUtility:
     isanysnapshotfailed = False
     UploadStatusAndLog = True
     WriteLog = True
+    snapshotthreadcount = 16
+    LogBufferSize = 10000
 
     seqsnapshot valid values(0-> parallel snapshot, 1-> programatically set sequential snapshot , 2-> customer set it for sequential snapshot)
+    snapshotthreadcount is the size of the worker pool used for parallel snapshot
+    LogBufferSize is the number of log records kept in memory while the file systems are frozen
     '''
 
     def get_value_from_configfile(self, key):
-        global backup_logger
         value = None
-        configfile = '/etc/azure/vmbackup.conf'
         try :
-            if os.path.exists(configfile):
-                config = ConfigParsers.ConfigParser()
-                config.read(configfile)
-                if config.has_option('SnapshotThread',key):
-                    value = config.get('SnapshotThread',key)
+            value = VMBackupConfig.get_instance().get(key)
         except Exception as e:
             pass
 
@@ -368,24 +367,9 @@ class HandlerUtility:
         return int(value)
  
     def set_value_to_configfile(self, key, value):
-        configfile = '/etc/azure/vmbackup.conf'
         try :
             self.log('setting ' + str(key)  + 'in config file to ' + str(value) , 'Info')
-            if not os.path.exists(os.path.dirname(configfile)):
-                os.makedirs(os.path.dirname(configfile))
-            config = ConfigParsers.RawConfigParser()
-            if os.path.exists(configfile):
-                config.read(configfile)
-                if config.has_section('SnapshotThread'):
-                    if config.has_option('SnapshotThread', key):
-                        config.remove_option('SnapshotThread', key)
-                else:
-                    config.add_section('SnapshotThread')
-            else:
-                config.add_section('SnapshotThread')
-            config.set('SnapshotThread', key, value)
-            with open(configfile, 'w') as config_file:
-                config.write(config_file)
+            VMBackupConfig.get_instance().set(key, value)
         except Exception as e:
             errorMsg = " Unable to set config file.key is "+ key +"with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
             self.log(errorMsg, 'Warning')
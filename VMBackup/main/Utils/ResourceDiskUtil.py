@@ -5,6 +5,7 @@ import subprocess
 from subprocess import *
 import traceback
 from Utils.DiskUtil import DiskUtil
+from Utils.BlockDeviceInventory import BlockDeviceInventory
 
 STORAGE_DEVICE_PATH = '/sys/bus/vmbus/devices/'
 GEN2_DEVICE_ID = 'f8b3781a-1e82-4818-a1c3-63d806ec15bb'
@@ -140,6 +141,14 @@ class ResourceDiskUtil(object):
 			if(option==0):
 				return partition
 
+			if device is not None:
+				try:
+					mount_point = BlockDeviceInventory.get_instance(self.logger).get_mount_point_of_device(device)
+					self.logger.log(("Resource disk [{0}] is mounted [{1}]",partition,mount_point),True)
+					return mount_point
+				except Exception as e:
+					self.logger.log('Failed to read the block device inventory, falling back to mount command, Exception %s' % (str(e)), True, 'Warning')
+
 			#p = Popen("mount", stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 			#mount_list, err = p.communicate()
 			mount_list = self.disk_util.get_mount_output()
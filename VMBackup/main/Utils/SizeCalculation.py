@@ -8,9 +8,11 @@ except ImportError:
 import base64
 import json
 import tempfile
+import threading
 import time
 from Utils.DiskUtil import DiskUtil
 from Utils.ResourceDiskUtil import ResourceDiskUtil
+from Utils.BlockDeviceInventory import BlockDeviceInventory
 import Utils.HandlerUtil
 import traceback
 import subprocess
@@ -40,11 +42,25 @@ class SizeCalculation(object):
             self.logger.log(errMsg, True, 'Error')
             self.isOnlyOSDiskBackupEnabled = False
 
+    def get_inventory(self):
+        try:
+            return BlockDeviceInventory.get_instance(self.logger)
+        except Exception as e:
+            errMsg = 'Failed to read the block device inventory with error: %s, stack trace: %s' % (str(e), traceback.format_exc())
+            self.logger.log(errMsg, True, 'Warning')
+            return None
+
+    def get_mount_file_systems(self):
+        inventory = self.get_inventory()
+        if inventory is not None:
+            return inventory.get_mount_file_systems()
+        return disk_util.get_mount_file_systems()
+
     def get_loop_devices(self):
         global disk_util
         disk_util = DiskUtil(patching = self.patching,logger = self.logger)
         if len(self.file_systems_info) == 0 :
-            self.file_systems_info = disk_util.get_mount_file_systems()
+            self.file_systems_info = self.get_mount_file_systems()
         self.logger.log("file_systems list : ",True)
         self.logger.log(str(self.file_systems_info),True)
         disk_loop_devices_file_systems = []
@@ -56,51 +72,98 @@ class SizeCalculation(object):
     def device_list_for_billing(self):
         self.logger.log("In device_list_for_billing",True)
         devices_to_bill = [] #list to store device names to be billed
-        device_items = disk_util.get_device_items(None)
+        inventory = self.get_inventory()
+        if inventory is not None:
+            device_items = inventory.get_device_items()
+        else:
+            device_items = disk_util.get_device_items(None)
         for device_item in device_items :
             # self.logger.log("Device name : {0} ".format(str(device_item.name)),True)
-            if str(device_item.name).startswith("sd"):
-                devices_to_bill.append("/dev/{0}".format(str(device_item.name)))
+            device_name = "/dev/{0}".format(str(device_item.name))
+            if str(device_item.name).startswith("sd") and device_name not in devices_to_bill:
+                devices_to_bill.append(device_name)
         self.logger.log("exiting device_list_for_billing",True)
         return devices_to_bill
 
+    def get_file_system_usage(self):
+        """
+        Returns the (device, size, used, available, mountpoint) rows, in KB, and whether it failed.
+        The rows come from statvfs of the mounts in the block device inventory; df -k is only
+        run when the inventory cannot be read. statvfs runs on a separate thread since a
+        hung network share must not hang the extension, like the df wait below.
+        """
+        process_wait_time = 300
+        inventory = self.get_inventory()
+        if inventory is not None:
+            result = []
+            def collect_usage():
+                try:
+                    result.append(inventory.get_file_system_usage())
+                except Exception as e:
+                    errMsg = 'statvfs of the mounts failed with error: %s, stack trace: %s' % (str(e), traceback.format_exc())
+                    self.logger.log(errMsg, True, 'Warning')
+            usage_thread = threading.Thread(target=collect_usage)
+            usage_thread.daemon = True
+            usage_thread.start()
+            usage_thread.join(process_wait_time)
+            if len(result) > 0:
+                return result[0], False
+            self.logger.log("statvfs of the mounts did not complete, falling back to df", True)
+        return self.get_df_usage(process_wait_time)
+
+    def get_df_usage(self, process_wait_time):
+        size_calc_failed = False
+        rows = []
+        df = subprocess.Popen(["df" , "-k"], stdout=subprocess.PIPE)
+        '''
+        Sample output of the df command
+
+        Filesystem                                              Type     1K-blocks    Used    Avail Use% Mounted on
+        /dev/sda2                                               xfs       52155392 3487652 48667740   7% /
+        devtmpfs                                                devtmpfs   7170976       0  7170976   0% /dev
+        tmpfs                                                   tmpfs      7180624       0  7180624   0% /dev/shm
+        /dev/sda1                                               ext4        245679  151545    76931  67% /boot
+        /dev/sdb1                                               ext4      28767204 2142240 25140628   8% /mnt/resource
+        /dev/mapper/mygroup-thinv1                              xfs        1041644   33520  1008124   4% /bricks/brick1
+        /dev/mapper/mygroup-85197c258a54493da7880206251f5e37_0  xfs        1041644   33520  1008124   4% /run/gluster/snaps/85197c258a54493da7880206251f5e37/brick2
+        //Centos72test/cifs_test                                cifs      52155392 4884620 47270772  10% /mnt/cifs_test2
+
+        '''
+        output = ""
+        while(df is not None and process_wait_time >0 and df.poll() is None):
+            time.sleep(1)
+            process_wait_time -= 1
+        self.logger.log("df command executed for process wait time value" + str(process_wait_time), True)
+        if(df is not None and df.poll() is not None):
+            self.logger.log("df return code"+str(df.returncode), True)
+            output = df.stdout.read()
+        if sys.version_info > (3,):
+            output = str(output, encoding='utf-8', errors="backslashreplace")
+        else:
+            output = str(output)
+        output = output.strip().split("\n")
+        output_length = len(output)
+        index = 1
+        while index < output_length:
+            if(len(output[index].split()) < 6 ): #when a row is divided in 2 lines
+                index = index+1
+                if(index < output_length and len(output[index-1].split()) + len(output[index].split()) == 6):
+                    output[index] = output[index-1] + output[index]
+                else:
+                    self.logger.log("Output of df command is not in desired format",True)
+                    size_calc_failed = True
+                    break
+            device, size, used, available, percent, mountpoint = output[index].split()
+            rows.append((device, size, used, available, mountpoint))
+            index = index + 1
+        return rows, size_calc_failed
+
     def get_total_used_size(self):
         try:
             size_calc_failed = False
-            df = subprocess.Popen(["df" , "-k"], stdout=subprocess.PIPE)
-            '''
-            Sample output of the df command
-
-            Filesystem                                              Type     1K-blocks    Used    Avail Use% Mounted on
-            /dev/sda2                                               xfs       52155392 3487652 48667740   7% /
-            devtmpfs                                                devtmpfs   7170976       0  7170976   0% /dev
-            tmpfs                                                   tmpfs      7180624       0  7180624   0% /dev/shm
-            tmpfs                                                   tmpfs      7180624  760496  6420128  11% /run
-            tmpfs                                                   tmpfs      7180624       0  7180624   0% /sys/fs/cgroup
-            /dev/sda1                                               ext4        245679  151545    76931  67% /boot
-            /dev/sdb1                                               ext4      28767204 2142240 25140628   8% /mnt/resource
-            /dev/mapper/mygroup-thinv1                              xfs        1041644   33520  1008124   4% /bricks/brick1
-            /dev/mapper/mygroup-85197c258a54493da7880206251f5e37_0  xfs        1041644   33520  1008124   4% /run/gluster/snaps/85197c258a54493da7880206251f5e37/brick2
-            /dev/mapper/mygroup2-thinv2                             xfs       15717376 5276944 10440432  34% /tmp/test
-            /dev/mapper/mygroup2-63a858543baf4e40a3480a38a2f232a0_0 xfs       15717376 5276944 10440432  34% /run/gluster/snaps/63a858543baf4e40a3480a38a2f232a0/brick2
-            tmpfs                                                   tmpfs      1436128       0  1436128   0% /run/user/1000
-            //Centos72test/cifs_test                                cifs      52155392 4884620 47270772  10% /mnt/cifs_test2
-
-            '''
-            output = ""
-            process_wait_time = 300
-            while(df is not None and process_wait_time >0 and df.poll() is None):
-                time.sleep(1)
-                process_wait_time -= 1
-            self.logger.log("df command executed for process wait time value" + str(process_wait_time), True)
-            if(df is not None and df.poll() is not None):
-                self.logger.log("df return code"+str(df.returncode), True)
-                output = df.stdout.read()
-            if sys.version_info > (3,):
-                output = str(output, encoding='utf-8', errors="backslashreplace")
-            else:
-                output = str(output)
-            output = output.strip().split("\n")
+            usage_rows, size_calc_failed = self.get_file_system_usage()
+            if size_calc_failed:
+                return 0, size_calc_failed
             disk_loop_devices_file_systems = self.get_loop_devices()
             self.logger.log("outside loop device", True)
             total_used = 0
@@ -116,34 +179,22 @@ class SizeCalculation(object):
             unknown_fs_types = []
       
             if len(self.file_systems_info) == 0 :
-                self.file_systems_info = disk_util.get_mount_file_systems()
+                self.file_systems_info = self.get_mount_file_systems()
+            # (device, mountpoint) -> fstype, instead of scanning file_systems_info for every df row
+            fstype_by_device_mount = {}
+            for file_system_info in self.file_systems_info:
+                fstype_by_device_mount[(file_system_info[0], file_system_info[2])] = file_system_info[1]
 
-            output_length = len(output)
-            index = 1
             self.resource_disk= ResourceDiskUtil(patching = self.patching, logger = self.logger)
             resource_disk_device= self.resource_disk.get_resource_disk_mount_point(0)
             resource_disk_device= "/dev/{0}".format(resource_disk_device)
             device_list=self.device_list_for_billing() #new logic: calculate the disk size for billing
 
-            while index < output_length:
-                if(len(output[index].split()) < 6 ): #when a row is divided in 2 lines
-                    index = index+1
-                    if(index < output_length and len(output[index-1].split()) + len(output[index].split()) == 6):
-                        output[index] = output[index-1] + output[index]
-                    else:
-                        self.logger.log("Output of df command is not in desired format",True)
-                        total_used = 0
-                        size_calc_failed = True
-                        break
-                device, size, used, available, percent, mountpoint = output[index].split()
-                fstype = ''
+            for device, size, used, available, mountpoint in usage_rows:
+                fstype = fstype_by_device_mount.get((device, mountpoint), '')
                 isNetworkFs = False
                 isKnownFs = False
 
-
-                for file_system_info in self.file_systems_info:
-                    if device == file_system_info[0] and mountpoint == file_system_info[2]:
-                        fstype = file_system_info[1]
                 self.logger.log("Device name : {0} fstype : {1} size : {2} used space in KB : {3} available space : {4} mountpoint : {5}".format(device,fstype,size,used,available,mountpoint),True)
 
                 for nonPhysicaFsType in self.non_physical_file_systems:
@@ -205,8 +256,6 @@ class SizeCalculation(object):
                     if not (isKnownFs or fstype == '' or fstype == None):
                         total_used_unknown_fs = total_used_unknown_fs + int(used)
 
-                index = index + 1
-                
             if not len(unknown_fs_types) == 0:
                 Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("unknownFSTypeInDf",str(unknown_fs_types))
                 Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("totalUsedunknownFS",str(total_used_unknown_fs))
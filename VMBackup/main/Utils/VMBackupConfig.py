@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import threading
+try:
+    import ConfigParser as ConfigParsers
+except ImportError:
+    import configparser as ConfigParsers
+
+class VMBackupConfig(object):
+    """
+    Process wide snapshot of /etc/azure/vmbackup.conf.
+    The file is parsed once and parsed again only when its inode or mtime changes.
+    While held (the file systems are frozen) the file is not even stat'ed, the
+    values loaded before the freeze are served from memory.
+    """
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    section = 'SnapshotThread'
+
+    def __init__(self, configfile = '/etc/azure/vmbackup.conf'):
+        self.configfile = configfile
+        # reentrant, signal handlers end up reading the config through the logger
+        self.lock = threading.RLock()
+        self.values = {}
+        self.file_identity = None
+        self.held = False
+
+    @staticmethod
+    def get_instance():
+        with VMBackupConfig.__instance_lock:
+            if VMBackupConfig.__instance is None:
+                VMBackupConfig.__instance = VMBackupConfig()
+            return VMBackupConfig.__instance
+
+    def _get_file_identity(self):
+        try:
+            stat = os.stat(self.configfile)
+            return (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size)
+        except OSError:
+            return None
+
+    def _load(self, file_identity):
+        values = {}
+        if file_identity is not None:
+            config = ConfigParsers.ConfigParser()
+            config.read(self.configfile)
+            if config.has_section(self.section):
+                for key in config.options(self.section):
+                    values[key] = config.get(self.section, key)
+        self.values = values
+        self.file_identity = file_identity
+
+    def refresh(self):
+        with self.lock:
+            file_identity = self._get_file_identity()
+            if file_identity != self.file_identity:
+                self._load(file_identity)
+
+    def hold(self):
+        """ Stop looking at the file, e.g. for the duration of the freeze. """
+        self.refresh()
+        self.held = True
+
+    def release(self):
+        self.held = False
+
+    def get(self, key):
+        if not self.held:
+            self.refresh()
+        # ConfigParser lower cases the option names
+        return self.values.get(key.lower())
+
+    def set(self, key, value):
+        """
+        Updates the key and writes the file atomically (temp file + rename), so a
+        concurrent reader never sees a half written config.
+        """
+        with self.lock:
+            configdir = os.path.dirname(self.configfile)
+            if not os.path.exists(configdir):
+                os.makedirs(configdir)
+            config = ConfigParsers.RawConfigParser()
+            if os.path.exists(self.configfile):
+                config.read(self.configfile)
+            if not config.has_section(self.section):
+                config.add_section(self.section)
+            config.set(self.section, key, value)
+            fd, temp_path = tempfile.mkstemp(dir = configdir, prefix = '.vmbackup.conf.')
+            try:
+                with os.fdopen(fd, 'w') as config_file:
+                    config.write(config_file)
+                    config_file.flush()
+                    os.fsync(config_file.fileno())
+                if os.path.exists(self.configfile):
+                    os.chmod(temp_path, os.stat(self.configfile).st_mode & 0o777)
+                else:
+                    os.chmod(temp_path, 0o644)
+                os.rename(temp_path, self.configfile)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            self._load(self._get_file_identity())
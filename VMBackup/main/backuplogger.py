@@ -19,29 +19,94 @@
 import datetime
 import os
 import string
+import threading
 import time
 import traceback
 from blobwriter import BlobWriter
 from Utils.WAAgentUtil import waagent
+from Utils.VMBackupConfig import VMBackupConfig
 import sys
 
+class LogRecordBuffer(object):
+    """
+    Preallocated ring buffer of (timestamp, level, message) records used while
+    the file systems are frozen. Appending does no I/O and no string formatting,
+    the records are formatted once when the buffer is drained at thaw/commit.
+    When full, the oldest records are overwritten and counted as dropped.
+    """
+    max_message_length = 4096
+
+    def __init__(self, capacity):
+        # reentrant, the freeze signal handlers log from the main thread
+        self.lock = threading.RLock()
+        self.resize(capacity)
+
+    def resize(self, capacity):
+        with self.lock:
+            self.capacity = max(1, capacity)
+            self.records = [None] * self.capacity
+            self.next_index = 0
+            self.count = 0
+            self.dropped = 0
+
+    def append(self, timestamp, level, msg):
+        if isinstance(msg, str) and len(msg) > self.max_message_length:
+            msg = msg[:self.max_message_length] + '...(truncated)'
+        with self.lock:
+            self.records[self.next_index] = (timestamp, level, msg)
+            self.next_index = (self.next_index + 1) % self.capacity
+            if self.count == self.capacity:
+                self.dropped = self.dropped + 1
+            else:
+                self.count = self.count + 1
+
+    def drain(self):
+        """ returns the buffered records oldest first along with the dropped count, and empties the buffer """
+        with self.lock:
+            first = (self.next_index - self.count) % self.capacity
+            records = [self.records[(first + i) % self.capacity] for i in range(self.count)]
+            records = [record for record in records if record is not None]
+            dropped = self.dropped
+            for i in range(self.capacity):
+                self.records[i] = None
+            self.next_index = 0
+            self.count = 0
+            self.dropped = 0
+        return records, dropped
+
 class Backuplogger(object):
+    default_log_buffer_size = 10000
+
     def __init__(self, hutil):
         self.msg = ''
         self.con_path = '/dev/console'
+        self.con_fd = None
         self.enforced_local_flag_value = True
         self.hutil = hutil
         self.prev_log = ''
         self.logging_off = False
+        self.log_buffer = LogRecordBuffer(Backuplogger.default_log_buffer_size)
 
     def enforce_local_flag(self, enforced_local):
         if (self.hutil.get_intvalue_from_configfile('LoggingOff', 0) == 1):
             self.logging_off = True
+        if (self.enforced_local_flag_value != False and enforced_local == False):
+            # size the buffer before the freeze so that logging while frozen never allocates it
+            log_buffer_size = self.hutil.get_intvalue_from_configfile('LogBufferSize', Backuplogger.default_log_buffer_size)
+            if (log_buffer_size != self.log_buffer.capacity):
+                self.log_buffer.resize(log_buffer_size)
+            self.open_console()
+        # no config file access while the file systems are frozen
+        if (enforced_local == False):
+            VMBackupConfig.get_instance().hold()
+        else:
+            VMBackupConfig.get_instance().release()
         if (self.enforced_local_flag_value != False and enforced_local == False and self.logging_off == True):
             pass
         elif (self.enforced_local_flag_value != False and enforced_local == False):
             self.msg = self.msg + "================== Logs during Freeze Start ==============" + "\n"
         elif (self.enforced_local_flag_value == False and enforced_local == True):
+            self.flush_log_buffer()
             self.msg = self.msg + "================== Logs during Freeze End ==============" + "\n"
             self.commit_to_local()
         self.enforced_local_flag_value = enforced_local
@@ -52,25 +117,65 @@ class Backuplogger(object):
             return
         WriteLog = self.hutil.get_strvalue_from_configfile('WriteLog','True')
         if (WriteLog == None or WriteLog == 'True'):
-            log_msg = ""
+            if(self.enforced_local_flag_value == False):
+                self.log_buffer.append(time.time(), level, msg)
+                return
             if sys.version_info > (3,):
-                log_msg = self.log_to_con_py3(msg, level)
+                self.log_to_con_py3(msg, level)
             else:
                 log_msg = "{0}  {1}  {2} \n".format(str(datetime.datetime.now()) , level , msg)
-                if(self.enforced_local_flag_value != False):
-                    self.log_to_con(log_msg)
-            if(self.enforced_local_flag_value == False):
-                self.msg += log_msg
-            else:
-                self.hutil.log(str(msg),level)
+                self.log_to_con(log_msg)
+            self.hutil.log(str(msg),level)
 
-    def log_to_con(self, msg):
+    def format_log_record(self, timestamp, level, msg):
+        if sys.version_info > (3,):
+            try:
+                if type(msg) is not str:
+                    msg = str(msg, errors="backslashreplace")
+                log_time = datetime.datetime.fromtimestamp(timestamp).strftime(u'%Y/%m/%d %H:%M:%S.%f')
+                log_msg = u"{0}  {1}  {2} \n".format(log_time , level , msg)
+                return str(log_msg.encode('ascii', "backslashreplace"), encoding="ascii")
+            except Exception as e:
+                return "###### Exception in format_log_record\n"
+        return "{0}  {1}  {2} \n".format(str(datetime.datetime.fromtimestamp(timestamp)) , level , msg)
+
+    def flush_log_buffer(self):
+        """ moves the records logged during the freeze into self.msg in one batch """
+        records, dropped = self.log_buffer.drain()
+        if (dropped > 0):
+            self.msg = self.msg + "###### " + str(dropped) + " log records were dropped, increase LogBufferSize in vmbackup.conf \n"
+        self.msg = self.msg + "".join([self.format_log_record(timestamp, level, msg) for (timestamp, level, msg) in records])
+
+    def open_console(self):
+        # the console is opened once and kept open, instead of once per message
+        if (self.con_fd is None):
+            try:
+                self.con_fd = os.open(self.con_path, os.O_WRONLY | os.O_NOCTTY | os.O_APPEND)
+            except Exception as e:
+                self.con_fd = -1
+        return self.con_fd
+
+    def close_console(self):
+        if (self.con_fd is not None and self.con_fd >= 0):
+            try:
+                os.close(self.con_fd)
+            except Exception as e:
+                pass
+        self.con_fd = None
+
+    def write_to_con(self, data):
+        con_fd = self.open_console()
+        if (con_fd < 0):
+            return
         try:
-            with open(self.con_path, "wb") as C :
-                message = "".join(list(filter(lambda x : x in string.printable, msg)))
-                C.write(message.encode('ascii','ignore'))
-        except IOError as e:
+            os.write(con_fd, data)
+        except Exception as e:
             pass
+
+    def log_to_con(self, msg):
+        try:
+            message = "".join(list(filter(lambda x : x in string.printable, msg)))
+            self.write_to_con(message.encode('ascii','ignore'))
         except Exception as e:
             pass
 
@@ -84,8 +189,7 @@ class Backuplogger(object):
             log_msg= str(log_msg.encode('ascii', "backslashreplace"), 
                          encoding="ascii")
             if(self.enforced_local_flag_value != False):
-                with open(self.con_path, "w") as C :
-                    C.write(log_msg)
+                self.write_to_con(log_msg.encode('ascii'))
         except IOError:
             pass
         except Exception as e:
@@ -95,6 +199,8 @@ class Backuplogger(object):
     def commit(self, logbloburi):
         #commit to local file system first, then commit to the network.
         try:
+            self.flush_log_buffer()
+            self.close_console()
             self.hutil.log(self.msg)
             self.msg = ''
         except Exception as e:
@@ -105,6 +211,7 @@ class Backuplogger(object):
             self.hutil.log('commit to blob failed')
 
     def commit_to_local(self):
+        self.flush_log_buffer()
         self.hutil.log(self.msg)
         self.msg = ''
 
@@ -23,8 +23,13 @@ try:
     import urlparse
 except ImportError:
     import urllib.parse as urlparse
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import threading
 from common import CommonVariables
-from HttpUtil import HttpUtil
+from HttpUtil import HttpUtil, HttpConnectionCache
 from Utils import HandlerUtil
 
 class BlobProperties():
@@ -36,6 +41,11 @@ class BlobProperties():
 
 class BlobWriter(object):
     """description of class"""
+    PAGE_SIZE_BYTES = 512
+    PAGE_UPLOAD_LIMIT_BYTES = 4194304 # 4 MB
+    STATUS_BLOB_LIMIT_BYTES = 10485760 # 10 MB
+    MAX_PAGE_UPLOAD_CONNECTIONS = 4
+
     def __init__(self, hutil):
         self.hutil = hutil
     """
@@ -45,12 +55,15 @@ class BlobWriter(object):
         try:
             # get the blob type
             if(blobUri is not None):
-                blobType = self.GetBlobType(blobUri)
+                # one properties round-trip, shared by the type check and the page writes
+                blobProperties = self.GetBlobProperties(blobUri)
+                blobType = "BlockBlob"
+                if(blobProperties is not None):
+                    blobType = blobProperties.blobType
+                self.hutil.log("WriteBlob: Blob-Type :"+str(blobType))
                 if (str(blobType).lower() == "pageblob"):
-                    # Clear Page-Blob Contents
-                    self.ClearPageBlob(blobUri)
-                    # Write to Page-Blob
-                    self.WritePageBlob(msg, blobUri)
+                    # Write to Page-Blob, the pages past the new content are cleared along with it
+                    self.WritePageBlob(msg, blobUri, blobProperties)
                 else:
                     self.WriteBlockBlob(msg, blobUri)
             else:
@@ -86,19 +99,19 @@ class BlobWriter(object):
             self.hutil.log("retry times is " + str(retry_times))
             retry_times = retry_times - 1
 
-    def WritePageBlob(self, message, blobUri):
+    def WritePageBlob(self, message, blobUri, blobProperties = None):
         if(blobUri is not None):
             retry_times = 3
             while(retry_times > 0):
                 msg = message
                 try:
-                    PAGE_SIZE_BYTES = 512
-                    PAGE_UPLOAD_LIMIT_BYTES = 4194304 # 4 MB
-                    STATUS_BLOB_LIMIT_BYTES = 10485760 # 10 MB
-                    http_util = HttpUtil(self.hutil)
-                    sasuri_obj = urlparse.urlparse(blobUri + '&comp=page')
+                    PAGE_SIZE_BYTES = BlobWriter.PAGE_SIZE_BYTES
+                    STATUS_BLOB_LIMIT_BYTES = BlobWriter.STATUS_BLOB_LIMIT_BYTES
+                    if(not isinstance(msg, bytes)):
+                        msg = msg.encode('utf-8')
                     # Get Blob-properties to know content-length
-                    blobProperties = self.GetBlobProperties(blobUri)
+                    if(blobProperties is None):
+                        blobProperties = self.GetBlobProperties(blobUri)
                     blobContentLength = int(blobProperties.contentLength)
                     self.hutil.log("WritePageBlob: contentLength:"+str(blobContentLength))
                     maxMsgLen = STATUS_BLOB_LIMIT_BYTES
@@ -128,75 +141,114 @@ class BlobWriter(object):
                         msg = msg[msgLen-blobContentLength:msgLen]
                         msgLen = len(msg)
                         self.hutil.log("WritePageBlob: msg length after aligning to blobContentLength:"+str(msgLen))
-                    # Write Pages
-                    result = CommonVariables.error
-                    bytes_sent = 0
-                    while (bytes_sent < msgLen):
-                        bytes_remaining = msgLen - bytes_sent
-                        pageContent = None
-                        if(bytes_remaining > PAGE_UPLOAD_LIMIT_BYTES): # more than 4 MB
-                            pageContent = msg[bytes_sent:bytes_sent+PAGE_UPLOAD_LIMIT_BYTES]
-                        else:
-                            pageContent = msg[bytes_sent:msgLen]
-                        self.hutil.log("WritePageBlob: pageContentLen:"+str(len(pageContent)))
-                        result = self.put_page_update(pageContent, blobUri, bytes_sent)
-                        if(result == CommonVariables.success):
-                            self.hutil.log("WritePageBlob: page written succesfully")
-                        else:
-                            self.hutil.log("WritePageBlob: page failed to write")
-                            break
-                        bytes_sent = bytes_sent + len(pageContent)                      
+                    # Write Pages, and clear only the old content past the new one
+                    result = self.put_pages(msg, msgLen, blobUri, blobContentLength)
                     if(result == CommonVariables.success):
                         self.hutil.log("WritePageBlob: page-blob written succesfully")
                         retry_times = 0
                     else:
                         self.hutil.log("WritePageBlob: page-blob failed to write")
                         HandlerUtil.HandlerUtility.add_to_telemetery_data(CommonVariables.statusBlobUploadError, "true")
+                        blobProperties = None
                 except Exception as e:
                     HandlerUtil.HandlerUtility.add_to_telemetery_data(CommonVariables.statusBlobUploadError, "true")
                     self.hutil.log("WritePageBlob: Failed to write to page-blob with error: %s, stack trace: %s" % (str(e), traceback.format_exc()))
+                    blobProperties = None
                 self.hutil.log("WritePageBlob: retry times is " + str(retry_times))
                 retry_times = retry_times - 1
         else:
             self.hutil.log("WritePageBlob: bloburi is None")
 
-    def ClearPageBlob(self, blobUri):
-        if(blobUri is not None):
-            retry_times = 3
-            while(retry_times > 0):
+    def put_pages(self, msg, msgLen, blobUri, blobContentLength):
+        """
+        Uploads msg as 4 MB page ranges over kept-alive connections, several ranges at a time,
+        and clears [msgLen, blobContentLength) when the old content was longer than the new one.
+        The ranges are sent as memoryview slices of msg, without copying it.
+        """
+        PAGE_UPLOAD_LIMIT_BYTES = BlobWriter.PAGE_UPLOAD_LIMIT_BYTES
+        try:
+            view = memoryview(msg)
+        except NameError:
+            # python 2.6
+            view = msg
+        operations = []
+        for offset in range(0, msgLen, PAGE_UPLOAD_LIMIT_BYTES):
+            operations.append(('update', offset, view[offset:min(offset + PAGE_UPLOAD_LIMIT_BYTES, msgLen)]))
+        if(blobContentLength > msgLen):
+            operations.append(('clear', msgLen, blobContentLength - msgLen))
+        elif(msgLen == 0):
+            self.hutil.log("put_pages: nothing to write")
+            return CommonVariables.success
+        else:
+            self.hutil.log("put_pages: new content covers the old range, skipping the clear")
+
+        http_util = HttpUtil(self.hutil)
+        sasuri_obj = urlparse.urlparse(blobUri + '&comp=page')
+        connection_cache = HttpConnectionCache()
+        results = [None] * len(operations)
+        work_queue = queue.Queue()
+        for index in range(len(operations)):
+            work_queue.put(index)
+
+        def put_page_worker():
+            while True:
                 try:
-                    http_util = HttpUtil(self.hutil)
-                    sasuri_obj = urlparse.urlparse(blobUri + '&comp=page')
-                    # Get Blob-properties to know content-length
-                    blobProperties = self.GetBlobProperties(blobUri)
-                    contentLength = int(blobProperties.contentLength)
-                    # Clear Pages
-                    if(contentLength > 0):
-                        result = self.put_page_clear(blobUri, 0, contentLength)
-                        if(result == CommonVariables.success):
-                            self.hutil.log("ClearPageBlob: page-blob cleared succesfully")
-                            retry_times = 0
-                        else:
-                            self.hutil.log("ClearPageBlob: page-blob failed to clear")
-                    else:
-                        self.hutil.log("ClearPageBlob: page-blob contentLength is 0")
-                        retry_times = 0
-                except Exception as e:
-                    self.hutil.log("ClearPageBlob: Failed to clear to page-blob with error: %s, stack trace: %s" % (str(e), traceback.format_exc()))
-                self.hutil.log("ClearPageBlob: retry times is " + str(retry_times))
-                retry_times = retry_times - 1
+                    index = work_queue.get_nowait()
+                except queue.Empty:
+                    return
+                results[index] = self.put_page_keep_alive(http_util, sasuri_obj, connection_cache, operations[index])
+
+        thread_count = min(BlobWriter.MAX_PAGE_UPLOAD_CONNECTIONS, len(operations))
+        if(thread_count <= 1):
+            put_page_worker()
         else:
-            self.hutil.log("ClearPageBlob: bloburi is None")
+            workers = []
+            for i in range(thread_count):
+                worker = threading.Thread(target = put_page_worker)
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+            for worker in workers:
+                worker.join()
+        connection_cache.close_all()
+        self.hutil.log("put_pages: " + str(len(operations)) + " page operations over " + str(connection_cache.created_count) + " connections")
 
-    def GetBlobType(self, blobUri):
-        blobType = "BlockBlob"
-        if(blobUri is not None):
-            # Get Blob Properties
-            blobProperties = self.GetBlobProperties(blobUri)
-            if(blobProperties is not None):
-                blobType = blobProperties.blobType
-        self.hutil.log("GetBlobType: Blob-Type :"+str(blobType))
-        return blobType
+        result = CommonVariables.success
+        for index in range(len(operations)):
+            operation, offset, content = operations[index]
+            status, errorMsg = results[index]
+            if(status != CommonVariables.success):
+                self.hutil.log("put_pages: page " + operation + " at offset " + str(offset) + " failed with " + str(status) + ", errorMsg: " + str(errorMsg) + ". retrying with curl fallback")
+                # same path as before, including the curl fallback
+                if(operation == 'update'):
+                    if(hasattr(content, 'tobytes')):
+                        content = content.tobytes()
+                    status = self.put_page_update(content, blobUri, offset)
+                else:
+                    status = self.put_page_clear(blobUri, offset, content)
+                if(status != CommonVariables.success):
+                    result = status
+        return result
+
+    def put_page_keep_alive(self, http_util, sasuri_obj, connection_cache, operation_item):
+        """ runs on the page upload threads; does not log, returns (result, errorMsg) """
+        operation, offset, content = operation_item
+        headers = {}
+        headers["x-ms-page-write"] = operation
+        if(operation == 'update'):
+            headers["x-ms-range"] = 'bytes={0}-{1}'.format(offset, offset + len(content) - 1)
+            headers["Content-Length"] = str(len(content))
+            data = content
+        else:
+            headers["x-ms-range"] = 'bytes={0}-{1}'.format(offset, offset + content - 1)
+            headers["Content-Length"] = '0'
+            data = None
+        result, httpResp, errorMsg, responseBody = http_util.HttpCallGetResponseKeepAlive('PUT', sasuri_obj, data, headers, connection_cache)
+        if(result == CommonVariables.success and httpResp is not None):
+            if(httpResp.status == 200 or httpResp.status == 201):
+                return CommonVariables.success, None
+            return httpResp.status, responseBody
+        return CommonVariables.error_http_failure, errorMsg
 
     def GetBlobProperties(self, blobUri):
         blobProperties = None
@@ -207,7 +259,8 @@ class BlobWriter(object):
                     http_util = HttpUtil(self.hutil)
                     sasuri_obj = urlparse.urlparse(blobUri)
                     headers = {}
-                    result, httpResp, errMsg = http_util.HttpCallGetResponse('GET', sasuri_obj, None, headers = headers)
+                    # HEAD returns the same headers without transferring the blob content
+                    result, httpResp, errMsg = http_util.HttpCallGetResponse('HEAD', sasuri_obj, None, headers = headers)
                     self.hutil.log("GetBlobProperties: HttpCallGetResponse : result :" + str(result) + ", errMsg :" + str(errMsg))
                     blobProperties = self.httpresponse_get_blob_properties(httpResp)
                     self.hutil.log("GetBlobProperties: blobProperties :" + str(blobProperties))
@@ -234,7 +287,7 @@ class BlobWriter(object):
         headers = {}
         headers["x-ms-page-write"] = 'update'
         headers["x-ms-range"] = 'bytes={0}-{1}'.format(pageBlobIndex, pageBlobIndex + len(pageContent) - 1)
-        headers["Content-Length"] = len(str(pageContent))
+        headers["Content-Length"] = len(pageContent)
         result = http_util.Call(method = 'PUT', sasuri_obj = sasuri_obj, data = pageContent, headers = headers, fallback_to_curl = True)
         return result
     
@@ -68,6 +68,8 @@ class CommonVariables:
 
     unable_to_open_err_string= 'file open failed for some mount'
 
+    default_snapshot_thread_count = 16
+
     """
     error code definitions
     """
@@ -229,7 +229,7 @@ class FreezeSnapshotter(object):
             time_after_freeze = datetime.datetime.now()
             freezeTimeTaken = time_after_freeze-time_before_freeze
             self.logger.log('T:S ***** freeze, time_before_freeze=' + str(time_before_freeze) + ", time_after_freeze=" + str(time_after_freeze) + ", freezeTimeTaken=" + str(freezeTimeTaken))
-            HandlerUtil.HandlerUtility.add_to_telemetery_data("FreezeTime", str(time_after_freeze-time_before_freeze-datetime.timedelta(seconds=5)))
+            HandlerUtil.HandlerUtility.add_to_telemetery_data("FreezeTime", str(time_after_freeze-time_before_freeze))
             run_result = CommonVariables.success
             run_status = 'success'
             all_failed= False
@@ -24,18 +24,21 @@ import os
 import time
 import sys
 import signal
+import select
+import errno
+import fcntl
 import traceback
-import threading
 from common import CommonVariables
+from Utils import HandlerUtil
 from Utils.ResourceDiskUtil import ResourceDiskUtil
 
 def thread_for_binary(self,args):
     self.logger.log("Thread for binary is called",True)
-    time.sleep(3)
-    self.logger.log("Waited in thread for 3 seconds",True)
     self.logger.log("****** 1. Starting Freeze Binary ",True)
     self.child = subprocess.Popen(args,stdout=subprocess.PIPE)
     self.logger.log("Binary subprocess Created",True)
+    # the binary may have exited before self.child was set, let the waiter look at it
+    self.notify()
 
 class FreezeError(object):
     def __init__(self):
@@ -61,11 +64,39 @@ class FreezeHandler(object):
         self.child= None
         self.logger=logger
         self.hutil = hutil
+        # self-pipe, written from the signal handlers so that the waiters wake up
+        # as soon as the binary signals or exits instead of sleeping in fixed steps
+        self.wakeup_read_fd, self.wakeup_write_fd = os.pipe()
+        for fd in (self.wakeup_read_fd, self.wakeup_write_fd):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def notify(self):
+        try:
+            os.write(self.wakeup_write_fd, b'1')
+        except OSError:
+            # pipe full, the waiter is already due to wake up
+            pass
+
+    def wait_for_notification(self, timeout):
+        """ returns when notified or after timeout seconds """
+        try:
+            readable, writable, exceptional = select.select([self.wakeup_read_fd], [], [], max(0, timeout))
+        except (select.error, OSError, IOError) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if readable:
+            try:
+                while os.read(self.wakeup_read_fd, 512):
+                    pass
+            except OSError:
+                pass
 
     def sigusr1_handler(self,signal,frame):
         self.logger.log('freezed',False)
         self.logger.log("****** 4. Freeze Completed (Signal=1 received)",False)
         self.sig_handle=1
+        self.notify()
 
     def sigchld_handler(self,signal,frame):
         self.logger.log('some child process terminated')
@@ -73,6 +104,7 @@ class FreezeHandler(object):
             self.logger.log("binary child terminated",True)
             self.logger.log("****** 9. Binary Process completed (Signal=2 received)",True)
             self.sig_handle=2
+        self.notify()
 
     def reset_signals(self):
         self.sig_handle = 0
@@ -87,15 +119,29 @@ class FreezeHandler(object):
 
         proc_sleep_time = self.hutil.get_intvalue_from_configfile('SafeFreezeWaitInSeconds',SafeFreezeWaitInSecondsDefault)
         
-        for i in range(0,(int(proc_sleep_time/2))):
-            if(self.sig_handle==0):
-                self.logger.log("inside while with sig_handle "+str(self.sig_handle))
-                time.sleep(2)
-            else:
+        start_time = time.time()
+        deadline = start_time + proc_sleep_time
+        while(self.sig_handle==0 and time.time() < deadline):
+            if(self.child is not None and self.child.poll() is not None):
+                self.logger.log("binary child terminated before signalling",True)
+                self.sig_handle=2
                 break
+            self.wait_for_notification(deadline - time.time())
+        HandlerUtil.HandlerUtility.add_to_telemetery_data("FreezeSignalLatency", str(round(time.time() - start_time, 3)))
         self.logger.log("Binary output for signal handled: "+str(self.sig_handle))
         return self.sig_handle
 
+    def wait_for_child_exit(self, timeout):
+        """ returns True if the binary exited within timeout seconds """
+        deadline = time.time() + timeout
+        while(self.child.poll() is None):
+            remaining = deadline - time.time()
+            if(remaining <= 0):
+                return False
+            # SIGCHLD wakes this up; the 1 second cap only guards against a lost signal
+            self.wait_for_notification(min(remaining, 1))
+        return True
+
     def signal_receiver(self):
         signal.signal(signal.SIGUSR1,self.sigusr1_handler)
         signal.signal(signal.SIGCHLD,self.sigchld_handler)
@@ -121,8 +167,7 @@ class FsFreezer:
         self.resource_disk= ResourceDiskUtil(patching = patching, logger = logger)
         self.skip_freeze= True
 
-    def should_skip(self, mount):
-        resource_disk_mount_point= self.resource_disk.get_resource_disk_mount_point()
+    def should_skip(self, mount, resource_disk_mount_point):
         if(resource_disk_mount_point is not None and mount.mount_point == resource_disk_mount_point):
             return True
         elif((mount.fstype == 'ext3' or mount.fstype == 'ext4' or mount.fstype == 'xfs' or mount.fstype == 'btrfs') and mount.type != 'loop' ):
@@ -148,16 +193,18 @@ class FsFreezer:
             freezebin=os.path.join(os.getcwd(),os.path.dirname(__file__),"safefreeze/bin/safefreeze")
             args=[freezebin,str(timeout)]
             no_mount_found = True
+            # looked up once, not once per mount
+            resource_disk_mount_point = self.resource_disk.get_resource_disk_mount_point()
             for mount in self.mounts.mounts:
                 self.logger.log("fsfreeze mount :" + str(mount.mount_point), True)
                 if(mount.mount_point == '/'):
                     self.root_seen = True
                     self.root_mount = mount
-                elif(mount.mount_point not in mounts_list_to_skip and not self.should_skip(mount)):
+                elif(mount.mount_point not in mounts_list_to_skip and not self.should_skip(mount, resource_disk_mount_point)):
                     if(self.skip_freeze == True):
                         self.skip_freeze = False
                     args.append(str(mount.mount_point))
-            if(self.root_seen and not self.should_skip(self.root_mount)):
+            if(self.root_seen and not self.should_skip(self.root_mount, resource_disk_mount_point)):
                 if(self.skip_freeze == True):
                     self.skip_freeze = False
                 args.append('/')
@@ -210,13 +257,11 @@ class FsFreezer:
         elif(self.freeze_handler.child.poll() is None):
             self.logger.log("child process still running")
             self.logger.log("****** 7. Sending Thaw Signal to Binary")
+            time_before_thaw_signal = time.time()
             self.freeze_handler.child.send_signal(signal.SIGUSR1)
-            for i in range(0,30):
-                if(self.freeze_handler.child.poll() is None):
-                    self.logger.log("child still running sigusr1 sent")
-                    time.sleep(1)
-                else:
-                    break
+            if(not self.freeze_handler.wait_for_child_exit(30)):
+                self.logger.log("child still running sigusr1 sent")
+            HandlerUtil.HandlerUtility.add_to_telemetery_data("ThawSignalLatency", str(round(time.time() - time_before_thaw_signal, 3)))
             self.logger.enforce_local_flag(True)
             self.log_binary_output()
             if(self.freeze_handler.child.returncode!=0):
@@ -27,10 +27,13 @@ try:
     import ConfigParser as ConfigParsers
 except ImportError:
     import configparser as ConfigParsers
-import multiprocessing as mp
-import datetime
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import threading
 from common import CommonVariables
-from HttpUtil import HttpUtil
+from HttpUtil import HttpUtil, HttpConnectionCache
 from Utils import Status
 from Utils import HandlerUtil
 from fsfreezer import FsFreezer
@@ -70,9 +73,14 @@ class GuestSnapshotter(object):
         self.configfile='/etc/azure/vmbackup.conf'
         self.hutil = hutil
 
-    def snapshot(self, sasuri, sasuri_index, meta_data, snapshot_result_error, snapshot_info_indexer_queue, global_logger, global_error_logger):
+    def snapshot(self, sasuri, sasuri_index, meta_data, connection_cache):
+        """
+        Runs on a snapshot worker thread. Nothing is logged from here since the
+        file systems may be frozen; the log lines are handed back to the caller.
+        """
         temp_logger=''
         error_logger=''
+        time_taken = None
         snapshot_error = SnapshotError()
         snapshot_info_indexer = SnapshotInfoIndexerObj(sasuri_index, False, None, None)
         if(sasuri is None):
@@ -99,8 +107,8 @@ class GuestSnapshotter(object):
                 http_util = HttpUtil(self.logger)
                 sasuri_obj = urlparser.urlparse(sasuri + '&comp=snapshot')
                 temp_logger = temp_logger + str(datetime.datetime.now()) + ' start calling the snapshot rest api. '
-                # initiate http call for blob-snapshot and get http response
-                result, httpResp, errMsg, responseBody  = http_util.HttpCallGetResponse('PUT', sasuri_obj, body_content, headers = headers, responseBodyRequired = True)
+                # initiate http call for blob-snapshot over the kept-alive connection of this worker
+                result, httpResp, errMsg, responseBody  = http_util.HttpCallGetResponseKeepAlive('PUT', sasuri_obj, body_content, headers, connection_cache)
                 temp_logger = temp_logger + str("responseBody: " + responseBody)
                 if(result == CommonVariables.success and httpResp != None):
                     # retrieve snapshot information from http response
@@ -121,10 +129,39 @@ class GuestSnapshotter(object):
             snapshot_error.errorcode = CommonVariables.error
             snapshot_error.sasuri = sasuri
         temp_logger=temp_logger + str(datetime.datetime.now()) + ' snapshot ends..'
-        global_logger.put(temp_logger)
-        global_error_logger.put(error_logger)
-        snapshot_result_error.put(snapshot_error)
-        snapshot_info_indexer_queue.put(snapshot_info_indexer)
+        return snapshot_error, snapshot_info_indexer, temp_logger, error_logger, time_taken
+
+    def snapshot_worker(self, work_queue, meta_data, connection_cache, results):
+        while True:
+            try:
+                blob, blob_index = work_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[blob_index] = self.snapshot(blob, blob_index, meta_data, connection_cache)
+            except Exception as e:
+                snapshot_error = SnapshotError()
+                snapshot_error.errorcode = CommonVariables.error
+                snapshot_error.sasuri = blob
+                results[blob_index] = (snapshot_error, SnapshotInfoIndexerObj(blob_index, False, None, None), '', str(datetime.datetime.now()) + " snapshot worker failed with error: " + str(e), None)
+
+    @staticmethod
+    def get_latency_histogram(latencies):
+        """
+        Buckets the per-blob snapshot latencies (in seconds) for telemetry,
+        e.g. "<0.5s:10,<1s:4,<2s:1,<5s:0,<10s:0,>=10s:0".
+        """
+        bounds = [0.5, 1, 2, 5, 10]
+        counts = [0] * (len(bounds) + 1)
+        for latency in latencies:
+            bucket = len(bounds)
+            for i in range(len(bounds)):
+                if latency < bounds[i]:
+                    bucket = i
+                    break
+            counts[bucket] = counts[bucket] + 1
+        buckets = ['<' + str(bound) + 's' for bound in bounds] + ['>=' + str(bounds[-1]) + 's']
+        return ','.join([buckets[i] + ':' + str(counts[i]) for i in range(len(buckets))])
 
     def snapshot_seq(self, sasuri, sasuri_index, meta_data):
         result = None
@@ -183,49 +220,44 @@ class GuestSnapshotter(object):
         thaw_done_local = thaw_done
         unable_to_sleep = False
         all_snapshots_failed = False
-        set_next_backup_to_seq = False
+        connection_cache = HttpConnectionCache()
         try:
-            self.logger.log("before start of multiprocessing queues..")
-            mp_jobs = []
-            queue_creation_starttime = datetime.datetime.now()
-            global_logger = mp.Queue()
-            global_error_logger = mp.Queue()
-            snapshot_result_error = mp.Queue()
-            snapshot_info_indexer_queue = mp.Queue()
-            time_before_snapshot_start = datetime.datetime.now()
             blobs = paras.blobs
 
             if blobs is not None:
                 # initialize blob_snapshot_info_array
-                mp_jobs = []
+                work_queue = queue.Queue()
                 blob_index = 0
-                self.logger.log('****** 5. Snaphotting (Guest-parallel) Started')
                 for blob in blobs:
                     blobUri = blob.split("?")[0]
                     self.logger.log("index: " + str(blob_index) + " blobUri: " + str(blobUri))
                     blob_snapshot_info_array.append(HostSnapshotObjects.BlobSnapshotInfo(False, blobUri, None, 500))
-                    try:
-                        mp_jobs.append(mp.Process(target=self.snapshot,args=(blob, blob_index, paras.backup_metadata, snapshot_result_error, snapshot_info_indexer_queue, global_logger, global_error_logger)))
-                    except Exception as e:
-                        self.logger.log("multiprocess queue creation failed")
-                        all_snapshots_failed = True
-                        raise Exception("Exception while creating multiprocess queue")
-
+                    work_queue.put((blob, blob_index))
                     blob_index = blob_index + 1
 
-                counter = 0
-                for job in mp_jobs:
-                    job.start()
-                    if(counter == 0):
-                        queue_creation_endtime = datetime.datetime.now()
-                        timediff = queue_creation_endtime - queue_creation_starttime
-                        if(timediff.seconds >= 10):
-                            self.logger.log("mp queue creation took more than 10 secs. Setting next backup to sequential")
-                            set_next_backup_to_seq = True
-                    counter = counter + 1
+                results = [None] * len(blobs)
+                thread_count = self.hutil.get_intvalue_from_configfile('snapshotthreadcount', CommonVariables.default_snapshot_thread_count)
+                thread_count = max(1, min(thread_count, len(blobs)))
+                self.logger.log("snapshot worker thread count: " + str(thread_count))
+                HandlerUtil.HandlerUtility.add_to_telemetery_data("snapshotThreadCount", str(thread_count))
+
+                self.logger.log('****** 5. Snaphotting (Guest-parallel) Started')
+                workers = []
+                for i in range(thread_count):
+                    try:
+                        worker = threading.Thread(target=self.snapshot_worker, args=(work_queue, paras.backup_metadata, connection_cache, results))
+                        worker.daemon = True
+                        worker.start()
+                        workers.append(worker)
+                    except Exception as e:
+                        self.logger.log("snapshot worker thread creation failed with error: " + str(e))
+                        if(len(workers) == 0):
+                            all_snapshots_failed = True
+                            raise Exception("Exception while creating snapshot worker threads")
+                        break
 
-                for job in mp_jobs:
-                    job.join()
+                for worker in workers:
+                    worker.join()
                 self.logger.log('****** 6. Snaphotting (Guest-parallel) Completed')
                 thaw_result = None
                 if g_fsfreeze_on and thaw_done_local == False:
@@ -234,35 +266,45 @@ class GuestSnapshotter(object):
                     time_after_thaw = datetime.datetime.now()
                     HandlerUtil.HandlerUtility.add_to_telemetery_data("ThawTime", str(time_after_thaw-time_before_thaw))
                     thaw_done_local = True
-                    if(set_next_backup_to_seq == True):
-                        self.logger.log("Setting to sequential snapshot")
-                        self.hutil.set_value_to_configfile('seqsnapshot', '1')
                     self.logger.log('T:S thaw result ' + str(thaw_result))
                     if(thaw_result is not None and len(thaw_result.errors) > 0  and (snapshot_result is None or len(snapshot_result.errors) == 0)):
                         is_inconsistent = True
                         snapshot_result.errors.append(thaw_result.errors)
                         return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
                 self.logger.log('end of snapshot process')
-                logging = [global_logger.get() for job in mp_jobs]
+                connection_cache.close_all()
+                HandlerUtil.HandlerUtility.add_to_telemetery_data("snapshotConnectionsCreated", str(connection_cache.created_count))
+                HandlerUtil.HandlerUtility.add_to_telemetery_data("snapshotConnectionsReused", str(connection_cache.reused_count))
+
+                latencies = []
+                logging = []
+                error_logging = []
+                for result in results:
+                    if result is None:
+                        continue
+                    snapshot_error, snapshot_info_indexer, temp_logger, error_logger, time_taken = result
+                    logging.append(temp_logger)
+                    error_logging.append(error_logger)
+                    if time_taken is not None:
+                        latencies.append(self.hutil.timedelta_total_seconds(time_taken))
+                    if(snapshot_error.errorcode != CommonVariables.success):
+                        snapshot_result.errors.append(snapshot_error)
+                    # update blob_snapshot_info_array element properties from snapshot_info_indexer object
+                    self.get_snapshot_info(snapshot_info_indexer, blob_snapshot_info_array[snapshot_info_indexer.index])
+                    if (blob_snapshot_info_array[snapshot_info_indexer.index].isSuccessful == True):
+                        all_failed = False
+                    self.logger.log("index: " + str(snapshot_info_indexer.index) + " blobSnapshotUri: " + str(blob_snapshot_info_array[snapshot_info_indexer.index].snapshotUri))
                 self.logger.log(str(logging))
-                error_logging = [global_error_logger.get() for job in mp_jobs]
                 self.logger.log(str(error_logging),False,'Error')
-                if not snapshot_result_error.empty():
-                    results = [snapshot_result_error.get() for job in mp_jobs]
-                    for result in results:
-                        if(result.errorcode != CommonVariables.success):
-                            snapshot_result.errors.append(result)
-                if not snapshot_info_indexer_queue.empty():
-                    snapshot_info_indexers = [snapshot_info_indexer_queue.get() for job in mp_jobs]
-                    for snapshot_info_indexer in snapshot_info_indexers:
-                        # update blob_snapshot_info_array element properties from snapshot_info_indexer object
-                        self.get_snapshot_info(snapshot_info_indexer, blob_snapshot_info_array[snapshot_info_indexer.index])
-                        if (blob_snapshot_info_array[snapshot_info_indexer.index].isSuccessful == True):
-                            all_failed = False
-                        self.logger.log("index: " + str(snapshot_info_indexer.index) + " blobSnapshotUri: " + str(blob_snapshot_info_array[snapshot_info_indexer.index].snapshotUri))
 
-                    all_snapshots_failed = all_failed
-                    self.logger.log("Setting all_snapshots_failed to " + str(all_snapshots_failed))
+                latency_histogram = GuestSnapshotter.get_latency_histogram(latencies)
+                self.logger.log("snapshot latency histogram: " + latency_histogram)
+                HandlerUtil.HandlerUtility.add_to_telemetery_data("snapshotLatencyHistogram", latency_histogram)
+                if(len(latencies) > 0):
+                    HandlerUtil.HandlerUtility.add_to_telemetery_data("snapshotLatencyMax", str(max(latencies)))
+
+                all_snapshots_failed = all_failed
+                self.logger.log("Setting all_snapshots_failed to " + str(all_snapshots_failed))
 
                 return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
             else:
@@ -272,6 +314,7 @@ class GuestSnapshotter(object):
             errorMsg = " Unable to perform parallel snapshot with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
             self.logger.log(errorMsg)
             exceptOccurred = True
+            connection_cache.close_all()
             return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
 
 
@@ -296,14 +296,9 @@ def daemon():
         if(freezer.mounts is not None):
             hutil.partitioncount = len(freezer.mounts.mounts)
         backup_logger.log(" configfile " + str(configfile), True)
-        config = ConfigParsers.ConfigParser()
-        config.read(configfile)
-        if config.has_option('SnapshotThread','timeout'):
-            thread_timeout= config.get('SnapshotThread','timeout')      
-        if config.has_option('SnapshotThread','OnAppFailureDoFsFreeze'):
-            OnAppFailureDoFsFreeze= config.get('SnapshotThread','OnAppFailureDoFsFreeze')
-        if config.has_option('SnapshotThread','OnAppSuccessDoFsFreeze'):
-            OnAppSuccessDoFsFreeze= config.get('SnapshotThread','OnAppSuccessDoFsFreeze')
+        thread_timeout = hutil.get_strvalue_from_configfile('timeout', thread_timeout)
+        OnAppFailureDoFsFreeze = hutil.get_strvalue_from_configfile('OnAppFailureDoFsFreeze', OnAppFailureDoFsFreeze)
+        OnAppSuccessDoFsFreeze = hutil.get_strvalue_from_configfile('OnAppSuccessDoFsFreeze', OnAppSuccessDoFsFreeze)
     except Exception as e:
         errMsg='cannot read config file or file not present'
         backup_logger.log(errMsg, True, 'Warning')
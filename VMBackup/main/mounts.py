@@ -22,7 +22,9 @@ import re
 import sys
 import subprocess
 import types
+import traceback
 from Utils.DiskUtil import DiskUtil
+from Utils.BlockDeviceInventory import BlockDeviceInventory
 
 class Error(Exception): 
     pass
@@ -38,61 +40,65 @@ class Mount:
 class Mounts:
     def __init__(self,patching,logger):
         self.mounts = []
-        added_mount_point_names = [] 
-        disk_util = DiskUtil(patching,logger)
-        # Get mount points 
-        mount_points, mount_points_info = disk_util.get_mount_points() 
-        # Get lsblk devices 
-        self.device_items = disk_util.get_device_items(None)
-        lsblk_mounts = [] 
-        lsblk_mount_points = []
-        lsblk_unique_names = []
-        lsblk_fs_types = []
+        added_mount_point_names = set()
+        added_mount_point_names_ordered = []
+        try:
+            inventory = BlockDeviceInventory.get_instance(logger)
+            mount_points, mount_points_info = inventory.get_mount_points()
+            self.device_items = inventory.get_device_items()
+        except Exception as e:
+            logger.log("Failed to read the block device inventory, falling back to mount and lsblk, error " + str(e) + ", stack trace: " + traceback.format_exc(), True, 'Warning')
+            disk_util = DiskUtil(patching,logger)
+            # Get mount points 
+            mount_points, mount_points_info = disk_util.get_mount_points() 
+            # Get lsblk devices 
+            self.device_items = disk_util.get_device_items(None)
+        mount_points_set = set(mount_points)
+        # lsblk mounts indexed by unique name and by mount point (first one wins, as list.index did)
+        lsblk_mounts_by_unique_name = {}
+        lsblk_mounts_by_mount_point = {}
         # List to hold mount-points returned from lsblk command but not reurned from mount command 
-        lsblk_mounts_not_in_mount = [] 
+        lsblk_mounts_not_in_mount = set()
         for device_item in self.device_items:
             mount = Mount(device_item.name, device_item.type, device_item.file_system, device_item.mount_point)
-            lsblk_mounts.append(mount)
             logger.log("lsblk mount point "+str(mount.mount_point)+" added with device-name "+str(mount.name)+" and fs type "+str(mount.fstype)+", unique-name "+str(mount.unique_name), True)
-            lsblk_mount_points.append(device_item.mount_point)
-            lsblk_unique_names.append(mount.unique_name)
-            lsblk_fs_types.append(device_item.file_system)
-            # If lsblk mount is not found in "mount command" mount-list, add it to the lsblk_mounts_not_in_mount array
-            if((device_item.mount_point not in mount_points) and (device_item.mount_point not in lsblk_mounts_not_in_mount)):
-                lsblk_mounts_not_in_mount.append(device_item.mount_point)
-        # Sort lsblk_mounts_not_in_mount array in ascending order
-        lsblk_mounts_not_in_mount.sort()
+            if mount.unique_name not in lsblk_mounts_by_unique_name:
+                lsblk_mounts_by_unique_name[mount.unique_name] = mount
+            if mount.mount_point not in lsblk_mounts_by_mount_point:
+                lsblk_mounts_by_mount_point[mount.mount_point] = mount
+            # If lsblk mount is not found in "mount command" mount-list, add it to the lsblk_mounts_not_in_mount set
+            if(device_item.mount_point not in mount_points_set):
+                lsblk_mounts_not_in_mount.add(device_item.mount_point)
         # Add the lsblk devices in the same order as they are returned in mount command output
         for mount_point_info in mount_points_info:
             mountPoint = mount_point_info[0]
             deviceNameParts = mount_point_info[1].split("/")
             uniqueName = str(mountPoint) + "_" + str(deviceNameParts[len(deviceNameParts)-1])
             fsType = mount_point_info[2]
-            if((mountPoint in lsblk_mount_points) and (mountPoint not in added_mount_point_names)):
+            if((mountPoint in lsblk_mounts_by_mount_point) and (mountPoint not in added_mount_point_names)):
                 if (self.should_skip_fstype(str(fsType))):
                     logger.log("######## mounts list item Skipped due to fsType, mountPoint "+str(mountPoint)+", fsType "+str(fsType)+" and unique-name "+str(uniqueName), True)
                 else:
-                    lsblk_mounts_index = 0
-                    try:
-                        lsblk_mounts_index = lsblk_unique_names.index(uniqueName)
-                    except ValueError as e:
+                    mountObj = lsblk_mounts_by_unique_name.get(uniqueName)
+                    if mountObj is None:
                         logger.log("######## UniqueName not found in lsblk list :" + str(uniqueName), True)
-                        lsblk_mounts_index = lsblk_mount_points.index(mountPoint)
-                    mountObj = lsblk_mounts[lsblk_mounts_index]
+                        mountObj = lsblk_mounts_by_mount_point[mountPoint]
                     if(mountObj.fstype is None or mountObj.fstype == "" or mountObj.fstype == " "):
                         logger.log("fstype empty from lsblk for mount" + str(mountPoint), True)
                         mountObj.fstype = fsType
                     self.mounts.append(mountObj)
-                    added_mount_point_names.append(mountPoint)
+                    added_mount_point_names.add(mountPoint)
+                    added_mount_point_names_ordered.append(mountPoint)
                     logger.log("mounts list item added, mount point "+str(mountObj.mount_point)+", device-name "+str(mountObj.name)+", fs-type "+str(mountObj.fstype)+", unique-name "+str(mountObj.unique_name), True)
-        # Append all the lsblk devices corresponding to lsblk_mounts_not_in_mount list mount-points
-        for mount_point in lsblk_mounts_not_in_mount:
-            if((mount_point in lsblk_mount_points) and (mount_point not in added_mount_point_names)):
-                self.mounts.append(lsblk_mounts[lsblk_mount_points.index(mount_point)])
-                added_mount_point_names.append(mount_point)
+        # Append all the lsblk devices corresponding to lsblk_mounts_not_in_mount list mount-points, in ascending order
+        for mount_point in sorted(lsblk_mounts_not_in_mount):
+            if((mount_point in lsblk_mounts_by_mount_point) and (mount_point not in added_mount_point_names)):
+                self.mounts.append(lsblk_mounts_by_mount_point[mount_point])
+                added_mount_point_names.add(mount_point)
+                added_mount_point_names_ordered.append(mount_point)
                 logger.log("mounts list item added from lsblk_mounts_not_in_mount, mount point "+str(mount_point), True)
-        added_mount_point_names.reverse()
-        logger.log("added_mount_point_names :" + str(added_mount_point_names), True)
+        added_mount_point_names_ordered.reverse()
+        logger.log("added_mount_point_names :" + str(added_mount_point_names_ordered), True)
         # Reverse the mounts list
         self.mounts.reverse()
 
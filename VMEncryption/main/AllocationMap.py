@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import json
+import os
+import os.path
+import re
+from CommandExecutor import CommandExecutor, ProcessCommunicator
+from Common import CommonVariables
+
+
+class AllocationMap(object):
+    """
+    The free space of a file system, as byte ranges of its device. The in
+    place copy skips the slices that are entirely free. The map is read once,
+    before the device is touched, and saved next to the ongoing item config so
+    a resumed copy skips exactly the same slices.
+    """
+    def __init__(self, free_ranges):
+        # sorted, merged (start, end) byte ranges, end excluded
+        self.free_ranges = free_ranges
+        self.free_range_starts = [start for start, end in free_ranges]
+
+    @staticmethod
+    def from_dumpe2fs_output(output):
+        """
+        dumpe2fs prints the block size in the header and the free blocks of
+        each group, e.g. '  Free blocks: 7897-8192, 8200'.
+        """
+        block_size = None
+        free_blocks = []
+        for line in output.splitlines():
+            if line.startswith('Block size:'):
+                block_size = int(line.split(':', 1)[1])
+            elif line.startswith(' ') and line.strip().startswith('Free blocks:'):
+                for block_range in line.split(':', 1)[1].split(','):
+                    block_range = block_range.strip()
+                    if not block_range:
+                        continue
+                    match = re.match(r'^(\d+)(?:-(\d+))?$', block_range)
+                    if match is None:
+                        raise ValueError("unexpected free blocks: {0}".format(line))
+                    first_block = int(match.group(1))
+                    last_block = int(match.group(2)) if match.group(2) else first_block
+                    free_blocks.append((first_block, last_block + 1))
+        if block_size is None:
+            raise ValueError("the block size is missing in the dumpe2fs output")
+
+        free_ranges = []
+        for start, end in sorted(free_blocks):
+            if free_ranges and free_ranges[-1][1] >= start * block_size:
+                free_ranges[-1] = (free_ranges[-1][0], max(free_ranges[-1][1], end * block_size))
+            else:
+                free_ranges.append((start * block_size, end * block_size))
+        return AllocationMap(free_ranges)
+
+    @staticmethod
+    def from_file_system(logger, patching, dev_path, file_system):
+        """ the allocation map of an unmounted file system, None when it can not be read """
+        if file_system is None or file_system.lower() not in CommonVariables.inplace_supported_file_systems:
+            logger.log(msg="no allocation map for the {0} file system of {1}, copying all of it".format(file_system, dev_path),
+                       level=CommonVariables.WarningLevel)
+            return None
+        proc_comm = ProcessCommunicator()
+        return_code = CommandExecutor(logger).Execute(patching.dumpe2fs_path + ' ' + dev_path,
+                                                      communicator=proc_comm,
+                                                      suppress_logging=True)
+        if return_code != CommonVariables.process_success:
+            logger.log(msg="dumpe2fs {0} failed with {1}, copying all of it".format(dev_path, return_code),
+                       level=CommonVariables.WarningLevel)
+            return None
+        try:
+            allocation_map = AllocationMap.from_dumpe2fs_output(proc_comm.stdout)
+        except ValueError as e:
+            logger.log(msg="parsing the free blocks of {0} failed: {1}, copying all of it".format(dev_path, e),
+                       level=CommonVariables.WarningLevel)
+            return None
+        logger.log("{0} has {1} bytes free in {2} ranges".format(dev_path, allocation_map.get_free_size(), len(allocation_map.free_ranges)))
+        return allocation_map
+
+    def get_free_size(self):
+        return sum(end - start for start, end in self.free_ranges)
+
+    def is_unallocated(self, offset, length):
+        index = bisect.bisect_right(self.free_range_starts, offset) - 1
+        return index >= 0 and self.free_ranges[index][1] >= offset + length
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'free_ranges': self.free_ranges}, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def load(path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            free_ranges = json.load(f)['free_ranges']
+        return AllocationMap([(start, end) for start, end in free_ranges])
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import os
+import os.path
+import re
+import threading
+import time
+from Common import CommonVariables, DeviceItem
+
+
+class BlockDevice(DeviceItem):
+    def __init__(self):
+        super(BlockDevice, self).__init__()
+        self.kernel_name = None
+        self.parent = None
+        self.holders = []
+        self.slaves = []
+        # False when udev has no data for the device, its file system is unknown
+        self.udev_data_found = False
+
+
+class BlockDeviceCache(object):
+    """
+    The block devices as lsblk shows them, read from /sys/class/block, the
+    udev database, /dev/disk/by-* and /proc/mounts without forking. The
+    devices are read once and kept until invalidate(), callers invalidate
+    after they changed a device (format, luksOpen, mount...), and the cache
+    expires after max_age seconds for the changes made by others.
+    root is the root of the captured trees for the tests.
+    """
+    def __init__(self, logger, root='/', max_age=CommonVariables.device_cache_max_age_seconds):
+        self.logger = logger
+        self.root = root
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.devices = None
+        self.read_time = None
+
+    def get_path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def invalidate(self):
+        with self.lock:
+            self.devices = None
+
+    def is_available(self):
+        return os.path.isdir(self.get_path('/sys/class/block'))
+
+    def get_devices(self):
+        """ {kernel name: BlockDevice}, None without sysfs """
+        with self.lock:
+            if self.devices is None or time.time() - self.read_time >= self.max_age:
+                if not self.is_available():
+                    return None
+                self.devices = self.read_devices()
+                self.read_time = time.time()
+            return self.devices
+
+    def get_kernel_name(self, dev_path):
+        """ sdc1 for /dev/sdc1, /dev/disk/by-uuid/..., /dev/mapper/... or /dev/vg/lv """
+        path = self.get_path(dev_path)
+        if not os.path.exists(path):
+            return None
+        path = os.path.realpath(path)
+        if os.path.dirname(path) != os.path.realpath(self.get_path('/dev')):
+            return None
+        return os.path.basename(path)
+
+    def get_device_by_path(self, dev_path):
+        devices = self.get_devices()
+        if devices is None or not dev_path:
+            return None
+        return devices.get(self.get_kernel_name(dev_path))
+
+    def get_device(self, dev_name):
+        """ the device by name, like DiskUtil.get_device_path: sdc, a mapper name or vg/lv """
+        for dev_path in ['/dev/' + dev_name, CommonVariables.dev_mapper_root + dev_name]:
+            device = self.get_device_by_path(dev_path)
+            if device is not None:
+                return device
+        return None
+
+    def get_device_items(self, dev_path):
+        """
+        copies of the devices lsblk lists for dev_path, the device and the
+        devices on it, or of all devices for None. None when a device is not
+        known to udev yet, the caller asks lsblk then.
+        """
+        devices = self.get_devices()
+        if devices is None:
+            return None
+        if dev_path is None:
+            roots = sorted(name for name, device in devices.items() if device.parent is None and not device.slaves)
+        else:
+            kernel_name = self.get_kernel_name(dev_path)
+            if kernel_name not in devices:
+                return None
+            roots = [kernel_name]
+
+        device_items = []
+        visited = set()
+
+        def visit(kernel_name):
+            if kernel_name in visited or kernel_name not in devices:
+                return
+            visited.add(kernel_name)
+            device_items.append(devices[kernel_name])
+            children = sorted(name for name, device in devices.items() if device.parent == kernel_name)
+            for child in children + devices[kernel_name].holders:
+                visit(child)
+
+        for root in roots:
+            visit(root)
+        if dev_path is None:
+            for kernel_name in sorted(devices):
+                visit(kernel_name)
+
+        if not all(device.udev_data_found for device in device_items):
+            return None
+        return [copy.copy(device) for device in device_items]
+
+    def has_holders(self, dev_path, device_type):
+        """ True when devices of device_type are on dev_path, None when the cache can not tell """
+        devices = self.get_devices()
+        if devices is None:
+            return None
+        kernel_name = self.get_kernel_name(dev_path)
+        if kernel_name not in devices:
+            return None
+        return any(devices[holder].type == device_type for holder in devices[kernel_name].holders if holder in devices)
+
+    def read_devices(self):
+        class_block_path = self.get_path('/sys/class/block')
+        devices = {}
+        for kernel_name in os.listdir(class_block_path):
+            try:
+                devices[kernel_name] = self.read_device(os.path.join(class_block_path, kernel_name), kernel_name)
+            except (IOError, OSError) as e:
+                # the device went away while reading it
+                self.logger.log(msg="reading the sysfs of {0} failed: {1}".format(kernel_name, e),
+                                level=CommonVariables.WarningLevel)
+
+        mount_points = self.read_mount_points()
+        symlinks = self.read_disk_symlinks()
+        for kernel_name, device in devices.items():
+            device.mount_point = mount_points.get(kernel_name, '')
+            device.uuid = device.uuid or symlinks['by-uuid'].get(kernel_name, '')
+            device.label = device.label or symlinks['by-label'].get(kernel_name, '')
+        return devices
+
+    def read_device(self, sys_path, kernel_name):
+        device = BlockDevice()
+        device.kernel_name = kernel_name
+        device.name = kernel_name
+        uevent = self.read_properties(os.path.join(sys_path, 'uevent'))
+        device.majmin = '{0}:{1}'.format(uevent['MAJOR'], uevent['MINOR'])
+        device.size = int(self.read_attribute(sys_path, 'size')) * CommonVariables.sector_size
+        device.holders = sorted(os.listdir(os.path.join(sys_path, 'holders')))
+        device.slaves = sorted(os.listdir(os.path.join(sys_path, 'slaves'))) if os.path.isdir(os.path.join(sys_path, 'slaves')) else []
+        device.model = self.read_attribute(sys_path, 'device/model') or ''
+        device.device_id = self.read_device_id(sys_path)
+
+        dm_uuid = self.read_attribute(sys_path, 'dm/uuid')
+        md_level = self.read_attribute(sys_path, 'md/level')
+        if uevent.get('DEVTYPE') == 'partition':
+            device.parent = os.path.basename(os.path.dirname(os.path.realpath(sys_path)))
+            device.type = 'part'
+        elif dm_uuid is not None:
+            device.name = self.read_attribute(sys_path, 'dm/name')
+            if dm_uuid.startswith('CRYPT-'):
+                device.type = 'crypt'
+            elif dm_uuid.startswith('LVM-'):
+                device.type = 'lvm'
+                device.name = self.get_lvm_name(device.name)
+            elif dm_uuid.startswith('mpath-'):
+                device.type = 'mpath'
+            else:
+                device.type = 'dm'
+        elif md_level:
+            device.type = md_level
+        elif kernel_name.startswith('loop'):
+            device.type = 'loop'
+        elif self.read_attribute(sys_path, 'device/type') == '5':
+            device.type = 'rom'
+        else:
+            device.type = 'disk'
+
+        udev_data_path = self.get_path('/run/udev/data/b' + device.majmin)
+        device.udev_data_found = os.path.exists(udev_data_path)
+        udev_properties = {}
+        if device.udev_data_found:
+            with open(udev_data_path, 'r') as f:
+                for line in f:
+                    if line.startswith('E:') and '=' in line:
+                        key, value = line[2:].rstrip('\n').split('=', 1)
+                        udev_properties[key] = value
+        device.file_system = udev_properties.get('ID_FS_TYPE', '')
+        device.uuid = self.decode(udev_properties.get('ID_FS_UUID_ENC', udev_properties.get('ID_FS_UUID', '')))
+        device.label = self.decode(udev_properties.get('ID_FS_LABEL_ENC', udev_properties.get('ID_FS_LABEL', '')))
+        return device
+
+    def read_attribute(self, sys_path, name):
+        path = os.path.join(sys_path, name)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as f:
+            return f.read().strip()
+
+    def read_properties(self, path):
+        properties = {}
+        with open(path, 'r') as f:
+            for line in f:
+                if '=' in line:
+                    key, value = line.strip().split('=', 1)
+                    properties[key] = value
+        return properties
+
+    def read_device_id(self, sys_path):
+        """ the vmbus device_id of the disk, what 'udevadm info -a' shows of the parents """
+        devices_root = os.path.realpath(self.get_path('/sys/devices'))
+        path = os.path.realpath(sys_path)
+        while path.startswith(devices_root + os.sep):
+            device_id = self.read_attribute(path, 'device_id')
+            if device_id is not None:
+                match = re.findall(r'{(.*)}', device_id)
+                return match[0] if match else ''
+            path = os.path.dirname(path)
+        return ''
+
+    def get_lvm_name(self, dm_name):
+        """ vg/lv of the dm name vg-lv, lvm doubles the dashes in the names """
+        match = re.match(r'^((?:[^-]|--)+)-((?:[^-]|--)+)$', dm_name)
+        if match is None:
+            return dm_name
+        return match.group(1).replace('--', '-') + '/' + match.group(2).replace('--', '-')
+
+    def decode(self, value):
+        """ udev encodes the unsafe characters as \\xNN """
+        return re.sub(r'\\x([0-9a-fA-F]{2})', lambda match: chr(int(match.group(1), 16)), value)
+
+    def read_mount_points(self):
+        """ the first mount point of each device, [SWAP] for swap devices, like lsblk """
+        mount_points = {}
+
+        def unescape(value):
+            return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), value)
+
+        swaps_path = self.get_path('/proc/swaps')
+        if os.path.exists(swaps_path):
+            with open(swaps_path, 'r') as f:
+                for line in f.readlines()[1:]:
+                    fields = line.split()
+                    if fields and fields[0].startswith('/dev/'):
+                        kernel_name = self.get_kernel_name(unescape(fields[0]))
+                        if kernel_name is not None:
+                            mount_points.setdefault(kernel_name, '[SWAP]')
+        with open(self.get_path('/proc/mounts'), 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 1 and fields[0].startswith('/dev/'):
+                    kernel_name = self.get_kernel_name(unescape(fields[0]))
+                    if kernel_name is not None:
+                        mount_points.setdefault(kernel_name, unescape(fields[1]))
+        return mount_points
+
+    def read_disk_symlinks(self):
+        """ {'by-uuid': {kernel name: uuid}, 'by-label': {kernel name: label}} """
+        symlinks = {}
+        for link_type in ['by-uuid', 'by-label']:
+            symlinks[link_type] = {}
+            link_dir = self.get_path('/dev/disk/' + link_type)
+            if not os.path.isdir(link_dir):
+                continue
+            for link in sorted(os.listdir(link_dir)):
+                kernel_name = self.get_kernel_name(os.path.join('/dev/disk', link_type, link))
+                if kernel_name is not None:
+                    symlinks[link_type].setdefault(kernel_name, self.decode(link))
+        return symlinks
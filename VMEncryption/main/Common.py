@@ -33,6 +33,18 @@ class CommonVariables:
     sector_size = 512
     luks_header_size = 4096 * 512
     default_block_size = 52428800
+    # slices read ahead while the previous ones are written, 1 copies them one by one
+    copy_queue_depth = 2
+    # the slice index is committed every copy_checkpoint_slices slices, copy_checkpoint_seconds seconds
+    # or before the backup of the uncommitted slices grows over copy_checkpoint_bytes, whichever comes first
+    copy_checkpoint_slices = 64
+    copy_checkpoint_seconds = 30
+    copy_checkpoint_bytes = 268435456
+    copy_status_report_seconds = 30
+    # data volumes encrypted in place at the same time, each copy holds copy_queue_depth slices in memory
+    default_encryption_concurrency = 2
+    # the block devices read from sysfs are read again after this long, or when DiskUtil changed one
+    device_cache_max_age_seconds = 60
     min_filesystem_size_support = 52428800 * 3
     #TODO for the sles 11, we should use the ext3
     default_file_system = 'ext4'
@@ -70,6 +82,8 @@ class CommonVariables:
     AADClientSecretKey = 'AADClientSecret'
     SecretUriKey = 'SecretUri'
     SecretSeqNum = 'SecretSeqNum'
+    EncryptionConcurrencyKey = 'EncryptionConcurrency'
+    SkipUnallocatedBlocksKey = 'SkipUnallocatedBlocks'
 
     VolumeTypeOS = 'OS'
     VolumeTypeData = 'Data'
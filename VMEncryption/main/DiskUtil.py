@@ -23,6 +23,7 @@ import os.path
 import re
 from subprocess import Popen
 import shutil
+import threading
 import traceback
 import uuid
 import glob
@@ -32,6 +33,7 @@ from EncryptionConfig import EncryptionConfig
 from DecryptionMarkConfig import DecryptionMarkConfig
 from EncryptionMarkConfig import EncryptionMarkConfig
 from TransactionalCopyTask import TransactionalCopyTask
+from BlockDeviceCache import BlockDeviceCache
 from CommandExecutor import CommandExecutor, ProcessCommunicator
 from Common import CommonVariables, CryptItem, LvmItem, DeviceItem
 
@@ -40,6 +42,11 @@ class DiskUtil(object):
     os_disk_lvm = None
     sles_cache = {}
     device_id_cache = {}
+    # devices encrypted in parallel share crypttab, azure_crypt_mount and fstab
+    config_files_lock = threading.RLock()
+    # the block devices read from sysfs, shared by all the DiskUtil of the process
+    device_cache = None
+    device_cache_lock = threading.Lock()
 
     def __init__(self, hutil, patching, logger, encryption_environment):
         self.encryption_environment = encryption_environment
@@ -50,33 +57,43 @@ class DiskUtil(object):
         self.vmbus_sys_path = '/sys/bus/vmbus/devices'
 
         self.command_executor = CommandExecutor(self.logger)
+        with DiskUtil.device_cache_lock:
+            if DiskUtil.device_cache is None:
+                DiskUtil.device_cache = BlockDeviceCache(self.logger)
 
-    def copy(self, ongoing_item_config, status_prefix=''):
+    def invalidate_device_cache(self):
+        """
+        Forgets the block devices, their properties and mount points read so far.
+        Call it after changing a device outside of the DiskUtil methods that do.
+        """
+        DiskUtil.device_cache.invalidate()
+        DiskUtil.sles_cache.clear()
+
+    def copy(self, ongoing_item_config, status_prefix='', allocation_map=None, destination_shift=0):
         copy_task = TransactionalCopyTask(logger=self.logger,
                                           disk_util=self,
                                           hutil=self.hutil,
                                           ongoing_item_config=ongoing_item_config,
                                           patching=self.distro_patcher,
                                           encryption_environment=self.encryption_environment,
-                                          status_prefix=status_prefix)
+                                          status_prefix=status_prefix,
+                                          allocation_map=allocation_map,
+                                          destination_shift=destination_shift)
         try:
-            mem_fs_result = copy_task.prepare_mem_fs()
-            if mem_fs_result != CommonVariables.process_success:
-                return CommonVariables.tmpfs_error
-            else:
-                return copy_task.begin_copy()
+            return copy_task.begin_copy()
         except Exception as e:
-            message = "Failed to perform dd copy: {0}, stack trace: {1}".format(e, traceback.format_exc())
+            message = "Failed to perform the copy: {0}, stack trace: {1}".format(e, traceback.format_exc())
             self.logger.log(msg=message, level=CommonVariables.ErrorLevel)
-        finally:
-            copy_task.clear_mem_fs()
+            return CommonVariables.copy_data_error
 
     def format_disk(self, dev_path, file_system):
         mkfs_command = ""
         if file_system in CommonVariables.format_supported_file_systems:
             mkfs_command = "mkfs." + file_system
         mkfs_cmd = "{0} {1}".format(mkfs_command, dev_path)
-        return self.command_executor.Execute(mkfs_cmd)
+        return_code = self.command_executor.Execute(mkfs_cmd)
+        self.invalidate_device_cache()
+        return return_code
 
     def make_sure_path_exists(self, path):
         mkdir_cmd = self.distro_patcher.mkdir_path + ' -p ' + path
@@ -239,10 +256,11 @@ class DiskUtil(object):
         return non_os_entry_found
 
     def add_crypt_item(self, crypt_item, key_file_path):
-        if self.should_use_azure_crypt_mount():
-            return self.add_crypt_item_to_azure_crypt_mount(crypt_item)
-        else:
-            return self.add_crypt_item_to_crypttab(crypt_item, key_file_path)
+        with DiskUtil.config_files_lock:
+            if self.should_use_azure_crypt_mount():
+                return self.add_crypt_item_to_azure_crypt_mount(crypt_item)
+            else:
+                return self.add_crypt_item_to_crypttab(crypt_item, key_file_path)
 
     def add_crypt_item_to_crypttab(self, crypt_item, key_file):
         if key_file is None and crypt_item.uses_cleartext_key:
@@ -296,42 +314,44 @@ class DiskUtil(object):
             return False
 
     def remove_crypt_item(self, crypt_item):
-        try:
-            if self.should_use_azure_crypt_mount():
-                crypt_file_path = self.encryption_environment.azure_crypt_mount_config_path
-                crypt_line_parser = self.parse_azure_crypt_mount_line
-            elif os.path.exists("/etc/crypttab"):
-                crypt_file_path = "/etc/crypttab"
-                crypt_line_parser = self.parse_crypttab_line
-            else:
-                return True
+        with DiskUtil.config_files_lock:
+            try:
+                if self.should_use_azure_crypt_mount():
+                    crypt_file_path = self.encryption_environment.azure_crypt_mount_config_path
+                    crypt_line_parser = self.parse_azure_crypt_mount_line
+                elif os.path.exists("/etc/crypttab"):
+                    crypt_file_path = "/etc/crypttab"
+                    crypt_line_parser = self.parse_crypttab_line
+                else:
+                    return True
 
-            filtered_mount_lines = []
-            with open(crypt_file_path, 'r') as f:
-                self.logger.log("removing an entry from {0}".format(crypt_file_path))
-                for line in f:
-                    if not line.strip():
-                        continue
+                filtered_mount_lines = []
+                with open(crypt_file_path, 'r') as f:
+                    self.logger.log("removing an entry from {0}".format(crypt_file_path))
+                    for line in f:
+                        if not line.strip():
+                            continue
 
-                    parsed_crypt_item = crypt_line_parser(line)
-                    if parsed_crypt_item is not None and parsed_crypt_item.mapper_name == crypt_item.mapper_name:
-                        self.logger.log("Removing crypt mount entry: {0}".format(line))
-                        continue
+                        parsed_crypt_item = crypt_line_parser(line)
+                        if parsed_crypt_item is not None and parsed_crypt_item.mapper_name == crypt_item.mapper_name:
+                            self.logger.log("Removing crypt mount entry: {0}".format(line))
+                            continue
 
-                    filtered_mount_lines.append(line)
+                        filtered_mount_lines.append(line)
 
-            with open(crypt_file_path, 'w') as wf:
-                wf.write(''.join(filtered_mount_lines))
+                with open(crypt_file_path, 'w') as wf:
+                    wf.write(''.join(filtered_mount_lines))
 
-            return True
+                return True
 
-        except Exception as e:
-            return False
+            except Exception as e:
+                return False
 
     def update_crypt_item(self, crypt_item, key_file_path):
-        self.logger.log("Updating entry for crypt item {0}".format(crypt_item))
-        self.remove_crypt_item(crypt_item)
-        self.add_crypt_item(crypt_item, key_file_path)
+        with DiskUtil.config_files_lock:
+            self.logger.log("Updating entry for crypt item {0}".format(crypt_item))
+            self.remove_crypt_item(crypt_item)
+            self.add_crypt_item(crypt_item, key_file_path)
 
     def migrate_crypt_items(self, passphrase_file):
         crypt_items = self.get_crypt_items()
@@ -437,14 +457,18 @@ class DiskUtil(object):
             passphrase = proc_comm.stdout
 
             cryptsetup_cmd = "{0} luksFormat {1} -q".format(self.distro_patcher.cryptsetup_path, dev_path)
-            return self.command_executor.Execute(cryptsetup_cmd, input=passphrase)
+            return_code = self.command_executor.Execute(cryptsetup_cmd, input=passphrase)
+            self.invalidate_device_cache()
+            return return_code
         else:
             if header_file is not None:
                 cryptsetup_cmd = "{0} luksFormat {1} --header {2} -d {3} -q".format(self.distro_patcher.cryptsetup_path, dev_path, header_file, passphrase_file)
             else:
                 cryptsetup_cmd = "{0} luksFormat {1} -d {2} -q".format(self.distro_patcher.cryptsetup_path, dev_path, passphrase_file)
             
-            return self.command_executor.Execute(cryptsetup_cmd)
+            return_code = self.command_executor.Execute(cryptsetup_cmd)
+            self.invalidate_device_cache()
+            return return_code
         
     def luks_add_key(self, passphrase_file, dev_path, mapper_name, header_file, new_key_path):
         """
@@ -530,7 +554,9 @@ class DiskUtil(object):
         else:
             cryptsetup_cmd = "{0} luksOpen {1} {2} -d {3} -q".format(self.distro_patcher.cryptsetup_path, dev_path, mapper_name, passphrase_file)
 
-        return self.command_executor.Execute(cryptsetup_cmd)
+        return_code = self.command_executor.Execute(cryptsetup_cmd)
+        self.invalidate_device_cache()
+        return return_code
 
     def luks_close(self, mapper_name):
         """
@@ -539,7 +565,9 @@ class DiskUtil(object):
         self.hutil.log("dev mapper name to cryptsetup luksOpen " + (mapper_name))
         cryptsetup_cmd = "{0} luksClose {1} -q".format(self.distro_patcher.cryptsetup_path, mapper_name)
 
-        return self.command_executor.Execute(cryptsetup_cmd)
+        return_code = self.command_executor.Execute(cryptsetup_cmd)
+        self.invalidate_device_cache()
+        return return_code
 
     # TODO error handling.
     def append_mount_info(self, dev_path, mount_point):
@@ -573,46 +601,47 @@ class DiskUtil(object):
         return fstab_device, fstab_mount_point
 
     def modify_fstab_entry_encrypt(self, mount_point, mapper_path):
-        self.logger.log("modify_fstab_entry_encrypt called with mount_point={0}, mapper_path={1}".format(mount_point, mapper_path))
+        with DiskUtil.config_files_lock:
+            self.logger.log("modify_fstab_entry_encrypt called with mount_point={0}, mapper_path={1}".format(mount_point, mapper_path))
 
-        if not mount_point:
-            self.logger.log("modify_fstab_entry_encrypt: mount_point is empty")
-            return
+            if not mount_point:
+                self.logger.log("modify_fstab_entry_encrypt: mount_point is empty")
+                return
 
-        shutil.copy2('/etc/fstab', '/etc/fstab.backup.' + str(str(uuid.uuid4())))
+            shutil.copy2('/etc/fstab', '/etc/fstab.backup.' + str(str(uuid.uuid4())))
 
-        with open('/etc/fstab', 'r') as f:
-            lines = f.readlines()
+            with open('/etc/fstab', 'r') as f:
+                lines = f.readlines()
 
-        relevant_line = None
-        for i in range(len(lines)):
-            line = lines[i]
-            fstab_device, fstab_mount_point = self.parse_fstab_line(line)
-            if fstab_mount_point != mount_point:  # Not the line we are looking for
-                continue
+            relevant_line = None
+            for i in range(len(lines)):
+                line = lines[i]
+                fstab_device, fstab_mount_point = self.parse_fstab_line(line)
+                if fstab_mount_point != mount_point:  # Not the line we are looking for
+                    continue
 
-            self.logger.log("Found the relevant fstab line: " + line)
-            relevant_line = line
+                self.logger.log("Found the relevant fstab line: " + line)
+                relevant_line = line
 
-            if self.should_use_azure_crypt_mount():
-                # in this case we just remove the line
-                lines.pop(i)
-                break
-            else:
-                new_line = relevant_line.replace(fstab_device, mapper_path)
-                self.logger.log("Replacing that line with: " + new_line)
-                lines[i] = new_line
-                break
+                if self.should_use_azure_crypt_mount():
+                    # in this case we just remove the line
+                    lines.pop(i)
+                    break
+                else:
+                    new_line = relevant_line.replace(fstab_device, mapper_path)
+                    self.logger.log("Replacing that line with: " + new_line)
+                    lines[i] = new_line
+                    break
 
-        if not self.is_bek_in_fstab_file(lines):
-            lines.append(self.get_fstab_bek_line())
+            if not self.is_bek_in_fstab_file(lines):
+                lines.append(self.get_fstab_bek_line())
 
-        with open('/etc/fstab', 'w') as f:
-            f.writelines(lines)
+            with open('/etc/fstab', 'w') as f:
+                f.writelines(lines)
 
-        if relevant_line is not None:
-            with open('/etc/fstab.azure.backup', 'a+') as f:
-                f.write("\n" + relevant_line)
+            if relevant_line is not None:
+                with open('/etc/fstab.azure.backup', 'a+') as f:
+                    f.write("\n" + relevant_line)
 
     def get_fstab_bek_line(self):
         if self.distro_patcher.distro_info[0].lower() == 'ubuntu' and self.distro_patcher.distro_info[1].startswith('14'):
@@ -713,14 +742,18 @@ class DiskUtil(object):
         """
         self.make_sure_path_exists(mount_point)
         mount_cmd = self.distro_patcher.mount_path + ' -L "' + bek_label + '" ' + mount_point + ' -o ' + option_string
-        return self.command_executor.Execute(mount_cmd)
+        return_code = self.command_executor.Execute(mount_cmd)
+        self.invalidate_device_cache()
+        return return_code
 
     def mount_auto(self, dev_path_or_mount_point):
         """
         mount the file system via fstab entry
         """
         mount_cmd = self.distro_patcher.mount_path + ' ' + dev_path_or_mount_point
-        return self.command_executor.Execute(mount_cmd)
+        return_code = self.command_executor.Execute(mount_cmd)
+        self.invalidate_device_cache()
+        return return_code
 
     def mount_filesystem(self, dev_path, mount_point, file_system=None):
         """
@@ -732,7 +765,9 @@ class DiskUtil(object):
         else: 
             mount_cmd = self.distro_patcher.mount_path + ' ' + dev_path + ' ' + mount_point + ' -t ' + file_system
 
-        return self.command_executor.Execute(mount_cmd)
+        return_code = self.command_executor.Execute(mount_cmd)
+        self.invalidate_device_cache()
+        return return_code
 
     def mount_crypt_item(self, crypt_item, passphrase):
         self.logger.log("trying to mount the crypt item:" + str(crypt_item))
@@ -744,11 +779,15 @@ class DiskUtil(object):
             self.logger.log("mount file system result:{0}".format(mount_filesystem_result))
 
     def swapoff(self):
-        return self.command_executor.Execute('swapoff -a')
+        return_code = self.command_executor.Execute('swapoff -a')
+        self.invalidate_device_cache()
+        return return_code
 
     def umount(self, path):
         umount_cmd = self.distro_patcher.umount_path + ' ' + path
-        return self.command_executor.Execute(umount_cmd)
+        return_code = self.command_executor.Execute(umount_cmd)
+        self.invalidate_device_cache()
+        return return_code
 
     def umount_all_crypt_items(self):
         for crypt_item in self.get_crypt_items():
@@ -757,7 +796,9 @@ class DiskUtil(object):
 
     def mount_all(self):
         mount_all_cmd = self.distro_patcher.mount_path + ' -a'
-        return self.command_executor.Execute(mount_all_cmd)
+        return_code = self.command_executor.Execute(mount_all_cmd)
+        self.invalidate_device_cache()
+        return return_code
 
     def get_mount_items(self):
         items = []
@@ -790,8 +831,11 @@ class DiskUtil(object):
         osmapper_path = os.path.join(CommonVariables.dev_mapper_root, CommonVariables.osmapper_name)
 
         if self.is_os_disk_lvm():
-            grep_result = self.command_executor.ExecuteInBash('pvdisplay | grep {0}'.format(osmapper_path),
-                                                              suppress_logging=True)
+            if DiskUtil.device_cache.has_holders(osmapper_path, 'lvm'):
+                grep_result = 0
+            else:
+                grep_result = self.command_executor.ExecuteInBash('pvdisplay | grep {0}'.format(osmapper_path),
+                                                                  suppress_logging=True)
             if grep_result == 0 and not os.path.exists('/volumes.lvm'):
                 self.logger.log("OS PV is encrypted")
                 os_drive_encrypted = True
@@ -925,6 +969,10 @@ class DiskUtil(object):
         if (dev_path) in DiskUtil.device_id_cache:
             return DiskUtil.device_id_cache[dev_path]
 
+        device = DiskUtil.device_cache.get_device_by_path(dev_path)
+        if device is not None:
+            return device.device_id
+
         udev_cmd = "udevadm info -a -p $(udevadm info -q path -n {0}) | grep device_id".format(dev_path)
         proc_comm = ProcessCommunicator()
         self.command_executor.ExecuteInBash(udev_cmd, communicator=proc_comm, suppress_logging=True)
@@ -937,6 +985,22 @@ class DiskUtil(object):
         if (dev_name, property_name) in DiskUtil.sles_cache:
             return DiskUtil.sles_cache[(dev_name, property_name)]
 
+        device = DiskUtil.device_cache.get_device(dev_name)
+        if device is not None:
+            cached_properties = {'SIZE': str(device.size),
+                                 'MOUNTPOINT': device.mount_point,
+                                 'LABEL': device.label,
+                                 'UUID': device.uuid,
+                                 'MAJ:MIN': device.majmin,
+                                 'DEVICE_ID': device.device_id,
+                                 'TYPE': device.type,
+                                 'MODEL': device.model}
+            # only udev knows the file system
+            if device.udev_data_found:
+                cached_properties['FSTYPE'] = device.file_system
+            if property_name in cached_properties:
+                return cached_properties[property_name]
+
         self.logger.log("getting property of device {0}".format(dev_name))
 
         device_path = self.get_device_path(dev_name)
@@ -1067,6 +1131,16 @@ class DiskUtil(object):
         return device_items_to_return
 
     def get_device_items(self, dev_path):
+        device_items = DiskUtil.device_cache.get_device_items(dev_path)
+        if device_items is not None:
+            azure_symlinks = self.get_azure_symlinks()
+            for device_item in device_items:
+                device_item.azure_name = ''
+                for symlink, target in azure_symlinks.items():
+                    if device_item.name in target:
+                        device_item.azure_name = symlink
+            return device_items
+
         if self.distro_patcher.distro_info[0].lower() == 'suse' and self.distro_patcher.distro_info[1] == '11':
             return self.get_device_items_sles(dev_path)
         else:
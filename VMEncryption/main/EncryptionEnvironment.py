@@ -16,8 +16,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import os
 import os.path
+import re
 import subprocess
 from subprocess import *
 
@@ -40,9 +42,36 @@ class EncryptionEnvironment(object):
         self.cleartext_key_base_path = os.path.join(self.encryption_config_path, 'cleartext_key')
         self.copy_header_slice_file_path = os.path.join(self.encryption_config_path, 'copy_header_slice_file')
         self.copy_slice_item_backup_file = os.path.join(self.encryption_config_path, 'copy_slice_item.bak')
+        self.copy_allocation_map_file = os.path.join(self.encryption_config_path, 'copy_allocation_map.json')
         self.os_encryption_markers_path = os.path.join(self.encryption_config_path, 'os_encryption_markers')
         self.bek_backup_path = os.path.join(self.encryption_config_path, 'bek_backup')
 
+    def get_device_environment(self, device_name):
+        """
+        the environment of one device when several devices are encrypted in parallel,
+        each device has its own ongoing item config, header slice and slice backup files.
+        """
+        device_id = re.sub(r'[^A-Za-z0-9_.-]', '_', device_name)
+        device_environment = copy.copy(self)
+        device_environment.device_id = device_id
+        device_environment.azure_crypt_ongoing_item_config_path = os.path.join(self.encryption_config_path, 'azure_crypt_ongoing_item_{0}.ini'.format(device_id))
+        device_environment.copy_header_slice_file_path = os.path.join(self.encryption_config_path, 'copy_header_slice_file_{0}'.format(device_id))
+        device_environment.copy_slice_item_backup_file = os.path.join(self.encryption_config_path, 'copy_slice_item_{0}.bak'.format(device_id))
+        device_environment.copy_allocation_map_file = os.path.join(self.encryption_config_path, 'copy_allocation_map_{0}.json'.format(device_id))
+        return device_environment
+
+    def get_ongoing_device_environments(self):
+        """ environments of the devices whose parallel encryption is not finished """
+        prefix = 'azure_crypt_ongoing_item_'
+        suffix = '.ini'
+        device_environments = []
+        if os.path.isdir(self.encryption_config_path):
+            # archived configs have a time stamp after the suffix
+            for file_name in sorted(os.listdir(self.encryption_config_path)):
+                if file_name.startswith(prefix) and file_name.endswith(suffix):
+                    device_environments.append(self.get_device_environment(file_name[len(prefix):-len(suffix)]))
+        return device_environments
+
     def get_se_linux(self):
         proc = Popen([self.patching.getenforce_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         identity, err = proc.communicate()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import traceback
+from Common import CommonVariables
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class AggregatedStatusReporter(object):
+    """
+    Merges the status reports of the devices encrypted in parallel into one
+    extension status. Each device reports through its own DeviceStatusReporter,
+    which stands in for hutil in the DiskUtil of that device.
+    """
+    def __init__(self, hutil, operation, message):
+        self.hutil = hutil
+        self.operation = operation
+        self.message = message
+        self.lock = threading.Lock()
+        self.device_names = []
+        self.device_messages = {}
+        self.done_device_names = set()
+
+    def for_device(self, device_name):
+        with self.lock:
+            self.device_names.append(device_name)
+        return DeviceStatusReporter(self, device_name)
+
+    def device_done(self, device_name):
+        with self.lock:
+            self.done_device_names.add(device_name)
+            self.device_messages.pop(device_name, None)
+            self.report()
+
+    def update(self, device_name, message):
+        with self.lock:
+            self.device_messages[device_name] = message
+            self.report()
+
+    def report(self):
+        messages = ['{0}: {1}'.format(device_name, self.device_messages[device_name])
+                    for device_name in self.device_names if device_name in self.device_messages]
+        message = '{0}, {1}/{2} done'.format(self.message, len(self.done_device_names), len(self.device_names))
+        if messages:
+            message += '; ' + '; '.join(messages)
+        self.hutil.do_status_report(operation=self.operation,
+                                    status=CommonVariables.extension_success_status,
+                                    status_code=str(CommonVariables.success),
+                                    message=message)
+
+
+class DeviceStatusReporter(object):
+    """
+    The hutil of the DiskUtil of one device: status reports go to the
+    aggregated status, log and error to the hutil of the extension, prefixed
+    with the device name since the devices log concurrently.
+    """
+    def __init__(self, aggregated_status_reporter, device_name):
+        self.aggregated_status_reporter = aggregated_status_reporter
+        self.device_name = device_name
+
+    def do_status_report(self, operation, status, status_code, message):
+        self.aggregated_status_reporter.update(self.device_name, message)
+
+    def log(self, message):
+        self.aggregated_status_reporter.hutil.log('{0}: {1}'.format(self.device_name, message))
+
+    def error(self, message):
+        self.aggregated_status_reporter.hutil.error('{0}: {1}'.format(self.device_name, message))
+
+
+class EncryptionScheduler(object):
+    """
+    Runs one job per device on at most concurrency threads. The devices are
+    independent block devices, each with its own ongoing item config, so a
+    failing device does not stop the others.
+    """
+    def __init__(self, logger, concurrency):
+        self.logger = logger
+        self.concurrency = max(1, concurrency)
+
+    def run(self, jobs):
+        """
+        jobs is a list of (device_name, function), returns {device_name: result},
+        a job that raised has no result.
+        """
+        pending = queue.Queue()
+        for job in jobs:
+            pending.put(job)
+        results = {}
+        results_lock = threading.Lock()
+
+        def worker():
+            while True:
+                try:
+                    device_name, function = pending.get_nowait()
+                except queue.Empty:
+                    return
+                self.logger.log("encrypting {0}".format(device_name))
+                try:
+                    result = function()
+                except Exception as e:
+                    self.logger.log(msg="encrypting {0} failed: {1}, stack trace: {2}".format(device_name, e, traceback.format_exc()),
+                                    level=CommonVariables.ErrorLevel)
+                    continue
+                with results_lock:
+                    results[device_name] = result
+
+        workers = []
+        for _ in range(min(self.concurrency, len(jobs))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            workers.append(thread)
+        for thread in workers:
+            thread.join()
+        return results
@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import io
+import mmap
+import os
+import os.path
+import threading
+from Common import CommonVariables
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class AlignedFile(object):
+    """
+    A file or block device opened with O_DIRECT when the kernel allows it.
+    Reads and writes go through page aligned mmap buffers, so O_DIRECT works
+    on python 2 too, where there is no os.pread/os.pwrite. When the file system
+    refuses O_DIRECT (tmpfs, some fuse mounts) the file is used buffered.
+    """
+    def __init__(self, logger, path, flags, mode=0o600):
+        self.logger = logger
+        self.path = path
+        self.flags = flags
+        self.mode = mode
+        self.fd = None
+        self.file = None
+        self.direct = False
+        self.open(hasattr(os, 'O_DIRECT'))
+
+    def open(self, direct):
+        self.close()
+        flags = self.flags
+        if direct:
+            flags |= os.O_DIRECT
+        try:
+            self.fd = os.open(self.path, flags, self.mode)
+        except OSError as e:
+            if not direct or e.errno != errno.EINVAL:
+                raise
+            self.logger.log("O_DIRECT is not supported for {0}, using buffered io".format(self.path))
+            direct = False
+            self.fd = os.open(self.path, self.flags, self.mode)
+        self.direct = direct
+        # closefd=False, the descriptor is closed in close()
+        if self.flags & os.O_RDWR:
+            file_mode = 'r+'
+        elif self.flags & os.O_WRONLY:
+            file_mode = 'w'
+        else:
+            file_mode = 'r'
+        self.file = io.FileIO(self.fd, file_mode, closefd=False)
+
+    def fall_back_to_buffered(self, e):
+        if not self.direct or e.errno != errno.EINVAL:
+            raise e
+        self.logger.log("direct io failed for {0} with {1}, using buffered io".format(self.path, e))
+        self.open(direct=False)
+
+    def read_at(self, offset, buf):
+        """
+        Fills buf with the data at offset, returns the number of bytes read,
+        which is only smaller than len(buf) at the end of the file.
+        """
+        while True:
+            try:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                read = self.file.readinto(buf)
+                break
+            except (IOError, OSError) as e:
+                self.fall_back_to_buffered(e)
+        if read is None:
+            read = 0
+        # a short read is either the end of the file or an interrupted read,
+        # the rest is not aligned anymore so it is read buffered
+        while 0 < read < len(buf):
+            data = os.pread(self.fd, len(buf) - read, offset + read) if hasattr(os, 'pread') else self._buffered_read(offset + read, len(buf) - read)
+            if not data:
+                break
+            buf[read:read + len(data)] = data
+            read += len(data)
+        return read
+
+    def _buffered_read(self, offset, length):
+        if self.direct:
+            self.open(direct=False)
+        os.lseek(self.fd, offset, os.SEEK_SET)
+        return os.read(self.fd, length)
+
+    def write_at(self, offset, buf, length):
+        """ writes the first length bytes of buf at offset """
+        written = 0
+        if length == len(buf):
+            while True:
+                try:
+                    os.lseek(self.fd, offset, os.SEEK_SET)
+                    written = self.file.write(buf) or 0
+                    break
+                except (IOError, OSError) as e:
+                    self.fall_back_to_buffered(e)
+        if written < length:
+            # the end of a short slice, or the rest of an interrupted write
+            if self.direct:
+                self.open(direct=False)
+            os.lseek(self.fd, offset + written, os.SEEK_SET)
+            data = buf[written:length]
+            while data:
+                data = data[os.write(self.fd, data):]
+
+    def sync(self):
+        os.fsync(self.fd)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class SliceCopier(object):
+    """
+    Copies slices from the source to the destination in process, without dd
+    and without a tmpfs staging file. A slice is read once into an aligned
+    buffer, appended and synced to the backup file, then written and synced
+    to the destination.
+    The backup file is a journal of the slices written since the caller last
+    committed the slice index, it starts with the slice in the backup index
+    file. The caller calls remove_backup() only after the commit, so on resume
+    a backup older than the committed slice index is stale, any other is
+    replayed by restore_backup().
+    """
+    def __init__(self, logger, source_path, destination_path, backup_file_path):
+        self.logger = logger
+        self.source_path = source_path
+        self.destination_path = destination_path
+        self.backup_file_path = backup_file_path
+        self.backup_index_file_path = backup_file_path + '.index'
+        self.source = None
+        self.destination = None
+        self.backup = None
+        self.backup_size = 0
+        self.buffers = {}
+
+    def open(self):
+        self.source = AlignedFile(self.logger, self.source_path, os.O_RDONLY)
+        # no O_TRUNC, the destination may be a file holding the other slices
+        self.destination = AlignedFile(self.logger, self.destination_path, os.O_WRONLY | os.O_CREAT)
+        self.logger.log("copying {0} (direct io: {1}) to {2} (direct io: {3})".format(self.source_path,
+                                                                                     self.source.direct,
+                                                                                     self.destination_path,
+                                                                                     self.destination.direct))
+
+    def close(self):
+        for aligned_file in (self.source, self.destination, self.backup):
+            if aligned_file is not None:
+                aligned_file.close()
+        self.source = None
+        self.destination = None
+        self.backup = None
+        for buf in self.buffers.values():
+            buf.close()
+        self.buffers = {}
+
+    def get_buffer(self, length):
+        # anonymous maps are page aligned; there are at most two lengths, the slice and the last slice
+        buf = self.buffers.get(length)
+        if buf is None:
+            buf = mmap.mmap(-1, length)
+            self.buffers[length] = buf
+        return buf
+
+    def copy_slice(self, slice_index, offset, length):
+        """ copies length bytes at offset, returns the number of bytes copied """
+        buf = self.get_buffer(length)
+        read = self.read_slice(offset, buf)
+        self.write_slice(slice_index, offset, buf, read)
+        return read
+
+    def read_slice(self, offset, buf):
+        read = self.source.read_at(offset, buf)
+        if read != len(buf):
+            self.logger.log(msg="read {0} bytes at {1} from {2}, expected {3}".format(read, offset, self.source_path, len(buf)),
+                            level=CommonVariables.WarningLevel)
+        return read
+
+    def write_slice(self, slice_index, offset, buf, length):
+        self.write_backup(slice_index, buf, length)
+        self.destination.write_at(offset, buf, length)
+        self.destination.sync()
+
+    def copy_slices(self, slices, slice_copied, queue_depth=1):
+        """
+        Copies the (slice_index, offset, length) slices in order and calls
+        slice_copied(slice_index) after each one, a slice of length 0 is only
+        passed to slice_copied. With a queue_depth above 1 a reader thread
+        reads up to queue_depth slices ahead while the slices before them are
+        backed up and written, the backups, the writes and the slice_copied
+        calls stay in order on the calling thread.
+        The read ahead never touches what was already written: the slices are
+        copied in the order where the destination trails the source.
+        """
+        if queue_depth <= 1:
+            for slice_index, offset, length in slices:
+                if length > 0:
+                    self.copy_slice(slice_index, offset, length)
+                slice_copied(slice_index)
+            return
+
+        reader = SliceReader(self, slices, queue_depth)
+        reader.start()
+        try:
+            while True:
+                item = reader.filled.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                slice_index, offset, buf, read = item
+                if buf is not None:
+                    self.write_slice(slice_index, offset, buf, read)
+                    reader.release(buf)
+                slice_copied(slice_index)
+        finally:
+            reader.stop()
+
+    def write_backup(self, slice_index, buf, length):
+        """ appends the slice to the backup journal, slice_index starts a new journal """
+        if self.backup is None:
+            self.write_backup_index(slice_index)
+            self.backup = AlignedFile(self.logger, self.backup_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            self.backup_size = 0
+        self.backup.write_at(self.backup_size, buf, length)
+        self.backup.sync()
+        self.backup_size += length
+
+    def write_backup_index(self, slice_index):
+        with open(self.backup_index_file_path, 'w') as f:
+            f.write(str(slice_index))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def get_backup_index(self):
+        """ first slice index of the backup, None for a backup without index """
+        try:
+            with open(self.backup_index_file_path, 'r') as f:
+                return int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def restore_backup(self, slices):
+        """
+        Writes the slices of the backup journal to the destination again,
+        slices are the (slice_index, offset, length) from the first slice of
+        the journal on. The last slice of the journal may be partial, the
+        destination was not touched for it yet, so it is completed from the
+        source first. Returns the index of the slice after the journal.
+        """
+        journal_size = os.path.getsize(self.backup_file_path)
+        journal = AlignedFile(self.logger, self.backup_file_path, os.O_RDWR)
+        try:
+            position = 0
+            next_slice_index = None
+            for slice_index, offset, length in slices:
+                if position >= journal_size:
+                    break
+                next_slice_index = slice_index + 1
+                if length == 0:
+                    continue
+                buf = self.get_buffer(length)
+                backed_up = min(length, journal_size - position)
+                if backed_up < length:
+                    # the backup was being written, so the source slice is still intact
+                    left = self.get_buffer(length - backed_up)
+                    read = self.source.read_at(offset + backed_up, left)
+                    journal.write_at(position + backed_up, left, read)
+                    journal.sync()
+                    length = backed_up + read
+                    buf = self.get_buffer(length)
+                read = journal.read_at(position, buf)
+                self.destination.write_at(offset, buf, read)
+                self.destination.sync()
+                position += length
+            return next_slice_index
+        finally:
+            journal.close()
+
+    def remove_backup(self):
+        if self.backup is not None:
+            self.backup.close()
+            self.backup = None
+        self.backup_size = 0
+        for path in (self.backup_file_path, self.backup_index_file_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SliceReader(threading.Thread):
+    """
+    Reads the slices for SliceCopier.copy_slices into a pool of queue_depth
+    aligned buffers, a buffer is reused once the writer released it.
+    """
+    def __init__(self, copier, slices, queue_depth):
+        super(SliceReader, self).__init__()
+        self.daemon = True
+        self.copier = copier
+        self.slices = slices
+        self.filled = queue.Queue()
+        self.free = queue.Queue()
+        for _ in range(queue_depth):
+            self.free.put(None)
+        self.stopped = False
+
+    def get_buffer(self, length):
+        buf = self.free.get()
+        if buf is not None and len(buf) != length:
+            buf.close()
+            buf = None
+        if buf is None and not self.stopped:
+            buf = mmap.mmap(-1, length)
+        return buf
+
+    def release(self, buf):
+        self.free.put(buf)
+
+    def run(self):
+        try:
+            for slice_index, offset, length in self.slices:
+                if self.stopped:
+                    return
+                if length == 0:
+                    self.filled.put((slice_index, offset, None, 0))
+                    continue
+                buf = self.get_buffer(length)
+                if self.stopped:
+                    return
+                read = self.copier.read_slice(offset, buf)
+                self.filled.put((slice_index, offset, buf, read))
+            self.filled.put(None)
+        except Exception as e:
+            self.filled.put(e)
+
+    def stop(self):
+        self.stopped = True
+        # wakes the reader up if it waits for a free buffer
+        self.free.put(None)
+        self.join()
+        while True:
+            try:
+                item = self.free.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item.close()
+        while True:
+            try:
+                item = self.filled.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, tuple) and item[2] is not None:
+                item[2].close()
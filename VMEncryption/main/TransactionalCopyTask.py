@@ -16,16 +16,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import subprocess
+import datetime
 import os
 import os.path
-import sys
-import shlex
-from subprocess import *
-from CommandExecutor import CommandExecutor
+import time
 from Common import CommonVariables
 from ConfigUtil import ConfigUtil
 from OnGoingItemConfig import *
+from SliceCopier import SliceCopier
 
 
 class TransactionalCopyTask(object):
@@ -33,11 +31,15 @@ class TransactionalCopyTask(object):
     copy_total_size is in byte, skip_target_size is also in byte
     slice_size is in byte 50M
     """
-    def __init__(self, logger, hutil, disk_util, ongoing_item_config, patching, encryption_environment, status_prefix=''):
+    def __init__(self, logger, hutil, disk_util, ongoing_item_config, patching, encryption_environment, status_prefix='', queue_depth=CommonVariables.copy_queue_depth, allocation_map=None, destination_shift=0):
         """
         copy_total_size is in bytes.
+        the slices entirely free in the allocation_map of the source are not copied.
+        destination_shift is the number of bytes the destination starts after the
+        source on the same device, the LUKS header of an in place encryption: a
+        skipped slice leaves that many bytes of the next slice in the raw device
+        as they were, so a slice is only skipped if they are free too.
         """
-        self.command_executer = CommandExecutor(logger)
         self.ongoing_item_config = ongoing_item_config
         self.total_size = self.ongoing_item_config.get_current_total_copy_size()
         self.block_size = self.ongoing_item_config.get_current_block_size()
@@ -56,239 +58,159 @@ class TransactionalCopyTask(object):
         self.patching = patching
         self.disk_util = disk_util
         self.hutil = hutil
-        self.tmpfs_mount_point = "/mnt/azure_encrypt_tmpfs"
-        self.slice_file_path = self.tmpfs_mount_point + "/slice_file"
-        self.copy_command = self.patching.dd_path
-
-    def resume_copy_internal(self, copy_slice_item_backup_file_size, skip_block, original_total_copy_size):
-        block_size_of_slice_item_backup = 512
-        #copy the left slice
-        if copy_slice_item_backup_file_size <= original_total_copy_size:
-            skip_of_slice_item_backup_file = copy_slice_item_backup_file_size / block_size_of_slice_item_backup
-            left_count = ((original_total_copy_size - copy_slice_item_backup_file_size) / block_size_of_slice_item_backup)
-            total_count = original_total_copy_size / block_size_of_slice_item_backup
-            original_device_skip_count = (self.block_size * skip_block) / block_size_of_slice_item_backup 
-            if left_count != 0:
-                dd_cmd = str(self.copy_command) \
-                       + ' if=' + self.source_dev_full_path \
-                       + ' of=' + self.encryption_environment.copy_slice_item_backup_file \
-                       + ' bs=' + str(block_size_of_slice_item_backup) \
-                       + ' skip=' + str(original_device_skip_count + skip_of_slice_item_backup_file) \
-                       + ' seek=' + str(skip_of_slice_item_backup_file) \
-                       + ' count=' + str(left_count)
-
-                return_code = self.command_executer.Execute(dd_cmd)
-                if return_code != CommonVariables.process_success:
-                    return return_code
-
-            dd_cmd = str(self.copy_command) \
-                   + ' if=' + self.encryption_environment.copy_slice_item_backup_file \
-                   + ' of=' + self.destination \
-                   + ' bs=' + str(block_size_of_slice_item_backup) \
-                   + ' seek=' + str(original_device_skip_count) \
-                   + ' count=' + str(total_count)
-
-            return_code = self.command_executer.Execute(dd_cmd)
-            if return_code != CommonVariables.process_success:
-                return return_code
-            else:
-                self.current_slice_index += 1
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    os.remove(self.encryption_environment.copy_slice_item_backup_file)
-                return return_code
-        else:
-            self.logger.log(msg="copy_slice_item_backup_file_size is bigger than original_total_copy_size",
-                            level=CommonVariables.ErrorLevel)
-            return CommonVariables.backup_slice_file_error
-
-    def resume_copy(self):
+        self.queue_depth = queue_depth
+        self.checkpoint_slices = CommonVariables.copy_checkpoint_slices
+        self.checkpoint_seconds = CommonVariables.copy_checkpoint_seconds
+        self.checkpoint_bytes = CommonVariables.copy_checkpoint_bytes
+        self.status_report_seconds = CommonVariables.copy_status_report_seconds
+        self.committed_slice_index = self.current_slice_index
+        self.last_checkpoint_time = time.time()
+        self.last_status_report_time = None
+        self.start_time = time.time()
+        self.start_slice_index = self.current_slice_index
+        self.allocation_map = allocation_map
+        self.destination_shift = destination_shift
+        self.copied_size = 0
+        self.skipped_size = 0
+        self.copier = SliceCopier(logger=self.logger,
+                                  source_path=self.source_dev_full_path,
+                                  destination_path=self.destination,
+                                  backup_file_path=self.encryption_environment.copy_slice_item_backup_file)
+
+    def get_slice(self, slice_index):
+        """
+        returns the block index and the size in bytes of the slice, the last slice
+        of the device is the one with last_slice_size bytes.
+        """
         if self.from_end.lower() == 'true':
-            skip_block = (self.total_slice_size - self.current_slice_index - 1)
+            skip_block = self.total_slice_size - slice_index - 1
         else:
-            skip_block = self.current_slice_index
-
-        return_code = CommonVariables.process_success
-
-        if self.current_slice_index == 0:
-            if self.last_slice_size > 0:
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    copy_slice_item_backup_file_size = os.path.getsize(self.encryption_environment.copy_slice_item_backup_file)
-                    return_code = self.resume_copy_internal(copy_slice_item_backup_file_size=copy_slice_item_backup_file_size,
-                                                           skip_block=skip_block,
-                                                           original_total_copy_size=self.last_slice_size)
-                else:
-                    self.logger.log(msg="1. the slice item backup file not exists.",
-                                    level=CommonVariables.WarningLevel)
-            else:
-                self.logger.log(msg="the last slice",
-                                level=CommonVariables.WarningLevel)
+            skip_block = slice_index
+        if skip_block == self.total_slice_size - 1:
+            return skip_block, self.last_slice_size
+        return skip_block, self.block_size
+
+    def get_slices(self, first_slice_index):
+        for slice_index in range(first_slice_index, self.total_slice_size):
+            skip_block, slice_size = self.get_slice(slice_index)
+            if slice_size == 0:
+                self.logger.log(msg="the last slice size is zero, so skip the slice index {0}.".format(slice_index))
+            elif self.is_unallocated(skip_block, slice_size):
+                slice_size = 0
+            yield slice_index, skip_block * self.block_size, slice_size
+
+    def is_unallocated(self, skip_block, slice_size):
+        return self.allocation_map is not None and self.allocation_map.is_unallocated(skip_block * self.block_size, slice_size + self.destination_shift)
+
+    def slice_copied(self, slice_index):
+        skip_block, slice_size = self.get_slice(slice_index)
+        if self.is_unallocated(skip_block, slice_size):
+            self.skipped_size += slice_size
         else:
-            if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                copy_slice_item_backup_file_size = os.path.getsize(self.encryption_environment.copy_slice_item_backup_file)
-                return_code = self.resume_copy_internal(copy_slice_item_backup_file_size, skip_block=skip_block, original_total_copy_size=self.block_size)
-            else:
-                self.logger.log(msg="2. unfortunately the slice item backup file not exists.",
-                                level=CommonVariables.WarningLevel)
-        return return_code
-
-    def copy_last_slice(self, skip_block):
-        block_size_of_last_slice = 512
-        skip_of_last_slice = (skip_block * self.block_size) / block_size_of_last_slice
-        count_of_last_slice = self.last_slice_size / block_size_of_last_slice
-
-        copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                         to_device = self.destination,
-                                         skip=skip_of_last_slice,
-                                         seek=skip_of_last_slice,
-                                         block_size=block_size_of_last_slice,
-                                         count = count_of_last_slice)
-        return copy_result
-
-    def begin_copy(self):
+            self.copied_size += slice_size
+        self.current_slice_index = slice_index + 1
+        if self.checkpoint_due():
+            self.checkpoint()
+        self.report_progress()
+
+    def checkpoint_due(self):
+        uncommitted_slices = self.current_slice_index - self.committed_slice_index
+        return uncommitted_slices >= self.checkpoint_slices \
+            or (uncommitted_slices + 1) * self.block_size > self.checkpoint_bytes \
+            or time.time() - self.last_checkpoint_time >= self.checkpoint_seconds
+
+    def checkpoint(self):
         """
-        check the device_item size first, cut it
+        Commits the slice index. Until then the backup journal holds every slice
+        written since the previous checkpoint, so a resume replays them.
         """
-        self.resume_copy()
-        if self.from_end.lower() == 'true':
-            while self.current_slice_index < self.total_slice_size:
-                skip_block = (self.total_slice_size - self.current_slice_index - 1)
-
-                if self.current_slice_index == 0:
-                    if self.last_slice_size > 0:
-                        copy_result = self.copy_last_slice(skip_block)
-                        if copy_result != CommonVariables.process_success:
-                            return copy_result
-                    else:
-                        self.logger.log(msg = "the last slice size is zero, so skip the 0 index.")
-                else:
-                    copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                                     to_device=self.destination,
-                                                     skip=skip_block,
-                                                     seek=skip_block,
-                                                     block_size=self.block_size)
-
-                    if copy_result != CommonVariables.process_success:
-                        return copy_result
-
-                self.current_slice_index += 1
-
-                if self.status_prefix:
-                    msg = self.status_prefix + ': ' \
-                        + str(int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)) \
-                        + '%'
-
-                    self.hutil.do_status_report(operation='DataCopy',
-                                                status=CommonVariables.extension_success_status,
-                                                status_code=str(CommonVariables.success),
-                                                message=msg)
-
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
+        self.ongoing_item_config.current_slice_index = self.current_slice_index
+        self.ongoing_item_config.commit()
+        self.committed_slice_index = self.current_slice_index
+        self.last_checkpoint_time = time.time()
+        # the backup goes only once the next slice index is committed
+        self.copier.remove_backup()
 
+    def resume_copy(self):
+        backup_file = self.encryption_environment.copy_slice_item_backup_file
+        if not os.path.exists(backup_file):
+            self.logger.log(msg="the slice item backup file not exists.",
+                            level=CommonVariables.WarningLevel)
             return CommonVariables.process_success
-        else:
-            while self.current_slice_index < self.total_slice_size:
-                skip_block = self.current_slice_index
-
-                if self.current_slice_index == (self.total_slice_size - 1):
-                    if self.last_slice_size > 0:
-                        copy_result = self.copy_last_slice(skip_block)
-                        if copy_result != CommonVariables.process_success:
-                            return copy_result
-                    else:
-                        self.logger.log(msg = "the last slice size is zero, so skip the last slice index.")
-                else:
-                    copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                                     to_device=self.destination,
-                                                     skip=skip_block,
-                                                     seek=skip_block,
-                                                     block_size=self.block_size)
-
-                    if copy_result != CommonVariables.process_success:
-                        return copy_result
-
-                self.current_slice_index += 1
-
-                if self.status_prefix:
-                    msg = self.status_prefix + ': ' \
-                        + str(int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)) \
-                        + '%'
-
-                    self.hutil.do_status_report(operation='DataCopy',
-                                                status=CommonVariables.extension_success_status,
-                                                status_code=str(CommonVariables.success),
-                                                message=msg)
-
-                self.hutil.do_status_report(operation='DataCopy',
-                                            status=CommonVariables.extension_success_status,
-                                            status_code=str(CommonVariables.success),
-                                            message=msg)
 
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
+        backup_index = self.copier.get_backup_index()
+        if backup_index is None:
+            # a backup of a single slice, without index, written by an older version
+            backup_index = self.current_slice_index
+            backup_size = os.path.getsize(backup_file)
+            skip_block, slice_size = self.get_slice(backup_index)
+            if backup_size > slice_size:
+                self.logger.log(msg="copy_slice_item_backup_file_size is bigger than original_total_copy_size",
+                                level=CommonVariables.ErrorLevel)
+                return CommonVariables.backup_slice_file_error
+        elif backup_index < self.current_slice_index:
+            # the slices were committed, the crash came before the backup was removed
+            self.logger.log(msg="the slice item backup file starts at the committed slice {0}, current slice is {1}".format(backup_index, self.current_slice_index),
+                            level=CommonVariables.WarningLevel)
+            self.copier.remove_backup()
             return CommonVariables.process_success
 
-    """
-    TODO: if the copy failed?
-    """
-    def copy_internal(self, from_device, to_device,  block_size, skip=0, seek=0, count=1):
+        next_slice_index = self.copier.restore_backup(self.get_slices(backup_index))
+        if next_slice_index is not None:
+            self.logger.log(msg="restored the slices {0} to {1} from the backup".format(backup_index, next_slice_index - 1))
+            self.current_slice_index = next_slice_index
+        self.checkpoint()
+        return CommonVariables.process_success
+
+    def report_progress(self):
+        """ at most one status report every status_report_seconds, and one for the last slice """
+        if not self.status_prefix:
+            return
+        now = time.time()
+        if self.current_slice_index < self.total_slice_size and self.last_status_report_time is not None \
+                and now - self.last_status_report_time < self.status_report_seconds:
+            return
+        self.last_status_report_time = now
+
+        msg = self.status_prefix + ': ' \
+            + str(int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)) \
+            + '%'
+        copied_slices = self.current_slice_index - self.start_slice_index
+        if 0 < copied_slices and self.current_slice_index < self.total_slice_size:
+            seconds_left = (now - self.start_time) / copied_slices * (self.total_slice_size - self.current_slice_index)
+            msg += ', ETA ' + str(datetime.timedelta(seconds=int(seconds_left)))
+        elif self.current_slice_index == self.total_slice_size and self.allocation_map is not None:
+            msg += ', {0} bytes copied, {1} bytes of unallocated blocks skipped'.format(self.copied_size, self.skipped_size)
+
+        self.hutil.do_status_report(operation='DataCopy',
+                                    status=CommonVariables.extension_success_status,
+                                    status_code=str(CommonVariables.success),
+                                    message=msg)
+
+    def begin_copy(self):
         """
-        first, copy the data to the middle cache
+        check the device_item size first, cut it
         """
-        dd_cmd = str(self.copy_command) \
-               + ' if=' + from_device \
-               + ' of=' + self.slice_file_path \
-               + ' bs=' + str(block_size) \
-               + ' skip=' + str(skip) \
-               + ' count=' + str(count)
-
-        return_code = self.command_executer.Execute(dd_cmd)
-        if return_code != CommonVariables.process_success:
-            self.logger.log(msg="{0} is {1}".format(dd_cmd, return_code), level=CommonVariables.ErrorLevel)
-            return return_code
-        else:
-            slice_file_size = os.path.getsize(self.slice_file_path)
-            self.logger.log(msg=("slice_file_size is: {0}".format(slice_file_size)))
-            """
-            second, copy the data in the middle cache to the backup slice.
-            """
-            backup_slice_item_cmd = str(self.copy_command) \
-                                  + ' if=' + self.slice_file_path \
-                                  + ' of=' + self.encryption_environment.copy_slice_item_backup_file \
-                                  + ' bs=' + str(block_size) \
-                                  + ' count=' + str(count)
-            backup_slice_args = shlex.split(backup_slice_item_cmd)
-            backup_process = Popen(backup_slice_args)
-            self.logger.log("backup_slice_item_cmd is:{0}".format(backup_slice_item_cmd))
-
-            """
-            third, copy the data in the middle cache to the target device.
-            """
-            dd_cmd = str(self.copy_command) + ' if=' + self.slice_file_path + ' of=' + to_device + ' bs=' + str(block_size) + ' seek=' + str(seek) + ' count=' + str(count)
-            return_code = self.command_executer.Execute(dd_cmd)
+        try:
+            self.copier.open()
+            return_code = self.resume_copy()
             if return_code != CommonVariables.process_success:
-                self.logger.log(msg=("{0} is: {1}".format(dd_cmd, return_code)), level = CommonVariables.ErrorLevel)
-            else:
-                #the copy done correctly, so clear the backup slice file item.
-                backup_process.kill()
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    self.logger.log(msg = "clean up the backup file")
-                    os.remove(self.encryption_environment.copy_slice_item_backup_file)
-                if os.path.exists(self.slice_file_path):
-                    self.logger.log(msg = "clean up the slice file")
-                    os.remove(self.slice_file_path)
-            return return_code
+                return return_code
 
-    def prepare_mem_fs(self):
-        self.disk_util.make_sure_path_exists(self.tmpfs_mount_point)
-        commandToExecute = self.patching.mount_path + " -t tmpfs -o size=" + str(self.block_size + 1024) + " tmpfs " + self.tmpfs_mount_point
-        self.logger.log("prepare mem fs script is: {0}".format(commandToExecute))
-        return_code = self.command_executer.Execute(commandToExecute)
-        return return_code
+            self.start_time = time.time()
+            self.start_slice_index = self.current_slice_index
+            self.copier.copy_slices(slices=self.get_slices(self.current_slice_index),
+                                    slice_copied=self.slice_copied,
+                                    queue_depth=self.queue_depth)
+            if self.committed_slice_index != self.current_slice_index:
+                self.checkpoint()
 
-    def clear_mem_fs(self):
-        commandToExecute = self.patching.umount_path + " " + self.tmpfs_mount_point
-        return_code = self.command_executer.Execute(commandToExecute)
-        return return_code
+            if self.allocation_map is not None:
+                self.logger.log("copied {0} bytes of {1}, skipped {2} bytes of unallocated blocks".format(self.copied_size, self.source_dev_full_path, self.skipped_size))
+            return CommonVariables.process_success
+        except (IOError, OSError) as e:
+            self.logger.log(msg="copying slice {0} of {1} failed: {2}".format(self.current_slice_index, self.source_dev_full_path, e),
+                            level=CommonVariables.ErrorLevel)
+            return CommonVariables.copy_data_error
+        finally:
+            self.copier.close()
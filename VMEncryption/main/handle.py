@@ -30,6 +30,7 @@ import uuid
 import shutil
 
 from Utils import HandlerUtil
+from AllocationMap import AllocationMap
 from Common import CommonVariables, CryptItem
 from ExtensionParameter import ExtensionParameter
 from DiskUtil import DiskUtil
@@ -43,6 +44,7 @@ from check_util import CheckUtil
 from DecryptionMarkConfig import DecryptionMarkConfig
 from EncryptionMarkConfig import EncryptionMarkConfig
 from EncryptionEnvironment import EncryptionEnvironment
+from EncryptionScheduler import EncryptionScheduler, AggregatedStatusReporter
 from OnGoingItemConfig import OnGoingItemConfig
 from ProcessLock import ProcessLock
 from CommandExecutor import CommandExecutor, ProcessCommunicator
@@ -896,7 +898,7 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
     logger.log("encrypt_inplace_without_seperate_header_file")
     current_phase = CommonVariables.EncryptionPhaseBackupHeader
     if ongoing_item_config is None:
-        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment, logger=logger)
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=disk_util.encryption_environment, logger=logger)
         ongoing_item_config.current_block_size = CommonVariables.default_block_size
         ongoing_item_config.current_slice_index = 0
         ongoing_item_config.device_size = device_item.size
@@ -957,15 +959,16 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
             else:
                 ongoing_item_config.current_slice_index = 0
                 ongoing_item_config.current_source_path = original_dev_path
-                ongoing_item_config.current_destination = encryption_environment.copy_header_slice_file_path
+                ongoing_item_config.current_destination = disk_util.encryption_environment.copy_header_slice_file_path
                 ongoing_item_config.current_total_copy_size = CommonVariables.default_block_size
                 ongoing_item_config.from_end = False
-                ongoing_item_config.header_slice_file_path = encryption_environment.copy_header_slice_file_path
+                ongoing_item_config.header_slice_file_path = disk_util.encryption_environment.copy_header_slice_file_path
                 ongoing_item_config.original_dev_path = original_dev_path
                 ongoing_item_config.commit()
-                if os.path.exists(encryption_environment.copy_header_slice_file_path):
+                save_allocation_map(disk_util, original_dev_path, device_fs)
+                if os.path.exists(disk_util.encryption_environment.copy_header_slice_file_path):
                     logger.log(msg="the header slice file is there, remove it.", level=CommonVariables.WarningLevel)
-                    os.remove(encryption_environment.copy_header_slice_file_path)
+                    os.remove(disk_util.encryption_environment.copy_header_slice_file_path)
 
                 copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config, status_prefix=status_prefix)
 
@@ -1010,7 +1013,11 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
             ongoing_item_config.phase = CommonVariables.EncryptionPhaseCopyData
             ongoing_item_config.commit()
 
-            copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config, status_prefix=status_prefix)
+            # the mapper starts after the LUKS header on the same device
+            copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config,
+                                         status_prefix=status_prefix,
+                                         allocation_map=AllocationMap.load(disk_util.encryption_environment.copy_allocation_map_file),
+                                         destination_shift=luks_header_size)
             if copy_result != CommonVariables.process_success:
                 logger.log(msg="copy the main content block failed, return code is: {0}".format(copy_result),
                            level=CommonVariables.ErrorLevel)
@@ -1062,8 +1069,10 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
                     logger.log(msg=original_dev_name_path + " is not defined in fstab, no need to update",
                                level=CommonVariables.InfoLevel)
 
-                if os.path.exists(encryption_environment.copy_header_slice_file_path):
-                    os.remove(encryption_environment.copy_header_slice_file_path)
+                if os.path.exists(disk_util.encryption_environment.copy_header_slice_file_path):
+                    os.remove(disk_util.encryption_environment.copy_header_slice_file_path)
+                if os.path.exists(disk_util.encryption_environment.copy_allocation_map_file):
+                    os.remove(disk_util.encryption_environment.copy_allocation_map_file)
 
                 current_phase = CommonVariables.EncryptionPhaseDone
                 ongoing_item_config.phase = current_phase
@@ -1098,7 +1107,7 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file,
     logger.log("encrypt_inplace_with_seperate_header_file")
     current_phase = CommonVariables.EncryptionPhaseEncryptDevice
     if ongoing_item_config is None:
-        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment,
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=disk_util.encryption_environment,
                                                 logger=logger)
         mapper_name = str(uuid.uuid4())
         ongoing_item_config.current_block_size = CommonVariables.default_block_size
@@ -1121,6 +1130,7 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file,
             ongoing_item_config.luks_header_file_path = luks_header_file_path
             ongoing_item_config.phase = CommonVariables.EncryptionPhaseEncryptDevice
             ongoing_item_config.commit()
+            save_allocation_map(disk_util, ongoing_item_config.get_original_dev_path(), device_item.file_system)
     else:
         logger.log(msg="ongoing item config is not none, this is resuming: {0}".format(ongoing_item_config),
                    level=CommonVariables.WarningLevel)
@@ -1183,7 +1193,9 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file,
                 ongoing_item_config.from_end = True
                 ongoing_item_config.commit()
 
-                copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config, status_prefix=status_prefix)
+                copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config,
+                                             status_prefix=status_prefix,
+                                             allocation_map=AllocationMap.load(disk_util.encryption_environment.copy_allocation_map_file))
 
                 if copy_result != CommonVariables.success:
                     error_message = "the copying result is {0} so skip the mounting".format(copy_result)
@@ -1222,6 +1234,9 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file,
                         logger.log(msg=original_dev_name_path + " is not defined in fstab, no need to update",
                                    level=CommonVariables.InfoLevel)
 
+                    if os.path.exists(disk_util.encryption_environment.copy_allocation_map_file):
+                        os.remove(disk_util.encryption_environment.copy_allocation_map_file)
+
                     current_phase = CommonVariables.EncryptionPhaseDone
                     ongoing_item_config.phase = current_phase
                     ongoing_item_config.commit()
@@ -1424,6 +1439,102 @@ def find_all_devices_to_encrypt(encryption_marker, disk_util, bek_util):
     return device_items_to_encrypt
 
 
+def encrypt_device_item_in_place(passphrase_file, device_item, disk_util, bek_util, status_prefix):
+    """
+    unmounts and encrypts the device item, returns the phase it reached or None if it could not be unmounted.
+    """
+    umount_status_code = CommonVariables.success
+    if device_item.mount_point is not None and device_item.mount_point != "":
+        umount_status_code = disk_util.umount(device_item.mount_point)
+    if umount_status_code != CommonVariables.success:
+        logger.log("error occured when do the umount for: {0} with code: {1}".format(device_item.mount_point, umount_status_code))
+        return None
+
+    logger.log(msg=("encrypting: {0}".format(device_item)))
+    no_header_file_support = not_support_header_option_distro(DistroPatcher)
+
+    # TODO check the file system before encrypting it.
+    if no_header_file_support:
+        logger.log(msg="this is the centos 6 or redhat 6 or sles 11 series, need to resize data drive",
+                   level=CommonVariables.WarningLevel)
+
+        return encrypt_inplace_without_seperate_header_file(passphrase_file=passphrase_file,
+                                                            device_item=device_item,
+                                                            disk_util=disk_util,
+                                                            bek_util=bek_util,
+                                                            status_prefix=status_prefix)
+    else:
+        return encrypt_inplace_with_seperate_header_file(passphrase_file=passphrase_file,
+                                                         device_item=device_item,
+                                                         disk_util=disk_util,
+                                                         bek_util=bek_util,
+                                                         status_prefix=status_prefix)
+
+
+def get_encryption_concurrency():
+    concurrency = CommonVariables.default_encryption_concurrency
+    public_settings = get_public_settings()
+    if public_settings and public_settings.get(CommonVariables.EncryptionConcurrencyKey):
+        try:
+            concurrency = int(public_settings.get(CommonVariables.EncryptionConcurrencyKey))
+        except ValueError:
+            logger.log(msg="ignoring the invalid {0}: {1}".format(CommonVariables.EncryptionConcurrencyKey,
+                                                                   public_settings.get(CommonVariables.EncryptionConcurrencyKey)),
+                       level=CommonVariables.WarningLevel)
+    return max(1, concurrency)
+
+
+def skip_unallocated_blocks_enabled():
+    public_settings = get_public_settings()
+    return bool(public_settings) and str(public_settings.get(CommonVariables.SkipUnallocatedBlocksKey)).lower() == 'true'
+
+
+def save_allocation_map(disk_util, dev_path, file_system):
+    """
+    With the SkipUnallocatedBlocks setting the copy leaves out the slices that
+    are free in the file system. The map is taken before the device is touched
+    and kept until the copy is done, a resumed copy skips the same slices.
+    The skipped blocks keep their former content unencrypted, the setting is
+    meant for data disks whose free space never held data. When the LUKS header
+    is on the device, the data is written luks_header_size bytes after where it
+    is read, so a slice is skipped only if that many bytes after it are free too,
+    no allocated block is left in clear. Without a map the whole device is copied.
+    """
+    allocation_map_file = disk_util.encryption_environment.copy_allocation_map_file
+    if os.path.exists(allocation_map_file):
+        os.remove(allocation_map_file)
+    if not skip_unallocated_blocks_enabled():
+        return
+    allocation_map = AllocationMap.from_file_system(logger, disk_util.distro_patcher, dev_path, file_system)
+    if allocation_map is not None:
+        allocation_map.save(allocation_map_file)
+
+
+def run_device_encryptions(jobs, status_reporter):
+    """
+    jobs is a list of (device_name, device_disk_util, function(device_disk_util)), each device with
+    its own DiskUtil, environment and status. Returns the names of the devices that failed, a device
+    that could not be unmounted (phase None) is skipped like in the serial encryption.
+    """
+    def run_job(device_name, device_disk_util, function):
+        def job():
+            try:
+                return function(device_disk_util)
+            finally:
+                status_reporter.device_done(device_name)
+        return device_name, job
+
+    scheduler = EncryptionScheduler(logger, get_encryption_concurrency())
+    results = scheduler.run([run_job(device_name, device_disk_util, function) for device_name, device_disk_util, function in jobs])
+    return [device_name for device_name, device_disk_util, function in jobs
+            if device_name not in results or results[device_name] not in (None, CommonVariables.EncryptionPhaseDone)]
+
+
+def create_device_disk_util(device_name, status_reporter):
+    device_environment = encryption_environment.get_device_environment(device_name)
+    return DiskUtil(status_reporter.for_device(device_name), DistroPatcher, logger, device_environment)
+
+
 def enable_encryption_all_in_place(passphrase_file, encryption_marker, disk_util, bek_util):
     """
     if return None for the success case, or return the device item which failed.
@@ -1439,40 +1550,39 @@ def enable_encryption_all_in_place(passphrase_file, encryption_marker, disk_util
                            status_code=str(CommonVariables.success),
                            message=msg)
 
+    concurrency = get_encryption_concurrency()
+    if concurrency > 1 and len(device_items_to_encrypt) > 1:
+        logger.log(msg="encrypting {0} data volumes, {1} at a time".format(len(device_items_to_encrypt), concurrency))
+        status_reporter = AggregatedStatusReporter(hutil, 'EnableEncryption', msg)
+
+        def encrypt(device_item):
+            return lambda device_disk_util: encrypt_device_item_in_place(passphrase_file=passphrase_file,
+                                                                         device_item=device_item,
+                                                                         disk_util=device_disk_util,
+                                                                         bek_util=bek_util,
+                                                                         status_prefix="Encrypting")
+
+        jobs = [(device_item.name, create_device_disk_util(device_item.name, status_reporter), encrypt(device_item))
+                for device_item in device_items_to_encrypt]
+        failed_device_names = run_device_encryptions(jobs, status_reporter)
+        for device_item in device_items_to_encrypt:
+            if device_item.name in failed_device_names:
+                return device_item
+        return None
+
     for device_num, device_item in enumerate(device_items_to_encrypt):
-        umount_status_code = CommonVariables.success
-        if device_item.mount_point is not None and device_item.mount_point != "":
-            umount_status_code = disk_util.umount(device_item.mount_point)
-        if umount_status_code != CommonVariables.success:
-            logger.log("error occured when do the umount for: {0} with code: {1}".format(device_item.mount_point, umount_status_code))
+        status_prefix = "Encrypting data volume {0}/{1}".format(device_num + 1,
+                                                                len(device_items_to_encrypt))
+        encryption_result_phase = encrypt_device_item_in_place(passphrase_file=passphrase_file,
+                                                               device_item=device_item,
+                                                               disk_util=disk_util,
+                                                               bek_util=bek_util,
+                                                               status_prefix=status_prefix)
+        if encryption_result_phase is None or encryption_result_phase == CommonVariables.EncryptionPhaseDone:
+            continue
         else:
-            logger.log(msg=("encrypting: {0}".format(device_item)))
-            no_header_file_support = not_support_header_option_distro(DistroPatcher)
-            status_prefix = "Encrypting data volume {0}/{1}".format(device_num + 1,
-                                                                    len(device_items_to_encrypt))
-
-            # TODO check the file system before encrypting it.
-            if no_header_file_support:
-                logger.log(msg="this is the centos 6 or redhat 6 or sles 11 series, need to resize data drive",
-                           level=CommonVariables.WarningLevel)
-
-                encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file=passphrase_file,
-                                                                                       device_item=device_item,
-                                                                                       disk_util=disk_util,
-                                                                                       bek_util=bek_util,
-                                                                                       status_prefix=status_prefix)
-            else:
-                encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=passphrase_file,
-                                                                                    device_item=device_item,
-                                                                                    disk_util=disk_util,
-                                                                                    bek_util=bek_util,
-                                                                                    status_prefix=status_prefix)
-
-            if encryption_result_phase == CommonVariables.EncryptionPhaseDone:
-                continue
-            else:
-                # do exit to exit from this round
-                return device_item
+            # do exit to exit from this round
+            return device_item
     return None
 
 
@@ -1732,6 +1842,34 @@ def daemon_encrypt():
                                message=message)
 
 
+def resume_encryption(ongoing_item_config, disk_util, bek_util, bek_passphrase_file, status_prefix):
+    """
+    resumes the in place encryption of the ongoing item, returns the phase it reached.
+    """
+    ongoing_item_config.load_value_from_file()
+    header_file_path = ongoing_item_config.get_header_file_path()
+    mount_point = ongoing_item_config.get_mount_point()
+    if not none_or_empty(mount_point):
+        logger.log("mount point is not empty {0}, trying to unmount it first.".format(mount_point))
+        umount_status_code = disk_util.umount(mount_point)
+        logger.log("unmount return code is {0}".format(umount_status_code))
+    if none_or_empty(header_file_path):
+        # TODO mount it back when shrink failed
+        return encrypt_inplace_without_seperate_header_file(passphrase_file=bek_passphrase_file,
+                                                            device_item=None,
+                                                            disk_util=disk_util,
+                                                            bek_util=bek_util,
+                                                            status_prefix=status_prefix,
+                                                            ongoing_item_config=ongoing_item_config)
+    else:
+        return encrypt_inplace_with_seperate_header_file(passphrase_file=bek_passphrase_file,
+                                                         device_item=None,
+                                                         disk_util=disk_util,
+                                                         bek_util=bek_util,
+                                                         status_prefix=status_prefix,
+                                                         ongoing_item_config=ongoing_item_config)
+
+
 def daemon_encrypt_data_volumes(encryption_marker, encryption_config, disk_util, bek_util, bek_passphrase_file):
     try:
         """
@@ -1749,40 +1887,51 @@ def daemon_encrypt_data_volumes(encryption_marker, encryption_config, disk_util,
         """
         ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment, logger=logger)
 
+        device_environments = encryption_environment.get_ongoing_device_environments()
+
         if ongoing_item_config.config_file_exists():
             logger.log("OngoingItemConfig exists.")
-            ongoing_item_config.load_value_from_file()
-            header_file_path = ongoing_item_config.get_header_file_path()
-            mount_point = ongoing_item_config.get_mount_point()
-            status_prefix = "Resuming encryption after reboot"
-            if not none_or_empty(mount_point):
-                logger.log("mount point is not empty {0}, trying to unmount it first.".format(mount_point))
-                umount_status_code = disk_util.umount(mount_point)
-                logger.log("unmount return code is {0}".format(umount_status_code))
-            if none_or_empty(header_file_path):
-                encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file=bek_passphrase_file,
-                                                                                       device_item=None,
-                                                                                       disk_util=disk_util,
-                                                                                       bek_util=bek_util,
-                                                                                       status_prefix=status_prefix,
-                                                                                       ongoing_item_config=ongoing_item_config)
-                # TODO mount it back when shrink failed
-            else:
-                encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=bek_passphrase_file,
-                                                                                    device_item=None,
-                                                                                    disk_util=disk_util,
-                                                                                    bek_util=bek_util,
-                                                                                    status_prefix=status_prefix,
-                                                                                    ongoing_item_config=ongoing_item_config)
+            encryption_result_phase = resume_encryption(ongoing_item_config=ongoing_item_config,
+                                                        disk_util=disk_util,
+                                                        bek_util=bek_util,
+                                                        bek_passphrase_file=bek_passphrase_file,
+                                                        status_prefix="Resuming encryption after reboot")
             """
             if the resuming failed, we should fail.
             """
             if encryption_result_phase != CommonVariables.EncryptionPhaseDone:
-                original_dev_path = ongoing_item_config.get_original_dev_path
+                original_dev_path = ongoing_item_config.get_original_dev_path()
                 message = 'EnableEncryption: resuming encryption for {0} failed'.format(original_dev_path)
                 raise Exception(message)
             else:
                 ongoing_item_config.clear_config()
+        elif device_environments:
+            logger.log("OngoingItemConfig exists for {0} devices encrypted in parallel.".format(len(device_environments)))
+            msg = "Resuming encryption of {0} data volumes after reboot".format(len(device_environments))
+            status_reporter = AggregatedStatusReporter(hutil, 'EnableEncryption', msg)
+
+            def resume(device_ongoing_item_config):
+                def resume_device(device_disk_util):
+                    encryption_result_phase = resume_encryption(ongoing_item_config=device_ongoing_item_config,
+                                                                disk_util=device_disk_util,
+                                                                bek_util=bek_util,
+                                                                bek_passphrase_file=bek_passphrase_file,
+                                                                status_prefix="Resuming encryption")
+                    if encryption_result_phase == CommonVariables.EncryptionPhaseDone:
+                        device_ongoing_item_config.clear_config()
+                    return encryption_result_phase
+                return resume_device
+
+            jobs = []
+            for device_environment in device_environments:
+                device_disk_util = create_device_disk_util(device_environment.device_id, status_reporter)
+                device_ongoing_item_config = OnGoingItemConfig(encryption_environment=device_disk_util.encryption_environment, logger=logger)
+                jobs.append((device_environment.device_id, device_disk_util, resume(device_ongoing_item_config)))
+
+            failed_device_names = run_device_encryptions(jobs, status_reporter)
+            if failed_device_names:
+                message = 'EnableEncryption: resuming encryption for {0} failed'.format(', '.join(failed_device_names))
+                raise Exception(message)
         else:
             logger.log("OngoingItemConfig does not exist")
             failed_item = None
@@ -43,6 +43,7 @@ class AbstractPatching(object):
         self.cat_path = '/bin/cat'
         self.cryptsetup_path = '/usr/sbin/cryptsetup'
         self.dd_path = '/usr/bin/dd'
+        self.dumpe2fs_path = '/sbin/dumpe2fs'
         self.e2fsck_path = '/sbin/e2fsck'
         self.echo_path = '/usr/bin/echo'
         self.lsblk_path = '/usr/bin/lsblk'
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Throughput of the SliceCopier for several slice sizes and queue depths.
+Needs root: the source and the destination are loop devices over sparse
+files, with --dm-crypt the destination is a dm-crypt mapping of its loop
+device, like the encrypted device of an in place encryption.
+
+    cd VMEncryption
+    sudo python test/benchmark_slice_copier.py --size-mb 1024 --dm-crypt
+"""
+
+import argparse
+import binascii
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+from SliceCopier import SliceCopier
+
+
+class NullLogger(object):
+    def log(self, msg, level='Info'):
+        pass
+
+
+def run(args):
+    return subprocess.check_output(args).decode('ascii').strip()
+
+
+def create_loop_device(path, size):
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    return run(['losetup', '-f', '--show', path])
+
+
+def fill(device, size):
+    # the source content does not matter, but its blocks have to be allocated
+    chunk = os.urandom(4 * 1024 * 1024)
+    with open(device, 'wb') as f:
+        left = size
+        while left > 0:
+            f.write(chunk[:left])
+            left -= len(chunk[:left])
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def create_crypt_device(device, size, name):
+    key = binascii.hexlify(os.urandom(64)).decode('ascii')
+    table = '0 {0} crypt aes-xts-plain64 {1} 0 {2} 0'.format(size // 512, key, device)
+    subprocess.check_call(['dmsetup', 'create', name, '--table', table])
+    return '/dev/mapper/' + name
+
+
+def benchmark(source, destination, backup_file_path, size, slice_size, queue_depth):
+    copier = SliceCopier(NullLogger(), source, destination, backup_file_path)
+    slices = [(index, offset, min(slice_size, size - offset))
+              for index, offset in enumerate(range(0, size, slice_size))]
+    copier.open()
+    try:
+        start = time.time()
+        copier.copy_slices(slices, lambda slice_index: copier.remove_backup(), queue_depth)
+        elapsed = time.time() - start
+    finally:
+        copier.close()
+    return size / elapsed / 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SliceCopier throughput benchmark')
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--slice-sizes-mb', default='10,50,100')
+    parser.add_argument('--queue-depths', default='1,2,4')
+    parser.add_argument('--dm-crypt', action='store_true', help='write to a dm-crypt mapping of the destination')
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    work_dir = tempfile.mkdtemp()
+    devices = []
+    crypt_name = None
+    try:
+        source = create_loop_device(os.path.join(work_dir, 'source.img'), size)
+        devices.append(source)
+        destination = create_loop_device(os.path.join(work_dir, 'destination.img'), size)
+        devices.append(destination)
+        fill(source, size)
+        if args.dm_crypt:
+            crypt_name = 'slice_copier_benchmark_{0}'.format(os.getpid())
+            destination = create_crypt_device(destination, size, crypt_name)
+
+        print('{0} -> {1}, {2} MB'.format(source, destination, args.size_mb))
+        print('{0:>10} {1:>12} {2:>10}'.format('slice MB', 'queue depth', 'MB/s'))
+        for slice_size_mb in [int(value) for value in args.slice_sizes_mb.split(',')]:
+            for queue_depth in [int(value) for value in args.queue_depths.split(',')]:
+                throughput = benchmark(source, destination, os.path.join(work_dir, 'copy_slice_item.bak'),
+                                       size, slice_size_mb * 1024 * 1024, queue_depth)
+                print('{0:>10} {1:>12} {2:>10.1f}'.format(slice_size_mb, queue_depth, throughput))
+    finally:
+        if crypt_name is not None:
+            subprocess.call(['dmsetup', 'remove', crypt_name])
+        for device in devices:
+            subprocess.call(['losetup', '-d', device])
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from main.AllocationMap import AllocationMap
+
+# the group descriptors of dumpe2fs for a 20 MB ext4 file system with 1k blocks
+DUMPE2FS_OUTPUT = """Filesystem volume name:   <none>
+Block count:              20480
+Free blocks:              19087
+First block:              1
+Block size:               1024
+
+
+Group 0: (Blocks 1-8192) csum 0xf16d [ITABLE_ZEROED]
+  Primary superblock at 1, Group descriptors at 2-2
+  Reserved GDT blocks at 3-161
+  Block bitmap at 162 (+161), csum 0x54f0ae45
+  Inode bitmap at 165 (+164), csum 0x330f20b7
+  Inode table at 168-173 (+167)
+  7985 free blocks, 13 free inodes, 2 directories, 13 unused inodes
+  Free blocks: 200-1000, 1002, 1010-8192
+  Free inodes: 12-24
+Group 1: (Blocks 8193-16384) csum 0x3817 [INODE_UNINIT, ITABLE_ZEROED]
+  Backup superblock at 8193, Group descriptors at 8194-8194
+  Reserved GDT blocks at 8195-8353
+  Block bitmap at 163 (bg #0 + 162), csum 0x8b79dbbe
+  Inode bitmap at 166 (bg #0 + 165), csum 0x00000000
+  Inode table at 174-179 (bg #0 + 173)
+  7007 free blocks, 24 free inodes, 0 directories, 24 unused inodes
+  Free blocks: 9378-16384
+  Free inodes: 25-48
+Group 2: (Blocks 16385-20479) csum 0x4540 [INODE_UNINIT, ITABLE_ZEROED]
+  Block bitmap at 164 (bg #0 + 163), csum 0x721dbc59
+  Inode bitmap at 167 (bg #0 + 166), csum 0x00000000
+  Inode table at 180-185 (bg #0 + 179)
+  4095 free blocks, 24 free inodes, 0 directories, 24 unused inodes
+  Free blocks: 16385-20479
+  Free inodes: 49-72
+Group 3: (Blocks 20480-20479) [INODE_UNINIT, BLOCK_UNINIT]
+  Free blocks: 
+  Free inodes: 
+"""
+
+
+class TestAllocationMap(unittest.TestCase):
+    """ unit tests for the free space map of the AllocationMap module """
+    def test_parse_dumpe2fs_output(self):
+        allocation_map = AllocationMap.from_dumpe2fs_output(DUMPE2FS_OUTPUT)
+        # the free ranges of the groups 1 and 2 are adjacent
+        self.assertEqual(allocation_map.free_ranges, [(200 * 1024, 1001 * 1024),
+                                                      (1002 * 1024, 1003 * 1024),
+                                                      (1010 * 1024, 8193 * 1024),
+                                                      (9378 * 1024, 20480 * 1024)])
+        self.assertEqual(allocation_map.get_free_size(), 19087 * 1024)
+
+    def test_parse_needs_the_block_size(self):
+        self.assertRaises(ValueError, AllocationMap.from_dumpe2fs_output, "  Free blocks: 200-8192\n")
+        self.assertRaises(ValueError, AllocationMap.from_dumpe2fs_output, "Block size: 4096\n  Free blocks: 200-x\n")
+
+    def test_is_unallocated(self):
+        allocation_map = AllocationMap.from_dumpe2fs_output(DUMPE2FS_OUTPUT)
+        self.assertFalse(allocation_map.is_unallocated(0, 1024))
+        self.assertFalse(allocation_map.is_unallocated(199 * 1024, 1024))
+        self.assertTrue(allocation_map.is_unallocated(200 * 1024, 801 * 1024))
+        self.assertFalse(allocation_map.is_unallocated(200 * 1024, 802 * 1024))
+        self.assertTrue(allocation_map.is_unallocated(10 * 1024 * 1024, 10 * 1024 * 1024))
+        self.assertFalse(allocation_map.is_unallocated(10 * 1024 * 1024, 10 * 1024 * 1024 + 1))
+
+    def test_save_and_load(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'copy_allocation_map.json')
+            self.assertEqual(AllocationMap.load(path), None)
+            AllocationMap.from_dumpe2fs_output(DUMPE2FS_OUTPUT).save(path)
+            allocation_map = AllocationMap.load(path)
+            self.assertEqual(allocation_map.free_ranges, AllocationMap.from_dumpe2fs_output(DUMPE2FS_OUTPUT).free_ranges)
+            self.assertTrue(allocation_map.is_unallocated(9378 * 1024, 1024))
+        finally:
+            shutil.rmtree(temp_dir)
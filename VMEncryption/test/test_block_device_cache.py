@@ -0,0 +1,225 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from main.BlockDeviceCache import BlockDeviceCache
+from console_logger import ConsoleLogger
+
+VMBUS_PATH = 'sys/devices/LNXSYSTM:00/LNXSYBUS:00/PNP0A03:00/device:07/VMBUS:01'
+
+
+def scsi_disk(vmbus_id, device_id, host, name, majmin, sectors, model='Virtual Disk', scsi_type='0'):
+    """ the sysfs of a disk on the storvsc of vmbus_id, like /sys of an Azure VM """
+    scsi_path = '{0}/{1}/host{2}/target{2}:0:0/{2}:0:0:0'.format(VMBUS_PATH, vmbus_id, host)
+    block_path = scsi_path + '/block/' + name
+    major, minor = majmin.split(':')
+    files = {
+        '{0}/{1}/device_id'.format(VMBUS_PATH, vmbus_id): '{' + device_id + '}\n',
+        scsi_path + '/model': model + '    \n',
+        scsi_path + '/type': scsi_type + '\n',
+        block_path + '/uevent': 'MAJOR={0}\nMINOR={1}\nDEVNAME={2}\nDEVTYPE=disk\n'.format(major, minor, name),
+        block_path + '/size': '{0}\n'.format(sectors),
+        block_path + '/holders/': None,
+        block_path + '/slaves/': None,
+        'dev/' + name: '',
+    }
+    symlinks = {
+        block_path + '/device': scsi_path,
+        'sys/class/block/' + name: block_path,
+    }
+    return block_path, files, symlinks
+
+
+def partition(block_path, name, majmin, sectors):
+    major, minor = majmin.split(':')
+    files = {
+        block_path + '/' + name + '/uevent': 'MAJOR={0}\nMINOR={1}\nDEVNAME={2}\nDEVTYPE=partition\nPARTN=1\n'.format(major, minor, name),
+        block_path + '/' + name + '/size': '{0}\n'.format(sectors),
+        block_path + '/' + name + '/partition': '1\n',
+        block_path + '/' + name + '/holders/': None,
+        'dev/' + name: '',
+    }
+    symlinks = {
+        'sys/class/block/' + name: block_path + '/' + name,
+    }
+    return files, symlinks
+
+
+def device_mapper(name, majmin, sectors, dm_name, dm_uuid, slave_path):
+    block_path = 'sys/devices/virtual/block/' + name
+    major, minor = majmin.split(':')
+    files = {
+        block_path + '/uevent': 'MAJOR={0}\nMINOR={1}\nDEVNAME={2}\nDEVTYPE=disk\n'.format(major, minor, name),
+        block_path + '/size': '{0}\n'.format(sectors),
+        block_path + '/dm/name': dm_name + '\n',
+        block_path + '/dm/uuid': dm_uuid + '\n',
+        block_path + '/holders/': None,
+        'dev/' + name: '',
+    }
+    symlinks = {
+        'sys/class/block/' + name: block_path,
+        block_path + '/slaves/' + os.path.basename(slave_path): slave_path,
+        slave_path + '/holders/' + name: block_path,
+        'dev/mapper/' + dm_name: 'dev/' + name,
+    }
+    return files, symlinks
+
+
+class TestBlockDeviceCache(unittest.TestCase):
+    """ unit tests for the sysfs device model of the BlockDeviceCache module, on a captured Azure VM tree """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+        self.root = tempfile.mkdtemp()
+        files = {}
+        symlinks = {}
+
+        def add(parts):
+            files.update(parts[-2])
+            symlinks.update(parts[-1])
+
+        sda = scsi_disk('00000000-0000-8899-0000-000000000000', '00000000-0000-8899-0000-000000000000', 0, 'sda', '8:0', 62914560)
+        add(sda)
+        add(partition(sda[0], 'sda1', '8:1', 62912512))
+        sdb = scsi_disk('00000000-0001-8899-0000-000000000000', '00000000-0001-8899-0000-000000000000', 1, 'sdb', '8:16', 14680064)
+        add(sdb)
+        add(partition(sdb[0], 'sdb1', '8:17', 14678016))
+        sdc = scsi_disk('f8b3781b-1e82-4818-a1c3-63d806ec15bb', 'f8b3781b-1e82-4818-a1c3-63d806ec15bb', 3, 'sdc', '8:32', 2097152)
+        add(sdc)
+        add(partition(sdc[0], 'sdc1', '8:33', 2095104))
+        sdd = scsi_disk('f8b3781a-1e82-4818-a1c3-63d806ec15bb', 'f8b3781a-1e82-4818-a1c3-63d806ec15bb', 4, 'sdd', '8:48', 4194304)
+        add(sdd)
+        add(scsi_disk('00000000-0002-8899-0000-000000000000', '00000000-0002-8899-0000-000000000000', 2, 'sr0', '11:0', 2048,
+                      model='Virtual CD/ROM', scsi_type='5'))
+        add(device_mapper('dm-0', '253:0', 2091008, 'a1b2c3d4-luks', 'CRYPT-LUKS1-4b5c0b9a0c2b4b8a8f0e0d6a1f6c2e3d-a1b2c3d4-luks',
+                          sdc[0] + '/sdc1'))
+        add(device_mapper('dm-1', '253:1', 4186112, 'data--vg-data--lv', 'LVM-Hc6tQn2H0eTB1cJbqlTQ3vRn9Z7zW0sHk1vG2x5y3Z8A', sdd[0]))
+        symlinks['dev/data-vg/data-lv'] = 'dev/dm-1'
+        files.update({
+            'run/udev/data/b8:0': 'S:disk/by-id/scsi-14d534654202020200000000000000000\nE:ID_PART_TABLE_TYPE=dos\n',
+            'run/udev/data/b8:1': 'E:ID_FS_UUID=4e6e1a2b-0c3d-4e5f-8a9b-0c1d2e3f4a5b\nE:ID_FS_UUID_ENC=4e6e1a2b-0c3d-4e5f-8a9b-0c1d2e3f4a5b\n'
+                                  'E:ID_FS_TYPE=ext4\nE:ID_FS_LABEL=cloudimg-rootfs\nE:ID_FS_LABEL_ENC=cloudimg-rootfs\n',
+            'run/udev/data/b8:16': 'E:ID_PART_TABLE_TYPE=dos\n',
+            'run/udev/data/b8:17': 'E:ID_FS_UUID=9a8b7c6d-5e4f-4a3b-2c1d-0e9f8a7b6c5d\nE:ID_FS_TYPE=ext4\n',
+            'run/udev/data/b8:32': 'E:ID_PART_TABLE_TYPE=gpt\n',
+            'run/udev/data/b8:33': 'E:ID_FS_UUID=4b5c0b9a-0c2b-4b8a-8f0e-0d6a1f6c2e3d\nE:ID_FS_TYPE=crypto_LUKS\n',
+            'run/udev/data/b8:48': 'E:ID_FS_UUID=Hc6tQn-2H0e-TB1c-Jbql-TQ3v-Rn9Z-7zW0sH\nE:ID_FS_TYPE=LVM2_member\n',
+            'run/udev/data/b11:0': 'E:ID_CDROM=1\n',
+            'run/udev/data/b253:0': 'E:DM_NAME=a1b2c3d4-luks\nE:ID_FS_UUID=0f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0\nE:ID_FS_TYPE=ext4\n'
+                                    'E:ID_FS_LABEL=data_disk\nE:ID_FS_LABEL_ENC=data\\x20disk\n',
+            'run/udev/data/b253:1': 'E:DM_NAME=data--vg-data--lv\nE:ID_FS_UUID=5d6e7f80-9a1b-4c2d-8e3f-4a5b6c7d8e9f\nE:ID_FS_TYPE=xfs\n',
+            'proc/mounts': 'sysfs /sys sysfs rw,nosuid,nodev,noexec,relatime 0 0\n'
+                           '/dev/sda1 / ext4 rw,relatime,discard,data=ordered 0 0\n'
+                           '/dev/sdb1 /mnt/resource ext4 rw,relatime,data=ordered 0 0\n'
+                           '/dev/mapper/a1b2c3d4-luks /data ext4 rw,relatime,data=ordered 0 0\n'
+                           '/dev/mapper/a1b2c3d4-luks /data/bind ext4 rw,relatime,data=ordered 0 0\n'
+                           '/dev/mapper/data--vg-data--lv /mnt/my\\040data xfs rw,relatime 0 0\n',
+            'proc/swaps': 'Filename\t\t\t\tType\t\tSize\tUsed\tPriority\n',
+        })
+        symlinks.update({
+            'dev/disk/by-uuid/4e6e1a2b-0c3d-4e5f-8a9b-0c1d2e3f4a5b': 'dev/sda1',
+            'dev/disk/by-uuid/9a8b7c6d-5e4f-4a3b-2c1d-0e9f8a7b6c5d': 'dev/sdb1',
+            'dev/disk/by-label/cloudimg-rootfs': 'dev/sda1',
+        })
+        self.create_tree(files, symlinks)
+        self.cache = BlockDeviceCache(self.logger, root=self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def create_tree(self, files, symlinks):
+        """ files with None content are directories, the symlinks are relative like in sysfs and /dev """
+        for path, content in files.items():
+            full_path = os.path.join(self.root, path)
+            directory = full_path if content is None else os.path.dirname(full_path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            if content is not None:
+                with open(full_path, 'w') as f:
+                    f.write(content)
+        for path, target in symlinks.items():
+            full_path = os.path.join(self.root, path)
+            if not os.path.isdir(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+            os.symlink(os.path.relpath(os.path.join(self.root, target), os.path.dirname(full_path)), full_path)
+
+    def test_device_items(self):
+        device_items = self.cache.get_device_items(None)
+        self.assertEqual([(item.name, item.type) for item in device_items],
+                         [('sda', 'disk'), ('sda1', 'part'),
+                          ('sdb', 'disk'), ('sdb1', 'part'),
+                          ('sdc', 'disk'), ('sdc1', 'part'), ('a1b2c3d4-luks', 'crypt'),
+                          ('sdd', 'disk'), ('data-vg/data-lv', 'lvm'),
+                          ('sr0', 'rom')])
+        items = dict((item.name, item) for item in device_items)
+        self.assertEqual(items['sda1'].mount_point, '/')
+        self.assertEqual(items['sda1'].file_system, 'ext4')
+        self.assertEqual(items['sda1'].label, 'cloudimg-rootfs')
+        self.assertEqual(items['sda'].model, 'Virtual Disk')
+        self.assertEqual(items['sda'].size, 62914560 * 512)
+        self.assertEqual(items['sda'].device_id, '00000000-0000-8899-0000-000000000000')
+        self.assertEqual(items['sdc1'].device_id, 'f8b3781b-1e82-4818-a1c3-63d806ec15bb')
+        self.assertEqual(items['sdc1'].file_system, 'crypto_LUKS')
+        self.assertEqual(items['sdc1'].majmin, '8:33')
+        self.assertEqual(items['a1b2c3d4-luks'].mount_point, '/data')
+        self.assertEqual(items['a1b2c3d4-luks'].label, 'data disk')
+        self.assertEqual(items['a1b2c3d4-luks'].device_id, '')
+        self.assertEqual(items['data-vg/data-lv'].mount_point, '/mnt/my data')
+        self.assertEqual(items['data-vg/data-lv'].file_system, 'xfs')
+
+    def test_device_items_of_a_device(self):
+        self.assertEqual([item.name for item in self.cache.get_device_items('/dev/sdc')], ['sdc', 'sdc1', 'a1b2c3d4-luks'])
+        self.assertEqual([item.name for item in self.cache.get_device_items('/dev/disk/by-uuid/9a8b7c6d-5e4f-4a3b-2c1d-0e9f8a7b6c5d')], ['sdb1'])
+        self.assertEqual([item.name for item in self.cache.get_device_items('/dev/data-vg/data-lv')], ['data-vg/data-lv'])
+        self.assertEqual(self.cache.get_device_items('/dev/sdz'), None)
+
+    def test_device_items_are_copies(self):
+        self.cache.get_device_items('/dev/sdc')[0].name = 'changed'
+        self.assertEqual(self.cache.get_device('sdc').name, 'sdc')
+
+    def test_device_without_udev_data(self):
+        # the udev database falls behind a new device, lsblk has to tell its file system
+        os.remove(os.path.join(self.root, 'run/udev/data/b8:17'))
+        self.assertEqual(self.cache.get_device_items('/dev/sdb'), None)
+        self.assertEqual(len(self.cache.get_device_items('/dev/sdc')), 3)
+        device = self.cache.get_device('sdb1')
+        self.assertFalse(device.udev_data_found)
+        # the by-uuid link still tells the uuid
+        self.assertEqual(device.uuid, '9a8b7c6d-5e4f-4a3b-2c1d-0e9f8a7b6c5d')
+
+    def test_get_device(self):
+        self.assertEqual(self.cache.get_device('a1b2c3d4-luks').kernel_name, 'dm-0')
+        self.assertEqual(self.cache.get_device('data-vg/data-lv').kernel_name, 'dm-1')
+        self.assertEqual(self.cache.get_device('sdz'), None)
+        self.assertEqual(self.cache.get_device_by_path('/dev/mapper/a1b2c3d4-luks').slaves, ['sdc1'])
+
+    def test_has_holders(self):
+        self.assertTrue(self.cache.has_holders('/dev/sdd', 'lvm'))
+        self.assertFalse(self.cache.has_holders('/dev/sdc1', 'lvm'))
+        self.assertTrue(self.cache.has_holders('/dev/sdc1', 'crypt'))
+        self.assertEqual(self.cache.has_holders('/dev/mapper/osencrypt', 'lvm'), None)
+
+    def test_invalidate(self):
+        self.assertEqual(self.cache.get_device('sdc1').file_system, 'crypto_LUKS')
+        with open(os.path.join(self.root, 'run/udev/data/b8:33'), 'w') as f:
+            f.write('E:ID_FS_TYPE=ext4\n')
+        with open(os.path.join(self.root, 'proc/mounts'), 'a') as f:
+            f.write('/dev/sdc1 /mnt/sdc1 ext4 rw 0 0\n')
+        # read once, until invalidated
+        self.assertEqual(self.cache.get_device('sdc1').file_system, 'crypto_LUKS')
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get_device('sdc1').file_system, 'ext4')
+        self.assertEqual(self.cache.get_device('sdc1').mount_point, '/mnt/sdc1')
+
+    def test_expires(self):
+        self.cache.max_age = 0
+        self.assertEqual(self.cache.get_device('sdb1').mount_point, '/mnt/resource')
+        with open(os.path.join(self.root, 'proc/mounts'), 'w') as f:
+            f.write('/dev/sda1 / ext4 rw 0 0\n')
+        self.assertEqual(self.cache.get_device('sdb1').mount_point, '')
+
+    def test_unavailable_without_sysfs(self):
+        cache = BlockDeviceCache(self.logger, root=os.path.join(self.root, 'missing'))
+        self.assertEqual(cache.get_devices(), None)
+        self.assertEqual(cache.get_device_items(None), None)
+        self.assertEqual(cache.get_device('sda'), None)
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from main.DiskUtil import DiskUtil
+from main.EncryptionEnvironment import EncryptionEnvironment
+from main.EncryptionScheduler import EncryptionScheduler, AggregatedStatusReporter
+from console_logger import ConsoleLogger
+from test_utils import MockDistroPatcher
+
+
+class FakeHandlerUtil(object):
+    def __init__(self):
+        self.messages = []
+        self.logs = []
+        self.errors = []
+
+    def do_status_report(self, operation, status, status_code, message):
+        self.messages.append(message)
+
+    def log(self, message):
+        self.logs.append(message)
+
+    def error(self, message):
+        self.errors.append(message)
+
+
+class FakeCommandExecutor(object):
+    def __init__(self):
+        self.commands = []
+
+    def Execute(self, command_to_execute, *args, **kwargs):
+        self.commands.append(command_to_execute)
+        return 0
+
+
+class TestEncryptionScheduler(unittest.TestCase):
+    """ unit tests for the parallel encryption of the EncryptionScheduler module """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+
+    def test_run_limits_concurrency(self):
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+        release = threading.Event()
+
+        def job(result):
+            def run():
+                with lock:
+                    running[0] += 1
+                    max_running[0] = max(max_running[0], running[0])
+                release.wait(0.2)
+                with lock:
+                    running[0] -= 1
+                return result
+            return run
+
+        scheduler = EncryptionScheduler(self.logger, 2)
+        results = scheduler.run([('sd' + name, job(name)) for name in 'cdefg'])
+        self.assertEqual(results, {'sdc': 'c', 'sdd': 'd', 'sde': 'e', 'sdf': 'f', 'sdg': 'g'})
+        self.assertEqual(max_running[0], 2)
+
+    def test_failed_job_does_not_stop_the_others(self):
+        def fail():
+            raise Exception("cryptsetup failed")
+
+        scheduler = EncryptionScheduler(self.logger, 4)
+        results = scheduler.run([('sdc', fail), ('sdd', lambda: 'done')])
+        self.assertEqual(results, {'sdd': 'done'})
+
+    def test_aggregated_status(self):
+        hutil = FakeHandlerUtil()
+        status_reporter = AggregatedStatusReporter(hutil, 'EnableEncryption', 'Encrypting 2 data volumes')
+        sdc_reporter = status_reporter.for_device('sdc')
+        sdd_reporter = status_reporter.for_device('sdd')
+        sdc_reporter.do_status_report('DataCopy', 'success', '0', 'Encrypting: 50%')
+        sdd_reporter.do_status_report('DataCopy', 'success', '0', 'Encrypting: 10%')
+        status_reporter.device_done('sdc')
+        self.assertEqual(hutil.messages, ['Encrypting 2 data volumes, 0/2 done; sdc: Encrypting: 50%',
+                                          'Encrypting 2 data volumes, 0/2 done; sdc: Encrypting: 50%; sdd: Encrypting: 10%',
+                                          'Encrypting 2 data volumes, 1/2 done; sdd: Encrypting: 10%'])
+
+    def test_device_disk_util_logs(self):
+        # built as create_device_disk_util in handle.py does, the cryptsetup calls of DiskUtil log through the hutil
+        hutil = FakeHandlerUtil()
+        status_reporter = AggregatedStatusReporter(hutil, 'EnableEncryption', 'Encrypting 2 data volumes')
+        encryption_environment = EncryptionEnvironment(None, self.logger)
+        distro_patcher = MockDistroPatcher('Ubuntu', '16.04', '4.15')
+        distro_patcher.cryptsetup_path = '/sbin/cryptsetup'
+        disk_util = DiskUtil(status_reporter.for_device('sdc'), distro_patcher, self.logger,
+                             encryption_environment.get_device_environment('sdc'))
+        disk_util.command_executor = FakeCommandExecutor()
+
+        self.assertEqual(disk_util.luks_format('/mnt/bek/LinuxPassPhraseFileName', '/dev/sdc', None), 0)
+        self.assertEqual(disk_util.luks_open('/mnt/bek/LinuxPassPhraseFileName', '/dev/sdc', 'sdc-crypt', None, False), 0)
+        self.assertEqual(disk_util.luks_add_key('/mnt/bek/LinuxPassPhraseFileName', '/dev/sdc', 'sdc-crypt', None, '/nonexistent/key'), None)
+        self.assertEqual(disk_util.luks_close('sdc-crypt'), 0)
+
+        self.assertEqual(disk_util.command_executor.commands,
+                         ['/sbin/cryptsetup luksFormat /dev/sdc -d /mnt/bek/LinuxPassPhraseFileName -q',
+                          '/sbin/cryptsetup luksOpen /dev/sdc sdc-crypt -d /mnt/bek/LinuxPassPhraseFileName -q',
+                          '/sbin/cryptsetup luksClose sdc-crypt -q'])
+        self.assertEqual(hutil.logs[0], 'sdc: dev path to cryptsetup luksFormat /dev/sdc')
+        self.assertEqual(len(hutil.logs), 5)
+        self.assertEqual(hutil.errors, ['sdc: new key does not exist'])
+        self.assertEqual(hutil.messages, [])
+
+    def test_device_environments(self):
+        encryption_environment = EncryptionEnvironment(None, self.logger)
+        encryption_environment.encryption_config_path = tempfile.mkdtemp()
+        try:
+            sdc_environment = encryption_environment.get_device_environment('sdc1')
+            self.assertNotEqual(sdc_environment.azure_crypt_ongoing_item_config_path, encryption_environment.azure_crypt_ongoing_item_config_path)
+            self.assertNotEqual(sdc_environment.copy_slice_item_backup_file, encryption_environment.copy_slice_item_backup_file)
+            self.assertEqual(sdc_environment.azure_crypt_mount_config_path, encryption_environment.azure_crypt_mount_config_path)
+
+            data_environment = encryption_environment.get_device_environment('vg-data/lv 1')
+            for path in [sdc_environment.azure_crypt_ongoing_item_config_path,
+                         data_environment.azure_crypt_ongoing_item_config_path,
+                         # archived and serial configs are not resumed in parallel
+                         data_environment.azure_crypt_ongoing_item_config_path + '_2019-01-01 00:00:00',
+                         os.path.join(encryption_environment.encryption_config_path, 'azure_crypt_ongoing_item.ini')]:
+                open(path, 'w').close()
+            self.assertEqual([environment.device_id for environment in encryption_environment.get_ongoing_device_environments()],
+                             ['sdc1', 'vg-data_lv_1'])
+        finally:
+            shutil.rmtree(encryption_environment.encryption_config_path)
@@ -0,0 +1,262 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from main.AllocationMap import AllocationMap
+from main.Common import CommonVariables
+from main.TransactionalCopyTask import TransactionalCopyTask
+from console_logger import ConsoleLogger
+
+
+class FakeOnGoingItemConfig(object):
+    def __init__(self, source, destination, total_size, block_size, from_end):
+        self.source = source
+        self.destination = destination
+        self.total_size = total_size
+        self.block_size = block_size
+        self.from_end = from_end
+        self.current_slice_index = 0
+        self.committed_slice_indexes = []
+
+    def get_current_total_copy_size(self):
+        return self.total_size
+
+    def get_current_block_size(self):
+        return self.block_size
+
+    def get_current_source_path(self):
+        return self.source
+
+    def get_current_destination(self):
+        return self.destination
+
+    def get_current_slice_index(self):
+        return self.current_slice_index
+
+    def get_from_end(self):
+        return self.from_end
+
+    def commit(self):
+        self.committed_slice_indexes.append(self.current_slice_index)
+
+
+class FakeHandlerUtil(object):
+    def __init__(self):
+        self.messages = []
+
+    def do_status_report(self, operation, status, status_code, message):
+        self.messages.append(message)
+
+
+class FakeEncryptionEnvironment(object):
+    def __init__(self, config_path):
+        self.copy_slice_item_backup_file = os.path.join(config_path, 'copy_slice_item.bak')
+
+
+class TestTransactionalCopyTask(unittest.TestCase):
+    """ unit tests for the in process slice copy of the TransactionalCopyTask module """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+        self.temp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.temp_dir, 'source')
+        self.destination = os.path.join(self.temp_dir, 'destination')
+        self.encryption_environment = FakeEncryptionEnvironment(self.temp_dir)
+        self.block_size = 64 * 1024
+        # three full slices and a last slice of 5 sectors
+        self.data = os.urandom(self.block_size * 3 + 5 * 512)
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _create_copy_task(self, from_end, current_slice_index=0, status_prefix='', allocation_map=None, destination_shift=0):
+        self.ongoing_item_config = FakeOnGoingItemConfig(self.source, self.destination, len(self.data) - destination_shift, self.block_size, from_end)
+        self.ongoing_item_config.current_slice_index = current_slice_index
+        self.hutil = FakeHandlerUtil()
+        return TransactionalCopyTask(logger=self.logger,
+                                     hutil=self.hutil,
+                                     disk_util=None,
+                                     ongoing_item_config=self.ongoing_item_config,
+                                     patching=None,
+                                     encryption_environment=self.encryption_environment,
+                                     status_prefix=status_prefix,
+                                     allocation_map=allocation_map,
+                                     destination_shift=destination_shift)
+
+    def _shift_destination(self, copy_task, shift):
+        """ writes at offset + shift of the source, as the mapper behind a LUKS header on the same device """
+        copier = copy_task.copier
+        copier_open = copier.open
+
+        def open_shifted():
+            copier_open()
+            write_at = copier.destination.write_at
+            copier.destination.write_at = lambda offset, buf, length: write_at(offset + shift, buf, length)
+        copier.open = open_shifted
+
+    def _write_backup(self, first_slice_index, data):
+        with open(self.encryption_environment.copy_slice_item_backup_file, 'wb') as f:
+            f.write(data)
+        with open(self.encryption_environment.copy_slice_item_backup_file + '.index', 'w') as f:
+            f.write(str(first_slice_index))
+
+    def _read_destination(self):
+        with open(self.destination, 'rb') as f:
+            return f.read()
+
+    def test_copy_forward(self):
+        copy_task = self._create_copy_task('False')
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.data)
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [4])
+        self.assertFalse(os.path.exists(self.encryption_environment.copy_slice_item_backup_file))
+
+    def test_copy_from_end(self):
+        copy_task = self._create_copy_task('True')
+        copy_task.checkpoint_slices = 1
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.data)
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [1, 2, 3, 4])
+
+    def test_resume_from_partial_backup(self):
+        # crashed while writing the backup of slice 1, the destination is not touched yet
+        with open(self.destination, 'wb') as f:
+            f.write(self.data[:self.block_size])
+        self._write_backup(1, self.data[self.block_size:self.block_size + 4096])
+        copy_task = self._create_copy_task('False', current_slice_index=1)
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.data)
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [2, 4])
+
+    def test_resume_from_full_backup(self):
+        # crashed while writing slice 1 to the source itself, its backup is complete
+        with open(self.encryption_environment.copy_slice_item_backup_file, 'wb') as f:
+            f.write(self.data[self.block_size:self.block_size * 2])
+        with open(self.source, 'r+b') as f:
+            f.seek(self.block_size)
+            f.write(b'\0' * 512)
+        self.destination = self.source
+        copy_task = self._create_copy_task('False', current_slice_index=1)
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.data)
+
+    def test_resume_ignores_committed_backup(self):
+        # crashed after slice 1 was committed but before its backup was removed
+        with open(self.destination, 'wb') as f:
+            f.write(self.data[:self.block_size * 2])
+        self._write_backup(1, self.data[self.block_size:self.block_size * 2])
+        copy_task = self._create_copy_task('False', current_slice_index=2)
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.data)
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [4])
+
+    def test_copy_without_read_ahead(self):
+        copy_task = self._create_copy_task('True')
+        copy_task.queue_depth = 1
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.data)
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [4])
+
+    def test_read_error_stops_the_copy(self):
+        copy_task = self._create_copy_task('False')
+        read_slice = copy_task.copier.read_slice
+
+        def failing_read_slice(offset, buf):
+            if offset >= self.block_size * 2:
+                raise IOError(5, 'Input/output error')
+            return read_slice(offset, buf)
+        copy_task.copier.read_slice = failing_read_slice
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.copy_data_error)
+        # the slices before the failed read are written but not committed, the backup holds them
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [])
+        self.assertEqual(self._read_destination(), self.data[:self.block_size * 2])
+
+        copy_task = self._create_copy_task('False')
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.data)
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [2, 4])
+
+    def test_checkpoint_every_n_slices(self):
+        copy_task = self._create_copy_task('False')
+        copy_task.checkpoint_slices = 3
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [3, 4])
+        self.assertFalse(os.path.exists(self.encryption_environment.copy_slice_item_backup_file))
+
+    def test_resume_replays_all_uncommitted_slices(self):
+        # in place copy from the end, crashed while backing up slice 3 (the first one of the device)
+        # after slices 1 and 2 were written over the source
+        self._write_backup(1, self.data[self.block_size * 2:self.block_size * 3]
+                              + self.data[self.block_size:self.block_size * 2]
+                              + self.data[:1024])
+        with open(self.source, 'r+b') as f:
+            f.seek(self.block_size + 512)
+            f.write(b'\0' * (self.block_size * 2 - 512))
+        self.destination = self.source
+        copy_task = self._create_copy_task('True', current_slice_index=1)
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.data)
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [4])
+
+    def test_status_report_is_throttled(self):
+        copy_task = self._create_copy_task('False', status_prefix='Encrypting')
+        copy_task.status_report_seconds = 3600
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(len(self.hutil.messages), 2)
+        self.assertTrue(self.hutil.messages[0].startswith('Encrypting: 25%, ETA '))
+        self.assertEqual(self.hutil.messages[1], 'Encrypting: 100%')
+
+    def test_copy_skips_unallocated_slices(self):
+        # the second slice is free, the third one only partly
+        allocation_map = AllocationMap([(self.block_size, self.block_size * 2 + 4096)])
+        copy_task = self._create_copy_task('True', status_prefix='Encrypting', allocation_map=allocation_map)
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.data[:self.block_size]
+                                                   + b'\0' * self.block_size
+                                                   + self.data[self.block_size * 2:])
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [4])
+        self.assertEqual(self.hutil.messages[-1], 'Encrypting: 100%, {0} bytes copied, {1} bytes of unallocated blocks skipped'.format(
+            len(self.data) - self.block_size, self.block_size))
+
+    def test_resume_skips_the_same_slices(self):
+        # in place copy from the end with the second slice free, crashed while backing up
+        # the first slice after the third one was written over the source
+        allocation_map = AllocationMap([(self.block_size, self.block_size * 2)])
+        self._write_backup(1, self.data[self.block_size * 2:self.block_size * 3] + self.data[:1024])
+        with open(self.source, 'r+b') as f:
+            f.seek(self.block_size * 2 + 512)
+            f.write(b'\0' * (self.block_size - 512))
+        self.destination = self.source
+        copy_task = self._create_copy_task('True', current_slice_index=1, allocation_map=allocation_map)
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.data)
+        self.assertEqual(self.ongoing_item_config.committed_slice_indexes, [4])
+
+    def test_in_place_copy_behind_a_header(self):
+        # the in place copy writes every slice header_size bytes further, skipping the free second
+        # slice would leave the first header_size bytes of the third one in clear
+        header_size = 8192
+        self.destination = self.source
+        allocation_map = AllocationMap([(self.block_size, self.block_size * 2)])
+        copy_task = self._create_copy_task('True', allocation_map=allocation_map, destination_shift=header_size)
+        self._shift_destination(copy_task, header_size)
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(copy_task.skipped_size, 0)
+        self.assertEqual(self._read_destination(), self.data[:header_size] + self.data[:len(self.data) - header_size])
+
+    def test_in_place_copy_behind_a_header_skips_free_slices(self):
+        header_size = 8192
+        self.destination = self.source
+        allocation_map = AllocationMap([(self.block_size, self.block_size * 2 + header_size)])
+        copy_task = self._create_copy_task('True', allocation_map=allocation_map, destination_shift=header_size)
+        self._shift_destination(copy_task, header_size)
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(copy_task.skipped_size, self.block_size)
+        destination = self._read_destination()
+        # only the free blocks of the source are left as they were
+        self.assertEqual(destination[:self.block_size + header_size], self.data[:header_size] + self.data[:self.block_size])
+        self.assertEqual(destination[self.block_size + header_size:self.block_size * 2 + header_size],
+                         self.data[self.block_size + header_size:self.block_size * 2 + header_size])
+        self.assertEqual(destination[self.block_size * 2 + header_size:], self.data[self.block_size * 2:len(self.data) - header_size])